@@ -1,40 +1,32 @@
 import logging
 import os
-import time
 import pickle
-import requests
 import traceback
-import forta_agent
 
 from src.utils import Utils
+from src.persistence_client import PersistenceClient, get_client
 
-DATABASE = "https://research.forta.network/database/bot/"
 VERSION = "V2.1"
 
 class L2Cache:
-    MAX_RETRIES = 3
+    CLIENT = None  # PersistenceClient to use instead of the shared one, e.g. pointed at a local stand-in in tests
+
+    @staticmethod
+    def client() -> PersistenceClient:
+        return L2Cache.CLIENT if L2Cache.CLIENT is not None else get_client()
 
     @staticmethod
     def write(obj: object, chain_id: int, key: str):
         key = f"{VERSION}-{key}"
         if 'NODE_ENV' in os.environ and 'production' in os.environ.get('NODE_ENV'):
-            attempt = 0  
-            while attempt < L2Cache.MAX_RETRIES:
-                try:
-                    logging.info(f"Persisting {key} using API")
-                    bytes = pickle.dumps(obj)
-                    token = forta_agent.fetch_jwt({})
-
-                    headers = {"Authorization": f"Bearer {token}"}
-                    res = requests.post(f"{DATABASE}{key}_{chain_id}", data=bytes, headers=headers)
-                    logging.info(f"Persisting {key}_{chain_id} to database. Response: {res}")
-                    break
-                except Exception as e:
-                    logging.warn(f"Exception in persist {e}")
-                    attempt += 1 
-                    time.sleep(0.01)
-                    if attempt == L2Cache.MAX_RETRIES:
-                        Utils.ERROR_CACHE.add(Utils.alert_error(str(e), f"l2_cache.write (max retries reached)", traceback.format_exc()))
+            try:
+                logging.info(f"Persisting {key} using API")
+                bytes = pickle.dumps(obj)
+                res = L2Cache.client().post(f"{key}_{chain_id}", bytes)
+                logging.info(f"Persisting {key}_{chain_id} to database. Response: {res}")
+            except Exception as e:
+                logging.warn(f"Exception in persist {e}")
+                Utils.ERROR_CACHE.add(Utils.alert_error(str(e), f"l2_cache.write (max retries reached)", traceback.format_exc()))
         else:
             logging.info(f"Persisting {key}_{chain_id} locally")
             pickle.dump(obj, open(key, "wb"))
@@ -45,9 +37,7 @@ class L2Cache:
         if 'NODE_ENV' in os.environ and 'production' in os.environ.get('NODE_ENV'):
             try:
                 logging.info(f"Loading {key}_{chain_id}  using API")
-                token = forta_agent.fetch_jwt({})
-                headers = {"Authorization": f"Bearer {token}"}
-                res = requests.get(f"{DATABASE}{key}_{chain_id}", headers=headers)
+                res = L2Cache.client().get(f"{key}_{chain_id}")
                 logging.info(f"Loaded {key}_{chain_id} . Response: {res}")
                 if res.status_code == 200 and len(res.content) > 0:
                     return pickle.loads(res.content)
@@ -18,12 +18,15 @@ from src.findings import AlertCombinerFinding
 from src.constants import (BASE_BOTS, ALERTED_CLUSTERS_MAX_QUEUE_SIZE, ALERTED_FP_CLUSTERS_QUEUE_SIZE, MANUALLY_ALERTED_ENTITIES_QUEUE_SIZE, ATTACK_DETECTOR_BOT_ID, ATTACK_DETECTOR_BETA_BOT_ID,
                            FP_MITIGATION_BOTS, ANOMALY_SCORE_THRESHOLD_STRICT, ANOMALY_SCORE_THRESHOLD_LOOSE,
                            MIN_ALERTS_COUNT, ALERTED_CLUSTERS_STRICT_KEY, ALERTED_CLUSTERS_LOOSE_KEY, ALERTED_FP_CLUSTERS_KEY, MANUALLY_ALERTED_ENTITIES_KEY, VICTIM_IDENTIFICATION_BOTS, DEFAULT_ANOMALY_SCORE, HIGHLY_PRECISE_BOTS,
-                           ALERTED_CLUSTERS_FP_MITIGATED_KEY, FINDINGS_CACHE_BLOCK_KEY, END_USER_ATTACK_BOTS, POLYGON_VALIDATOR_ALERT_COUNT_THRESHOLD, PASSTHROUGH_BOTS, ENCRYPTED_BOTS)
+                           ALERTED_CLUSTERS_FP_MITIGATED_KEY, FINDINGS_CACHE_BLOCK_KEY, DETECT_ATTACK_MAX_WORKERS, END_USER_ATTACK_BOTS, POLYGON_VALIDATOR_ALERT_COUNT_THRESHOLD, PASSTHROUGH_BOTS, ENCRYPTED_BOTS,
+                           ETHERSCAN_LABEL_CACHE_SNAPSHOT_PATH, CLUSTER_AGGREGATE_CACHE_SIZE)
 from src.L2Cache import L2Cache
-from src.storage import s3_client, dynamo_table, get_secrets
+from src.storage import s3_client, dynamo_table, get_secrets, DynamoTablePool
 from src.blockchain_indexer_service import BlockChainIndexer
 from src.utils import Utils
 from src.dynamo_utils import DynamoUtils, PROD_TAG
+from src.cluster_aggregate import ClusterAggregateCache
+from src.label_cache import LabelCache
 
 
 web3 = Web3(Web3.HTTPProvider(get_json_rpc_url()))
@@ -33,7 +36,7 @@ INITIALIZED = False
 CHAIN_ID = -1
 
 CONTRACT_CACHE = dict()  # address -> is_contract
-ETHERSCAN_LOCAL_CACHE = dict() # cluster -> {labels, time}
+ETHERSCAN_LABEL_CACHE = LabelCache(lambda addresses: block_chain_indexer.get_etherscan_labels_by_address(addresses, CHAIN_ID))  # address -> etherscan labels
 ALERTED_CLUSTERS_STRICT = []  # cluster
 ALERTED_CLUSTERS_LOOSE = []  # cluster
 ALERTED_CLUSTERS_FP_MITIGATED = []  # cluster
@@ -43,9 +46,11 @@ ALERTED_FP_CLUSTERS = []
 REACTIVE_LIKELY_FPS = {}  # address -> list of label and label metadata (addresses that are yet to be checked)
 LAST_PROCESSED_TIME = 0 # Used to update reactive likely fps
 FINDINGS_CACHE_BLOCK = []
+CLUSTER_AGGREGATES = ClusterAggregateCache(CLUSTER_AGGREGATE_CACHE_SIZE)  # cluster -> aggregate of its alert records
 
 s3 = None
 dynamo = None
+dynamo_table_pool = None  # tables of the threads of detect_attack; a boto3 resource isnt thread safe
 secrets = None
 
 root = logging.getLogger()
@@ -98,8 +103,18 @@ def initialize():
     global CONTRACT_CACHE
     CONTRACT_CACHE = {}
 
-    global ETHERSCAN_LOCAL_CACHE
-    ETHERSCAN_LOCAL_CACHE = {}
+    global CLUSTER_AGGREGATES
+    CLUSTER_AGGREGATES = ClusterAggregateCache(CLUSTER_AGGREGATE_CACHE_SIZE)
+
+    global ETHERSCAN_LABEL_CACHE
+    is_production = 'NODE_ENV' in os.environ and 'production' in os.environ.get('NODE_ENV')
+    ETHERSCAN_LABEL_CACHE = LabelCache(lambda addresses: block_chain_indexer.get_etherscan_labels_by_address(addresses, CHAIN_ID),
+                                       snapshot_path=ETHERSCAN_LABEL_CACHE_SNAPSHOT_PATH if is_production else None)
+    Utils.LABEL_CACHE = None
+
+    # the alert data items written by previous releases are converted in the background, off the alert handling path
+    if is_production:
+        DynamoUtils(PROD_TAG, CHAIN_ID).start_folding_legacy_alert_data(lambda: dynamo_table(secrets))
 
     subscription_json = []
     for bot, alertId, stage in BASE_BOTS:
@@ -143,6 +158,7 @@ def reinitialize():
     global CHAIN_ID
     global s3
     global dynamo
+    global dynamo_table_pool
     global secrets
 
     try:
@@ -151,6 +167,7 @@ def reinitialize():
             secrets = get_secrets()
             s3 = s3_client(secrets)
             dynamo = dynamo_table(secrets)
+            dynamo_table_pool = DynamoTablePool(lambda: dynamo_table(secrets))
             logging.info(f"Initialized dynamo DB successfully.")
     except Exception as e:
         logging.error(f"Error getting chain id: {e}")
@@ -381,6 +398,107 @@ def update_reactive_likely_fps(w3, du, current_date) -> list:
    
     return findings
 
+def analyze_address(w3, du, table, alert_event: forta_agent.alert_event.AlertEvent, address: str, chain_id: int, is_passthrough_bot: bool, fp_mitigation_cluster_cache: set, end_user_attack_cluster_cache: set) -> dict:
+    """
+    per address part of detect_attack: resolves the cluster, appends the alert to its alert data and aggregate and evaluates the thresholds and FP checks
+    it only does I/O and doesnt touch state shared across addresses, so it can run concurrently for the addresses of an alert
+    :param table: dynamo table used by this thread only
+    :return: None if the address is ignored; otherwise the cluster, aggregate, whether a finding may be raised (is_candidate) and the alert data of candidates
+    """
+    logging.info(f"alert {alert_event.alert_hash} - Analysing address {address}")
+    address_lower = address.lower()
+    cluster = address_lower
+    entity_clusters = du.read_entity_clusters(table, address_lower)
+    if address_lower in entity_clusters.keys():
+        cluster = entity_clusters[address_lower]
+    if(not Utils.is_address(cluster)):  # ignore contracts and invalid addresses like 0x0000000000000blabla
+        logging.info(f"alert {alert_event.alert_hash}: {cluster} is not an address. Continue ... ")
+        return None
+
+    logging.info(f"alert {alert_event.alert_hash}: {cluster} is valid EOA.")
+
+    alert_anomaly_score = get_anomaly_score(alert_event)
+
+    stage = ALERT_ID_STAGE_MAPPING[(alert_event.bot_id, alert_event.alert.alert_id)]
+    logging.info(f"alert {alert_event.alert_hash} {alert_event.bot_id} {alert_event.alert.alert_id} {stage}: {cluster} anomaly score of {alert_anomaly_score}")
+
+    columns = ['stage', 'created_at', 'anomaly_score', 'alert_hash', 'bot_id', 'alert_id', 'addresses', 'transaction_hash', 'address_filter', 'chain_id']
+
+    created_at = datetime.strptime(alert_event.alert.created_at[:-4] + 'Z', "%Y-%m-%dT%H:%M:%S.%fZ")
+
+    address_filter = alert_event.alert.address_filter
+    if address_filter is not None:
+        # Create a list of the filter values to pass to the dataframe
+        filter_data = [address_filter.k, address_filter.m, address_filter.base64_data]
+    else:
+        filter_data = None
+
+    new_alert_data = pd.DataFrame([[stage, created_at, alert_anomaly_score, alert_event.alert_hash, alert_event.bot_id, alert_event.alert.alert_id, alert_event.alert.addresses, alert_event.alert.source.transaction_hash, filter_data, chain_id]], columns=columns)
+    du.put_alert_data(table, cluster, new_alert_data)
+    aggregate = CLUSTER_AGGREGATES.add(cluster, stage, created_at, alert_anomaly_score, alert_event.bot_id, alert_event.alert.alert_id, chain_id, lambda: du.read_alert_data(table, cluster, created_at))
+
+    # contains highly precise bot
+    highly_precise_bot_alert_id_count, is_highly_precise_bot_preparation_stage_alert_id, highly_precise_bot_ids = aggregate.highly_precise_bots(HIGHLY_PRECISE_BOTS)
+
+    analysis = {'cluster': cluster, 'alert_data': None, 'aggregate': aggregate, 'passthrough_sources': aggregate.passthrough_sources(PASSTHROUGH_BOTS),
+                'highly_precise_bots': (highly_precise_bot_alert_id_count, is_highly_precise_bot_preparation_stage_alert_id, highly_precise_bot_ids),
+                'is_candidate': False, 'is_preparation_alert': False, 'fp_mitigated': False, 'end_user_attack': False}
+
+    # analyze alert_data to see whether conditions are met to generate a finding
+    # 1. Have to have at least MIN_ALERTS_COUNT bots reporting alerts
+    if aggregate.bot_count() >= MIN_ALERTS_COUNT or highly_precise_bot_alert_id_count>0 or is_passthrough_bot:
+        # 2. Have to have overall anomaly score of less than ANOMALY_SCORE_THRESHOLD
+        anomaly_scores = aggregate.min_anomaly_score_by_stage
+        anomaly_score = aggregate.anomaly_score()
+        logging.info(f"alert {alert_event.alert_hash} - Have sufficient number of alerts for {cluster}. Overall anomaly score is {anomaly_score}, {len(anomaly_scores)} stages, {highly_precise_bot_alert_id_count} highly precise bot alert ids, {len(highly_precise_bot_ids)} highly precise bot ids, {is_passthrough_bot} passthrough bot {is_passthrough_bot}.")
+        logging.info(f"alert {alert_event.alert_hash} - {cluster} anomaly scores {anomaly_scores}.")
+
+        # Check if a preparation alert should also be emitted
+        analysis['is_preparation_alert'] = is_highly_precise_bot_preparation_stage_alert_id and not (aggregate.has_stage('MoneyLaundering') or aggregate.has_stage('Exploitation'))
+
+        if anomaly_score < ANOMALY_SCORE_THRESHOLD_LOOSE or len(anomaly_scores) == 4 or is_passthrough_bot or (highly_precise_bot_alert_id_count>0 and len(anomaly_scores)>1) or (len(highly_precise_bot_ids)>1):
+            logging.info(f"alert {alert_event.alert_hash} - Overall anomaly score for {cluster} is below threshold, 4 stages, or highly precise bot with 2 stages have been observed or two highly precise bots have been observed or a passthrough alert has been observed. Unless FP mitigation kicks in, will raise finding.")
+
+            if not aggregate.has_chain(CHAIN_ID):
+                logging.info(f"No alert on chain {CHAIN_ID} for {cluster}. Wont raise finding")
+                return analysis
+
+            fp_mitigated = False
+            end_user_attack = False
+            if(Utils.is_contract(w3, cluster)):
+                logging.info(f"alert {alert_event.alert_hash} - {cluster} is contract. Wont raise finding")
+                return analysis
+
+            # the alert data itself is only read for the clusters a finding may be raised for
+            alert_data = pd.concat([du.read_alert_data(table, cluster, created_at), new_alert_data], ignore_index=True, axis=0).drop_duplicates(subset=['stage', 'created_at', 'anomaly_score', 'alert_hash', 'bot_id', 'alert_id', 'transaction_hash'], inplace=False)
+            logging.info(f"alert {alert_event.alert_hash} - alert data size for cluster {cluster} now: {len(alert_data)}")
+            analysis['alert_data'] = alert_data
+
+            # Etherscan API on mainnet, Forta label API on other chains
+            label_cache = ETHERSCAN_LABEL_CACHE if CHAIN_ID == 1 else Utils.get_label_cache()
+            etherscan_labels = [label for address_labels in label_cache.get_many(cluster.split(',')).values() for label in address_labels]
+            if LabelCache.is_non_attacker(etherscan_labels):
+                logging.info(f"alert {alert_event.alert_hash} - Non attacker etherscan FP mitigation labels {etherscan_labels} for cluster {cluster}.")
+                fp_mitigated = True
+
+            if (CHAIN_ID == 137 and len(alert_data) > POLYGON_VALIDATOR_ALERT_COUNT_THRESHOLD) or is_polygon_validator(w3, cluster, alert_event.alert.source.transaction_hash):
+                logging.info(f"alert {alert_event.alert_hash} - {cluster} is polygon validator. Wont raise finding")
+                fp_mitigated = True
+
+            if cluster in fp_mitigation_cluster_cache:
+                logging.info(f"alert {alert_event.alert_hash} - Mitigating FP for {cluster}. Wont raise finding")
+                fp_mitigated = True
+
+            if cluster in end_user_attack_cluster_cache:
+                logging.info(
+                    f"alert {alert_event.alert_hash} - End user attack identified for {cluster}. Downgrade finding")
+                end_user_attack = True
+
+            analysis.update({'is_candidate': True, 'fp_mitigated': fp_mitigated, 'end_user_attack': end_user_attack})
+
+    return analysis
+
+
 def detect_attack(w3, du, alert_event: forta_agent.alert_event.AlertEvent) -> list:
     """
     this function returns finding for any address with at least 3 alerts observed on that address; it will generate an anomaly score
@@ -465,218 +583,99 @@ def detect_attack(w3, du, alert_event: forta_agent.alert_event.AlertEvent) -> li
                     bot_sources = set()
                     pot_attacker_addresses = get_pot_attacker_addresses(alert_event)
 
-                    fp_mitigation_cluster_cache = du.read_fp_mitigation_clusters(dynamo)
-                    end_user_attack_cluster_cache = du.read_end_user_attack_clusters(dynamo)
-                    for address in pot_attacker_addresses:
-                        logging.info(f"alert {alert_event.alert_hash} - Analysing address {address}")
-                        address_lower = address.lower()
-                        cluster = address_lower
-                        entity_clusters = du.read_entity_clusters(dynamo, address_lower)
-                        if address_lower in entity_clusters.keys():
-                            cluster = entity_clusters[address_lower]
-                        if(not Utils.is_address(cluster)):  # ignore contracts and invalid addresses like 0x0000000000000blabla
-                            logging.info(f"alert {alert_event.alert_hash}: {cluster} is not an address. Continue ... ")
+                    fp_mitigation_cluster_cache = du.get_fp_mitigation_clusters(dynamo)
+                    end_user_attack_cluster_cache = du.get_end_user_attack_clusters(dynamo)
+                    is_passthrough_bot = False
+                    for bot_id, alert_id, source in PASSTHROUGH_BOTS:
+                        if alert_event.bot_id == bot_id and alert_event.alert.alert_id == alert_id:
+                            is_passthrough_bot = True
+                            bot_sources.add(source)
+
+                    # fan out the per address I/O; findings are created in address order below as they depend on state shared across addresses
+                    def analyze(address: str) -> dict:
+                        with dynamo_table_pool.table() as table:
+                            return analyze_address(w3, du, table, alert_event, address, chain_id, is_passthrough_bot, fp_mitigation_cluster_cache, end_user_attack_cluster_cache)
+                    analyses = Utils.map_in_order(analyze, pot_attacker_addresses, DETECT_ATTACK_MAX_WORKERS)
+                    for analysis in analyses:
+                        if isinstance(analysis, Exception):
+                            raise analysis
+                        if analysis is None:
                             continue
 
-                        logging.info(f"alert {alert_event.alert_hash}: {cluster} is valid EOA.")
-
-                        alert_anomaly_score = get_anomaly_score(alert_event)
-
-                        stage = ALERT_ID_STAGE_MAPPING[(alert_event.bot_id, alert_event.alert.alert_id)]
-                        logging.info(f"alert {alert_event.alert_hash} {alert_event.bot_id} {alert_event.alert.alert_id} {stage}: {cluster} anomaly score of {alert_anomaly_score}")
-
-                        columns = ['stage', 'created_at', 'anomaly_score', 'alert_hash', 'bot_id', 'alert_id', 'addresses', 'transaction_hash', 'address_filter', 'chain_id']
-
-                        stored_alert_data_cluster = du.read_alert_data(dynamo, cluster)
-                        if stored_alert_data_cluster.empty:                            
-                            alert_data_cluster = pd.DataFrame(columns=columns)
-                        else:
-                            alert_data_cluster = stored_alert_data_cluster
-
-                        stage = ALERT_ID_STAGE_MAPPING[(alert_event.bot_id, alert_event.alert.alert_id)]
-                        address_filter = alert_event.alert.address_filter
-                        if address_filter is not None:
-                            # Create a list of the filter values to pass to the dataframe
-                            filter_data = [address_filter.k, address_filter.m, address_filter.base64_data]
-                        else:
-                            filter_data = None
-
-                        
-                        new_alert_data = pd.DataFrame([[stage, datetime.strptime(alert_event.alert.created_at[:-4] + 'Z', "%Y-%m-%dT%H:%M:%S.%fZ"), alert_anomaly_score, alert_event.alert_hash, alert_event.bot_id, alert_event.alert.alert_id, alert_event.alert.addresses, alert_event.alert.source.transaction_hash, filter_data, chain_id]], columns=columns)
-                        alert_data_cluster = pd.concat([alert_data_cluster, new_alert_data], ignore_index=True, axis=0).drop_duplicates(subset=['stage', 'created_at', 'anomaly_score', 'alert_hash', 'bot_id', 'alert_id', 'transaction_hash'], inplace=False)
-                        logging.info(f"alert {alert_event.alert_hash} - alert data size for cluster {cluster} now: {len(alert_data_cluster)}")
-                        du.put_alert_data(dynamo, cluster, alert_data_cluster, stage)
-                        alert_data = alert_data_cluster
-                        
-                        # contains highly precise bot
-                        highly_precise_bot_alert_id_count = 0
-                        is_highly_precise_bot_preparation_stage_alert_id = False
-                        highly_precise_bot_ids = set()
-                        uniq_bot_alert_ids = alert_data[['bot_id', 'alert_id']].drop_duplicates(inplace=False)
-                        for bot_id, alert_id, s in HIGHLY_PRECISE_BOTS:
-                            if len(uniq_bot_alert_ids[(uniq_bot_alert_ids['bot_id'] == bot_id) & (uniq_bot_alert_ids['alert_id'] == alert_id)]) > 0:
-                                highly_precise_bot_alert_id_count += 1
-                                if not is_highly_precise_bot_preparation_stage_alert_id and  s == "Preparation":
-                                    is_highly_precise_bot_preparation_stage_alert_id = True
-                                highly_precise_bot_ids.add(bot_id)
-
-                        is_passthrough_bot = False
-                        for bot_id, alert_id, source in PASSTHROUGH_BOTS:
-                            if alert_event.bot_id == bot_id and alert_event.alert.alert_id == alert_id:
-                                is_passthrough_bot = True
-                                bot_sources.add(source)
                         if not is_passthrough_bot:
                             bot_sources.add("Forta Base Bots") # a little convoluted; its because when we dont have a passthrough bots, we dont have a source value, so we set it manually as only passthrough bots have sources
-                            
-                        for bot_id, alert_id, source in PASSTHROUGH_BOTS:
-                            matching_bots = uniq_bot_alert_ids[(uniq_bot_alert_ids['bot_id'] == bot_id) & (uniq_bot_alert_ids['alert_id'] == alert_id)]
-                            if len(matching_bots) > 0:
-                                bot_sources.add(source)
-                        
-
+                        bot_sources.update(analysis['passthrough_sources'])
+                        if not analysis['is_candidate']:
+                            continue
 
-                        # analyze alert_data to see whether conditions are met to generate a finding
-                        # 1. Have to have at least MIN_ALERTS_COUNT bots reporting alerts
-                        if len(alert_data['bot_id'].drop_duplicates(inplace=False)) >= MIN_ALERTS_COUNT or highly_precise_bot_alert_id_count>0 or is_passthrough_bot:
-                            # 2. Have to have overall anomaly score of less than ANOMALY_SCORE_THRESHOLD
-                            anomaly_scores_by_stages = alert_data[['stage', 'anomaly_score']].drop_duplicates(inplace=False)
-                            anomaly_scores = anomaly_scores_by_stages.groupby('stage').min()
-                            anomaly_score = anomaly_scores['anomaly_score'].prod()
-                            logging.info(f"alert {alert_event.alert_hash} - Have sufficient number of alerts for {cluster}. Overall anomaly score is {anomaly_score}, {len(anomaly_scores)} stages, {highly_precise_bot_alert_id_count} highly precise bot alert ids, {len(highly_precise_bot_ids)} highly precise bot ids, {is_passthrough_bot} passthrough bot {is_passthrough_bot}.")
-                            logging.info(f"alert {alert_event.alert_hash} - {cluster} anomaly scores {anomaly_scores}.")
-
-                           
-                            
-
-                            # Check if a preparation alert should also be emitted
-                            is_preparation_alert = is_highly_precise_bot_preparation_stage_alert_id and not ('MoneyLaundering' in anomaly_scores.index or 'Exploitation' in anomaly_scores.index)
-                            
-                            if anomaly_score < ANOMALY_SCORE_THRESHOLD_LOOSE or len(anomaly_scores) == 4 or is_passthrough_bot or (highly_precise_bot_alert_id_count>0 and len(anomaly_scores)>1) or (len(highly_precise_bot_ids)>1):
-                                logging.info(f"alert {alert_event.alert_hash} - Overall anomaly score for {cluster} is below threshold, 4 stages, or highly precise bot with 2 stages have been observed or two highly precise bots have been observed or a passthrough alert has been observed. Unless FP mitigation kicks in, will raise finding.")
-
-                                if alert_data[alert_data['chain_id'] == CHAIN_ID].empty:
-                                    logging.info(f"No alert on chain {CHAIN_ID} for {cluster}. Wont raise finding")
-                                    continue
-
-                                fp_mitigated = False
-                                end_user_attack = False
-                                if(Utils.is_contract(w3, cluster)):
-                                    logging.info(f"alert {alert_event.alert_hash} - {cluster} is contract. Wont raise finding")
-                                    continue
-
-                                if CHAIN_ID == 1:
-                                    # Etherscan API
-                                    etherscan_called = False
-                                    if cluster in ETHERSCAN_LOCAL_CACHE.keys():
-                                        current_time = time.time()
-                                        # we put a 2h cache on etherscan labels
-                                        if current_time - ETHERSCAN_LOCAL_CACHE[cluster]['time'] < 2 * 3600:
-                                            etherscan_labels = ETHERSCAN_LOCAL_CACHE[cluster]['labels']
-                                            etherscan_called = True
-                                    if not etherscan_called:
-                                        etherscan_labels = block_chain_indexer.get_etherscan_labels(cluster, CHAIN_ID)
-                                        ETHERSCAN_LOCAL_CACHE[cluster] = {'labels': etherscan_labels, 'time': time.time()}
-                                    if etherscan_labels and all(
-                                        not any(word in label.lower() for word in ['attack', 'phish', 'hack', 'heist', 'drainer', 'exploit', 'scam', 'fraud', '.eth'])
-                                        for label in etherscan_labels
-                                    ):                 
-                                        logging.info(f"alert {alert_event.alert_hash} - Non attacker etherscan FP mitigation labels for cluster {cluster}.")
-                                        fp_mitigated = True
-                                else:
-                                    # Forta API
-                                    etherscan_called = False
-                                    if cluster in ETHERSCAN_LOCAL_CACHE.keys():
-                                        current_time = time.time()
-                                        # we put a 2h cache on etherscan labels
-                                        if current_time - ETHERSCAN_LOCAL_CACHE[cluster]['time'] < 2 * 3600:
-                                            etherscan_label = ETHERSCAN_LOCAL_CACHE[cluster]['labels']
-                                            etherscan_called = True
-                                    if not etherscan_called:  
-                                        etherscan_label = Utils.get_etherscan_label(cluster).lower()
-                                        ETHERSCAN_LOCAL_CACHE[cluster] = {'labels': etherscan_label, 'time': time.time()}
-                                    if not ('attack' in etherscan_label
-                                            or 'phish' in etherscan_label
-                                            or 'hack' in etherscan_label
-                                            or 'heist' in etherscan_label
-                                            or 'drainer' in etherscan_label
-                                            or 'exploit' in etherscan_label
-                                            or 'scam' in etherscan_label
-                                            or 'fraud' in etherscan_label
-                                            or '.eth' in etherscan_label
-                                            or etherscan_label == ''):
-                                        logging.info(f"alert {alert_event.alert_hash} -  Non attacker etherscan FP mitigation label {etherscan_label} for cluster {cluster}.")
-                                        fp_mitigated = True
-
-                                if (CHAIN_ID == 137 and len(alert_data) > POLYGON_VALIDATOR_ALERT_COUNT_THRESHOLD) or is_polygon_validator(w3, cluster, alert_event.alert.source.transaction_hash):
-                                    logging.info(f"alert {alert_event.alert_hash} - {cluster} is polygon validator. Wont raise finding")
-                                    fp_mitigated = True
-
-                                if cluster in fp_mitigation_cluster_cache:
-                                    logging.info(f"alert {alert_event.alert_hash} - Mitigating FP for {cluster}. Wont raise finding")
-                                    fp_mitigated = True
-
-                                if cluster in end_user_attack_cluster_cache:
-                                    logging.info(
-                                        f"alert {alert_event.alert_hash} - End user attack identified for {cluster}. Downgrade finding")
-                                    end_user_attack = True
-
-                                bot_source_identifier = get_bot_source_identifier(bot_sources) # dont suppress findings from different bot sources
-                                if not end_user_attack and not fp_mitigated and (len(anomaly_scores) == 4) and (cluster + bot_source_identifier) not in ALERTED_CLUSTERS_STRICT:
-                                    logging.info(f"alert {alert_event.alert_hash} -1 critical severity finding for {cluster}. Anomaly score is {anomaly_score}.")
-                                    
-                                    victims = du.read_victims(dynamo)
-                                    victim_address, victim_name, victim_metadata = get_victim_info(alert_data, victims)
-                                    update_list(ALERTED_CLUSTERS_STRICT, ALERTED_CLUSTERS_MAX_QUEUE_SIZE, cluster + get_bot_source_identifier(bot_sources))
-                                    findings.append(AlertCombinerFinding.create_finding(block_chain_indexer, cluster, victim_address, victim_name, anomaly_score, FindingSeverity.Critical, "ATTACK-DETECTOR-1", alert_event, alert_data, victim_metadata, anomaly_scores_by_stages, CHAIN_ID, bot_sources))
-                                    if is_preparation_alert:
-                                        findings.append(AlertCombinerFinding.create_finding(block_chain_indexer, cluster, victim_address, victim_name, anomaly_score, FindingSeverity.Critical, "ATTACK-DETECTOR-PREPARATION", alert_event, alert_data, victim_metadata, anomaly_scores_by_stages, CHAIN_ID, bot_sources))
-
-                                elif not end_user_attack and not fp_mitigated and ((highly_precise_bot_alert_id_count > 0 and len(anomaly_scores) > 1) or (len(highly_precise_bot_ids)>1)) and (cluster + bot_source_identifier) not in ALERTED_CLUSTERS_STRICT:
-                                    logging.info(f"alert {alert_event.alert_hash} -1 critical severity finding for {cluster}. Anomaly score is {anomaly_score}.")
-                                    victims = du.read_victims(dynamo)
-                                    victim_address, victim_name, victim_metadata = get_victim_info(alert_data, victims)
-                                    update_list(ALERTED_CLUSTERS_STRICT, ALERTED_CLUSTERS_MAX_QUEUE_SIZE, cluster + get_bot_source_identifier(bot_sources))
-                                    findings.append(AlertCombinerFinding.create_finding(block_chain_indexer, cluster, victim_address, victim_name, anomaly_score, FindingSeverity.Critical, "ATTACK-DETECTOR-2", alert_event, alert_data, victim_metadata, anomaly_scores_by_stages, CHAIN_ID, bot_sources))
-                                    if is_preparation_alert:
-                                        findings.append(AlertCombinerFinding.create_finding(block_chain_indexer, cluster, victim_address, victim_name, anomaly_score, FindingSeverity.Critical, "ATTACK-DETECTOR-PREPARATION", alert_event, alert_data, victim_metadata, anomaly_scores_by_stages, CHAIN_ID, bot_sources))
-                                elif not end_user_attack and is_passthrough_bot and (cluster + bot_source_identifier) not in ALERTED_CLUSTERS_STRICT:
-                                    logging.info(f"alert {alert_event.alert_hash} -1 critical severity finding for {cluster}. Anomaly score is {anomaly_score}.")
-                                    victims = du.read_victims(dynamo)
-                                    victim_address, victim_name, victim_metadata = get_victim_info(alert_data, victims)
-                                    update_list(ALERTED_CLUSTERS_STRICT, ALERTED_CLUSTERS_MAX_QUEUE_SIZE, cluster + get_bot_source_identifier(bot_sources))
-                                    findings.append(AlertCombinerFinding.create_finding(block_chain_indexer, cluster, victim_address, victim_name, -1, FindingSeverity.Critical, "ATTACK-DETECTOR-7", alert_event, alert_data, victim_metadata, pd.DataFrame(columns=['stage', 'anomaly_score']), CHAIN_ID, bot_sources))
-                                elif not end_user_attack and not fp_mitigated and (len(alert_data['bot_id'].drop_duplicates(inplace=False)) >= MIN_ALERTS_COUNT and anomaly_score < ANOMALY_SCORE_THRESHOLD_STRICT) and (cluster + bot_source_identifier) not in ALERTED_CLUSTERS_STRICT:
-                                    logging.info(f"alert {alert_event.alert_hash} -1 critical severity finding for {cluster}. Anomaly score is {anomaly_score}.") 
-                                    victims = du.read_victims(dynamo)
-                                    victim_address, victim_name, victim_metadata = get_victim_info(alert_data, victims)
-                                    update_list(ALERTED_CLUSTERS_STRICT, ALERTED_CLUSTERS_MAX_QUEUE_SIZE, cluster + get_bot_source_identifier(bot_sources))
-                                    findings.append(AlertCombinerFinding.create_finding(block_chain_indexer, cluster, victim_address, victim_name, anomaly_score, FindingSeverity.Critical, "ATTACK-DETECTOR-3", alert_event, alert_data, victim_metadata, anomaly_scores_by_stages, CHAIN_ID, bot_sources))
-                                    if is_preparation_alert:
-                                        findings.append(AlertCombinerFinding.create_finding(block_chain_indexer, cluster, victim_address, victim_name, anomaly_score, FindingSeverity.Critical, "ATTACK-DETECTOR-PREPARATION", alert_event, alert_data, victim_metadata, anomaly_scores_by_stages, CHAIN_ID, bot_sources))
-
-                                elif not end_user_attack and not fp_mitigated and (len(alert_data['bot_id'].drop_duplicates(inplace=False)) >= MIN_ALERTS_COUNT  and anomaly_score < ANOMALY_SCORE_THRESHOLD_LOOSE) and (cluster + bot_source_identifier) not in ALERTED_CLUSTERS_LOOSE and (cluster + bot_source_identifier) not in ALERTED_CLUSTERS_STRICT:
-                                    logging.info(f"alert {alert_event.alert_hash} -1 low severity finding for {cluster}. Anomaly score is {anomaly_score}.") 
-                                    victims = du.read_victims(dynamo)
-                                    victim_address, victim_name, victim_metadata = get_victim_info(alert_data, victims)
-                                    update_list(ALERTED_CLUSTERS_LOOSE, ALERTED_CLUSTERS_MAX_QUEUE_SIZE, cluster + get_bot_source_identifier(bot_sources))
-                                    findings.append(AlertCombinerFinding.create_finding(block_chain_indexer, cluster, victim_address, victim_name, anomaly_score, FindingSeverity.Low, "ATTACK-DETECTOR-4", alert_event, alert_data, victim_metadata, anomaly_scores_by_stages, CHAIN_ID, bot_sources))
-                                    if is_preparation_alert:
-                                        findings.append(AlertCombinerFinding.create_finding(block_chain_indexer, cluster, victim_address, victim_name, anomaly_score, FindingSeverity.Critical, "ATTACK-DETECTOR-PREPARATION", alert_event, alert_data, victim_metadata, anomaly_scores_by_stages, CHAIN_ID, bot_sources))
-
-                                elif not end_user_attack and fp_mitigated and ((cluster + bot_source_identifier) not in ALERTED_CLUSTERS_FP_MITIGATED) and (((len(anomaly_scores) == 4) and (cluster + bot_source_identifier) not in ALERTED_CLUSTERS_STRICT) or ((highly_precise_bot_alert_id_count > 0 and len(anomaly_scores) > 1) and (cluster + bot_source_identifier) not in ALERTED_CLUSTERS_STRICT) or (len(highly_precise_bot_ids)>1) or ((len(alert_data['bot_id'].drop_duplicates(inplace=False)) >= MIN_ALERTS_COUNT and anomaly_score < ANOMALY_SCORE_THRESHOLD_STRICT) and (cluster + bot_source_identifier) not in ALERTED_CLUSTERS_STRICT)
-                                                                                         or ((len(alert_data['bot_id'].drop_duplicates(inplace=False)) >= MIN_ALERTS_COUNT  and anomaly_score < ANOMALY_SCORE_THRESHOLD_LOOSE) and (cluster + bot_source_identifier) not in ALERTED_CLUSTERS_LOOSE and (cluster + bot_source_identifier) not in ALERTED_CLUSTERS_STRICT)):
-                                    victims = du.read_victims(dynamo)
-                                    victim_address, victim_name, victim_metadata = get_victim_info(alert_data, victims)
-                                    update_list(ALERTED_CLUSTERS_FP_MITIGATED, ALERTED_CLUSTERS_MAX_QUEUE_SIZE, cluster + get_bot_source_identifier(bot_sources)) 
-                                    findings.append(AlertCombinerFinding.create_finding(block_chain_indexer, cluster, victim_address, victim_name, anomaly_score, FindingSeverity.Info, "ATTACK-DETECTOR-5", alert_event, alert_data, victim_metadata, anomaly_scores_by_stages, CHAIN_ID, bot_sources))
-                                elif end_user_attack and not fp_mitigated and ((cluster + bot_source_identifier) not in ALERTED_CLUSTERS_FP_MITIGATED) and (((len(anomaly_scores) == 4) and (cluster + bot_source_identifier) not in ALERTED_CLUSTERS_STRICT) or ((highly_precise_bot_alert_id_count > 0 and len(anomaly_scores) > 1) and (cluster + bot_source_identifier) not in ALERTED_CLUSTERS_STRICT) or (len(highly_precise_bot_ids)>1) or ((len(alert_data['bot_id'].drop_duplicates(inplace=False)) >= MIN_ALERTS_COUNT and anomaly_score < ANOMALY_SCORE_THRESHOLD_STRICT) and (cluster + bot_source_identifier) not in ALERTED_CLUSTERS_STRICT)
-                                                                                         or ((len(alert_data['bot_id'].drop_duplicates(inplace=False)) >= MIN_ALERTS_COUNT  and anomaly_score < ANOMALY_SCORE_THRESHOLD_LOOSE) and (cluster + bot_source_identifier) not in ALERTED_CLUSTERS_LOOSE and (cluster + bot_source_identifier) not in ALERTED_CLUSTERS_STRICT)):
-                                    victims = du.read_victims(dynamo)
-                                    victim_address, victim_name, victim_metadata = get_victim_info(alert_data, victims)
-                                    update_list(ALERTED_CLUSTERS_FP_MITIGATED, ALERTED_CLUSTERS_MAX_QUEUE_SIZE, cluster  + get_bot_source_identifier(bot_sources)) 
-                                    findings.append(AlertCombinerFinding.create_finding(block_chain_indexer, cluster, victim_address, victim_name, anomaly_score, FindingSeverity.Info, "ATTACK-DETECTOR-6", alert_event, alert_data, victim_metadata, anomaly_scores_by_stages, CHAIN_ID, bot_sources))
-                                else:
-                                    logging.info(f"alert {alert_event.alert_hash} - Not raising finding for {cluster}. Already alerted.")
+                        cluster = analysis['cluster']
+                        alert_data = analysis['alert_data']
+                        aggregate = analysis['aggregate']
+                        anomaly_scores = aggregate.min_anomaly_score_by_stage
+                        anomaly_score = aggregate.anomaly_score()
+                        highly_precise_bot_alert_id_count, is_highly_precise_bot_preparation_stage_alert_id, highly_precise_bot_ids = analysis['highly_precise_bots']
+                        is_preparation_alert = analysis['is_preparation_alert']
+                        fp_mitigated = analysis['fp_mitigated']
+                        end_user_attack = analysis['end_user_attack']
+
+                        bot_source_identifier = get_bot_source_identifier(bot_sources) # dont suppress findings from different bot sources
+                        anomaly_scores_by_stages = aggregate.anomaly_scores_by_stage()
+                        if not end_user_attack and not fp_mitigated and (len(anomaly_scores) == 4) and (cluster + bot_source_identifier) not in ALERTED_CLUSTERS_STRICT:
+                            logging.info(f"alert {alert_event.alert_hash} -1 critical severity finding for {cluster}. Anomaly score is {anomaly_score}.")
+
+                            victims = du.get_victims(dynamo)
+                            victim_address, victim_name, victim_metadata = get_victim_info(alert_data, victims)
+                            update_list(ALERTED_CLUSTERS_STRICT, ALERTED_CLUSTERS_MAX_QUEUE_SIZE, cluster + get_bot_source_identifier(bot_sources))
+                            findings.append(AlertCombinerFinding.create_finding(block_chain_indexer, cluster, victim_address, victim_name, anomaly_score, FindingSeverity.Critical, "ATTACK-DETECTOR-1", alert_event, alert_data, victim_metadata, anomaly_scores_by_stages, CHAIN_ID, bot_sources))
+                            if is_preparation_alert:
+                                findings.append(AlertCombinerFinding.create_finding(block_chain_indexer, cluster, victim_address, victim_name, anomaly_score, FindingSeverity.Critical, "ATTACK-DETECTOR-PREPARATION", alert_event, alert_data, victim_metadata, anomaly_scores_by_stages, CHAIN_ID, bot_sources))
+
+                        elif not end_user_attack and not fp_mitigated and ((highly_precise_bot_alert_id_count > 0 and len(anomaly_scores) > 1) or (len(highly_precise_bot_ids)>1)) and (cluster + bot_source_identifier) not in ALERTED_CLUSTERS_STRICT:
+                            logging.info(f"alert {alert_event.alert_hash} -1 critical severity finding for {cluster}. Anomaly score is {anomaly_score}.")
+                            victims = du.get_victims(dynamo)
+                            victim_address, victim_name, victim_metadata = get_victim_info(alert_data, victims)
+                            update_list(ALERTED_CLUSTERS_STRICT, ALERTED_CLUSTERS_MAX_QUEUE_SIZE, cluster + get_bot_source_identifier(bot_sources))
+                            findings.append(AlertCombinerFinding.create_finding(block_chain_indexer, cluster, victim_address, victim_name, anomaly_score, FindingSeverity.Critical, "ATTACK-DETECTOR-2", alert_event, alert_data, victim_metadata, anomaly_scores_by_stages, CHAIN_ID, bot_sources))
+                            if is_preparation_alert:
+                                findings.append(AlertCombinerFinding.create_finding(block_chain_indexer, cluster, victim_address, victim_name, anomaly_score, FindingSeverity.Critical, "ATTACK-DETECTOR-PREPARATION", alert_event, alert_data, victim_metadata, anomaly_scores_by_stages, CHAIN_ID, bot_sources))
+                        elif not end_user_attack and is_passthrough_bot and (cluster + bot_source_identifier) not in ALERTED_CLUSTERS_STRICT:
+                            logging.info(f"alert {alert_event.alert_hash} -1 critical severity finding for {cluster}. Anomaly score is {anomaly_score}.")
+                            victims = du.get_victims(dynamo)
+                            victim_address, victim_name, victim_metadata = get_victim_info(alert_data, victims)
+                            update_list(ALERTED_CLUSTERS_STRICT, ALERTED_CLUSTERS_MAX_QUEUE_SIZE, cluster + get_bot_source_identifier(bot_sources))
+                            findings.append(AlertCombinerFinding.create_finding(block_chain_indexer, cluster, victim_address, victim_name, -1, FindingSeverity.Critical, "ATTACK-DETECTOR-7", alert_event, alert_data, victim_metadata, pd.DataFrame(columns=['stage', 'anomaly_score']), CHAIN_ID, bot_sources))
+                        elif not end_user_attack and not fp_mitigated and (aggregate.bot_count() >= MIN_ALERTS_COUNT and anomaly_score < ANOMALY_SCORE_THRESHOLD_STRICT) and (cluster + bot_source_identifier) not in ALERTED_CLUSTERS_STRICT:
+                            logging.info(f"alert {alert_event.alert_hash} -1 critical severity finding for {cluster}. Anomaly score is {anomaly_score}.") 
+                            victims = du.get_victims(dynamo)
+                            victim_address, victim_name, victim_metadata = get_victim_info(alert_data, victims)
+                            update_list(ALERTED_CLUSTERS_STRICT, ALERTED_CLUSTERS_MAX_QUEUE_SIZE, cluster + get_bot_source_identifier(bot_sources))
+                            findings.append(AlertCombinerFinding.create_finding(block_chain_indexer, cluster, victim_address, victim_name, anomaly_score, FindingSeverity.Critical, "ATTACK-DETECTOR-3", alert_event, alert_data, victim_metadata, anomaly_scores_by_stages, CHAIN_ID, bot_sources))
+                            if is_preparation_alert:
+                                findings.append(AlertCombinerFinding.create_finding(block_chain_indexer, cluster, victim_address, victim_name, anomaly_score, FindingSeverity.Critical, "ATTACK-DETECTOR-PREPARATION", alert_event, alert_data, victim_metadata, anomaly_scores_by_stages, CHAIN_ID, bot_sources))
+
+                        elif not end_user_attack and not fp_mitigated and (aggregate.bot_count() >= MIN_ALERTS_COUNT  and anomaly_score < ANOMALY_SCORE_THRESHOLD_LOOSE) and (cluster + bot_source_identifier) not in ALERTED_CLUSTERS_LOOSE and (cluster + bot_source_identifier) not in ALERTED_CLUSTERS_STRICT:
+                            logging.info(f"alert {alert_event.alert_hash} -1 low severity finding for {cluster}. Anomaly score is {anomaly_score}.") 
+                            victims = du.get_victims(dynamo)
+                            victim_address, victim_name, victim_metadata = get_victim_info(alert_data, victims)
+                            update_list(ALERTED_CLUSTERS_LOOSE, ALERTED_CLUSTERS_MAX_QUEUE_SIZE, cluster + get_bot_source_identifier(bot_sources))
+                            findings.append(AlertCombinerFinding.create_finding(block_chain_indexer, cluster, victim_address, victim_name, anomaly_score, FindingSeverity.Low, "ATTACK-DETECTOR-4", alert_event, alert_data, victim_metadata, anomaly_scores_by_stages, CHAIN_ID, bot_sources))
+                            if is_preparation_alert:
+                                findings.append(AlertCombinerFinding.create_finding(block_chain_indexer, cluster, victim_address, victim_name, anomaly_score, FindingSeverity.Critical, "ATTACK-DETECTOR-PREPARATION", alert_event, alert_data, victim_metadata, anomaly_scores_by_stages, CHAIN_ID, bot_sources))
+
+                        elif not end_user_attack and fp_mitigated and ((cluster + bot_source_identifier) not in ALERTED_CLUSTERS_FP_MITIGATED) and (((len(anomaly_scores) == 4) and (cluster + bot_source_identifier) not in ALERTED_CLUSTERS_STRICT) or ((highly_precise_bot_alert_id_count > 0 and len(anomaly_scores) > 1) and (cluster + bot_source_identifier) not in ALERTED_CLUSTERS_STRICT) or (len(highly_precise_bot_ids)>1) or ((aggregate.bot_count() >= MIN_ALERTS_COUNT and anomaly_score < ANOMALY_SCORE_THRESHOLD_STRICT) and (cluster + bot_source_identifier) not in ALERTED_CLUSTERS_STRICT)
+                                                                                 or ((aggregate.bot_count() >= MIN_ALERTS_COUNT  and anomaly_score < ANOMALY_SCORE_THRESHOLD_LOOSE) and (cluster + bot_source_identifier) not in ALERTED_CLUSTERS_LOOSE and (cluster + bot_source_identifier) not in ALERTED_CLUSTERS_STRICT)):
+                            victims = du.get_victims(dynamo)
+                            victim_address, victim_name, victim_metadata = get_victim_info(alert_data, victims)
+                            update_list(ALERTED_CLUSTERS_FP_MITIGATED, ALERTED_CLUSTERS_MAX_QUEUE_SIZE, cluster + get_bot_source_identifier(bot_sources)) 
+                            findings.append(AlertCombinerFinding.create_finding(block_chain_indexer, cluster, victim_address, victim_name, anomaly_score, FindingSeverity.Info, "ATTACK-DETECTOR-5", alert_event, alert_data, victim_metadata, anomaly_scores_by_stages, CHAIN_ID, bot_sources))
+                        elif end_user_attack and not fp_mitigated and ((cluster + bot_source_identifier) not in ALERTED_CLUSTERS_FP_MITIGATED) and (((len(anomaly_scores) == 4) and (cluster + bot_source_identifier) not in ALERTED_CLUSTERS_STRICT) or ((highly_precise_bot_alert_id_count > 0 and len(anomaly_scores) > 1) and (cluster + bot_source_identifier) not in ALERTED_CLUSTERS_STRICT) or (len(highly_precise_bot_ids)>1) or ((aggregate.bot_count() >= MIN_ALERTS_COUNT and anomaly_score < ANOMALY_SCORE_THRESHOLD_STRICT) and (cluster + bot_source_identifier) not in ALERTED_CLUSTERS_STRICT)
+                                                                                 or ((aggregate.bot_count() >= MIN_ALERTS_COUNT  and anomaly_score < ANOMALY_SCORE_THRESHOLD_LOOSE) and (cluster + bot_source_identifier) not in ALERTED_CLUSTERS_LOOSE and (cluster + bot_source_identifier) not in ALERTED_CLUSTERS_STRICT)):
+                            victims = du.get_victims(dynamo)
+                            victim_address, victim_name, victim_metadata = get_victim_info(alert_data, victims)
+                            update_list(ALERTED_CLUSTERS_FP_MITIGATED, ALERTED_CLUSTERS_MAX_QUEUE_SIZE, cluster  + get_bot_source_identifier(bot_sources)) 
+                            findings.append(AlertCombinerFinding.create_finding(block_chain_indexer, cluster, victim_address, victim_name, anomaly_score, FindingSeverity.Info, "ATTACK-DETECTOR-6", alert_event, alert_data, victim_metadata, anomaly_scores_by_stages, CHAIN_ID, bot_sources))
+                        else:
+                            logging.info(f"alert {alert_event.alert_hash} - Not raising finding for {cluster}. Already alerted.")
 
             except Exception as e:
                 logging.warning(f"alert {alert_event.alert_hash} - Exception in process_alert {alert_event.alert_hash}: {e} {traceback.format_exc()}")
@@ -895,6 +894,8 @@ def persist_state():
     persist(MANUALLY_ALERTED_ENTITIES, CHAIN_ID, MANUALLY_ALERTED_ENTITIES_KEY)
     persist(ALERTED_FP_CLUSTERS, CHAIN_ID, ALERTED_FP_CLUSTERS_KEY)
     persist(FINDINGS_CACHE_BLOCK, CHAIN_ID, FINDINGS_CACHE_BLOCK_KEY)
+    ETHERSCAN_LABEL_CACHE.save_snapshot()
+    Utils.get_label_cache().save_snapshot()
     end = time.time()
     logging.info(f"Persisted bot state. took {end - start} seconds")
 
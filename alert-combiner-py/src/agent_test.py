@@ -13,12 +13,14 @@ from datetime import datetime, timedelta
 import requests
 from unittest.mock import Mock, patch
 
-from storage import dynamo_table, get_secrets
+from storage import dynamo_table, get_secrets, DynamoTablePool
 from constants import (ALERTS_LOOKBACK_WINDOW_IN_HOURS, BASE_BOTS,
                        ALERTED_CLUSTERS_MAX_QUEUE_SIZE, ALERTED_CLUSTERS_STRICT_KEY, ALERTED_CLUSTERS_LOOSE_KEY, FUNDING_STAGE_ALERTS_LOOKBACK_WINDOW_IN_HOURS)
 from web3_mock import CONTRACT, EOA_ADDRESS, EOA_ADDRESS_2, Web3Mock
 from L2Cache import VERSION
 from dynamo_utils import DynamoUtils as du, TEST_TAG
+from dynamo_mock import DynamoMock
+from utils import Utils
 
 w3 = Web3Mock()
 
@@ -486,6 +488,30 @@ class TestAlertCombiner:
         assert findings[0].metadata['bot_source'] == 'BlockSec'
 
 
+    def test_alert_concurrent_addresses(self):
+        # one passthrough alert for many addresses against a dynamo and web3 with latency
+        addresses = [Web3.toChecksumAddress(Web3.keccak(text=str(i))[-20:].hex()) for i in range(8)]
+        metadata = {f"suspicious_address_{i}": address for i, address in enumerate(addresses)}
+        alert_event = TestAlertCombiner.generate_alert(EOA_ADDRESS, "0xe39e45ab19bb1c9a30887e157a21393680d336232263c96b326f68fa57a29723", "BlockSec Attack Alert", metadata)
+
+        def detect_attack(max_workers: int) -> tuple:
+            dynamo = DynamoMock(latency=0.05)
+            with patch.object(agent, 'dynamo', dynamo), patch.object(agent, 'dynamo_table_pool', DynamoTablePool(lambda: dynamo)), patch.object(agent, 'DETECT_ATTACK_MAX_WORKERS', max_workers), \
+                    patch.object(agent, 'block_chain_indexer', Mock(get_etherscan_labels_by_address=Mock(return_value={}), get_contracts=Mock(return_value=set()))):
+                agent.initialize()
+                agent.ALERTED_CLUSTERS_STRICT = []
+                Utils.CONTRACT_CACHE.clear()
+                findings = agent.detect_attack(Web3Mock(), du(TEST_TAG, 1), alert_event)
+                return findings, dynamo.max_in_flight
+
+        sequential_findings, sequential_max_in_flight = detect_attack(1)
+        concurrent_findings, concurrent_max_in_flight = detect_attack(8)
+
+        assert [finding.metadata['attacker_address'] for finding in sequential_findings] == [address.lower() for address in addresses], "findings should be in address order"
+        assert [finding.description for finding in concurrent_findings] == [finding.description for finding in sequential_findings], "concurrent analysis should emit the same findings in the same order"
+        assert sequential_max_in_flight == 1
+        assert concurrent_max_in_flight > 1, "dynamo calls of the addresses should overlap"
+
     def test_alert_consensus(self):
         # one passthrough alert
         TestAlertCombiner.remove_persistent_state(du(TEST_TAG, agent.CHAIN_ID))
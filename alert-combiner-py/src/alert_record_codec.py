@@ -0,0 +1,201 @@
+import struct
+from datetime import datetime, timedelta
+
+FORMAT_VERSION = 1
+EPOCH = datetime(1970, 1, 1)
+
+HEX_NONE = 0
+HEX_BYTES = 1
+HEX_TEXT = 2  # value isnt a lowercase 0x prefixed hex string and is stored as is
+
+
+class AlertRecordCodec:
+    """
+    fixed schema binary codec for the alert records of a cluster
+    a batch of records is written column by column; stage, bot_id and alert_id are dictionary encoded, hashes and addresses are stored as raw bytes
+    """
+    COLUMNS = ['stage', 'created_at', 'anomaly_score', 'alert_hash', 'bot_id', 'alert_id', 'addresses', 'transaction_hash', 'address_filter', 'chain_id']
+    DEDUP_COLUMNS = ['stage', 'created_at', 'anomaly_score', 'alert_hash', 'bot_id', 'alert_id', 'transaction_hash']
+
+    @staticmethod
+    def _write_varint(out: bytearray, value: int):
+        while value >= 0x80:
+            out.append((value & 0x7f) | 0x80)
+            value >>= 7
+        out.append(value)
+
+    @staticmethod
+    def _read_varint(data: bytes, pos: int) -> tuple:
+        value = 0
+        shift = 0
+        while True:
+            b = data[pos]
+            pos += 1
+            value |= (b & 0x7f) << shift
+            if b < 0x80:
+                return value, pos
+            shift += 7
+
+    @staticmethod
+    def _write_optional_int(out: bytearray, value):
+        AlertRecordCodec._write_varint(out, 0 if value is None else int(value) + 1)
+
+    @staticmethod
+    def _read_optional_int(data: bytes, pos: int) -> tuple:
+        value, pos = AlertRecordCodec._read_varint(data, pos)
+        return (None if value == 0 else value - 1), pos
+
+    @staticmethod
+    def _write_str(out: bytearray, value: str):
+        encoded = value.encode("utf-8")
+        AlertRecordCodec._write_varint(out, len(encoded))
+        out += encoded
+
+    @staticmethod
+    def _read_str(data: bytes, pos: int) -> tuple:
+        length, pos = AlertRecordCodec._read_varint(data, pos)
+        return data[pos:pos + length].decode("utf-8"), pos + length
+
+    @staticmethod
+    def _write_hex(out: bytearray, value):
+        if value is None:
+            out.append(HEX_NONE)
+            return
+        try:
+            raw = bytes.fromhex(value[2:]) if value.startswith("0x") else None
+        except ValueError:
+            raw = None
+        if raw is not None and "0x" + raw.hex() == value:
+            out.append(HEX_BYTES)
+            AlertRecordCodec._write_varint(out, len(raw))
+            out += raw
+        else:
+            out.append(HEX_TEXT)
+            AlertRecordCodec._write_str(out, value)
+
+    @staticmethod
+    def _read_hex(data: bytes, pos: int) -> tuple:
+        kind = data[pos]
+        pos += 1
+        if kind == HEX_NONE:
+            return None, pos
+        if kind == HEX_TEXT:
+            return AlertRecordCodec._read_str(data, pos)
+        length, pos = AlertRecordCodec._read_varint(data, pos)
+        return "0x" + data[pos:pos + length].hex(), pos + length
+
+    @staticmethod
+    def to_micros(created_at) -> int:
+        return (created_at - EPOCH) // timedelta(microseconds=1)
+
+    @staticmethod
+    def encode(records: list) -> bytes:
+        """
+        encodes a list of records (dicts with the COLUMNS as keys; missing keys are stored as None)
+        """
+        out = bytearray([FORMAT_VERSION])
+        AlertRecordCodec._write_varint(out, len(records))
+
+        strings = []
+        string_index = dict()
+        def index_of(value) -> int:
+            if value not in string_index:
+                string_index[value] = len(strings)
+                strings.append(value)
+            return string_index[value]
+
+        stage_ids = [index_of(record.get('stage')) for record in records]
+        bot_ids = [index_of(record.get('bot_id')) for record in records]
+        alert_ids = [index_of(record.get('alert_id')) for record in records]
+        AlertRecordCodec._write_varint(out, len(strings))
+        for value in strings:  # bot ids are hex, stages and alert ids are stored as text
+            AlertRecordCodec._write_hex(out, value)
+
+        for i in stage_ids:
+            AlertRecordCodec._write_varint(out, i)
+        out += struct.pack(f"<{len(records)}q", *[AlertRecordCodec.to_micros(record['created_at']) for record in records])
+        out += struct.pack(f"<{len(records)}d", *[float(record['anomaly_score']) for record in records])
+        for record in records:
+            AlertRecordCodec._write_hex(out, record.get('alert_hash'))
+        for ids in [bot_ids, alert_ids]:
+            for i in ids:
+                AlertRecordCodec._write_varint(out, i)
+        for record in records:
+            addresses = record.get('addresses')
+            AlertRecordCodec._write_optional_int(out, None if addresses is None else len(addresses))
+            for address in addresses or []:
+                AlertRecordCodec._write_hex(out, address)
+        for record in records:
+            AlertRecordCodec._write_hex(out, record.get('transaction_hash'))
+        for record in records:
+            address_filter = record.get('address_filter')
+            if address_filter is None:
+                out.append(0)
+            else:
+                k, m, base64_data = address_filter
+                out.append(1)
+                AlertRecordCodec._write_optional_int(out, k)
+                AlertRecordCodec._write_optional_int(out, m)
+                AlertRecordCodec._write_hex(out, base64_data)
+        for record in records:
+            AlertRecordCodec._write_optional_int(out, record.get('chain_id'))
+        return bytes(out)
+
+    @staticmethod
+    def decode(data: bytes) -> dict:
+        """
+        decodes the records into a dict of column -> list of values
+        """
+        if data[0] != FORMAT_VERSION:
+            raise ValueError(f"unsupported alert record format version {data[0]}")
+        count, pos = AlertRecordCodec._read_varint(data, 1)
+
+        string_count, pos = AlertRecordCodec._read_varint(data, pos)
+        strings = []
+        for i in range(string_count):
+            value, pos = AlertRecordCodec._read_hex(data, pos)
+            strings.append(value)
+
+        def read_column(read) -> list:
+            nonlocal pos
+            values = []
+            for i in range(count):
+                value, pos = read(data, pos)
+                values.append(value)
+            return values
+
+        def read_string_column() -> list:
+            return [strings[i] for i in read_column(AlertRecordCodec._read_varint)]
+
+        def read_addresses(data: bytes, pos: int) -> tuple:
+            length, pos = AlertRecordCodec._read_optional_int(data, pos)
+            if length is None:
+                return None, pos
+            addresses = []
+            for i in range(length):
+                address, pos = AlertRecordCodec._read_hex(data, pos)
+                addresses.append(address)
+            return addresses, pos
+
+        def read_address_filter(data: bytes, pos: int) -> tuple:
+            if data[pos] == 0:
+                return None, pos + 1
+            k, pos = AlertRecordCodec._read_optional_int(data, pos + 1)
+            m, pos = AlertRecordCodec._read_optional_int(data, pos)
+            base64_data, pos = AlertRecordCodec._read_hex(data, pos)
+            return [k, m, base64_data], pos
+
+        columns = dict()
+        columns['stage'] = read_string_column()
+        columns['created_at'] = [EPOCH + timedelta(microseconds=micros) for micros in struct.unpack_from(f"<{count}q", data, pos)]
+        pos += 8 * count
+        columns['anomaly_score'] = list(struct.unpack_from(f"<{count}d", data, pos))
+        pos += 8 * count
+        columns['alert_hash'] = read_column(AlertRecordCodec._read_hex)
+        columns['bot_id'] = read_string_column()
+        columns['alert_id'] = read_string_column()
+        columns['addresses'] = read_column(read_addresses)
+        columns['transaction_hash'] = read_column(AlertRecordCodec._read_hex)
+        columns['address_filter'] = read_column(read_address_filter)
+        columns['chain_id'] = read_column(AlertRecordCodec._read_optional_int)
+        return columns
@@ -0,0 +1,49 @@
+import json
+from datetime import datetime
+
+import pandas as pd
+
+from alert_record_codec import AlertRecordCodec
+
+BOT_ID = "0xa91a31df513afff32b9d85a2c2b7e786fdd681b3cdd8d93d6074943ba31ae400"
+ALERT_HASH = "0x" + "ab" * 32
+TX_HASH = "0x" + "cd" * 32
+ADDRESS = "0x" + "12" * 20
+
+
+def record(**kwargs) -> dict:
+    record = {'stage': 'Funding', 'created_at': datetime(2023, 1, 1, 12, 30, 15, 123456), 'anomaly_score': 0.001, 'alert_hash': ALERT_HASH,
+              'bot_id': BOT_ID, 'alert_id': 'FUNDING-TORNADO-CASH', 'addresses': [ADDRESS], 'transaction_hash': TX_HASH,
+              'address_filter': [7, 1024, "AAEC"], 'chain_id': 1}
+    record.update(kwargs)
+    return record
+
+
+class TestAlertRecordCodec:
+
+    def test_round_trip(self):
+        records = [record(),
+                   record(stage='Exploitation', anomaly_score=0.5, alert_id='FLASHBOTS-TRANSACTIONS', addresses=None, transaction_hash=None, address_filter=None, chain_id=10),
+                   record(alert_hash='not a hash', addresses=['0xABC', ''], bot_id='0x', address_filter=[None, 0, None], chain_id=None)]
+
+        columns = AlertRecordCodec.decode(AlertRecordCodec.encode(records))
+
+        assert list(columns.keys()) == AlertRecordCodec.COLUMNS
+        assert [dict(zip(columns.keys(), values)) for values in zip(*columns.values())] == records
+
+    def test_round_trip_dataframe(self):
+        dataframe = pd.DataFrame([record(), record(stage='Preparation')], columns=AlertRecordCodec.COLUMNS)
+
+        decoded = pd.DataFrame(AlertRecordCodec.decode(AlertRecordCodec.encode(dataframe.to_dict(orient="records"))))
+
+        pd.testing.assert_frame_equal(decoded, dataframe)
+
+    def test_empty(self):
+        assert AlertRecordCodec.decode(AlertRecordCodec.encode([])) == {column: [] for column in AlertRecordCodec.COLUMNS}
+
+    def test_smaller_than_json(self):
+        dataframe = pd.DataFrame([record(alert_hash="0x%064x" % i, addresses=["0x%040x" % i, ADDRESS]) for i in range(100)], columns=AlertRecordCodec.COLUMNS)
+
+        encoded = AlertRecordCodec.encode(dataframe.to_dict(orient="records"))
+
+        assert len(encoded) * 2 < len(json.dumps(dataframe.to_json(orient="records")))
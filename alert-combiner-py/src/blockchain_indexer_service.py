@@ -199,44 +199,60 @@ class BlockChainIndexer:
         return contracts
     
     @staticmethod
-    @RateLimiter(max_calls=1, period=1)
     def get_etherscan_labels(address, chain_id) -> set:
-        labels_url = f"https://api-metadata.etherscan.io/v1/api.ashx?module=nametag&action=getaddresstag&address={address}&tag=trusted&apikey={BlockChainIndexer.get_api_key(chain_id)}"
         labels = set()
-        success = False
+        labels_by_address = BlockChainIndexer.get_etherscan_labels_by_address(address.split(','), chain_id)
+        if labels_by_address is not None:
+            for address_labels in labels_by_address.values():
+                labels.update(address_labels)
+        return labels
+
+    @staticmethod
+    @RateLimiter(max_calls=1, period=1)
+    def get_etherscan_labels_by_address(addresses: list, chain_id) -> dict:
+        """
+        looks up the etherscan labels and nametag of up to 100 addresses in a single call
+        :return: dict of address -> list of labels (including the nametag) for the addresses that have labels; None if the lookup failed
+        """
+        addresses_str = ','.join(addresses)
+        labels_url = f"https://api-metadata.etherscan.io/v1/api.ashx?module=nametag&action=getaddresstag&address={addresses_str}&tag=trusted&apikey={BlockChainIndexer.get_api_key(chain_id)}"
+        labels_by_address = dict()
         count = 0
         wait_time = 1 # seconds
-        
-        while not success:
+
+        while True:
             data = requests.get(labels_url)
             json_data = json.loads(data.content)
             if data.status_code == 200 and json_data['status'] == '1':
-                success = True 
                 if "result" in json_data:
                     result_data = json_data.get("result")
-                    if isinstance(result_data, list) and result_data:
-                        labels.update(result_data[0].get("labels", []))
-                        labels.add(result_data[0].get("nametag", ""))
+                    if isinstance(result_data, list):
+                        for result in result_data:
+                            labels = list(result.get("labels", []))
+                            if result.get("nametag"):
+                                labels.append(result["nametag"])
+                            if len(labels) > 0:
+                                labels_by_address[result["address"].lower()] = labels
                     elif isinstance(result_data, str):
                         logging.warning(f"Etherscan Error Response: {result_data}")
                     else:
                         logging.warning("Etherscan response does not contain valid data.")
                 else:
                     logging.warning("Etherscan response does not contain 'result' field.")
+                return labels_by_address
             else:
                 if json_data['message'] == 'No matching records found':
-                    logging.info(f"No matching Etherscan labels found for {address}")
-                    return labels
+                    logging.info(f"No matching Etherscan labels found for {addresses_str}")
+                    return labels_by_address
                 logging.warning(f"Error getting labels on etherscan: {data.status_code} {data.content}")
                 count += 1
                 if count > 10:
                     Utils.ERROR_CACHE.add(Utils.alert_error(f'request etherscan {data.status_code}', "blockchain_indexer_service.get_etherscan_labels", ""))
-                    break
+                    return None
                 # Exponential backoff with jitter
                 time_to_sleep = wait_time + random.uniform(-0.3 * wait_time, 0.3 * wait_time)
                 time.sleep(time_to_sleep)
                 wait_time = min(wait_time * 2, 7)  # Ensure wait time does not exceed 7 seconds
-        return labels
     
     @staticmethod
     @RateLimiter(max_calls=1, period=1)
@@ -0,0 +1,163 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+import pandas as pd
+
+from src.constants import ALERTS_LOOKBACK_WINDOW_IN_HOURS, FUNDING_STAGE_ALERTS_LOOKBACK_WINDOW_IN_HOURS, CLUSTER_AGGREGATE_TTL_IN_SECONDS
+
+
+class ClusterAggregate:
+    """
+    aggregate over the alert records of a cluster that answers the detect_attack threshold conditions
+    each alert updates it in O(1): distinct bot ids, (bot_id, alert_id) pairs, chain ids and the min anomaly score per stage
+    records cant be removed from it; it tracks when the first of its records leaves the lookback window, so it can be rebuilt then
+    """
+
+    def __init__(self):
+        self.bot_ids = set()
+        self.bot_alert_ids = set()  # (bot_id, alert_id)
+        self.chain_ids = set()
+        self.min_anomaly_score_by_stage = dict()  # stage -> min anomaly score
+        self.stage_anomaly_scores = dict()  # stage -> set of distinct anomaly scores
+        self.last_anomaly_score_by_stage = dict()  # stage -> most recently observed distinct anomaly score
+        self.last_created_at = None  # created_at of the newest record
+        self.window_end = None  # records leave the lookback window once a record created at or after this time is added
+
+    @staticmethod
+    def lookback_window(stage: str) -> timedelta:
+        return timedelta(hours=FUNDING_STAGE_ALERTS_LOOKBACK_WINDOW_IN_HOURS if stage == "Funding" else ALERTS_LOOKBACK_WINDOW_IN_HOURS)
+
+    def has_expired_records(self) -> bool:
+        return self.window_end is not None and self.window_end <= self.last_created_at
+
+    def add(self, stage: str, anomaly_score: float, bot_id: str, alert_id: str, chain_id: int, created_at=None):
+        if created_at is not None:
+            record_window_end = created_at + ClusterAggregate.lookback_window(stage)
+            if self.last_created_at is not None and record_window_end <= self.last_created_at:
+                return  # already outside the lookback window
+            self.last_created_at = created_at if self.last_created_at is None else max(self.last_created_at, created_at)
+            self.window_end = record_window_end if self.window_end is None else min(self.window_end, record_window_end)
+        self.bot_ids.add(bot_id)
+        self.bot_alert_ids.add((bot_id, alert_id))
+        self.chain_ids.add(chain_id)
+        if stage is None or anomaly_score is None or math.isnan(anomaly_score):
+            return
+        if stage not in self.min_anomaly_score_by_stage:
+            self.min_anomaly_score_by_stage[stage] = anomaly_score
+            self.stage_anomaly_scores[stage] = {anomaly_score}
+            self.last_anomaly_score_by_stage[stage] = anomaly_score
+        elif anomaly_score not in self.stage_anomaly_scores[stage]:
+            self.min_anomaly_score_by_stage[stage] = min(self.min_anomaly_score_by_stage[stage], anomaly_score)
+            self.stage_anomaly_scores[stage].add(anomaly_score)
+            self.last_anomaly_score_by_stage[stage] = anomaly_score
+
+    @staticmethod
+    def from_alert_data(alert_data: pd.DataFrame, as_of=None) -> 'ClusterAggregate':
+        """
+        :param as_of: records outside the lookback window of their stage at this time are skipped; None keeps all records
+        """
+        aggregate = ClusterAggregate()
+        if not alert_data.empty:
+            for stage, created_at, anomaly_score, bot_id, alert_id, chain_id in zip(alert_data['stage'], alert_data['created_at'], alert_data['anomaly_score'], alert_data['bot_id'], alert_data['alert_id'], alert_data['chain_id']):
+                if as_of is not None and created_at + ClusterAggregate.lookback_window(stage) <= as_of:
+                    continue
+                aggregate.add(stage, anomaly_score, bot_id, alert_id, chain_id, created_at)
+        return aggregate
+
+    def bot_count(self) -> int:
+        return len(self.bot_ids)
+
+    def stage_count(self) -> int:
+        return len(self.min_anomaly_score_by_stage)
+
+    def has_stage(self, stage: str) -> bool:
+        return stage in self.min_anomaly_score_by_stage
+
+    def has_chain(self, chain_id: int) -> bool:
+        return chain_id in self.chain_ids
+
+    def anomaly_score(self) -> float:
+        """
+        product of the min anomaly score of each stage; multiplied in stage order as the groupby it replaces did
+        """
+        anomaly_score = 1.0
+        for stage in sorted(self.min_anomaly_score_by_stage.keys()):
+            anomaly_score *= self.min_anomaly_score_by_stage[stage]
+        return anomaly_score
+
+    def highly_precise_bots(self, highly_precise_bots: list) -> tuple:
+        """
+        returns the number of highly precise (bot_id, alert_id) pairs observed, whether one of them is a preparation stage alert, and their bot ids
+        """
+        count = 0
+        is_preparation_stage = False
+        bot_ids = set()
+        for bot_id, alert_id, stage in highly_precise_bots:
+            if (bot_id, alert_id) in self.bot_alert_ids:
+                count += 1
+                is_preparation_stage = is_preparation_stage or stage == "Preparation"
+                bot_ids.add(bot_id)
+        return count, is_preparation_stage, bot_ids
+
+    def passthrough_sources(self, passthrough_bots: list) -> set:
+        return set([source for bot_id, alert_id, source in passthrough_bots if (bot_id, alert_id) in self.bot_alert_ids])
+
+    def anomaly_scores_by_stage(self) -> pd.DataFrame:
+        """
+        per stage anomaly scores as reported in the finding metadata
+        """
+        return pd.DataFrame(list(self.last_anomaly_score_by_stage.items()), columns=['stage', 'anomaly_score'])
+
+
+class ClusterAggregateCache:
+    """
+    LRU cache of the aggregates of the clusters, so an alert only adds its record to the aggregate of the cluster
+    the alert data of a cluster is only read when its aggregate isnt cached (or was evicted), when records left the lookback window
+    and once the aggregate is older than ttl seconds: the records written by the other shards are only added by that read
+    """
+
+    def __init__(self, max_size: int, ttl: float = CLUSTER_AGGREGATE_TTL_IN_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.aggregates = OrderedDict()  # cluster -> (ClusterAggregate, time it was read at)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.aggregates)
+
+    def add(self, cluster: str, stage: str, created_at, anomaly_score: float, bot_id: str, alert_id: str, chain_id: int, read_alert_data) -> ClusterAggregate:
+        """
+        adds the record of an alert to the aggregate of the cluster
+        :param read_alert_data: returns the stored alert data of the cluster; called when the aggregate has to be built
+        :return: the aggregate of the cluster, including the record
+        """
+        with self.lock:
+            cached = self.aggregates.get(cluster)
+            if cached is not None:
+                aggregate, read_at = cached
+                aggregate.add(stage, anomaly_score, bot_id, alert_id, chain_id, created_at)
+                if aggregate.has_expired_records() or time.time() - read_at > self.ttl:
+                    del self.aggregates[cluster]
+                else:
+                    self.aggregates.move_to_end(cluster)
+                    self.hits += 1
+                    return aggregate
+            self.misses += 1
+
+        # read outside of the lock, so the clusters of concurrently analyzed addresses are read in parallel
+        read_at = time.time()
+        alert_data = read_alert_data()
+        as_of = created_at if alert_data.empty else max(alert_data['created_at'].max(), created_at)
+        aggregate = ClusterAggregate.from_alert_data(alert_data, as_of)
+        aggregate.add(stage, anomaly_score, bot_id, alert_id, chain_id, created_at)
+        with self.lock:
+            self.aggregates[cluster] = (aggregate, read_at)
+            self.aggregates.move_to_end(cluster)
+            while len(self.aggregates) > self.max_size:
+                self.aggregates.popitem(last=False)
+        return aggregate
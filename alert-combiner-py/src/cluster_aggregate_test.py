@@ -0,0 +1,188 @@
+import random
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from cluster_aggregate import ClusterAggregate, ClusterAggregateCache
+from constants import BASE_BOTS, HIGHLY_PRECISE_BOTS, PASSTHROUGH_BOTS
+from dynamo_mock import DynamoMock
+from dynamo_utils import DynamoUtils, TEST_TAG
+
+COLUMNS = ['stage', 'created_at', 'anomaly_score', 'alert_hash', 'bot_id', 'alert_id', 'addresses', 'transaction_hash', 'address_filter', 'chain_id']
+
+
+def pandas_aggregate(alert_data: pd.DataFrame) -> dict:
+    # the dataframe based logic ClusterAggregate replaces in agent.detect_attack
+    highly_precise_bot_alert_id_count = 0
+    is_highly_precise_bot_preparation_stage_alert_id = False
+    highly_precise_bot_ids = set()
+    uniq_bot_alert_ids = alert_data[['bot_id', 'alert_id']].drop_duplicates(inplace=False)
+    for bot_id, alert_id, s in HIGHLY_PRECISE_BOTS:
+        if len(uniq_bot_alert_ids[(uniq_bot_alert_ids['bot_id'] == bot_id) & (uniq_bot_alert_ids['alert_id'] == alert_id)]) > 0:
+            highly_precise_bot_alert_id_count += 1
+            if not is_highly_precise_bot_preparation_stage_alert_id and s == "Preparation":
+                is_highly_precise_bot_preparation_stage_alert_id = True
+            highly_precise_bot_ids.add(bot_id)
+
+    bot_sources = set()
+    for bot_id, alert_id, source in PASSTHROUGH_BOTS:
+        matching_bots = uniq_bot_alert_ids[(uniq_bot_alert_ids['bot_id'] == bot_id) & (uniq_bot_alert_ids['alert_id'] == alert_id)]
+        if len(matching_bots) > 0:
+            bot_sources.add(source)
+
+    anomaly_scores_by_stages = alert_data[['stage', 'anomaly_score']].drop_duplicates(inplace=False)
+    anomaly_scores = anomaly_scores_by_stages.groupby('stage').min()
+    finding_anomaly_scores = {}
+    for index, row in anomaly_scores_by_stages.iterrows():
+        finding_anomaly_scores[f'anomaly_score_stage_{row["stage"]}'] = row["anomaly_score"]
+
+    return {
+        'bot_count': len(alert_data['bot_id'].drop_duplicates(inplace=False)),
+        'anomaly_score': anomaly_scores['anomaly_score'].prod(),
+        'stage_count': len(anomaly_scores),
+        'stages': set(anomaly_scores.index),
+        'highly_precise_bots': (highly_precise_bot_alert_id_count, is_highly_precise_bot_preparation_stage_alert_id, highly_precise_bot_ids),
+        'passthrough_sources': bot_sources,
+        'chain_ids': set([chain_id for chain_id in [1, 10] if not alert_data[alert_data['chain_id'] == chain_id].empty]),
+        'finding_anomaly_scores': finding_anomaly_scores,
+    }
+
+
+def incremental_aggregate(aggregate: ClusterAggregate) -> dict:
+    finding_anomaly_scores = {}
+    for index, row in aggregate.anomaly_scores_by_stage().iterrows():
+        finding_anomaly_scores[f'anomaly_score_stage_{row["stage"]}'] = row["anomaly_score"]
+
+    return {
+        'bot_count': aggregate.bot_count(),
+        'anomaly_score': aggregate.anomaly_score(),
+        'stage_count': aggregate.stage_count(),
+        'stages': set([stage for stage in ['Funding', 'Preparation', 'Exploitation', 'MoneyLaundering'] if aggregate.has_stage(stage)]),
+        'highly_precise_bots': aggregate.highly_precise_bots(HIGHLY_PRECISE_BOTS),
+        'passthrough_sources': aggregate.passthrough_sources(PASSTHROUGH_BOTS),
+        'chain_ids': set([chain_id for chain_id in [1, 10] if aggregate.has_chain(chain_id)]),
+        'finding_anomaly_scores': finding_anomaly_scores,
+    }
+
+
+def alert_stream(rng: random.Random, length: int) -> list:
+    bots = [(bot_id, alert_id, stage) for bot_id, alert_id, stage in rng.sample(BASE_BOTS, 12)] + HIGHLY_PRECISE_BOTS
+    bots += [(bot_id, alert_id, "Exploitation") for bot_id, alert_id, source in PASSTHROUGH_BOTS]
+    anomaly_scores = [rng.choice([1.0, 0.5, 0.01]) * 10 ** -rng.randint(0, 6) for i in range(8)]
+    created_at = datetime(2023, 1, 1)
+    alerts = []
+    for i in range(length):
+        bot_id, alert_id, stage = rng.choice(bots)
+        alerts.append([stage, created_at + timedelta(seconds=rng.randint(0, 3)), rng.choice(anomaly_scores), f"0x{rng.randint(0, 5):064x}",
+                       bot_id, alert_id, ["0x1"], "0x2", None, rng.choice([1, 1, 10])])
+    return alerts
+
+
+class TestClusterAggregate:
+
+    def test_equivalent_to_dataframe_logic(self):
+        rng = random.Random(42)
+        for i in range(10):
+            alert_data = pd.DataFrame(columns=COLUMNS)
+            aggregate = ClusterAggregate()
+            for alert in alert_stream(rng, 30):
+                # mirrors agent.detect_attack: the new alert is added to the aggregate and appended to the deduplicated alert data
+                aggregate.add(alert[0], alert[2], alert[4], alert[5], alert[9])
+                new_alert_data = pd.DataFrame([alert], columns=COLUMNS)
+                alert_data = pd.concat([alert_data, new_alert_data], ignore_index=True, axis=0).drop_duplicates(subset=['stage', 'created_at', 'anomaly_score', 'alert_hash', 'bot_id', 'alert_id', 'transaction_hash'], inplace=False)
+
+                expected = pandas_aggregate(alert_data)
+                assert incremental_aggregate(aggregate) == expected
+                assert incremental_aggregate(ClusterAggregate.from_alert_data(alert_data)) == expected
+
+    def test_empty(self):
+        aggregate = ClusterAggregate.from_alert_data(pd.DataFrame(columns=COLUMNS))
+        assert aggregate.bot_count() == 0
+        assert aggregate.stage_count() == 0
+        assert aggregate.anomaly_score() == 1.0
+        assert aggregate.anomaly_scores_by_stage().empty
+
+    def test_min_anomaly_score_by_stage(self):
+        aggregate = ClusterAggregate()
+        aggregate.add("Funding", 0.1, "0xbot1", "ALERT-1", 1)
+        aggregate.add("Funding", 0.01, "0xbot2", "ALERT-2", 1)
+        aggregate.add("Funding", 0.1, "0xbot1", "ALERT-1", 1)
+        aggregate.add("Exploitation", 0.5, "0xbot1", "ALERT-3", 10)
+
+        assert aggregate.min_anomaly_score_by_stage == {"Funding": 0.01, "Exploitation": 0.5}
+        assert aggregate.anomaly_score() == 0.01 * 0.5
+        assert aggregate.bot_count() == 2
+        assert aggregate.has_chain(10) and not aggregate.has_chain(137)
+
+    def test_expired_records(self):
+        created_at = datetime(2023, 1, 1)
+        aggregate = ClusterAggregate()
+        aggregate.add("Funding", 0.1, "0xbot1", "ALERT-1", 1, created_at)
+        aggregate.add("Exploitation", 0.5, "0xbot2", "ALERT-2", 1, created_at + timedelta(hours=1))
+        assert not aggregate.has_expired_records()
+
+        aggregate.add("Exploitation", 0.5, "0xbot3", "ALERT-3", 1, created_at + timedelta(hours=25))
+        assert aggregate.has_expired_records(), "the first exploitation record left the lookback window"
+
+        aggregate = ClusterAggregate()
+        aggregate.add("Exploitation", 0.5, "0xbot3", "ALERT-3", 1, created_at + timedelta(hours=25))
+        aggregate.add("Exploitation", 0.5, "0xbot2", "ALERT-2", 1, created_at)
+        assert aggregate.bot_count() == 1 and not aggregate.has_expired_records(), "records outside the lookback window shouldnt be added"
+
+    def test_from_alert_data_as_of(self):
+        created_at = datetime(2023, 1, 1)
+        alert_data = pd.DataFrame([["Funding", created_at, 0.1, "0x1", "0xbot1", "ALERT-1", None, None, None, 1],
+                                   ["Exploitation", created_at, 0.5, "0x2", "0xbot2", "ALERT-2", None, None, None, 1]], columns=COLUMNS)
+        aggregate = ClusterAggregate.from_alert_data(alert_data, created_at + timedelta(days=2))
+        assert aggregate.bot_ids == {"0xbot1"}
+        assert not aggregate.has_expired_records()
+
+    def test_cache(self):
+        created_at = datetime(2023, 1, 1)
+        stored = pd.DataFrame([["Funding", created_at, 0.1, "0x1", "0xbot1", "ALERT-1", None, None, None, 1]], columns=COLUMNS)
+        reads = []
+
+        def read_alert_data():
+            reads.append(1)
+            return stored
+
+        cache = ClusterAggregateCache(max_size=2)
+        aggregate = cache.add("0xa", "Preparation", created_at + timedelta(hours=1), 0.2, "0xbot2", "ALERT-2", 1, read_alert_data)
+        assert aggregate.bot_ids == {"0xbot1", "0xbot2"} and len(reads) == 1
+        aggregate = cache.add("0xa", "Exploitation", created_at + timedelta(hours=2), 0.3, "0xbot3", "ALERT-3", 1, read_alert_data)
+        assert aggregate.bot_count() == 3 and len(reads) == 1, "a cached aggregate should only be added to"
+
+        stored = pd.DataFrame([["Funding", created_at, 0.1, "0x1", "0xbot1", "ALERT-1", None, None, None, 1],
+                               ["Exploitation", created_at + timedelta(hours=2), 0.3, "0x3", "0xbot3", "ALERT-3", None, None, None, 1]], columns=COLUMNS)
+        aggregate = cache.add("0xa", "Exploitation", created_at + timedelta(hours=25), 0.4, "0xbot4", "ALERT-4", 1, read_alert_data)
+        assert len(reads) == 2, "the aggregate should be rebuilt once records left the lookback window"
+        assert aggregate.bot_ids == {"0xbot1", "0xbot3", "0xbot4"}
+
+        cache.add("0xb", "Funding", created_at, 0.1, "0xbot1", "ALERT-1", 1, lambda: pd.DataFrame(columns=COLUMNS))
+        cache.add("0xc", "Funding", created_at, 0.1, "0xbot1", "ALERT-1", 1, lambda: pd.DataFrame(columns=COLUMNS))
+        assert list(cache.aggregates.keys()) == ["0xb", "0xc"], "least recently used clusters should be evicted"
+
+    def test_cache_shards(self):
+        # two shards of the bot analyze alerts of the same cluster, each with its own cache, sharing the alert data in dynamo
+        dynamo = DynamoMock()
+        du = DynamoUtils(TEST_TAG, 1)
+        created_at = datetime(2023, 1, 1)
+        shards = [ClusterAggregateCache(max_size=10, ttl=0.2), ClusterAggregateCache(max_size=10, ttl=0.2)]
+
+        def handle_alert(shard: int, minutes: int, bot_id: str) -> ClusterAggregate:
+            # mirrors agent.detect_attack: the alert is stored before it is added to the aggregate
+            alert = ["Exploitation", created_at + timedelta(minutes=minutes), 0.1, f"0x{minutes}", bot_id, "ALERT-1", ["0x2"], "0x3", None, 1]
+            du.put_alert_data(dynamo, "0xa", pd.DataFrame([alert], columns=COLUMNS))
+            return shards[shard].add("0xa", alert[0], alert[1], alert[2], alert[4], alert[5], alert[9],
+                                     lambda: du.read_alert_data(dynamo, "0xa", alert[1]))
+
+        assert handle_alert(0, 0, "0xbot1").bot_count() == 1
+        assert handle_alert(1, 1, "0xbot2").bot_count() == 2, "the alerts of the other shard should be read on a miss"
+        assert handle_alert(1, 2, "0xbot3").bot_count() == 3
+        assert handle_alert(0, 3, "0xbot4").bot_ids == {"0xbot1", "0xbot4"}, "the cached aggregate is only refreshed after the ttl"
+
+        time.sleep(0.3)
+        assert handle_alert(0, 4, "0xbot5").bot_ids == {"0xbot1", "0xbot2", "0xbot3", "0xbot4", "0xbot5"}, \
+            "the alerts of the other shard should be added once the aggregate is older than the ttl"
+        assert shards[0].misses == 2 and shards[0].hits == 1
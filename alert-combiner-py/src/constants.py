@@ -1,6 +1,9 @@
 ALERTS_LOOKBACK_WINDOW_IN_HOURS = 24
 FUNDING_STAGE_ALERTS_LOOKBACK_WINDOW_IN_HOURS = 10 * 24
 FP_MITIGATION_EXPIRY_IN_HOURS = 365 * 24
+DYNAMO_SNAPSHOT_MAX_AGE_IN_SECONDS = 5 * 60  # max staleness of the fp mitigation cluster, end user attack cluster and victim snapshots
+LEGACY_ALERT_DATA_FOLD_RETRY_INTERVAL_IN_SECONDS = 60  # min wait before the conversion of the legacy alert data items is retried; doubled after each failure
+LEGACY_ALERT_DATA_FOLD_MAX_RETRY_INTERVAL_IN_SECONDS = 3600
 MIN_ALERTS_COUNT = 3
 ANOMALY_SCORE_THRESHOLD_STRICT = 0.0000001
 ANOMALY_SCORE_THRESHOLD_LOOSE = 0.0001
@@ -17,9 +20,20 @@ CONTRACTS_TX_COUNT_FILTER_THRESHOLD = 5000 # ignore EOAs that have deployed a co
 
 DEFAULT_ANOMALY_SCORE = 0.001  # used if anomaly score is less or eq than 0
 
+CLUSTER_AGGREGATE_CACHE_SIZE = 20000  # number of clusters whose aggregate is kept in memory; evicted clusters are read from dynamo again
+CLUSTER_AGGREGATE_TTL_IN_SECONDS = 60  # cached aggregates are read from dynamo again once older than this, to add the alerts of the other shards
+DETECT_ATTACK_MAX_WORKERS = 8  # max number of addresses of an alert analyzed concurrently; 1 analyzes them sequentially
+
+ATTACKER_LABEL_KEYWORDS = ['attack', 'phish', 'hack', 'heist', 'drainer', 'exploit', 'scam', 'fraud', '.eth']  # labels containing any of these (case insensitive) dont mitigate FPs
+LABEL_CACHE_SIZE = 50000  # number of addresses whose labels are kept in memory
+LABEL_CACHE_TTL_IN_SECONDS = 2 * 3600
+LABEL_CACHE_NEGATIVE_TTL_IN_SECONDS = 3600  # addresses without labels are looked up again sooner, as labels get added over time
+LABEL_CACHE_BATCH_SIZE = 100  # max number of addresses looked up in a single label API call
+ETHERSCAN_LABEL_CACHE_SNAPSHOT_PATH = "etherscan_label_cache.pkl"
+FORTA_LABEL_CACHE_SNAPSHOT_PATH = "forta_label_cache.pkl"
+
 POLYGON_VALIDATOR_ALERT_COUNT_THRESHOLD = 40  # assume validator if alert count is larger than this threshold on polygon as the topic analysis seems unreliable
 
-DATAFRAME_SIZE_LIMIT = 350 * 1024 # 350KB
 
 ATTACK_DETECTOR_BOT_ID = "0x80ed808b586aeebe9cdd4088ea4dea0a8e322909c0e4493c993e060e89c09ed1"
 ATTACK_DETECTOR_BETA_BOT_ID = "0xac82fb2a572c7c0d41dc19d24790db17148d1e00505596ebe421daf91c837799"
@@ -0,0 +1,56 @@
+import threading
+import time
+
+
+class DynamoMock:
+    """
+    in memory stand-in for the dynamo table used by DynamoUtils; supports the key conditions of dynamo_query.query_items
+    latency (in seconds) is added to every call; the max number of calls in flight at the same time is recorded in max_in_flight
+    """
+
+    def __init__(self, latency: float = 0):
+        self.latency = latency
+        self.items = dict()  # (itemId, sortKey) -> item
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def _wait(self):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.latency)
+        with self.lock:
+            self.in_flight -= 1
+
+    def put_item(self, Item: dict) -> dict:
+        self._wait()
+        with self.lock:
+            self.items[(Item['itemId'], Item['sortKey'])] = Item
+        return {'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+    def delete_item(self, Key: dict) -> dict:
+        self._wait()
+        with self.lock:
+            self.items.pop((Key['itemId'], Key['sortKey']), None)
+        return {'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+    def query(self, KeyConditionExpression: str, ExpressionAttributeValues: dict, ProjectionExpression: str = None, ExpressionAttributeNames: dict = None, **kwargs) -> dict:
+        self._wait()
+        item_id = ExpressionAttributeValues[':id']
+        sort_key = ExpressionAttributeValues.get(':sid')
+        if 'begins_with' in KeyConditionExpression:
+            matches = lambda key: key.startswith(sort_key)
+        elif 'BETWEEN' in KeyConditionExpression:
+            matches = lambda key: sort_key <= key <= ExpressionAttributeValues[':sid_to']
+        elif 'sortKey' in KeyConditionExpression:
+            matches = lambda key: key == sort_key
+        else:
+            matches = lambda key: True
+
+        with self.lock:
+            items = [item for (id, key), item in sorted(self.items.items()) if id == item_id and matches(key)]
+        if ProjectionExpression is not None:
+            attributes = [ExpressionAttributeNames[name.strip()] for name in ProjectionExpression.split(',')]
+            items = [{attribute: item[attribute] for attribute in attributes if attribute in item} for item in items]
+        return {'Items': items}
@@ -0,0 +1,47 @@
+# Copyright 2022 The Forta Foundation
+
+import logging
+
+
+def query_items(dynamo, item_id: str, sort_key: str = None, projection: list = None, page_size: int = None, sort_key_prefix: str = None, sort_key_range: tuple = None):
+    """
+    generator over all items of the dynamo query itemId = item_id (AND sortKey = sort_key, begins_with(sortKey, sort_key_prefix) or sortKey BETWEEN sort_key_range); follows LastEvaluatedKey across pages
+    callers that only need part of the items can stop iterating, which stops further pages from being requested
+    :param projection: attribute names to return; other attributes are not sent over the wire
+    :param page_size: max number of items dynamo evaluates per request
+    """
+    kwargs = {}
+    if sort_key is not None:
+        kwargs['KeyConditionExpression'] = 'itemId = :id AND sortKey = :sid'
+        kwargs['ExpressionAttributeValues'] = {':id': item_id, ':sid': sort_key}
+    elif sort_key_prefix is not None:
+        kwargs['KeyConditionExpression'] = 'itemId = :id AND begins_with(sortKey, :sid)'
+        kwargs['ExpressionAttributeValues'] = {':id': item_id, ':sid': sort_key_prefix}
+    elif sort_key_range is not None:
+        kwargs['KeyConditionExpression'] = 'itemId = :id AND sortKey BETWEEN :sid AND :sid_to'
+        kwargs['ExpressionAttributeValues'] = {':id': item_id, ':sid': sort_key_range[0], ':sid_to': sort_key_range[1]}
+    else:
+        kwargs['KeyConditionExpression'] = 'itemId = :id'
+        kwargs['ExpressionAttributeValues'] = {':id': item_id}
+
+    if projection:
+        # attribute names are passed as placeholders as some of them (e.g. metadata) are dynamo reserved words
+        attribute_names = {f"#p{i}": name for i, name in enumerate(projection)}
+        kwargs['ProjectionExpression'] = ", ".join(attribute_names.keys())
+        kwargs['ExpressionAttributeNames'] = attribute_names
+
+    if page_size is not None:
+        kwargs['Limit'] = page_size
+
+    page_count = 0
+    while True:
+        response = dynamo.query(**kwargs)
+        page_count += 1
+        for item in response.get('Items', []):
+            yield item
+
+        last_evaluated_key = response.get('LastEvaluatedKey')
+        if not last_evaluated_key:
+            break
+        logging.debug(f"Query for itemId {item_id} has more results; requesting page {page_count + 1}")
+        kwargs['ExclusiveStartKey'] = last_evaluated_key
@@ -1,24 +1,37 @@
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
 import time
-import json
+import threading
 import botocore
 import hashlib
+import numpy as np
 import pandas as pd
 
-from src.constants import ALERTS_LOOKBACK_WINDOW_IN_HOURS, DATAFRAME_SIZE_LIMIT, FP_MITIGATION_EXPIRY_IN_HOURS, FUNDING_STAGE_ALERTS_LOOKBACK_WINDOW_IN_HOURS
+from src.constants import (ALERTS_LOOKBACK_WINDOW_IN_HOURS, FP_MITIGATION_EXPIRY_IN_HOURS, FUNDING_STAGE_ALERTS_LOOKBACK_WINDOW_IN_HOURS, DYNAMO_SNAPSHOT_MAX_AGE_IN_SECONDS,
+                           LEGACY_ALERT_DATA_FOLD_RETRY_INTERVAL_IN_SECONDS, LEGACY_ALERT_DATA_FOLD_MAX_RETRY_INTERVAL_IN_SECONDS)
 from src.utils import Utils
+from src.dynamo_query import query_items
+from src.alert_record_codec import AlertRecordCodec
 
 TEST_TAG = "attack-detector-test_v3"
 PROD_TAG = "attack-detector-prod"
 BETA_ALT_TAG = "attack-detector-beta_alt"
+LEGACY_ALERT_DATA_FOLDED_KEY = "legacy_alert_data_folded"  # marker item written once the legacy alert data items are converted to records
 
 class DynamoUtils:
     chain_id = None
 
-    def __init__(self, tag = TEST_TAG, chain_id = 1):
+    def __init__(self, tag = TEST_TAG, chain_id = 1, snapshot_max_age = DYNAMO_SNAPSHOT_MAX_AGE_IN_SECONDS):
         self.chain_id = chain_id
         self.tag = tag
+        # snapshots of the fp mitigation clusters, end user attack clusters and victims; name -> (loaded_at, collection)
+        # they are reloaded once older than snapshot_max_age seconds and updated by the put_* calls of this instance in the meantime
+        self.snapshot_max_age = snapshot_max_age
+        self.snapshots = dict()
+        self.snapshot_lock = threading.Lock()
+        self.legacy_alert_data_folded = False
+        self.legacy_alert_data_thread = None
+        self.legacy_alert_data_lock = threading.Lock()
         logging.debug(f"Set chain ID = {self.chain_id} and tag = {self.tag} to the DynamoUtils class")
      
     def _get_expiry_offset(self, stage=None):
@@ -32,12 +45,6 @@ class DynamoUtils:
         else:
             return int(time.time()) + int(expiry_offset)
         
-    def compute_expiry_offset(self, row):
-            if row['stage'] == 'Funding':
-                return pd.Timedelta(seconds=self._get_expiry_offset("Funding"))
-            else:
-                return pd.Timedelta(seconds=self._get_expiry_offset())
-
     def _put_item(self, dynamo, item):
         response = None
         error_message = f'dynamo_utils._put_item'
@@ -116,6 +123,7 @@ class DynamoUtils:
         }
 
         self._put_item(dynamo, item)
+        self._update_snapshot("fp_mitigation_clusters", lambda fp_mitigation_clusters: fp_mitigation_clusters.add(address))
 
     def put_end_user_attack_cluster(self, dynamo, address: str):
         logging.debug(f"putting end user attack cluster alert for {address} in dynamo DB")
@@ -135,49 +143,31 @@ class DynamoUtils:
         }
 
         self._put_item(dynamo, item)
-
-    def put_alert_data(self, dynamo, cluster: str, dataframe: pd.DataFrame, stage: str = None):
+        self._update_snapshot("end_user_attack_clusters", lambda end_user_attack_clusters: end_user_attack_clusters.add(address))
+
+    def put_alert_data(self, dynamo, cluster: str, dataframe: pd.DataFrame):
+        """
+        appends the alert records of the dataframe to the alert data of the cluster
+        each call writes one item with sortKey cluster hash|created_at of the newest record|batch hash, so previously stored records are neither read nor rewritten
+        and reads of the lookback window only need the items whose sortKey is in the window
+        """
         logging.debug(f"Putting alert data for cluster {cluster} in DynamoDB")
-        last_alert_created_at = dataframe["created_at"].iloc[-1].timestamp()
-        logging.debug(f"alert_created_at: {last_alert_created_at}")
         itemId = f"{self.tag}|{self.chain_id}|alert"
         logging.debug(f"itemId: {itemId}")
-        sortId = f"{cluster}"
-        logging.debug(f"sortId: {sortId}")
-        sortIdHash = hashlib.sha256(sortId.encode()).hexdigest()
-        expiresAt = self._get_expires_at(last_alert_created_at, stage)
-        logging.debug(f"expiresAt: {expiresAt}")    
-        logging.debug(f"Dataframe length before filtering: {len(dataframe)}")
-        dataframe['expiry_offset'] = dataframe.apply(self.compute_expiry_offset, axis=1)
-        dataframe = dataframe[dataframe["created_at"] > (pd.to_datetime(last_alert_created_at, unit='s') - dataframe['expiry_offset'])]
-        dataframe = dataframe.drop('expiry_offset', axis=1)
-        logging.debug(f"Dataframe length after filtering: {len(dataframe)}")
-        dataframe_json = dataframe.to_json(orient="records")
-        dataframe_json_size = len(json.dumps(dataframe_json))
-
-        if dataframe_json_size > DATAFRAME_SIZE_LIMIT:
-            grouped = dataframe.groupby(['bot_id', 'alert_id'])
-
-            # Function to keep the top half of entries based on 'anomaly_score'
-            def reduce_entries(group):
-                if len(group) > 1:
-                    half = len(group) // 2
-                    return group.nsmallest(half, 'anomaly_score')
-                else:
-                    return group
-
-            # Apply the data reduction function to each group and concatenate the results
-            dataframe_to_store = grouped.apply(reduce_entries).reset_index(drop=True)
-        else:
-            dataframe_to_store = dataframe
-
-        dataframe_to_store_json = dataframe_to_store.to_json(orient="records")
+        records = dataframe.to_dict(orient="records")
+        records_bytes = AlertRecordCodec.encode(records)
+        last_alert_created_at = max(record["created_at"] for record in records)
+        sortIdHash = hashlib.sha256(cluster.encode()).hexdigest()
+        sortKey = f"{sortIdHash}|{AlertRecordCodec.to_micros(last_alert_created_at):020d}|{hashlib.sha256(records_bytes).hexdigest()[:16]}"
+        logging.debug(f"sortKey: {sortKey}")
+        expiresAt = max(self._get_expires_at(record["created_at"].timestamp(), record.get("stage")) for record in records)
+        logging.debug(f"expiresAt: {expiresAt}")
 
         item = {
             "itemId": itemId,
-            "sortKey": sortIdHash,
+            "sortKey": sortKey,
             "cluster": cluster,
-            "dataframe": dataframe_to_store_json,
+            "records": records_bytes,
             "expiresAt": expiresAt
         }
 
@@ -203,23 +193,14 @@ class DynamoUtils:
         }
 
         self._put_item(dynamo, item)
+        self._update_snapshot("victims", lambda victims: victims.__setitem__(transaction_hash, metadata))
 
-    def _query_items(self, dynamo, itemId, sortKey=None):
-        response = None
+    def _query_items(self, dynamo, itemId, sortKey=None, projection=None, sortKeyPrefix=None, sortKeyRange=None):
+        """
+        :return: the items of the query; None if the query failed, so callers can tell a failure from no items
+        """
         try:
-            if sortKey:
-                response = dynamo.query(KeyConditionExpression='itemId = :id AND sortKey = :sid',
-                                        ExpressionAttributeValues={
-                                            ':id': itemId,
-                                            ':sid': sortKey
-                                        }
-                                        )
-            else:
-                response = dynamo.query(KeyConditionExpression='itemId = :id',
-                                        ExpressionAttributeValues={
-                                            ':id': itemId,
-                                        }
-                                        )
+            return list(query_items(dynamo, itemId, sortKey if sortKey else None, projection, sort_key_prefix=sortKeyPrefix, sort_key_range=sortKeyRange))
         except botocore.exceptions.ClientError as e:
             if e.response['Error']['Code'] == 'ValidationException':
                 logging.error(f"ValidationException when calling the Query operation: {str(e)}")
@@ -227,12 +208,7 @@ class DynamoUtils:
             else:
                 logging.error(f"Error querying items in dynamoDB: {str(e)}")
                 Utils.ERROR_CACHE.add(Utils.alert_error(f'dynamo_utils._query_items Other Exception (SORT_KEY: {str(sortKey)}, ITEM_ID: {itemId})', "dynamo_utils._query_items", ""))
-            return []
-
-        if response is None:
-            return []
-
-        return response.get('Items', [])
+            return None
 
     def read_entity_clusters(self, dynamo, address: str) -> dict:
         entity_clusters = dict()
@@ -241,7 +217,7 @@ class DynamoUtils:
         logging.debug(f"Reading entity clusters for address {address}, itemId {itemId}")
         sortIdHash = hashlib.sha256(sortKey.encode()).hexdigest()
 
-        items = self._query_items(dynamo, itemId, sortIdHash)
+        items = self._query_items(dynamo, itemId, sortIdHash, ["cluster"]) or []
 
         logging.debug(f"Items retrieved: {len(items)}")
         for item in items:
@@ -251,10 +227,15 @@ class DynamoUtils:
         return entity_clusters
 
     def read_fp_mitigation_clusters(self, dynamo) -> list:
+        """
+        :return: the fp mitigation clusters; None if they couldnt be read
+        """
         fp_mitigation_clusters = []        
         itemId = f"{self.tag}|{self.chain_id}|fp_mitigation_cluster"
         
-        items = self._query_items(dynamo, itemId)
+        items = self._query_items(dynamo, itemId, projection=["address"])
+        if items is None:
+            return None
 
         logging.debug(f"Items retrieved: {len(items)}")
         for item in items:
@@ -264,10 +245,15 @@ class DynamoUtils:
         return fp_mitigation_clusters
     
     def read_end_user_attack_clusters(self, dynamo) -> list:
+        """
+        :return: the end user attack clusters; None if they couldnt be read
+        """
         end_user_attack_clusters = []
         itemId = f"{self.tag}|{self.chain_id}|end_user_attack_cluster"
         
-        items = self._query_items(dynamo, itemId)
+        items = self._query_items(dynamo, itemId, projection=["address"])
+        if items is None:
+            return None
 
         logging.debug(f"Items retrieved: {len(items)}")
         for item in items:
@@ -276,51 +262,185 @@ class DynamoUtils:
         logging.info(f"Read end user attack clusters. Retrieved {len(end_user_attack_clusters)} alert_clusters.")
         return end_user_attack_clusters
     
-    def read_alert_data(self, dynamo, cluster: str) -> pd.DataFrame:
-        alert_data = pd.DataFrame()
+    def _read_legacy_alert_data(self, dataframe_json: str) -> pd.DataFrame:
+        # alert data written before the record store was a single json serialized dataframe per cluster
+        dataframe = pd.read_json(dataframe_json, orient="records")
+        # Convert NaN values to string "NaN"
+        dataframe = dataframe.fillna("Nan")
+        # Replace "NaN" with None in each column
+        for column in dataframe.columns:
+            dataframe[column].replace("Nan", None, inplace=True)
+        return dataframe
+
+    def _get_snapshot(self, name: str, read, collection):
+        # read returns None if it failed; the previous snapshot (or an empty collection) is used then and the read is retried on the next call
+        with self.snapshot_lock:
+            snapshot = self.snapshots.get(name)
+            if snapshot is None or time.time() - snapshot[0] > self.snapshot_max_age:
+                items = read()
+                if items is not None:
+                    snapshot = (time.time(), collection(items))
+                    self.snapshots[name] = snapshot
+                elif snapshot is None:
+                    logging.warning(f"Could not read the {name} snapshot")
+                    return collection()
+                else:
+                    logging.warning(f"Could not reload the {name} snapshot; using the one loaded {time.time() - snapshot[0]:.0f}s ago")
+            return snapshot[1]
+
+    def _update_snapshot(self, name: str, update):
+        # write-through of local puts; a snapshot that isnt loaded yet will contain the item once it is read
+        with self.snapshot_lock:
+            if name in self.snapshots:
+                update(self.snapshots[name][1])
+
+    def clear_snapshots(self):
+        with self.snapshot_lock:
+            self.snapshots.clear()
+
+    def get_fp_mitigation_clusters(self, dynamo) -> set:
+        """
+        fp mitigation clusters from a snapshot that is at most snapshot_max_age seconds old (plus local puts)
+        """
+        return self._get_snapshot("fp_mitigation_clusters", lambda: self.read_fp_mitigation_clusters(dynamo), set)
+
+    def get_end_user_attack_clusters(self, dynamo) -> set:
+        """
+        end user attack clusters from a snapshot that is at most snapshot_max_age seconds old (plus local puts)
+        """
+        return self._get_snapshot("end_user_attack_clusters", lambda: self.read_end_user_attack_clusters(dynamo), set)
+
+    def get_victims(self, dynamo) -> dict:
+        """
+        victims (transaction hash -> metadata) from a snapshot that is at most snapshot_max_age seconds old (plus local puts)
+        """
+        return self._get_snapshot("victims", lambda: self.read_victims(dynamo), dict)
+
+    def fold_legacy_alert_data(self, dynamo) -> bool:
+        """
+        converts the alert data items written before the record store (a json serialized dataframe per cluster, sortKey cluster hash) to record items
+        it runs once: a marker item is written when all legacy items are converted, so later instances only read the marker
+        it scans the whole alert partition, so it runs in the background (start_folding_legacy_alert_data) rather than on the alert read path
+        :return: True once the legacy items are converted, False if it failed and should be retried
+        """
+        if self.legacy_alert_data_folded:
+            return True
         itemId = f"{self.tag}|{self.chain_id}|alert"
-        sortKey = f"{cluster}"
-        sortIdHash = hashlib.sha256(sortKey.encode()).hexdigest()
-        
-        items = self._query_items(dynamo, itemId, sortIdHash)
+        try:
+            if len(list(query_items(dynamo, itemId, LEGACY_ALERT_DATA_FOLDED_KEY, ["sortKey"]))) == 0:
+                folded_count = 0
+                for item in query_items(dynamo, itemId, projection=["sortKey", "cluster", "dataframe"]):
+                    if "dataframe" not in item:
+                        continue
+                    try:
+                        legacy_alert_data = self._read_legacy_alert_data(item["dataframe"])
+                        for column in AlertRecordCodec.COLUMNS:
+                            if column not in legacy_alert_data.columns:
+                                legacy_alert_data[column] = None
+                        legacy_alert_data["anomaly_score"] = legacy_alert_data["anomaly_score"].astype(float)
+                        if not legacy_alert_data.empty:
+                            self.put_alert_data(dynamo, item["cluster"], legacy_alert_data[AlertRecordCodec.COLUMNS])
+                    except Exception as e:
+                        # left to expire; it isnt read anymore
+                        logging.warning(f"Could not fold legacy alert data of cluster {item.get('cluster')}: {e}")
+                        continue
+                    dynamo.delete_item(Key={'itemId': itemId, 'sortKey': item['sortKey']})
+                    folded_count += 1
+                self._put_item(dynamo, {"itemId": itemId, "sortKey": LEGACY_ALERT_DATA_FOLDED_KEY})
+                logging.info(f"Folded {folded_count} legacy alert data items into records")
+            self.legacy_alert_data_folded = True
+            return True
+        except Exception as e:
+            # the legacy items are kept until they are converted
+            logging.error(f"Error folding legacy alert data: {e}")
+            Utils.ERROR_CACHE.add(Utils.alert_error(f'dynamo_utils.fold_legacy_alert_data {e}', "dynamo_utils.fold_legacy_alert_data", ""))
+            return False
+
+    def start_folding_legacy_alert_data(self, create_table, retry_interval: float = LEGACY_ALERT_DATA_FOLD_RETRY_INTERVAL_IN_SECONDS,
+                                        max_retry_interval: float = LEGACY_ALERT_DATA_FOLD_MAX_RETRY_INTERVAL_IN_SECONDS) -> threading.Thread:
+        """
+        folds the legacy alert data in a daemon thread with its own table (create_table), once per instance; after a failure it is retried
+        after retry_interval seconds, doubled up to max_retry_interval. The legacy records aren't read until they are converted.
+        """
+        def fold():
+            dynamo = None
+            interval = retry_interval
+            while True:
+                try:
+                    dynamo = create_table() if dynamo is None else dynamo
+                except Exception as e:
+                    logging.error(f"Error creating the table to fold legacy alert data: {e}")
+                if dynamo is not None and self.fold_legacy_alert_data(dynamo):
+                    return
+                logging.info(f"Folding legacy alert data again in {interval} seconds")
+                time.sleep(interval)
+                interval = min(interval * 2, max_retry_interval)
+
+        with self.legacy_alert_data_lock:
+            if self.legacy_alert_data_thread is None:
+                self.legacy_alert_data_thread = threading.Thread(target=fold, name="fold_legacy_alert_data", daemon=True)
+                self.legacy_alert_data_thread.start()
+            return self.legacy_alert_data_thread
+
+    def read_alert_data(self, dynamo, cluster: str, as_of: datetime = None) -> pd.DataFrame:
+        """
+        reads the alert records of the cluster created within the lookback window before as_of (now by default); only the items of that window are queried
+        duplicate records are dropped and records older than the lookback window of their stage (relative to the most recent record) are filtered out
+        """
+        itemId = f"{self.tag}|{self.chain_id}|alert"
+        sortIdHash = hashlib.sha256(cluster.encode()).hexdigest()
+        as_of = datetime.utcnow() if as_of is None else as_of
+        window_start = as_of - timedelta(seconds=max(self._get_expiry_offset("Funding"), self._get_expiry_offset()))
+        # "~" sorts after the digits of the created_at part of the sortKey
+        sortKeyRange = (f"{sortIdHash}|{AlertRecordCodec.to_micros(window_start):020d}", f"{sortIdHash}|~")
+
+        items = self._query_items(dynamo, itemId, projection=["records"], sortKeyRange=sortKeyRange)
+        if items is None:
+            # an empty result would be aggregated as a cluster without alerts
+            raise Exception(f"Could not read alert data for cluster {cluster}")
 
         logging.debug(f"Items retrieved: {len(items)}")
+        records = {column: [] for column in AlertRecordCodec.COLUMNS}
         for item in items:
-            logging.debug(f"Item retrieved: {item}")
-            dataframe_json = item["dataframe"]
-            dataframe = pd.read_json(dataframe_json, orient="records")
-            # Convert NaN values to string "NaN"
-            dataframe = dataframe.fillna("Nan")           
-            # Replace "NaN" with None in each column
-            for column in dataframe.columns:
-                dataframe[column].replace("Nan", None, inplace=True)
-
-            alert_data = pd.concat([alert_data, dataframe], ignore_index=True)
+            for column, values in AlertRecordCodec.decode(bytes(item["records"])).items():
+                records[column].extend(values)
+
+        alert_data = pd.DataFrame(records)
+        if not alert_data.empty:
+            alert_data = alert_data.drop_duplicates(subset=AlertRecordCodec.DEDUP_COLUMNS, inplace=False)
+            expiry_offset = pd.to_timedelta(np.where(alert_data["stage"] == "Funding", self._get_expiry_offset("Funding"), self._get_expiry_offset()), unit="s")
+            alert_data = alert_data[alert_data["created_at"] > alert_data["created_at"].max() - expiry_offset].reset_index(drop=True)
         logging.info(f"Read alert data for cluster {cluster}. Retrieved {len(alert_data)} alert_data.")
         return alert_data
 
     def delete_alert_data(self, dynamo, address):
         itemId = f"{self.tag}|{self.chain_id}|alert"
-        sortKey = f"{address}"
-        logging.debug(f"Deleting alert data for address {address}, itemId {itemId}, sortKey {sortKey}")
-        response = dynamo.delete_item(
-            Key={
-                'itemId': itemId,
-                'sortKey': sortKey
-            }
-        )
-
-        if response["ResponseMetadata"]["HTTPStatusCode"] != 200:
-            logging.error(f"Error deleting alert data for address {address} from DynamoDB: {response}")
-            Utils.ERROR_CACHE.add(Utils.alert_error(f'dynamo_utils.delete_alert_data HTTPStatusCode {response["ResponseMetadata"]["HTTPStatusCode"]}', "dynamo_utils.delete_alert_data", ""))
-        else:
-            logging.info(f"Successfully deleted alert data for address {address} from DynamoDB")
+        sortIdHash = hashlib.sha256(address.encode()).hexdigest()
+        logging.debug(f"Deleting alert data for address {address}, itemId {itemId}, sortKey prefix {sortIdHash}")
+        for item in self._query_items(dynamo, itemId, projection=["sortKey"], sortKeyPrefix=sortIdHash) or []:
+            response = dynamo.delete_item(
+                Key={
+                    'itemId': itemId,
+                    'sortKey': item['sortKey']
+                }
+            )
+
+            if response["ResponseMetadata"]["HTTPStatusCode"] != 200:
+                logging.error(f"Error deleting alert data for address {address} from DynamoDB: {response}")
+                Utils.ERROR_CACHE.add(Utils.alert_error(f'dynamo_utils.delete_alert_data HTTPStatusCode {response["ResponseMetadata"]["HTTPStatusCode"]}', "dynamo_utils.delete_alert_data", ""))
+                return
+        logging.info(f"Successfully deleted alert data for address {address} from DynamoDB")
 
     def read_victims(self, dynamo) -> dict:
+        """
+        :return: the victims (transaction hash -> metadata); None if they couldnt be read
+        """
         victims = dict()
         itemId = f"{self.tag}|{self.chain_id}|victim"
         
-        items = self._query_items(dynamo, itemId)
+        items = self._query_items(dynamo, itemId, projection=["transaction_hash", "metadata"])
+        if items is None:
+            return None
 
         logging.debug(f"Items retrieved: {len(items)}")
         for item in items:
@@ -364,4 +484,6 @@ class DynamoUtils:
 
                     lastEvaluatedKey = response.get('LastEvaluatedKey')
                     if not lastEvaluatedKey:
-                        break
\ No newline at end of file
+                        break
+
+        self.clear_snapshots()
@@ -1,10 +1,14 @@
-from unittest.mock import Mock
-from datetime import datetime
+from unittest.mock import Mock, patch
+from datetime import datetime, timedelta
 import time
 import pandas as pd
 import hashlib
+import botocore.exceptions
+import pytest
 
 from dynamo_utils import DynamoUtils, TEST_TAG
+from alert_record_codec import AlertRecordCodec
+from dynamo_mock import DynamoMock
 from constants import ALERTS_LOOKBACK_WINDOW_IN_HOURS, FP_MITIGATION_EXPIRY_IN_HOURS, FUNDING_STAGE_ALERTS_LOOKBACK_WINDOW_IN_HOURS
 
 
@@ -62,50 +66,60 @@ class TestDynamoUtils:
         dynamo.put_item.assert_called_once_with(
             Item={'itemId': f'{du.tag}|{TestDynamoUtils.CHAIN_ID}|end_user_attack_cluster', 'sortKey': sortIdHash, 'address': address, 'expiresAt': expiresAt})
     
+    @staticmethod
+    def alert_data(created_at: str, stage: str = 'Exploitation', alert_hash: str = '0x1') -> pd.DataFrame:
+        return pd.DataFrame([[stage, pd.to_datetime(created_at), 0.1, alert_hash, '0xbot', 'ALERT-1', ['0x2'], '0x3', None, 1]], columns=AlertRecordCodec.COLUMNS)
+
     def test_put_alert_data(self):
         dynamo = Mock()
         dynamo.put_item.return_value = {
             'ResponseMetadata': {'HTTPStatusCode': 200}}
         cluster = 'alert_cluster'
-        dataframe = pd.DataFrame(
-            {'created_at': ['2022-01-01T00:00:00'], 'data': ['test'], 'stage': 'Exploitation'})
-        dataframe['created_at'] = pd.to_datetime(dataframe['created_at'])
-        first_alert_created_at_str = dataframe['created_at'].iloc[0]
-        first_alert_created_at = first_alert_created_at_str.timestamp()
-        dataframe_json = dataframe.to_json(orient="records")
+        dataframe = TestDynamoUtils.alert_data('2022-01-01T00:00:00')
+        alert_created_at = dataframe['created_at'].iloc[0].timestamp()
         expiry_offset = ALERTS_LOOKBACK_WINDOW_IN_HOURS * 60 * 60
-        expiresAt = int(first_alert_created_at) + int(expiry_offset)
+        expiresAt = int(alert_created_at) + int(expiry_offset)
 
-        du = DynamoUtils(TEST_TAG, TestDynamoUtils.CHAIN_ID) 
-        du.put_alert_data(dynamo, cluster, dataframe, "Exploitation")
+        du = DynamoUtils(TEST_TAG, TestDynamoUtils.CHAIN_ID)
+        du.put_alert_data(dynamo, cluster, dataframe)
 
         sortIdHash = hashlib.sha256(cluster.encode()).hexdigest()
 
-        dynamo.put_item.assert_called_once_with(Item={'itemId': f'{du.tag}|{TestDynamoUtils.CHAIN_ID}|alert',
-                                                'sortKey': sortIdHash, 'cluster': cluster, 'dataframe': dataframe_json, 'expiresAt': expiresAt})
-        
+        item = dynamo.put_item.call_args.kwargs['Item']
+        assert item['itemId'] == f'{du.tag}|{TestDynamoUtils.CHAIN_ID}|alert'
+        assert item['sortKey'].startswith(f'{sortIdHash}|'), "records of a cluster should share the cluster hash as sort key prefix"
+        assert item['cluster'] == cluster
+        assert item['expiresAt'] == expiresAt
+        pd.testing.assert_frame_equal(pd.DataFrame(AlertRecordCodec.decode(item['records'])), dataframe)
+
     def test_put_alert_data_funding_stage(self):
         dynamo = Mock()
         dynamo.put_item.return_value = {
             'ResponseMetadata': {'HTTPStatusCode': 200}}
         cluster = 'alert_cluster'
-        dataframe = pd.DataFrame(
-            {'created_at': ['2022-01-01T00:00:00'], 'data': ['test'], 'stage': 'Funding'})
-        dataframe['created_at'] = pd.to_datetime(dataframe['created_at'])
-        first_alert_created_at_str = dataframe['created_at'].iloc[0]
-        first_alert_created_at = first_alert_created_at_str.timestamp()
-        dataframe_json = dataframe.to_json(orient="records")
+        dataframe = TestDynamoUtils.alert_data('2022-01-01T00:00:00', 'Funding')
+        alert_created_at = dataframe['created_at'].iloc[0].timestamp()
         expiry_offset = FUNDING_STAGE_ALERTS_LOOKBACK_WINDOW_IN_HOURS * 60 * 60
-        expiresAt = int(first_alert_created_at) + int(expiry_offset)
+        expiresAt = int(alert_created_at) + int(expiry_offset)
 
-        du = DynamoUtils(TEST_TAG, TestDynamoUtils.CHAIN_ID) 
-        du.put_alert_data(dynamo, cluster, dataframe, "Funding")
+        du = DynamoUtils(TEST_TAG, TestDynamoUtils.CHAIN_ID)
+        du.put_alert_data(dynamo, cluster, dataframe)
 
-        sortIdHash = hashlib.sha256(cluster.encode()).hexdigest()
+        assert dynamo.put_item.call_args.kwargs['Item']['expiresAt'] == expiresAt
+
+    def test_put_alert_data_appends(self):
+        dynamo = Mock()
+        dynamo.put_item.return_value = {
+            'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+        du = DynamoUtils(TEST_TAG, TestDynamoUtils.CHAIN_ID)
+        du.put_alert_data(dynamo, 'alert_cluster', TestDynamoUtils.alert_data('2022-01-01T00:00:00'))
+        du.put_alert_data(dynamo, 'alert_cluster', TestDynamoUtils.alert_data('2022-01-01T00:00:01'))
+
+        sort_keys = [call.kwargs['Item']['sortKey'] for call in dynamo.put_item.call_args_list]
+        assert sort_keys[0] < sort_keys[1], "each put should write a new item, ordered by created_at"
+        assert len(AlertRecordCodec.decode(dynamo.put_item.call_args.kwargs['Item']['records'])['alert_hash']) == 1, "only the new records should be written"
 
-        dynamo.put_item.assert_called_once_with(Item={'itemId': f'{du.tag}|{TestDynamoUtils.CHAIN_ID}|alert',
-                                                'sortKey': sortIdHash, 'cluster': cluster, 'dataframe': dataframe_json, 'expiresAt': expiresAt})
-    
     def test_put_victim(self):
         dynamo = Mock()
         dynamo.put_item.return_value = {
@@ -136,7 +150,7 @@ class TestDynamoUtils:
         sortIdHash = hashlib.sha256(address.encode()).hexdigest()
 
         dynamo.query.assert_called_once_with(KeyConditionExpression='itemId = :id AND sortKey = :sid', ExpressionAttributeValues={
-                                         ':id': f'{du.tag}|{TestDynamoUtils.CHAIN_ID}|entity_cluster', ':sid': f'{sortIdHash}'})
+                                         ':id': f'{du.tag}|{TestDynamoUtils.CHAIN_ID}|entity_cluster', ':sid': f'{sortIdHash}'}, ProjectionExpression='#p0', ExpressionAttributeNames={'#p0': 'cluster'})
 
     def test_read_fp_mitigation_clusters(self):
         dynamo = Mock()
@@ -148,7 +162,7 @@ class TestDynamoUtils:
         du.read_fp_mitigation_clusters(dynamo)
 
         dynamo.query.assert_called_once_with(KeyConditionExpression='itemId = :id', ExpressionAttributeValues={
-            ':id': f'{du.tag}|{TestDynamoUtils.CHAIN_ID}|fp_mitigation_cluster'})
+            ':id': f'{du.tag}|{TestDynamoUtils.CHAIN_ID}|fp_mitigation_cluster'}, ProjectionExpression='#p0', ExpressionAttributeNames={'#p0': 'address'})
 
     def test_read_end_user_attack_clusters(self):
         dynamo = Mock()
@@ -160,23 +174,84 @@ class TestDynamoUtils:
         du.read_end_user_attack_clusters(dynamo)
 
         dynamo.query.assert_called_once_with(KeyConditionExpression='itemId = :id', ExpressionAttributeValues={
-            ':id': f'{du.tag}|{TestDynamoUtils.CHAIN_ID}|end_user_attack_cluster'})
+            ':id': f'{du.tag}|{TestDynamoUtils.CHAIN_ID}|end_user_attack_cluster'}, ProjectionExpression='#p0', ExpressionAttributeNames={'#p0': 'address'})
 
     def test_read_alert_data(self):
         dynamo = Mock()
         cluster = 'alert_cluster'
-        items = [{'cluster': 'alert_cluster', 'sortKey': '1641074400',
-                  'dataframe': '{"created_at":{"0":"2022-01-01T00:00:00"},"data":{"0":"test"}}'}]
-        response = {'Items': items}
-        dynamo.query.return_value = response
+        dynamo.query.return_value = {'Items': []}
 
         du = DynamoUtils(TEST_TAG, TestDynamoUtils.CHAIN_ID)
-        du.read_alert_data(dynamo, cluster)
+        du.read_alert_data(dynamo, cluster, datetime(2022, 1, 11))
 
         sortIdHash = hashlib.sha256(cluster.encode()).hexdigest()
+        window_start_micros = AlertRecordCodec.to_micros(datetime(2022, 1, 11) - timedelta(hours=FUNDING_STAGE_ALERTS_LOOKBACK_WINDOW_IN_HOURS))
 
-        dynamo.query.assert_called_once_with(KeyConditionExpression='itemId = :id AND sortKey = :sid', ExpressionAttributeValues={
-            ':id': f'{du.tag}|{TestDynamoUtils.CHAIN_ID}|alert', ':sid': f'{sortIdHash}'})
+        dynamo.query.assert_called_once_with(KeyConditionExpression='itemId = :id AND sortKey BETWEEN :sid AND :sid_to', ExpressionAttributeValues={
+            ':id': f'{du.tag}|{TestDynamoUtils.CHAIN_ID}|alert', ':sid': f'{sortIdHash}|{window_start_micros:020d}', ':sid_to': f'{sortIdHash}|~'},
+            ProjectionExpression='#p0', ExpressionAttributeNames={'#p0': 'records'})
+
+    def test_read_alert_data_records(self):
+        dynamo = DynamoMock()
+        du = DynamoUtils(TEST_TAG, TestDynamoUtils.CHAIN_ID)
+        for created_at, stage, alert_hash in [('2021-12-01T00:00:00', 'Funding', '0xo'), ('2022-01-01T00:00:00', 'Funding', '0xa'), ('2022-01-01T00:00:00', 'Preparation', '0xb'),
+                                              ('2022-01-03T00:00:00', 'Exploitation', '0xc'), ('2022-01-03T00:00:00', 'Exploitation', '0xc'), ('2022-01-03T00:00:01', 'Exploitation', '0xd')]:
+            du.put_alert_data(dynamo, 'alert_cluster', TestDynamoUtils.alert_data(created_at, stage, alert_hash))
+        du.put_alert_data(dynamo, 'other_cluster', TestDynamoUtils.alert_data('2022-01-03T00:00:00', alert_hash='0xe'))
+
+        query = dynamo.query
+        dynamo.query = Mock(wraps=query)
+        alert_data = du.read_alert_data(dynamo, 'alert_cluster', datetime(2022, 1, 3, 0, 0, 2))
+        queried_items = query(**dynamo.query.call_args.kwargs)['Items']
+
+        assert list(alert_data['alert_hash']) == ['0xa', '0xc', '0xd'], "duplicates and records outside the lookback window of their stage should be dropped"
+        assert alert_data['addresses'].iloc[0] == ['0x2'] and alert_data['address_filter'].iloc[2] is None
+        assert len(queried_items) == 4, "only the items of the cluster within the lookback window should be read"
+
+    def test_read_alert_data_empty(self):
+        du = DynamoUtils(TEST_TAG, TestDynamoUtils.CHAIN_ID)
+        assert du.read_alert_data(DynamoMock(), 'alert_cluster').empty
+
+    def test_fold_legacy_alert_data(self):
+        dynamo = DynamoMock()
+        du = DynamoUtils(TEST_TAG, TestDynamoUtils.CHAIN_ID)
+        itemId = f'{du.tag}|{TestDynamoUtils.CHAIN_ID}|alert'
+        sortIdHash = hashlib.sha256('alert_cluster'.encode()).hexdigest()
+        legacy_alert_data = pd.concat([TestDynamoUtils.alert_data('2022-01-01T00:00:00', 'Funding', '0xa'), TestDynamoUtils.alert_data('2022-01-02T00:00:00', 'Preparation', '0xb')], ignore_index=True)
+        dynamo.put_item(Item={'itemId': itemId, 'sortKey': sortIdHash, 'cluster': 'alert_cluster', 'dataframe': legacy_alert_data.to_json(orient="records")})
+        du.put_alert_data(dynamo, 'alert_cluster', TestDynamoUtils.alert_data('2022-01-02T00:00:01', alert_hash='0xc'))
+
+        dynamo.query = Mock(wraps=dynamo.query)
+        assert list(du.read_alert_data(dynamo, 'alert_cluster', datetime(2022, 1, 2, 0, 0, 2))['alert_hash']) == ['0xc'], \
+            "the legacy items should be converted in the background, not by the reads"
+        assert dynamo.query.call_count == 1
+
+        assert du.fold_legacy_alert_data(dynamo)
+        alert_data = du.read_alert_data(dynamo, 'alert_cluster', datetime(2022, 1, 2, 0, 0, 2))
+        assert list(alert_data['alert_hash']) == ['0xa', '0xb', '0xc']
+        assert (itemId, sortIdHash) not in dynamo.items, "the legacy item should be converted to records"
+        assert (itemId, 'legacy_alert_data_folded') in dynamo.items
+
+        query_count = dynamo.query.call_count
+        assert du.fold_legacy_alert_data(dynamo)
+        assert dynamo.query.call_count == query_count, "the legacy items should be folded once per instance"
+        assert DynamoUtils(TEST_TAG, TestDynamoUtils.CHAIN_ID).fold_legacy_alert_data(dynamo)
+        assert dynamo.query.call_count == query_count + 1, "other instances should only read the marker"
+
+    def test_fold_legacy_alert_data_retried_in_background(self):
+        dynamo = Mock()
+        dynamo.query.side_effect = [botocore.exceptions.ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException'}}, 'Query')] * 2 + [{'Items': []}] * 2
+        dynamo.put_item.return_value = {'ResponseMetadata': {'HTTPStatusCode': 200}}
+        du = DynamoUtils(TEST_TAG, TestDynamoUtils.CHAIN_ID)
+        sleeps = []
+        with patch.object(time, 'sleep', side_effect=sleeps.append):
+            thread = du.start_folding_legacy_alert_data(lambda: dynamo, retry_interval=60, max_retry_interval=100)
+            assert du.start_folding_legacy_alert_data(lambda: dynamo) is thread, "the legacy items should be folded by one thread"
+            thread.join(timeout=5)
+
+        assert du.legacy_alert_data_folded
+        dynamo.put_item.assert_called_once_with(Item={'itemId': f'{du.tag}|{TestDynamoUtils.CHAIN_ID}|alert', 'sortKey': 'legacy_alert_data_folded'})
+        assert sleeps == [60, 100], "the retries should back off"
 
     def test_read_victims(self):
         dynamo = Mock()
@@ -192,18 +267,106 @@ class TestDynamoUtils:
             KeyConditionExpression='itemId = :id',
             ExpressionAttributeValues={
                 ':id': f'{du.tag}|{TestDynamoUtils.CHAIN_ID}|victim'
-            }
+            },
+            ProjectionExpression='#p0, #p1',
+            ExpressionAttributeNames={'#p0': 'transaction_hash', '#p1': 'metadata'}
         )
 
+    def test_read_fp_mitigation_clusters_paginated(self):
+        dynamo = Mock()
+        dynamo.query.side_effect = [{'Items': [{'address': '0x1'}], 'LastEvaluatedKey': {'itemId': 'x', 'sortKey': '1'}},
+                                    {'Items': [{'address': '0x2'}]}]
+
+        du = DynamoUtils(TEST_TAG, TestDynamoUtils.CHAIN_ID)
+        fp_mitigation_clusters = du.read_fp_mitigation_clusters(dynamo)
+
+        assert fp_mitigation_clusters == ['0x1', '0x2'], "should read all pages"
+        assert dynamo.query.call_count == 2
+        assert dynamo.query.call_args_list[1].kwargs['ExclusiveStartKey'] == {'itemId': 'x', 'sortKey': '1'}
+
     def test_delete_alert_data(self):
         dynamo = Mock()
         address = '0x432423'
+        sortIdHash = hashlib.sha256(address.encode()).hexdigest()
+        dynamo.query.return_value = {'Items': [{'sortKey': sortIdHash}, {'sortKey': f'{sortIdHash}|1'}]}
         dynamo.delete_item.return_value = {
             'ResponseMetadata': {'HTTPStatusCode': 200}}
 
         du = DynamoUtils(TEST_TAG, TestDynamoUtils.CHAIN_ID)
         du.delete_alert_data(dynamo, address)
-        dynamo.delete_item.assert_called_once_with(
-            Key={'itemId': f'{du.tag}|{TestDynamoUtils.CHAIN_ID}|alert',
-                 'sortKey': f'{address}'}
-        )
+        assert [call.kwargs for call in dynamo.delete_item.call_args_list] == [
+            {'Key': {'itemId': f'{du.tag}|{TestDynamoUtils.CHAIN_ID}|alert', 'sortKey': sortIdHash}},
+            {'Key': {'itemId': f'{du.tag}|{TestDynamoUtils.CHAIN_ID}|alert', 'sortKey': f'{sortIdHash}|1'}}]
+
+    def test_get_fp_mitigation_clusters_snapshot(self):
+        dynamo = Mock()
+        dynamo.query.return_value = {'Items': [{'address': '0x1'}]}
+        dynamo.put_item.return_value = {
+            'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+        du = DynamoUtils(TEST_TAG, TestDynamoUtils.CHAIN_ID)
+        assert du.get_fp_mitigation_clusters(dynamo) == {'0x1'}
+        assert du.get_fp_mitigation_clusters(dynamo) == {'0x1'}
+        assert dynamo.query.call_count == 1, "the snapshot should be reused until it is stale"
+
+        du.put_fp_mitigation_cluster(dynamo, '0x2')
+        assert du.get_fp_mitigation_clusters(dynamo) == {'0x1', '0x2'}, "local puts should be written through to the snapshot"
+        assert dynamo.query.call_count == 1
+
+        du.snapshots['fp_mitigation_clusters'] = (time.time() - du.snapshot_max_age - 1, {'0x1'})
+        dynamo.query.return_value = {'Items': [{'address': '0x1'}, {'address': '0x3'}]}
+        assert du.get_fp_mitigation_clusters(dynamo) == {'0x1', '0x3'}, "stale snapshots should be reloaded"
+        assert dynamo.query.call_count == 2
+
+    def test_get_end_user_attack_clusters_snapshot(self):
+        dynamo = Mock()
+        dynamo.query.return_value = {'Items': [{'address': '0x1'}]}
+        dynamo.put_item.return_value = {
+            'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+        du = DynamoUtils(TEST_TAG, TestDynamoUtils.CHAIN_ID)
+        du.put_end_user_attack_cluster(dynamo, '0x2')
+        assert du.get_end_user_attack_clusters(dynamo) == {'0x1'}, "puts before the snapshot is loaded are read from dynamo"
+        du.put_end_user_attack_cluster(dynamo, '0x2')
+        assert du.get_end_user_attack_clusters(dynamo) == {'0x1', '0x2'}
+        assert dynamo.query.call_count == 1
+
+    def test_get_fp_mitigation_clusters_snapshot_read_error(self):
+        dynamo = Mock()
+        throttled = botocore.exceptions.ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException'}}, 'Query')
+        dynamo.query.side_effect = [throttled, {'Items': [{'address': '0x1'}]}, throttled, {'Items': [{'address': '0x2'}]}]
+
+        du = DynamoUtils(TEST_TAG, TestDynamoUtils.CHAIN_ID)
+        assert du.get_fp_mitigation_clusters(dynamo) == set()
+        assert du.get_fp_mitigation_clusters(dynamo) == {'0x1'}, "a failed read shouldnt be cached"
+
+        du.snapshots['fp_mitigation_clusters'] = (time.time() - du.snapshot_max_age - 1, {'0x1'})
+        assert du.get_fp_mitigation_clusters(dynamo) == {'0x1'}, "the previous snapshot should be used while it cant be reloaded"
+        assert du.get_fp_mitigation_clusters(dynamo) == {'0x2'}
+        assert dynamo.query.call_count == 4
+
+    def test_read_alert_data_error(self):
+        dynamo = Mock()
+        dynamo.query.side_effect = botocore.exceptions.ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException'}}, 'Query')
+
+        du = DynamoUtils(TEST_TAG, TestDynamoUtils.CHAIN_ID)
+        with pytest.raises(Exception):
+            du.read_alert_data(dynamo, 'alert_cluster')
+
+    def test_get_victims_snapshot(self):
+        dynamo = Mock()
+        dynamo.query.return_value = {'Items': [{'transaction_hash': '0xa', 'metadata': {'key': 'value'}}]}
+        dynamo.put_item.return_value = {
+            'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+        du = DynamoUtils(TEST_TAG, TestDynamoUtils.CHAIN_ID, snapshot_max_age=0)
+        assert du.get_victims(dynamo) == {'0xa': {'key': 'value'}}
+        du.put_victim(dynamo, '0xb', {'key': 'value2'})
+        time.sleep(0.01)
+        assert du.get_victims(dynamo) == {'0xa': {'key': 'value'}}, "a max age of 0 should always read from dynamo"
+        assert dynamo.query.call_count == 2
+
+        du = DynamoUtils(TEST_TAG, TestDynamoUtils.CHAIN_ID)
+        du.get_victims(dynamo)
+        du.put_victim(dynamo, '0xb', {'key': 'value2'})
+        assert du.get_victims(dynamo) == {'0xa': {'key': 'value'}, '0xb': {'key': 'value2'}}
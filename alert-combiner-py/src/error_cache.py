@@ -1,18 +1,26 @@
+import threading
+
+
 class ErrorCache:
     errors = []
+    lock = threading.Lock()  # errors are added from the threads of detect_attack
 
     @staticmethod
     def add(error):
-        ErrorCache.errors.append(error)
+        with ErrorCache.lock:
+            ErrorCache.errors.append(error)
 
     @staticmethod
     def get_all():
-        return ErrorCache.errors
+        with ErrorCache.lock:
+            return list(ErrorCache.errors)
 
     @staticmethod
     def clear():
-        ErrorCache.errors = []
+        with ErrorCache.lock:
+            ErrorCache.errors = []
 
     @staticmethod
     def len():
-        return len(ErrorCache.errors)
\ No newline at end of file
+        with ErrorCache.lock:
+            return len(ErrorCache.errors)
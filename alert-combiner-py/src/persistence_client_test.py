@@ -0,0 +1,70 @@
+import base64
+import json
+import time
+from unittest.mock import Mock
+
+from persistence_client import PersistenceClient, JWT_REFRESH_MARGIN_IN_SECONDS
+from research_db_mock import ResearchDBMock
+
+
+def jwt(exp: float) -> str:
+    payload = base64.urlsafe_b64encode(json.dumps({"exp": exp}).encode()).decode().rstrip("=")
+    return f"header.{payload}.signature"
+
+
+class TestPersistenceClient:
+
+    def setup_method(self):
+        self.token = jwt(time.time() + 3600)
+        self.db = ResearchDBMock(self.token)
+        self.fetch_jwt = Mock(return_value=self.token)
+        self.client = PersistenceClient(self.db.url, backoff_base=0.01, fetch_jwt=self.fetch_jwt)
+
+    def teardown_method(self):
+        self.db.stop()
+
+    def test_post_and_get(self):
+        assert self.client.post("key_1", b"value").status_code == 200
+        res = self.client.get("key_1")
+        assert res.status_code == 200 and res.content == b"value"
+        assert self.client.get("missing_1").status_code == 404
+
+    def test_jwt_cached_until_expiry(self):
+        for i in range(5):
+            self.client.get("key_1")
+        assert self.fetch_jwt.call_count == 1, "jwt should be reused until it is about to expire"
+
+        self.client.token_expires_at = time.time() + JWT_REFRESH_MARGIN_IN_SECONDS - 1
+        self.client.get("key_1")
+        assert self.fetch_jwt.call_count == 2, "jwt should be refreshed shortly before it expires"
+
+    def test_jwt_refreshed_on_unauthorized(self):
+        self.fetch_jwt.side_effect = [jwt(time.time() + 3600), self.token]  # first token is rejected by the db
+        assert self.client.post("key_1", b"value").status_code == 200
+        assert self.fetch_jwt.call_count == 2
+
+    def test_retry_with_backoff(self):
+        self.client.post("key_1", b"value")
+        self.db.fail_next(503, 500)
+        res = self.client.get("key_1")
+        assert res.status_code == 200 and res.content == b"value"
+        assert len(self.db.requests) == 4
+
+    def test_retries_exhausted(self):
+        self.db.fail_next(503, 503, 503)
+        assert self.client.get("key_1").status_code == 503
+        assert len(self.db.requests) == 3
+
+    def test_backoff_is_exponential_and_capped(self):
+        client = PersistenceClient(self.db.url, backoff_base=1, backoff_max=5, fetch_jwt=self.fetch_jwt)
+        assert 0.5 <= client.backoff(0) <= 1
+        assert 2 <= client.backoff(2) <= 4
+        assert client.backoff(10) <= 5
+
+    def test_connection_error_raised_after_retries(self):
+        self.db.stop()
+        try:
+            self.client.get("key_1")
+            assert False, "connection errors should be raised once retries are exhausted"
+        except Exception:
+            pass
@@ -0,0 +1,67 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class ResearchDBMock:
+    """
+    local HTTP stand-in for the research DB used by L2Cache; stores posted bytes per path and serves them on get
+    failures can be injected with fail_next, and requests are recorded for assertions
+    """
+
+    def __init__(self, token: str = "token"):
+        self.token = token
+        self.items = {}  # path -> bytes
+        self.requests = []  # (method, path, authorization header)
+        self.failures = []  # status codes to return for the next requests
+        self.lock = threading.Lock()
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive
+
+            def log_message(self, format, *args):
+                pass
+
+            def respond(self, status: int, content: bytes = b""):
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def handle_request(self, method: str):
+                content = self.rfile.read(int(self.headers.get("Content-Length", 0))) if method == "POST" else b""
+                with mock.lock:
+                    mock.requests.append((method, self.path, self.headers.get("Authorization")))
+                    failure = mock.failures.pop(0) if len(mock.failures) > 0 else None
+                if failure is not None:
+                    self.respond(failure)
+                elif self.headers.get("Authorization") != f"Bearer {mock.token}":
+                    self.respond(401)
+                elif method == "POST":
+                    with mock.lock:
+                        mock.items[self.path] = content
+                    self.respond(200)
+                elif self.path in mock.items:
+                    self.respond(200, mock.items[self.path])
+                else:
+                    self.respond(404)
+
+            def do_GET(self):
+                self.handle_request("GET")
+
+            def do_POST(self):
+                self.handle_request("POST")
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/database/bot/"
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+        self.thread.start()
+
+    def fail_next(self, *status_codes: int):
+        with self.lock:
+            self.failures.extend(status_codes)
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
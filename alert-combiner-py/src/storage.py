@@ -3,6 +3,8 @@ import boto3
 import json
 import requests
 import os
+import queue
+from contextlib import contextmanager
 
 owner_db = "https://research.forta.network/database/owner/"
 bucket_name = "prod-research-bot-data"
@@ -52,3 +54,22 @@ def dynamo_table(secrets, region='us-east-1'):
                        region_name=region)
 
     return d.Table(dynamo_table_name)
+
+
+# Pool of dynamo tables for threads that access dynamo concurrently
+# boto3 resources arent thread safe, so each thread checks out its own table; tables are created on demand and reused
+class DynamoTablePool:
+    def __init__(self, create_table):
+        self.create_table = create_table
+        self.tables = queue.SimpleQueue()
+
+    @contextmanager
+    def table(self):
+        try:
+            table = self.tables.get_nowait()
+        except queue.Empty:
+            table = self.create_table()
+        try:
+            yield table
+        finally:
+            self.tables.put(table)
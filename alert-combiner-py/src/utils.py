@@ -5,19 +5,25 @@ import re
 import traceback
 import logging
 import json
+import os
 import base64
 import math
+import threading
 import gnupg
+from concurrent.futures import ThreadPoolExecutor
 from forta_agent import Finding, FindingType, FindingSeverity, AlertEvent, get_alerts, get_labels
 
 from src.error_cache import ErrorCache
-from src.constants import TX_COUNT_FILTER_THRESHOLD
+from src.constants import TX_COUNT_FILTER_THRESHOLD, FORTA_LABEL_CACHE_SNAPSHOT_PATH
+from src.label_cache import LabelCache
 
 etherscan_label_api = "https://api.forta.network/labels/state?sourceIds=etherscan,0x6f022d4a65f397dffd059e269e1c2b5004d822f905674dbf518d968f744c2ede&entities="
 
 class Utils:
     ERROR_CACHE = ErrorCache
     CONTRACT_CACHE = dict()
+    CONTRACT_CACHE_LOCK = threading.Lock()  # is_contract is called from the threads of detect_attack
+    LABEL_CACHE = None  # LabelCache of address -> etherscan labels from the forta label API
     TOTAL_SHARDS = None
     IS_BETA = None
     gpg = None
@@ -95,15 +101,18 @@ class Utils:
         if addresses is None:
             return True
 
-        if Utils.CONTRACT_CACHE.get(addresses) is not None:
-            return Utils.CONTRACT_CACHE[addresses]
+        with Utils.CONTRACT_CACHE_LOCK:
+            cached_is_contract = Utils.CONTRACT_CACHE.get(addresses)
+        if cached_is_contract is not None:
+            return cached_is_contract
         else:
             is_contract = True
             try:
                 for address in addresses.split(','):
                     code = w3.eth.get_code(Web3.toChecksumAddress(address))
                     is_contract = is_contract & (code != HexBytes('0x'))
-                Utils.CONTRACT_CACHE[addresses] = is_contract
+                with Utils.CONTRACT_CACHE_LOCK:
+                    Utils.CONTRACT_CACHE[addresses] = is_contract
             except Exception as e:
                 error_finding = Utils.alert_error(str(e), "Utils.is_contract", f"{traceback.format_exc()}")
                 Utils.ERROR_CACHE.add(error_finding)
@@ -127,6 +136,23 @@ class Utils:
 
         return is_address
 
+    @staticmethod
+    def map_in_order(fn, items: list, max_workers: int) -> list:
+        """
+        applies fn to the items on up to max_workers threads; results are returned in the order of the items
+        an exception raised for an item is returned in its place, so the results of preceding items can still be processed
+        """
+        def fn_or_exception(item):
+            try:
+                return fn(item)
+            except Exception as e:
+                return e
+
+        if max_workers > 1 and len(items) > 1:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+                return list(executor.map(fn_or_exception, items))
+        return [fn_or_exception(item) for item in items]
+
     @staticmethod
     def get_etherscan_label(address: str):
         if address is None:
@@ -144,6 +170,40 @@ class Utils:
             logging.error(f"Exception in get_etherscan_label {e}")
         return ""
 
+    @staticmethod
+    def get_etherscan_labels_by_address(addresses: list) -> dict:
+        """
+        looks up the etherscan labels of several addresses in a single call of the forta label API
+        :return: dict of address -> list of labels for the addresses that have labels; None if the lookup failed
+        """
+        try:
+            res = requests.get(etherscan_label_api + ','.join(addresses).lower(), timeout=30)
+            if res.status_code != 200:
+                logging.warning(f"Error getting etherscan labels: {res.status_code}")
+                return None
+            labels_by_address = dict()
+            labels = res.json()
+            for event in (labels.get('events', []) if labels else []):
+                label = event['label']
+                if label.get('label'):
+                    labels_by_address.setdefault(label['entity'].lower(), []).append(label['label'])
+            return labels_by_address
+        except Exception as e:
+            error_finding = Utils.alert_error(str(e), "Utils.get_etherscan_labels_by_address", f"{traceback.format_exc()}")
+            Utils.ERROR_CACHE.add(error_finding)
+            logging.error(f"Exception in get_etherscan_labels_by_address {e}")
+        return None
+
+    @staticmethod
+    def get_label_cache() -> LabelCache:
+        """
+        label cache of the etherscan labels obtained through the forta label API; snapshotted to disk in production, so restarts dont look up all labels again
+        """
+        if Utils.LABEL_CACHE is None:
+            is_production = 'NODE_ENV' in os.environ and 'production' in os.environ.get('NODE_ENV')
+            Utils.LABEL_CACHE = LabelCache(Utils.get_etherscan_labels_by_address, snapshot_path=FORTA_LABEL_CACHE_SNAPSHOT_PATH if is_production else None)
+        return Utils.LABEL_CACHE
+
     @staticmethod
     def get_total_shards(CHAIN_ID: int) -> int:
         if Utils.TOTAL_SHARDS is None:
@@ -213,22 +273,13 @@ class Utils:
     def is_fp(w3, du, dynamo, cluster: str) -> bool:
         global ERROR_CACHE
     
-        etherscan_label = (Utils.get_etherscan_label(cluster)).lower()
-        if not ('attack' in etherscan_label
-                or 'phish' in etherscan_label
-                or 'hack' in etherscan_label
-                or 'heist' in etherscan_label
-                or 'exploit' in etherscan_label
-                or 'drainer' in etherscan_label
-                or 'scam' in etherscan_label
-                or 'fraud' in etherscan_label
-                or '.eth' in etherscan_label
-                or etherscan_label == ''):
-            logging.info(f"Cluster {cluster} etherscan label: {etherscan_label}")
+        labels = [label for address_labels in Utils.get_label_cache().get_many(cluster.split(',')).values() for label in address_labels]
+        if LabelCache.is_non_attacker(labels):
+            logging.info(f"Cluster {cluster} etherscan label: {','.join(labels).lower()}")
             return True
 
         
-        if cluster in du.read_fp_mitigation_clusters(dynamo):
+        if cluster in du.get_fp_mitigation_clusters(dynamo):
             logging.info(f"Cluster {cluster} is in FP mitigation clusters")
             return True
 
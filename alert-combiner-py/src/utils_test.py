@@ -1,3 +1,6 @@
+import random
+import threading
+import time
 from forta_agent import get_json_rpc_url
 from web3 import Web3
 from utils import Utils
@@ -44,3 +47,36 @@ class TestUtils:
     def test_is_beta(self):
         assert Utils.is_beta() is not None
 
+    def test_map_in_order(self):
+        def slow_square(i):
+            time.sleep(random.uniform(0, 0.02))
+            return i * i
+
+        assert Utils.map_in_order(slow_square, list(range(20)), 8) == [i * i for i in range(20)], "results should be in item order regardless of completion order"
+        assert Utils.map_in_order(slow_square, list(range(5)), 1) == [i * i for i in range(5)]
+        assert Utils.map_in_order(slow_square, [], 8) == []
+
+    def test_map_in_order_overlaps_io(self):
+        thread_ids = set()
+        barrier = threading.Barrier(8, timeout=5)
+        def io(i):
+            thread_ids.add(threading.get_ident())
+            barrier.wait()  # only passes once all items are in flight
+            return i
+
+        assert Utils.map_in_order(io, list(range(8)), 8) == list(range(8)), "the items should be processed concurrently"
+        assert len(thread_ids) == 8
+
+        thread_ids.clear()
+        Utils.map_in_order(lambda i: thread_ids.add(threading.get_ident()), list(range(3)), 1)
+        assert thread_ids == {threading.get_ident()}, "a single worker should run on the calling thread"
+
+    def test_map_in_order_exception(self):
+        def fail_on_two(i):
+            if i == 2:
+                raise ValueError("2")
+            return i
+
+        results = Utils.map_in_order(fail_on_two, [1, 2, 3], 8)
+        assert results[0] == 1 and results[2] == 3
+        assert isinstance(results[1], ValueError)
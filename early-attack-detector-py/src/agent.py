@@ -22,8 +22,12 @@ from src.constants import (
     EXTRA_TIME_BOTS,
     EXTRA_TIME_DAYS,
     ETH_BLOCKS_IN_ONE_DAY,
-    THREE_SECOND_BLOCKS_IN_ONE_DAY
+    THREE_SECOND_BLOCKS_IN_ONE_DAY,
+    BYTECODE_CACHE_MAX_BYTES,
+    BYTECODE_CACHE_PATH,
+    BYTECODE_CACHE_PERSIST_INTERVAL_BLOCKS
 )
+from src.bytecode_cache import BytecodeCache, file_digest
 from src.findings import ContractFindings
 from src.logger import logger
 from src.utils import (
@@ -74,6 +78,13 @@ def initialize():
         MODEL_PRECISION_THRESHOLD = MODEL_THRESHOLD_DEFAULT_PRECISION
     logger.info(f"Model threshold: {MODEL_THRESHOLD}. Threshold for high precision: {MODEL_PRECISION_THRESHOLD}")
 
+    # the cached scores are only valid for the models and the high precision threshold they were computed with;
+    # the models are identified by the content of their files, as a retrained model may keep its path
+    global BYTECODE_CACHE
+    BYTECODE_CACHE = BytecodeCache(BYTECODE_CACHE_MAX_BYTES,
+                                   (file_digest(MODEL_PATH), file_digest(HIGH_PRECISION_MODEL_PATH), MODEL_PRECISION_THRESHOLD),
+                                   BYTECODE_CACHE_PATH)
+
     global ENV
     if 'production' in os.environ.get('NODE_ENV', ''):
         ENV = 'production'
@@ -105,12 +116,21 @@ def initialize():
 def exec_model(w3, opcodes: str, contract_creator: str) -> tuple:
     """
     this function executes the model to obtain the score for the contract
-    :return: score: float
+    :return: score: float, opcode_addresses: set, features: str
     """
-    t_aux = None
     t = time.time()
-    score = None
     features, opcode_addresses = get_features(w3, opcodes, contract_creator)
+    if ENV == 'dev':
+        logger.info(f"Model Timing:\t Time taken to get features: {time.time() - t}")
+    return score_features(features), opcode_addresses, features
+
+
+def score_features(features: str) -> float:
+    """
+    this function runs the models on the features of the contract
+    :return: score: float
+    """
+    t_aux = None
     t1 = time.time()
     with parallel_config(backend='threading'):
         score = ML_MODEL.predict_proba([features])[0][1]
@@ -126,10 +146,10 @@ def exec_model(w3, opcodes: str, contract_creator: str) -> tuple:
     score = round(score, 4)
     if ENV == 'dev':
         if t_aux is None:
-            logger.info(f"Model Timing:\t Time taken to get features: {t1 - t};\t Time taken to predict: {t2 - t1};\t Total time: {t2 - t}")
+            logger.info(f"Model Timing:\t Time taken to predict: {t2 - t1}")
         else:
-            logger.info(f"Model Timing:\t Time taken to get features: {t1 - t};\t Time taken to predict: {t_aux - t1};\t Time taken to predict high precision: {t2 - t_aux};\t Total time: {t2 - t}")
-    return score, opcode_addresses
+            logger.info(f"Model Timing:\t Time taken to predict: {t_aux - t1};\t Time taken to predict high precision: {t2 - t_aux}")
+    return score
 
 
 def detect_malicious_contract_tx(
@@ -281,6 +301,37 @@ def detect_malicious_contract_tx(
     return all_findings[:10]
 
 
+def analyze_bytecode(w3, from_, code) -> tuple:
+    """
+    this function scores the creation bytecode, reusing the analysis of the same bytecode from previous transactions
+    :return: model_score: float, opcode_addresses: set, function_signatures: set
+    """
+    cached = BYTECODE_CACHE.get(code, from_)
+    if cached is not None:
+        if ENV == 'dev':
+            logger.info("Bytecode analysis found in cache")
+        model_score = cached["model_score"]
+        if model_score is None:
+            model_score = score_features(cached["features"])
+            BYTECODE_CACHE.set_score(code, from_, model_score)
+        opcode_addresses = BytecodeCache.opcode_addresses(cached, from_, lambda address: is_contract(w3, address))
+        return model_score, opcode_addresses, set(cached["function_signatures"])
+
+    try:
+        opcodes = EvmBytecode(code).disassemble()
+    except Exception as e:
+        logger.warn(f"Error disassembling evm bytecode: {e}")
+
+    (
+        model_score,
+        opcode_addresses,
+        features,
+    ) = exec_model(w3, opcodes, from_)
+    function_signatures = get_function_signatures(w3, opcodes)
+    BYTECODE_CACHE.put(code, from_, features, opcode_addresses, function_signatures, model_score)
+    return model_score, opcode_addresses, function_signatures
+
+
 def detect_malicious_contract(
     w3, from_, created_contract_address, code, error=None
 ) -> list:
@@ -290,16 +341,7 @@ def detect_malicious_contract(
         known_past_attacker = from_ in TP_ATTACKER_LIST
 
         if (len(code) > BYTE_CODE_LENGTH_THRESHOLD) or known_past_attacker:
-            try:
-                opcodes = EvmBytecode(code).disassemble()
-            except Exception as e:
-                logger.warn(f"Error disassembling evm bytecode: {e}")
-
-            (
-                model_score,
-                opcode_addresses,
-            ) = exec_model(w3, opcodes, from_)
-            function_signatures = get_function_signatures(w3, opcodes)
+            model_score, opcode_addresses, function_signatures = analyze_bytecode(w3, from_, code)
             logger.info(f"{created_contract_address}: score={model_score}")
 
             if not known_past_attacker:
@@ -399,6 +441,9 @@ def provide_handle_block():
         if block_event.block_number % DAILY_BLOCKS_DENOMINATOR == 0:
             global TP_ATTACKER_LIST
             TP_ATTACKER_LIST = update_tp_attacker_list(TP_ATTACKER_LIST)
+        if block_event.block_number % BYTECODE_CACHE_PERSIST_INTERVAL_BLOCKS == 0:
+            logger.info(BYTECODE_CACHE.stats())
+            BYTECODE_CACHE.save()
         return findings
         
     return handle_block
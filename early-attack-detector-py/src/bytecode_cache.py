@@ -0,0 +1,172 @@
+import hashlib
+import os
+import pickle
+import sys
+from collections import OrderedDict
+
+from web3 import Web3
+
+from src.logger import logger
+
+CREATOR_PLACEHOLDER = "<creator>"  # not hex, so it can't collide with bytecode
+ENTRY_OVERHEAD_BYTES = 600  # dict, sets and key of an entry, on top of the strings it holds
+
+
+def file_digest(path: str) -> str:
+    """
+    this function returns the sha256 of the content of the file, so a model replaced under the same path is told apart
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BytecodeCache:
+    """
+    cache of the analysis of creation bytecodes across transactions, keyed by the keccak of the creation bytecode
+    the creator address is masked in the key, so factories deploying the same init code with their own address embedded share an entry
+    entries hold the model feature string, the contract addresses referenced by the opcodes, the function signatures and the model score;
+    the least recently used entries are evicted once their estimated size exceeds max_bytes
+    the cache can be persisted to a local file; scores are dropped on load if the models changed, the features are kept so only the models run again
+    """
+
+    def __init__(self, max_bytes: int, models: tuple, path: str = None):
+        self.max_bytes = max_bytes
+        self.models = models
+        self.path = path
+        self.entries = OrderedDict()  # key -> entry
+        self.size = 0  # estimated size of the entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if path is not None:
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @staticmethod
+    def _creator_hex(creator: str) -> str:
+        return creator[2:].lower() if creator else None
+
+    @staticmethod
+    def keys(code: str, creator: str) -> tuple:
+        """
+        this function returns the key of the bytecode with the creator masked, and the key of the bytecode as is
+        """
+        code = code.lower()
+        creator_hex = BytecodeCache._creator_hex(creator)
+        key = Web3.keccak(text=code)
+        if creator_hex is None or creator_hex not in code:
+            return key, key
+        return Web3.keccak(text=code.replace(creator_hex, CREATOR_PLACEHOLDER)), key
+
+    @staticmethod
+    def _entry_size(entry: dict) -> int:
+        return (ENTRY_OVERHEAD_BYTES + sys.getsizeof(entry["features"])
+                + sum(sys.getsizeof(s) for s in entry["opcode_addresses"])
+                + sum(sys.getsizeof(s) for s in entry["function_signatures"]))
+
+    def get(self, code: str, creator: str) -> dict:
+        """
+        this function returns the cached analysis of the creation bytecode (features, opcode_addresses, function_signatures, model_score, creator_in_code), None on a miss
+        the opcode addresses exclude the creator; creator_in_code tells whether the creator should be checked as an opcode address
+        """
+        for key in dict.fromkeys(self.keys(code, creator)):
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+        self.misses += 1
+        return None
+
+    @staticmethod
+    def opcode_addresses(entry: dict, creator: str, is_contract) -> set:
+        """
+        this function returns the opcode addresses of a cached entry for the creator
+        the creator was masked in the cached bytecode, it is one of the opcode addresses if it is a contract;
+        is_contract(address) is only called in that case, to avoid an rpc call for most bytecodes
+        """
+        opcode_addresses = set(entry["opcode_addresses"])
+        if entry["creator_in_code"] and is_contract(creator):
+            opcode_addresses.add(Web3.toChecksumAddress(creator))
+        return opcode_addresses
+
+    def put(self, code: str, creator: str, features: str, opcode_addresses: set, function_signatures: set, model_score: float) -> None:
+        masked_key, key = self.keys(code, creator)
+        creator_hex = self._creator_hex(creator)
+        creator_in_code = masked_key != key
+        # if the creator is part of the features (e.g. in a PUSH32 operand), bytecodes of other creators have other features
+        if creator_in_code and creator_hex in features:
+            masked_key = key
+        creator_address = Web3.toChecksumAddress(creator) if creator_in_code else None
+        entry = {
+            "features": features,
+            "opcode_addresses": frozenset(address for address in opcode_addresses if address != creator_address),
+            "function_signatures": frozenset(function_signatures),
+            "model_score": model_score,
+            "creator_in_code": creator_in_code,
+        }
+        self._put(masked_key, entry)
+
+    def set_score(self, code: str, creator: str, model_score: float) -> None:
+        """
+        this function stores the score of an entry whose score was dropped when the models changed
+        """
+        for key in dict.fromkeys(self.keys(code, creator)):
+            if key in self.entries:
+                self.entries[key]["model_score"] = model_score
+
+    def _put(self, key, entry: dict) -> None:
+        if key in self.entries:
+            self.size -= self.entries[key]["size"]
+        entry["size"] = self._entry_size(entry)
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        self.size += entry["size"]
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= evicted["size"]
+            self.evictions += 1
+
+    def stats(self) -> str:
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups > 0 else 0.0
+        return (f"Bytecode cache: {len(self.entries)} bytecodes, ~{self.size // 1024}KB, hit rate {hit_rate:.2%} "
+                f"({self.hits} hits, {self.misses} misses), {self.evictions} evictions")
+
+    def save(self) -> None:
+        """
+        this function writes the entries to path; the file is replaced atomically, so a crash while writing leaves the previous file intact
+        """
+        if self.path is None:
+            return
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump({"models": self.models, "entries": list(self.entries.items())}, f)
+            os.replace(tmp_path, self.path)
+            logger.info(f"Saved bytecode cache of {len(self.entries)} bytecodes to {self.path}")
+        except Exception as e:
+            logger.warn(f"Could not save bytecode cache {self.path}: {e}")
+
+    def load(self) -> None:
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "rb") as f:
+                persisted = pickle.load(f)
+        except Exception as e:
+            logger.warn(f"Could not load bytecode cache {self.path}: {e}")
+            return
+
+        models_changed = tuple(persisted["models"]) != tuple(self.models)
+        for key, entry in persisted["entries"]:
+            if models_changed:
+                entry["model_score"] = None
+            self._put(key, entry)
+        logger.info(f"Loaded bytecode cache of {len(self.entries)} bytecodes from {self.path}" +
+                    (" (models changed, the scores will be computed again)" if models_changed else ""))
@@ -0,0 +1,137 @@
+from web3 import Web3
+
+from src.bytecode_cache import BytecodeCache, file_digest
+
+CREATOR = "0x" + "ab" * 20
+OTHER_CREATOR = "0x" + "cd" * 20
+REFERENCED = Web3.toChecksumAddress("0x" + "12" * 20)
+MODELS = ("model", "high_precision_model", 0.98)
+
+
+def factory_code(creator: str) -> str:
+    # init code embedding the address of its creator, as deployed by factories
+    return "0x6080604052" + "73" + creator[2:] + "5b600080fd"
+
+
+def put(cache: BytecodeCache, code: str, creator: str, features: str = "PUSH1 MSTORE", model_score: float = 0.7) -> None:
+    cache.put(code, creator, features, {REFERENCED, Web3.toChecksumAddress(creator)}, {"transfer(address,uint256)"}, model_score)
+
+
+class TestBytecodeCache:
+
+    def test_keys(self):
+        masked_key, key = BytecodeCache.keys(factory_code(CREATOR), CREATOR)
+        assert masked_key != key, "the creator should be masked in the key"
+        assert BytecodeCache.keys(factory_code(OTHER_CREATOR), OTHER_CREATOR)[0] == masked_key
+        assert BytecodeCache.keys(factory_code(CREATOR).upper().replace("0X", "0x"), CREATOR.upper().replace("0X", "0x"))[0] == masked_key
+
+        code = "0x6080604052600080fd"
+        assert BytecodeCache.keys(code, CREATOR) == (Web3.keccak(text=code), Web3.keccak(text=code))
+        assert BytecodeCache.keys(code, None) == (Web3.keccak(text=code), Web3.keccak(text=code))
+
+    def test_shared_across_creators(self):
+        cache = BytecodeCache(1 << 20, MODELS)
+        put(cache, factory_code(CREATOR), CREATOR)
+
+        entry = cache.get(factory_code(OTHER_CREATOR), OTHER_CREATOR)
+        assert entry is not None, "the same init code of another creator should hit the masked entry"
+        assert entry["creator_in_code"]
+        assert entry["opcode_addresses"] == {REFERENCED}, "the creator should not be cached as an opcode address"
+        assert entry["model_score"] == 0.7
+        assert (cache.hits, cache.misses) == (1, 0)
+
+        assert cache.get("0x6080604052600080fd", CREATOR) is None
+        assert cache.misses == 1
+
+    def test_creator_in_features_not_shared(self):
+        cache = BytecodeCache(1 << 20, MODELS)
+        put(cache, factory_code(CREATOR), CREATOR, features=f"PUSH20 {CREATOR[2:]} MSTORE")
+
+        assert cache.get(factory_code(OTHER_CREATOR), OTHER_CREATOR) is None, \
+            "features holding the creator should only be reused for the same creator"
+        assert cache.get(factory_code(CREATOR), CREATOR) is not None
+
+    def test_opcode_addresses_readd_creator(self):
+        cache = BytecodeCache(1 << 20, MODELS)
+        put(cache, factory_code(CREATOR), CREATOR)
+        entry = cache.get(factory_code(OTHER_CREATOR), OTHER_CREATOR)
+
+        checked = []
+
+        def is_contract(address):
+            checked.append(address)
+            return True
+
+        assert BytecodeCache.opcode_addresses(entry, OTHER_CREATOR, is_contract) == {REFERENCED, Web3.toChecksumAddress(OTHER_CREATOR)}
+        assert checked == [OTHER_CREATOR]
+        assert BytecodeCache.opcode_addresses(entry, OTHER_CREATOR, lambda address: False) == {REFERENCED}, \
+            "an EOA creator is not an opcode address"
+
+        code = "0x6080604052600080fd"
+        put(cache, code, CREATOR)
+        checked = []
+        assert BytecodeCache.opcode_addresses(cache.get(code, OTHER_CREATOR), OTHER_CREATOR, is_contract) == \
+            {REFERENCED, Web3.toChecksumAddress(CREATOR)}
+        assert checked == [], "the creator should only be checked when it was masked"
+
+    def test_eviction(self):
+        cache = BytecodeCache(1 << 20, MODELS)
+        put(cache, "0x00", CREATOR)
+        entry_size = cache.size
+        cache = BytecodeCache(entry_size * 3, MODELS)
+        for i in range(3):
+            put(cache, f"0x0{i}", CREATOR)
+        assert len(cache) == 3
+
+        assert cache.get("0x00", CREATOR) is not None  # 0x01 is now the least recently used
+        put(cache, "0x03", CREATOR)
+        assert len(cache) == 3
+        assert cache.evictions == 1
+        assert cache.size <= cache.max_bytes
+        assert cache.get("0x01", CREATOR) is None
+        assert all(cache.get(code, CREATOR) is not None for code in ["0x00", "0x02", "0x03"])
+
+        put(cache, "0x04", CREATOR, features="PUSH1 " * 10000)
+        assert len(cache) == 1, "an entry larger than the cache should still be kept"
+        assert cache.get("0x04", CREATOR) is not None
+
+    def test_persisted(self, tmp_path):
+        path = str(tmp_path / "bytecode_cache.pkl")
+        cache = BytecodeCache(1 << 20, MODELS, path)
+        put(cache, factory_code(CREATOR), CREATOR)
+        put(cache, "0x00", CREATOR, model_score=0.2)
+        cache.save()
+
+        loaded = BytecodeCache(1 << 20, MODELS, path)
+        assert len(loaded) == 2
+        assert loaded.size == cache.size
+        assert loaded.get(factory_code(OTHER_CREATOR), OTHER_CREATOR)["model_score"] == 0.7
+        assert loaded.get("0x00", CREATOR)["model_score"] == 0.2
+
+    def test_scores_invalidated_on_load(self, tmp_path):
+        path = str(tmp_path / "bytecode_cache.pkl")
+        cache = BytecodeCache(1 << 20, MODELS, path)
+        put(cache, factory_code(CREATOR), CREATOR)
+        cache.save()
+
+        loaded = BytecodeCache(1 << 20, ("retrained_model", "high_precision_model", 0.98), path)
+        entry = loaded.get(factory_code(CREATOR), CREATOR)
+        assert entry["model_score"] is None, "the scores of other models should be dropped"
+        assert entry["features"] == "PUSH1 MSTORE", "the features should be kept"
+
+        loaded.set_score(factory_code(OTHER_CREATOR), OTHER_CREATOR, 0.9)
+        assert loaded.get(factory_code(CREATOR), CREATOR)["model_score"] == 0.9
+
+    def test_file_digest(self, tmp_path):
+        model = tmp_path / "model.joblib"
+        model.write_bytes(b"model")
+        digest = file_digest(str(model))
+        assert file_digest(str(model)) == digest
+        model.write_bytes(b"retrained model")
+        assert file_digest(str(model)) != digest, "a model replaced under the same path should have another digest"
+
+    def test_missing_or_corrupt_file(self, tmp_path):
+        path = tmp_path / "bytecode_cache.pkl"
+        assert len(BytecodeCache(1 << 20, MODELS, str(path))) == 0
+        path.write_bytes(b"not a pickle")
+        assert len(BytecodeCache(1 << 20, MODELS, str(path))) == 0
@@ -39,4 +39,7 @@ ETH_BLOCK_TIME = 12
 ETH_BLOCKS_IN_ONE_DAY = ONE_DAY / ETH_BLOCK_TIME
 # Amount of blocks in a day for faster chains
 # Using 3 second block times as the average
-THREE_SECOND_BLOCKS_IN_ONE_DAY = ONE_DAY / THREE_SECOND_BLOCK_TIME
\ No newline at end of file
+THREE_SECOND_BLOCKS_IN_ONE_DAY = ONE_DAY / THREE_SECOND_BLOCK_TIME
+BYTECODE_CACHE_MAX_BYTES = 64 * 1024 * 1024  # memory bound of the features, addresses and scores cached per creation bytecode
+BYTECODE_CACHE_PATH = None  # set to a local file (e.g. 'bytecode_cache.pkl') to persist the bytecode cache across restarts
+BYTECODE_CACHE_PERSIST_INTERVAL_BLOCKS = 300  # how often the bytecode cache stats are logged and the cache is persisted
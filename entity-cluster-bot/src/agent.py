@@ -7,7 +7,6 @@ import forta_agent
 import networkx as nx
 import rlp
 from forta_agent import Finding, FindingSeverity, FindingType, get_json_rpc_url
-from hexbytes import HexBytes
 from web3 import Web3
 from bot_alert_rate import calculate_alert_rate, ScanCountType
 import cProfile
@@ -20,10 +19,14 @@ load_dotenv()
 try:
     from src.constants import MAX_AGE_IN_DAYS, MAX_NONCE, GRAPH_KEY, ONE_WAY_WEI_TRANSFER_THRESHOLD, NEW_FUNDED_MAX_WEI_TRANSFER_THRESHOLD, NEW_FUNDED_MAX_NONCE, TX_SAVE_STEP, HTTP_RPC_TIMEOUT, PROFILING, BOT_ID, PROD_TAG
     from src.persistance import DynamoPersistance
+    from src.expiry_index import ExpiryIndex
+    from src.rpc_cache import ChainStateCache
     from src.storage import get_secrets
 except ModuleNotFoundError:
     from constants import MAX_AGE_IN_DAYS, MAX_NONCE, GRAPH_KEY, ONE_WAY_WEI_TRANSFER_THRESHOLD, NEW_FUNDED_MAX_WEI_TRANSFER_THRESHOLD, NEW_FUNDED_MAX_NONCE, TX_SAVE_STEP, HTTP_RPC_TIMEOUT, PROFILING, BOT_ID, PROD_TAG
     from persistance import DynamoPersistance
+    from expiry_index import ExpiryIndex
+    from rpc_cache import ChainStateCache
     from storage import get_secrets
 
 
@@ -54,10 +57,12 @@ handler.addFilter(ContextFilter())
 class EntityClusterAgent:
 
     GRAPH = nx.DiGraph()
+    DELTA = nx.DiGraph()  # nodes and edges added/updated since the last persist
+    expiry_index: ExpiryIndex = None  # last_seen of the nodes of GRAPH
     persistance: DynamoPersistance = None
     tx_counter = 0
     tx_save_step = 1
-    contract_cache =[]
+    chain_state: ChainStateCache = None  # code and nonce lookups
     previous_shared_graphs = []
     chain_id = None
 
@@ -76,6 +81,9 @@ class EntityClusterAgent:
         logging.info(f"Run initialize chain: {self.chain_id}")
         self.tx_save_step = tx_save_step
         self.GRAPH = nx.DiGraph()
+        self.DELTA = nx.DiGraph()
+        self.expiry_index = ExpiryIndex()
+        self.chain_state = ChainStateCache()
         environ["ZETTABLOCK_API_KEY"] = ZETTABLOCK_KEY
 
 
@@ -97,8 +105,11 @@ class EntityClusterAgent:
         else:
             self.GRAPH.add_node(checksum_address, last_seen=datetime.now())
             logging.info(f"Added address {checksum_address} to graph. Graph size is now {len(self.GRAPH.nodes)}")
+        self.expiry_index.touch(checksum_address, self.GRAPH.nodes[checksum_address]["last_seen"])
+        self.DELTA.add_node(checksum_address, **self.GRAPH.nodes[checksum_address])
+        self.persistance.cache_node(checksum_address, **self.GRAPH.nodes[checksum_address])
 
-    def is_address_below_max_transactions(self, w3, address):
+    def is_address_below_max_transactions(self, w3, address, block_number=None):
         if address is None:
             return False
 
@@ -106,22 +117,24 @@ class EntityClusterAgent:
             return False
 
         checksum_address = Web3.toChecksumAddress(address)
-        return w3.eth.get_transaction_count(checksum_address) <= MAX_NONCE
+        return self.chain_state.get_transaction_count(w3, checksum_address, block_number) <= MAX_NONCE
 
     def prune_graph(a_graph):
-        #  looks at each node in the graph and assesses how old it is
+        #  looks at each node in the graph and assesses how old it is; used for graphs without an expiry index (e.g. the compacted snapshot)
         #  if its older than MAX_AGE_IN_DAYS, it will be removed from the graph
         #  note, if the nonce is larger than MAX_NONCE, it will not be removed from the graph
         #  as the nonce is only assessed when the node is created
 
         nodes_to_remove = set()
+        now = datetime.now()
         for node in a_graph.nodes:
-            if datetime.now() - a_graph.nodes[node]["last_seen"] > timedelta(days=MAX_AGE_IN_DAYS):
+            if now - a_graph.nodes[node]["last_seen"] > timedelta(days=MAX_AGE_IN_DAYS):
                 nodes_to_remove.add(node)
 
         for node in nodes_to_remove:
             a_graph.remove_node(node)
             logging.info(f"Removed address {node} from graph. Graph size is now {len(a_graph.nodes)}")
+        return nodes_to_remove
 
 
     def add_directed_edge(self, w3, from_, to):
@@ -131,6 +144,10 @@ class EntityClusterAgent:
 
         if Web3.toChecksumAddress(from_) in self.GRAPH.nodes and Web3.toChecksumAddress(to) in self.GRAPH.nodes:
             self.GRAPH.add_edges_from([(Web3.toChecksumAddress(from_), Web3.toChecksumAddress(to))])
+            for address in [Web3.toChecksumAddress(from_), Web3.toChecksumAddress(to)]:
+                self.DELTA.add_node(address, **self.GRAPH.nodes[address])
+            self.DELTA.add_edges_from([(Web3.toChecksumAddress(from_), Web3.toChecksumAddress(to))])
+            self.persistance.cache_edge(Web3.toChecksumAddress(from_), Web3.toChecksumAddress(to))
             logging.info(f"Added edge from address {from_} to {to}.")
 
 
@@ -144,7 +161,7 @@ class EntityClusterAgent:
         return Web3.toChecksumAddress(Web3.keccak(rlp.encode([address_bytes, nonce]))[-20:]).lower()
 
 
-    def is_contract(self, w3, address) -> bool:
+    def is_contract(self, w3, address, block_number=None) -> bool:
         """
         this function determines whether address is a contract
         :return: is_contract: bool
@@ -152,34 +169,32 @@ class EntityClusterAgent:
         if address is None:
             return True
 
-        checksum_address = Web3.toChecksumAddress(address)
-        if checksum_address in self.contract_cache:
-            logging.info(f"Using cache for is contract for contract {checksum_address}")
-            return True
-        code = w3.eth.get_code(checksum_address)
-        if code != HexBytes('0x'):
-            self.contract_cache.append(checksum_address)
-            if len(self.contract_cache) > 10000:
-                self.contract_cache.pop(0)
-            return True
-        else:
-            return False
+        return self.chain_state.is_contract(w3, address, block_number)
 
 
     def cluster_entities(self, w3, transaction_event) -> list:
         findings = []
         if (transaction_event.transaction.to is None) or (transaction_event.transaction.value > 0) or (transaction_event.filter_log(ERC20_TRANSFER_EVENT)):
 
-            EntityClusterAgent.prune_graph(self.GRAPH)
+            self.expiry_index.prune(self.GRAPH)
+
+            # resolve the code and nonces of all addresses of the transaction in one batch; the checks below are served from the cache
+            block_number = transaction_event.block.number
+            transfer_events = transaction_event.filter_log(ERC20_TRANSFER_EVENT)
+            addresses = [transaction_event.transaction.from_, transaction_event.transaction.to]
+            for transfer_event in transfer_events:
+                if transfer_event['args']['value'] > 0:
+                    addresses.extend([transfer_event['args']['from'], transfer_event['args']['to']])
+            self.chain_state.prefetch(w3, addresses, block_number)
 
             #  add edges for each native transfer, treated as bidirectional if sender and recipient nonces are less than or equal to NEW_FUNDED_MAX_NONCE _OR_ if large native transfer
             if transaction_event.transaction.value > 0:
-                if not self.is_contract(w3, transaction_event.transaction.to) and not self.is_contract(w3, transaction_event.transaction.from_):
-                        if self.is_address_below_max_transactions(w3, transaction_event.transaction.from_) and self.is_address_below_max_transactions(w3, transaction_event.transaction.to):
+                if not self.is_contract(w3, transaction_event.transaction.to, block_number) and not self.is_contract(w3, transaction_event.transaction.from_, block_number):
+                        if self.is_address_below_max_transactions(w3, transaction_event.transaction.from_, block_number) and self.is_address_below_max_transactions(w3, transaction_event.transaction.to, block_number):
                             self.add_address(transaction_event.transaction.from_)
                             self.add_address(transaction_event.transaction.to)
                             self.add_directed_edge(w3, transaction_event.transaction.from_, transaction_event.transaction.to)
-                            if (w3.eth.get_transaction_count(Web3.toChecksumAddress(transaction_event.transaction.from_), transaction_event.block.number) <= NEW_FUNDED_MAX_NONCE and w3.eth.get_transaction_count(Web3.toChecksumAddress(transaction_event.transaction.to), transaction_event.block.number) <= NEW_FUNDED_MAX_NONCE) or transaction_event.transaction.value > ONE_WAY_WEI_TRANSFER_THRESHOLD:
+                            if (self.chain_state.get_transaction_count(w3, transaction_event.transaction.from_, block_number) <= NEW_FUNDED_MAX_NONCE and self.chain_state.get_transaction_count(w3, transaction_event.transaction.to, block_number) <= NEW_FUNDED_MAX_NONCE) or transaction_event.transaction.value > ONE_WAY_WEI_TRANSFER_THRESHOLD:
                                 self.add_directed_edge(w3, transaction_event.transaction.to, transaction_event.transaction.from_)
                                 if transaction_event.transaction.value < NEW_FUNDED_MAX_WEI_TRANSFER_THRESHOLD:
                                     logging.info(f"Observing small native transfer of value {transaction_event.transaction.value} from new EOA {transaction_event.transaction.from_} to new EOA {transaction_event.transaction.to}")
@@ -197,15 +212,14 @@ class EntityClusterAgent:
                                 findings.append(finding)
 
             #  add edges for ERC20 transfers
-            transfer_events = transaction_event.filter_log(ERC20_TRANSFER_EVENT)
             for transfer_event in transfer_events:
                 # extract transfer event arguments
                 if transfer_event['args']['value'] > 0:
                     erc20_from = transfer_event['args']['from']
                     erc20_to = transfer_event['args']['to']
                     logging.info(f"Observing ERC-20 transfer of value {transfer_event['args']['value']} from {erc20_from} to {erc20_to}")
-                    if not self.is_contract(w3, erc20_to) and not self.is_contract(w3, erc20_from):
-                        if self.is_address_below_max_transactions(w3, erc20_to) and self.is_address_below_max_transactions(w3, erc20_from):
+                    if not self.is_contract(w3, erc20_to, block_number) and not self.is_contract(w3, erc20_from, block_number):
+                        if self.is_address_below_max_transactions(w3, erc20_to, block_number) and self.is_address_below_max_transactions(w3, erc20_from, block_number):
                             self.add_address(erc20_from)
                             self.add_address(erc20_to)
                             self.add_directed_edge(w3, erc20_from, erc20_to)
@@ -217,7 +231,7 @@ class EntityClusterAgent:
             if transaction_event.transaction.to is None:
                 contract_address = self.calc_contract_address(transaction_event.transaction.from_, transaction_event.transaction.nonce)
                 logging.info(f"Observing contract creation from {transaction_event.transaction.from_}: {contract_address}")
-                if self.is_address_below_max_transactions(w3, transaction_event.transaction.from_):
+                if self.is_address_below_max_transactions(w3, transaction_event.transaction.from_, block_number):
                     self.add_address(transaction_event.transaction.from_)
                     self.add_address(contract_address)
                     self.add_directed_edge(w3, transaction_event.transaction.from_, contract_address)
@@ -245,38 +259,21 @@ class EntityClusterAgent:
 
     def create_finding(self, from_, message) -> Finding:
         shared_graph = self.persistance.graph_cache
-        # Add all nodes and all edges to the shared cached graph to have a updated graph with the delta + shared
-        shared_graph.update(self.GRAPH)
-        filtered_graph = nx.subgraph_view(shared_graph, filter_edge=EntityClusterAgent.filter_edge(shared_graph))
         checksum_addr = Web3.toChecksumAddress(from_)
 
-        ############################################
-        # Uncomment to view graph in cytoscape viewer
-        ##########################################
-        # ego_g = nx.ego_graph(filtered_graph, Web3.toChecksumAddress("0xc7081c60da6eb75e6f2a4a55c33580f0fee8d7da"), 100)
-        # c=0
-        # for node in ego_g:
-        #     ego_g.nodes[node]['last_seen'] = str(ego_g.nodes[node]['last_seen'])
-        #     c=c+1
-        # print(f"graph n {c}")
-        # nx.write_graphml(ego_g, f"cytoscape.xml")
-
-
-        # uses ego graph where the from address is the ego node and look for all his alters up to level 100
-        # https://networkx.org/documentation/stable/auto_examples/drawing/plot_ego_graph.html
-
-
-        ego_g = nx.ego_graph(filtered_graph, Web3.toChecksumAddress(checksum_addr), 100)
-        nodes = list(ego_g.nodes)
+        # the entity of the from address is the connected component over bidirectional edges that contains it
+        # the cluster index of the shared graph (which includes the local changes) maintains these incrementally
+        nodes = self.persistance.cluster_index.cluster(checksum_addr)
         n_nodes = len(nodes)
 
         diagram = "Too big or small for a diagram"
         if 8 <= n_nodes and n_nodes <= 16:
             try:
-                ego_for_json = ego_g.copy()
-                for n in ego_for_json:
-                    ego_for_json.nodes[n]["name"] = n
-                    ego_for_json.nodes[n]['last_seen'] = str(ego_for_json.nodes[n]['last_seen'])
+                ego_for_json = nx.DiGraph()
+                for n in nodes:
+                    ego_for_json.add_node(n, name=n, last_seen=str(shared_graph.nodes[n]['last_seen']))
+                for n in nodes:
+                    ego_for_json.add_edges_from((n, neighbor) for neighbor in self.persistance.cluster_index.neighbors[n])
                 link_data = nx.json_graph.node_link_data(ego_for_json)
                 diagram = base64.b64encode(json.dumps(link_data).encode()).decode()
             except Exception as e:
@@ -335,7 +332,18 @@ class EntityClusterAgent:
         return self.provide_handle_transaction(web3, transaction_event)
 
     def persist_state(self):
-        self.persistance.persist(self.GRAPH, GRAPH_KEY, EntityClusterAgent.prune_graph)
+        # only the changes since the last persist are written; if persisting fails, they are retained and written with the next delta
+        if self.persistance.persist(self.DELTA, GRAPH_KEY, EntityClusterAgent.prune_graph):
+            self.DELTA = nx.DiGraph()
+        logging.info(f"Pruning stats: {json.dumps(self.pruning_stats())}")
+        logging.info(f"Code/nonce lookup stats: {json.dumps(self.chain_state.stats())}")
+        logging.info(f"Compaction lease stats: {json.dumps(self.persistance.lease.stats())}")
+
+    def pruning_stats(self) -> dict:
+        return {
+            "graph": self.expiry_index.stats(),
+            "shared_graph": self.persistance.expiry_index.stats(),
+        }
 
 entity_cluster_agent =  EntityClusterAgent(DynamoPersistance(PROD_TAG, web3.eth.chain_id), TX_SAVE_STEP, web3.eth.chain_id)
 def handle_transaction(transaction_event: forta_agent.transaction_event.TransactionEvent) -> list:
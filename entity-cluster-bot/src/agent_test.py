@@ -6,7 +6,8 @@ import networkx as nx
 
 from web3 import Web3
 from web3_mock import CONTRACT, EOA_ADDRESS_LARGE_TX, EOA_ADDRESS_NEW, EOA_ADDRESS_OLD, EOA_ADDRESS_SMALL_TX, EOA_ADDRESS_FUNDED_NEW, EOA_ADDRESS_FUNDED_OLD, EOA_ADDRESS_FUNDER_NEW, EOA_ADDRESS_FUNDER_OLD, Web3Mock
-from constants import ALERTED_ADDRESSES_KEY, GRAPH_KEY
+from constants import ALERTED_ADDRESSES_KEY, GRAPH_KEY, DYNAMO_TABLE, DYNAMO_REGION
+from dyndbmutex import DynamoDbLease
 from forta_agent import get_alerts, get_json_rpc_url
 import timeit
 
@@ -40,6 +41,20 @@ class TestEntityClusterBot:
 
         assert len(entity_cluster_agent.GRAPH.nodes) == 1, "Old address was not removed from graph"
 
+    def test_prune_graph_expiry_index(self):
+        #  the expiry index is updated by add_address, so pruning only needs to look at the expired addresses
+        entity_cluster_agent = EntityClusterAgent(DynamoPersistance())
+
+        entity_cluster_agent.add_address(EOA_ADDRESS_NEW)
+        entity_cluster_agent.add_address(EOA_ADDRESS_OLD)
+
+        entity_cluster_agent.expiry_index.prune(entity_cluster_agent.GRAPH, datetime.now() + timedelta(days=6))
+        assert len(entity_cluster_agent.GRAPH.nodes) == 2, "No address should have been removed from graph"
+
+        entity_cluster_agent.expiry_index.prune(entity_cluster_agent.GRAPH, datetime.now() + timedelta(days=8))
+        assert len(entity_cluster_agent.GRAPH.nodes) == 0, "Old addresses were not removed from graph"
+        assert entity_cluster_agent.pruning_stats()["graph"]["pruned_nodes"] == 2
+
     def test_add_address_discard(self):
         #  calls address on address with too large of a nonce
         agent = EntityClusterAgent(DynamoPersistance())
@@ -68,6 +83,50 @@ class TestEntityClusterBot:
 
         assert len(agent.GRAPH.nodes) == 2, "Addresses should have been added to graph. Its nonce is within range"
 
+    def test_persist_delta_log(self):
+        TestEntityClusterBot.remove_persistent_state()
+        agent1 = EntityClusterAgent(DynamoPersistance())
+        agent1.add_address(EOA_ADDRESS_NEW)
+        agent1.add_address(EOA_ADDRESS_OLD)
+        agent1.add_directed_edge(w3, EOA_ADDRESS_NEW, EOA_ADDRESS_OLD)
+        agent1.persist_state()
+        assert len(agent1.DELTA.nodes) == 0, "Delta should have been reset once persisted"
+
+        agent2 = EntityClusterAgent(DynamoPersistance())
+        assert agent2.persistance.graph_cache.has_edge(EOA_ADDRESS_NEW, EOA_ADDRESS_OLD), "Delta of agent1 should have been loaded"
+        agent2.add_address(EOA_ADDRESS_NEW)
+        agent2.add_address(EOA_ADDRESS_OLD)
+        agent2.add_directed_edge(w3, EOA_ADDRESS_OLD, EOA_ADDRESS_NEW)
+        agent2.persist_state()
+
+        agent1.persist_state()
+        assert agent1.persistance.graph_cache.has_edge(EOA_ADDRESS_OLD, EOA_ADDRESS_NEW), "Delta of agent2 should have been applied on persist"
+
+        assert agent1.persistance.compact(GRAPH_KEY, EntityClusterAgent.prune_graph), "Compaction should have run"
+        agent3 = EntityClusterAgent(DynamoPersistance())
+        assert agent3.persistance.graph_cache.has_edge(EOA_ADDRESS_NEW, EOA_ADDRESS_OLD) and agent3.persistance.graph_cache.has_edge(EOA_ADDRESS_OLD, EOA_ADDRESS_NEW), "Snapshot and deltas should have been loaded"
+
+
+    def test_compaction_lease(self):
+        TestEntityClusterBot.remove_persistent_state()
+        persistance1 = DynamoPersistance()
+        persistance2 = DynamoPersistance()
+
+        assert persistance1.compact(GRAPH_KEY, EntityClusterAgent.prune_graph), "Compaction should have run"
+        assert not persistance2.compact(GRAPH_KEY, EntityClusterAgent.prune_graph), "Compaction should have been skipped as persistance1 holds the lease"
+        assert persistance1.lease.acquire(), "Lease should have been renewed"
+        assert persistance1.lease.stats()["acquisitions"] == 1 and persistance1.lease.stats()["renewals"] == 1
+
+        lease1 = DynamoDbLease("lease|test", DYNAMO_TABLE, "holder1", duration_seconds=1, region_name=DYNAMO_REGION)
+        lease2 = DynamoDbLease("lease|test", DYNAMO_TABLE, "holder2", duration_seconds=1, region_name=DYNAMO_REGION)
+        lease1.clear()
+        assert lease1.acquire()
+        assert not lease2.acquire(), "Lease shouldnt be taken over before it expired"
+        time.sleep(1.5)
+        assert lease2.acquire(), "Lease should be taken over once it expired"
+        assert lease2.stats()["handoffs"] == 1
+        lease2.release()
+        lease1.clear()
 
     def test_add_directed_edges_without_add(self):
         agent = EntityClusterAgent(DynamoPersistance())
@@ -0,0 +1,108 @@
+class ClusterIndex:
+    """
+    incremental index of the entities (connected components over bidirectional edges) of the graph
+    bidirectional edges are detected when an edge is added and its endpoints are unioned (union by size with path halving), so looking up an entity is O(α(n)) plus the size of the entity
+    removing nodes rebuilds only the entities that contained them from their remaining bidirectional edges
+    """
+
+    def __init__(self):
+        self.parent = dict()  # node -> parent node; roots are their own parent
+        self.members = dict()  # root -> list of nodes of the entity
+        self.successors = dict()  # node -> set of nodes it has an edge to
+        self.predecessors = dict()  # node -> set of nodes that have an edge to it
+        self.neighbors = dict()  # node -> set of nodes it has edges in both directions with
+
+    @staticmethod
+    def from_graph(graph) -> 'ClusterIndex':
+        index = ClusterIndex()
+        index.update(graph)
+        return index
+
+    def __len__(self) -> int:
+        return len(self.parent)
+
+    def __contains__(self, node) -> bool:
+        return node in self.parent
+
+    def add_node(self, node):
+        if node not in self.parent:
+            self.parent[node] = node
+            self.members[node] = [node]
+            self.successors[node] = set()
+            self.predecessors[node] = set()
+            self.neighbors[node] = set()
+
+    def add_edge(self, from_, to):
+        self.add_node(from_)
+        self.add_node(to)
+        if to in self.successors[from_]:
+            return
+        self.successors[from_].add(to)
+        self.predecessors[to].add(from_)
+        if from_ in self.successors[to] and from_ != to:
+            self.neighbors[from_].add(to)
+            self.neighbors[to].add(from_)
+            self._union(from_, to)
+
+    def update(self, graph):
+        """
+        adds the nodes and edges of the (networkx) graph
+        """
+        for node in graph.nodes:
+            self.add_node(node)
+        for from_, to in graph.edges:
+            self.add_edge(from_, to)
+
+    def find(self, node):
+        parent = self.parent
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    def _union(self, a, b):
+        root_a = self.find(a)
+        root_b = self.find(b)
+        if root_a == root_b:
+            return
+        if len(self.members[root_a]) < len(self.members[root_b]):
+            root_a, root_b = root_b, root_a
+        self.parent[root_b] = root_a
+        self.members[root_a].extend(self.members.pop(root_b))
+
+    def cluster(self, node) -> list:
+        """
+        returns the nodes of the entity of the node; empty if the node isnt in the index
+        """
+        if node not in self.parent:
+            return []
+        return list(self.members[self.find(node)])
+
+    def remove_nodes(self, nodes):
+        """
+        removes the nodes and their edges; the entities that contained them are rebuilt from the bidirectional edges of their remaining nodes
+        """
+        nodes = set(node for node in nodes if node in self.parent)
+        if len(nodes) == 0:
+            return
+
+        roots = set(self.find(node) for node in nodes)
+        for node in nodes:
+            for successor in self.successors.pop(node) - nodes:
+                self.predecessors[successor].discard(node)
+            for predecessor in self.predecessors.pop(node) - nodes:
+                self.successors[predecessor].discard(node)
+            for neighbor in self.neighbors.pop(node) - nodes:
+                self.neighbors[neighbor].discard(node)
+
+        survivors = []
+        for root in roots:
+            survivors.extend(member for member in self.members.pop(root) if member not in nodes)
+        for node in nodes:
+            del self.parent[node]
+        for member in survivors:
+            self.parent[member] = member
+            self.members[member] = [member]
+        for member in survivors:
+            for neighbor in self.neighbors[member]:
+                self._union(member, neighbor)
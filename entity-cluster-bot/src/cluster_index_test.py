@@ -0,0 +1,133 @@
+import os
+import random
+import time
+
+import networkx as nx
+
+from cluster_index import ClusterIndex
+
+BENCHMARK_SIZE = int(os.environ.get("CLUSTER_INDEX_BENCHMARK_SIZE", "100000"))  # set to e.g. 5000000 to benchmark millions of addresses
+
+
+def filter_edge(a_graph):
+    def f(n1, n2):
+        return a_graph.has_edge(n2, n1)
+    return f
+
+
+def networkx_clusters(graph) -> dict:
+    """
+    node -> entity as computed by the agent before the cluster index (connected components of the bidirectional edges)
+    """
+    bidirectional = nx.subgraph_view(graph, filter_edge=filter_edge(graph)).to_undirected()
+    clusters = dict()
+    for component in nx.connected_components(bidirectional):
+        for node in component:
+            clusters[node] = set(component)
+    return clusters
+
+
+def random_graph(n_nodes: int, n_edges: int, seed: int) -> nx.DiGraph:
+    rnd = random.Random(seed)
+    graph = nx.DiGraph()
+    graph.add_nodes_from(range(n_nodes))
+    for _ in range(n_edges):
+        from_, to = rnd.randrange(n_nodes), rnd.randrange(n_nodes)
+        if from_ != to:
+            graph.add_edge(from_, to)
+            if rnd.random() < 0.5:
+                graph.add_edge(to, from_)
+    return graph
+
+
+class TestClusterIndex:
+
+    def test_bidirectional_edges_are_clustered(self):
+        index = ClusterIndex()
+        index.add_edge("a", "b")
+        index.add_edge("b", "c")
+        assert index.cluster("a") == ["a"]
+        index.add_edge("b", "a")
+        assert sorted(index.cluster("a")) == ["a", "b"]
+        assert sorted(index.cluster("b")) == ["a", "b"]
+        assert index.cluster("c") == ["c"], "one way edges shouldnt be clustered"
+
+    def test_unknown_node(self):
+        index = ClusterIndex()
+        assert index.cluster("a") == []
+        assert "a" not in index
+
+    def test_remove_nodes_splits_cluster(self):
+        index = ClusterIndex()
+        for from_, to in [("a", "b"), ("b", "c"), ("c", "d")]:
+            index.add_edge(from_, to)
+            index.add_edge(to, from_)
+        assert sorted(index.cluster("a")) == ["a", "b", "c", "d"]
+
+        index.remove_nodes(["b"])
+        assert "b" not in index
+        assert index.cluster("a") == ["a"]
+        assert sorted(index.cluster("c")) == ["c", "d"]
+        assert len(index) == 3
+
+        index.add_edge("a", "c")
+        assert index.cluster("a") == ["a"]
+        index.add_edge("c", "a")
+        assert sorted(index.cluster("a")) == ["a", "c", "d"]
+
+    def test_self_loop(self):
+        index = ClusterIndex()
+        index.add_edge("a", "a")
+        assert index.cluster("a") == ["a"]
+        index.remove_nodes(["a"])
+        assert len(index) == 0
+
+    def test_remove_unknown_nodes(self):
+        index = ClusterIndex()
+        index.add_edge("a", "b")
+        index.remove_nodes(["c"])
+        assert len(index) == 2
+
+    def test_equivalent_to_networkx(self):
+        for seed in range(5):
+            graph = random_graph(300, 250, seed)
+            index = ClusterIndex.from_graph(graph)
+            expected = networkx_clusters(graph)
+            for node in graph.nodes:
+                assert set(index.cluster(node)) == expected[node]
+
+            removed = random.Random(seed).sample(list(graph.nodes), 50)
+            graph.remove_nodes_from(removed)
+            index.remove_nodes(removed)
+            expected = networkx_clusters(graph)
+            assert len(index) == len(graph.nodes)
+            for node in graph.nodes:
+                assert set(index.cluster(node)) == expected[node]
+
+    def test_benchmark(self):
+        # entities of 2 to 10 addresses connected by bidirectional edges, with one way edges between entities like in the entity cluster graph
+        rnd = random.Random(42)
+        index = ClusterIndex()
+        start = time.time()
+        node = 0
+        while node < BENCHMARK_SIZE:
+            size = rnd.randint(2, 10)
+            for member in range(node + 1, node + size):
+                index.add_edge(node, member)
+                index.add_edge(member, node)
+            index.add_edge(node, rnd.randrange(node + 1))
+            node += size
+        insert_seconds = time.time() - start
+
+        start = time.time()
+        lookups = 100000
+        for _ in range(lookups):
+            index.cluster(rnd.randrange(len(index)))
+        lookup_seconds = time.time() - start
+
+        start = time.time()
+        index.remove_nodes(range(0, len(index), 100))
+        remove_seconds = time.time() - start
+
+        print(f"{len(index)} addresses: insert {insert_seconds:.2f}s, {lookups} lookups {lookup_seconds:.2f}s, remove 1% {remove_seconds:.2f}s")
+        assert lookup_seconds < 10
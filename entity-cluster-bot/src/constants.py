@@ -27,6 +27,18 @@ PROFILING = False
 TX_SAVE_STEP = 150*6
 # Timeout for w3 calls in seconds 
 HTTP_RPC_TIMEOUT = 2
-# timeout of the lock in the mutex db 10s
-MUTEX_TIMEOUT_MILLIS=10*10000
+# duration of the compaction lease; the holder renews it on every persist, so it must be longer than the time between persists
+LEASE_DURATION_SECONDS = 10 * 60
 
+# graph deltas up to this size (compressed) are stored in the dynamo delta log item, larger ones in s3
+DELTA_INLINE_SIZE_LIMIT = 300 * 1024
+# how often an instance tries to compact the delta log into the shared graph snapshot and prunes its cached shared graph
+COMPACTION_INTERVAL_SECONDS = 60 * 60
+# deltas written up to this many seconds before the last one read are read again, so deltas of instances with a lagging clock arent missed
+DELTA_READ_OVERLAP_SECONDS = 60
+
+# granularity of the last_seen buckets of the expiry index; nodes are pruned up to this many seconds after they reached MAX_AGE_IN_DAYS
+EXPIRY_BUCKET_SECONDS = 10 * 60
+# max entries of each code/nonce lookup cache and max requests of a JSON-RPC batch
+RPC_CACHE_SIZE = 100000
+RPC_BATCH_SIZE = 100
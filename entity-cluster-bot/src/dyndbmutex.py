@@ -2,6 +2,7 @@ import logging
 import boto3
 import botocore
 import datetime
+import time
 import uuid
 import os
 from boto3.dynamodb.conditions import Attr
@@ -34,9 +35,6 @@ def setup_logging():
 NO_HOLDER = '__empty__'
 TWO_DAYS_IN_MINUTES = 2*24*60
 
-class AcquireLockFailedError(Exception):
-        pass
-
 
 def timestamp_millis():
     return int((datetime.datetime.utcnow() -
@@ -55,36 +53,6 @@ class MutexTable:
     def get_table(self):
         return self.dbresource.Table(self.table_name)
 
-    def get_lock(self, lockname):
-        return self.get_table().get_item(Key={DYNAMODB_PRIMARY_KEY: PRIMARY, DYNAMODB_SORT_KEY: lockname})
-
-
-    def write_lock_item(self, lockname, caller, waitms):
-        expire_ts = timestamp_millis() + waitms
-        ttl = expire_ts//1000 + self.ttl_minutes*60
-        logger.debug("Write_item: lockname=" + lockname + ", caller=" +
-                     caller + ", Expire time is " + str(expire_ts))
-        try:
-            self.get_table().put_item(
-                Item={
-                    DYNAMODB_PRIMARY_KEY: PRIMARY,
-                    DYNAMODB_SORT_KEY: lockname,
-                    'expire_ts': expire_ts,
-                    'holder': caller,
-                    DYNAMODB_TTL_KEY: ttl
-                },
-                # TODO: adding Attr("holder").eq(caller) should make it re-entrant
-                ConditionExpression=Attr("holder").eq(NO_HOLDER) | Attr(DYNAMODB_PRIMARY_KEY).not_exists()
-            )
-        except botocore.exceptions.ClientError as e:
-            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
-                logger.info("Write_item: lockname=" + lockname +
-                             ", caller=" + caller + ", lock is being held")
-                return False
-        logger.debug("Write_item: lockname=" + lockname +
-                     ", caller=" + caller + ", lock is acquired")
-        return True
-
     def clear_lock_item(self, lockname, caller):
         try:
             self.get_table().put_item(
@@ -104,63 +72,93 @@ class MutexTable:
         logger.debug("clear_lock_item: lockname=" + lockname + ", caller=" + caller + " release succeeded")
         return True
 
-    def prune_expired(self, lockname, caller):
-        now = timestamp_millis()
-        logger.debug("Prune: lockname=" + lockname + ", caller=" + caller +
-                     ", Time now is %s" + str(now))
-        try:
-            self.get_table().put_item(
-                Item={
-                    DYNAMODB_PRIMARY_KEY: PRIMARY,
-                    DYNAMODB_SORT_KEY: lockname,
-                    'expire_ts': 0,
-                    'holder': NO_HOLDER
-                },
-                ConditionExpression=Attr("expire_ts").lt(now) | Attr(DYNAMODB_PRIMARY_KEY).not_exists()
-            )
-        except botocore.exceptions.ClientError as e:
-            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
-                logger.info("Prune: lockname=" + lockname + ", caller=" + caller +
-                             " Prune failed")
-                return False
-        logger.debug("Prune: lockname=" + lockname + ", caller=" + caller + " Prune succeeded")
-        return True
-
-
-class DynamoDbMutex:
+class DynamoDbLease:
+    """
+    lease based leader election: the holder renews the lease before it expires and the other instances can only take it over once it expired
+    acquiring and renewing are a single conditional write, so an instance never waits for the holder
+    """
 
     def __init__(self, name, table_name, holder=None,
-                 timeoutms=10 * 1000, region_name='us-west-2', ttl_minutes=TWO_DAYS_IN_MINUTES):
+                 duration_seconds=10 * 60, region_name='us-west-2', ttl_minutes=TWO_DAYS_IN_MINUTES):
         if holder is None:
             holder = str(uuid.uuid4())
         self.lockname = name
         self.holder = holder
-        self.timeoutms = timeoutms
+        self.duration_ms = duration_seconds * 1000
         self.table = MutexTable(table_name, region_name=region_name, ttl_minutes=ttl_minutes)
-        self.locked = False
-
-    def lock(self):
-        self.table.prune_expired(self.lockname, self.holder)
-        self.locked = self.table.write_lock_item(self.lockname, self.holder, self.timeoutms)
-        logger.info("mutex.lock(): lockname=" + self.lockname + ", locked = " + str(self.locked))
-        return self.locked
+        self.expire_ts = 0  # expiry of the lease held by this instance; 0 if it doesnt hold it
+        self.acquisitions = 0
+        self.renewals = 0
+        self.handoffs = 0  # acquisitions of a lease that expired while held by another instance
+        self.lost = 0  # renewals that failed because another instance took over the lease
+        self.last_lock_wait_seconds = 0.0
+        self.lock_wait_seconds = 0.0
+
+    def is_held(self, now=None):
+        now = timestamp_millis() if now is None else now
+        return now < self.expire_ts
+
+    def acquire(self):
+        """
+        acquires or renews the lease
+        :return: whether this instance holds the lease
+        """
+        start = time.time()
+        now = timestamp_millis()
+        expire_ts = now + self.duration_ms
+        held = self.is_held(now)
+        try:
+            response = self.table.get_table().put_item(
+                Item={
+                    DYNAMODB_PRIMARY_KEY: PRIMARY,
+                    DYNAMODB_SORT_KEY: self.lockname,
+                    'expire_ts': expire_ts,
+                    'holder': self.holder,
+                    DYNAMODB_TTL_KEY: expire_ts//1000 + self.table.ttl_minutes*60
+                },
+                ConditionExpression=Attr("holder").eq(self.holder) | Attr("expire_ts").lt(now) | Attr(DYNAMODB_PRIMARY_KEY).not_exists(),
+                ReturnValues='ALL_OLD'
+            )
+            previous_holder = response.get('Attributes', {}).get('holder')
+            if held and previous_holder == self.holder:
+                self.renewals += 1
+            else:
+                self.acquisitions += 1
+                if previous_holder not in (None, NO_HOLDER, self.holder):
+                    self.handoffs += 1
+                    logger.info("lease.acquire(): lockname=" + self.lockname + ", taken over from " + previous_holder)
+            self.expire_ts = expire_ts
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                logger.warning("lease.acquire(): lockname=" + self.lockname + ", caller=" + self.holder + " failed: " + str(e))
+            elif held:
+                self.lost += 1
+                logger.warning("lease.acquire(): lockname=" + self.lockname + ", caller=" + self.holder + " lost the lease")
+            self.expire_ts = 0
+        finally:
+            self.last_lock_wait_seconds = time.time() - start
+            self.lock_wait_seconds += self.last_lock_wait_seconds
+        logger.info("lease.acquire(): lockname=" + self.lockname + ", held = " + str(self.is_held()))
+        return self.is_held()
 
     def release(self):
-        released = self.table.clear_lock_item(self.lockname, self.holder)
-        self.locked = not released
-        logger.info("mutex.release(): lockname=" + self.lockname + ", locked = " + str(self.locked))
-
-    def __enter__(self):
-        locked = self.lock()
-        if not locked:
-            raise AcquireLockFailedError()
-        return self
-
-    def __exit__(self, exc_type, exc_value, traceback):
-        self.release()
-
-    def is_locked(self):
-        return self.locked
-
-    def get_raw_lock(self):
-        return self.table.get_lock(self.lockname)
+        self.table.clear_lock_item(self.lockname, self.holder)
+        self.expire_ts = 0
+
+    def clear(self):
+        """
+        removes the lease regardless of its holder
+        """
+        self.table.get_table().delete_item(Key={DYNAMODB_PRIMARY_KEY: PRIMARY, DYNAMODB_SORT_KEY: self.lockname})
+        self.expire_ts = 0
+
+    def stats(self):
+        return {
+            "held": self.is_held(),
+            "acquisitions": self.acquisitions,
+            "renewals": self.renewals,
+            "handoffs": self.handoffs,
+            "lost": self.lost,
+            "last_lock_wait_seconds": self.last_lock_wait_seconds,
+            "lock_wait_seconds": self.lock_wait_seconds,
+        }
@@ -0,0 +1,119 @@
+import heapq
+import time
+from datetime import datetime, timedelta
+
+try:
+    from src.constants import MAX_AGE_IN_DAYS, EXPIRY_BUCKET_SECONDS
+except ModuleNotFoundError:
+    from constants import MAX_AGE_IN_DAYS, EXPIRY_BUCKET_SECONDS
+
+
+class ExpiryIndex:
+    """
+    time bucketed index of the last_seen of the nodes of a graph, so the nodes older than max_age can be pruned without scanning the graph
+    a node is in the bucket of its last_seen; touching it moves it to the bucket of its new last_seen
+    buckets are expired as a whole once all their nodes are older than max_age, i.e. nodes are pruned up to bucket_seconds late
+    """
+
+    def __init__(self, max_age: timedelta = timedelta(days=MAX_AGE_IN_DAYS), bucket_seconds: int = EXPIRY_BUCKET_SECONDS):
+        self.max_age = max_age
+        self.bucket_seconds = bucket_seconds
+        self.buckets = dict()  # bucket -> set of nodes last seen in it
+        self.node_buckets = dict()  # node -> bucket
+        self.bucket_heap = []  # buckets in self.buckets; min heap, so the oldest bucket is checked first
+        self.prune_runs = 0
+        self.pruned_nodes = 0
+        self.last_pruned_nodes = 0
+        self.last_prune_seconds = 0.0
+        self.last_prune = None
+
+    @staticmethod
+    def from_graph(graph) -> 'ExpiryIndex':
+        index = ExpiryIndex()
+        index.update(graph)
+        return index
+
+    def __len__(self) -> int:
+        return len(self.node_buckets)
+
+    def __contains__(self, node) -> bool:
+        return node in self.node_buckets
+
+    def bucket(self, last_seen: datetime) -> int:
+        return int(last_seen.timestamp() // self.bucket_seconds)
+
+    def touch(self, node, last_seen: datetime):
+        bucket = self.bucket(last_seen)
+        previous = self.node_buckets.get(node)
+        if previous == bucket:
+            return
+        if previous is not None:
+            self.buckets[previous].discard(node)
+        if bucket not in self.buckets:
+            # emptied buckets are kept until they expire, so a bucket is in the heap once
+            self.buckets[bucket] = set()
+            heapq.heappush(self.bucket_heap, bucket)
+        self.buckets[bucket].add(node)
+        self.node_buckets[node] = bucket
+
+    def update(self, graph):
+        """
+        touches the nodes of the (networkx) graph with their last_seen attribute
+        """
+        for node, last_seen in graph.nodes(data="last_seen"):
+            if last_seen is not None:
+                self.touch(node, last_seen)
+
+    def clear(self):
+        """
+        removes all nodes; the pruning stats are kept
+        """
+        self.buckets = dict()
+        self.node_buckets = dict()
+        self.bucket_heap = []
+
+    def discard(self, node):
+        bucket = self.node_buckets.pop(node, None)
+        if bucket is not None:
+            self.buckets[bucket].discard(node)
+
+    def expire(self, now: datetime = None) -> set:
+        """
+        removes the nodes older than max_age from the index and returns them
+        """
+        now = datetime.now() if now is None else now
+        # a bucket has expired if its end isnt after the cutoff
+        cutoff_bucket = self.bucket(now - self.max_age)
+        expired = set()
+        while len(self.bucket_heap) > 0 and self.bucket_heap[0] < cutoff_bucket:
+            nodes = self.buckets.pop(heapq.heappop(self.bucket_heap))
+            for node in nodes:
+                del self.node_buckets[node]
+            expired.update(nodes)
+        return expired
+
+    def prune(self, a_graph, now: datetime = None) -> set:
+        """
+        removes the nodes older than max_age from the graph and returns them
+        """
+        start = time.time()
+        nodes_to_remove = self.expire(now)
+        a_graph.remove_nodes_from(nodes_to_remove)
+
+        self.prune_runs += 1
+        self.pruned_nodes += len(nodes_to_remove)
+        self.last_pruned_nodes = len(nodes_to_remove)
+        self.last_prune_seconds = time.time() - start
+        self.last_prune = datetime.now()
+        return nodes_to_remove
+
+    def stats(self) -> dict:
+        return {
+            "tracked_nodes": len(self.node_buckets),
+            "buckets": len(self.buckets),
+            "prune_runs": self.prune_runs,
+            "pruned_nodes": self.pruned_nodes,
+            "last_pruned_nodes": self.last_pruned_nodes,
+            "last_prune_seconds": self.last_prune_seconds,
+            "last_prune": self.last_prune.isoformat() if self.last_prune else None,
+        }
@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta
+
+import networkx as nx
+
+from expiry_index import ExpiryIndex
+
+NOW = datetime(2023, 6, 1, 12, 0, 0)
+
+
+class TestExpiryIndex:
+
+    def test_expire(self):
+        index = ExpiryIndex(timedelta(days=7), bucket_seconds=60)
+        index.touch("a", NOW - timedelta(days=8))
+        index.touch("b", NOW - timedelta(days=6))
+        assert index.expire(NOW) == {"a"}
+        assert "a" not in index
+        assert "b" in index
+        assert index.expire(NOW) == set()
+
+    def test_touch_moves_node(self):
+        index = ExpiryIndex(timedelta(days=7), bucket_seconds=60)
+        index.touch("a", NOW - timedelta(days=8))
+        index.touch("a", NOW - timedelta(days=1))
+        assert index.expire(NOW) == set(), "a was seen again and shouldnt expire"
+        assert index.expire(NOW + timedelta(days=7)) == {"a"}
+        assert len(index) == 0
+
+    def test_expire_granularity(self):
+        # nodes are expired once their whole bucket is older than max_age
+        index = ExpiryIndex(timedelta(days=7), bucket_seconds=600)
+        last_seen = datetime.fromtimestamp(600 * 2000000)
+        index.touch("a", last_seen)
+        assert index.expire(last_seen + timedelta(days=7, seconds=599)) == set()
+        assert index.expire(last_seen + timedelta(days=7, seconds=600)) == {"a"}
+
+    def test_discard(self):
+        index = ExpiryIndex(timedelta(days=7), bucket_seconds=60)
+        index.touch("a", NOW - timedelta(days=8))
+        index.discard("a")
+        index.discard("b")
+        assert index.expire(NOW) == set()
+
+    def test_prune_graph(self):
+        graph = nx.DiGraph()
+        graph.add_node("a", last_seen=NOW - timedelta(days=8))
+        graph.add_node("b", last_seen=NOW - timedelta(days=6))
+        graph.add_node("c", last_seen=NOW - timedelta(days=9))
+        graph.add_edge("a", "b")
+
+        index = ExpiryIndex.from_graph(graph)
+        assert index.prune(graph, NOW) == {"a", "c"}
+        assert list(graph.nodes) == ["b"]
+        assert len(graph.edges) == 0
+
+        stats = index.stats()
+        assert stats["tracked_nodes"] == 1
+        assert stats["prune_runs"] == 1
+        assert stats["pruned_nodes"] == 2
+        assert stats["last_pruned_nodes"] == 2
+
+    def test_clear_keeps_stats(self):
+        graph = nx.DiGraph()
+        graph.add_node("a", last_seen=NOW - timedelta(days=8))
+        index = ExpiryIndex.from_graph(graph)
+        index.prune(graph, NOW)
+        index.touch("b", NOW)
+        index.clear()
+        assert len(index) == 0
+        assert index.stats()["pruned_nodes"] == 1
@@ -12,13 +12,17 @@ import string
 
 
 try:
-    from src.constants import  GRAPH_KEY, TEST_TAG, S3_BUCKET, MUTEX_TIMEOUT_MILLIS, S3_REGION, DYNAMO_REGION, DYNAMODB_PRIMARY_KEY, DYNAMODB_SORT_KEY, BOT_ID, DYNAMO_TABLE
-    from src.dyndbmutex import DynamoDbMutex
+    from src.constants import  GRAPH_KEY, TEST_TAG, S3_BUCKET, LEASE_DURATION_SECONDS, S3_REGION, DYNAMO_REGION, DYNAMODB_PRIMARY_KEY, DYNAMODB_SORT_KEY, BOT_ID, DYNAMO_TABLE, DELTA_INLINE_SIZE_LIMIT, COMPACTION_INTERVAL_SECONDS, DELTA_READ_OVERLAP_SECONDS
+    from src.dyndbmutex import DynamoDbLease
     from src.storage import get_secrets
+    from src.cluster_index import ClusterIndex
+    from src.expiry_index import ExpiryIndex
 except ModuleNotFoundError:
-    from constants import  GRAPH_KEY, TEST_TAG, S3_BUCKET, MUTEX_TIMEOUT_MILLIS, S3_REGION, DYNAMO_REGION, DYNAMODB_PRIMARY_KEY, DYNAMODB_SORT_KEY, BOT_ID, DYNAMO_TABLE
-    from dyndbmutex import DynamoDbMutex
+    from constants import  GRAPH_KEY, TEST_TAG, S3_BUCKET, LEASE_DURATION_SECONDS, S3_REGION, DYNAMO_REGION, DYNAMODB_PRIMARY_KEY, DYNAMODB_SORT_KEY, BOT_ID, DYNAMO_TABLE, DELTA_INLINE_SIZE_LIMIT, COMPACTION_INTERVAL_SECONDS, DELTA_READ_OVERLAP_SECONDS
+    from dyndbmutex import DynamoDbLease
     from storage import get_secrets
+    from cluster_index import ClusterIndex
+    from expiry_index import ExpiryIndex
 
 
 SECRETS_JSON = get_secrets()
@@ -47,12 +51,26 @@ PRIMARY_PREFIX = f"{BOT_ID}|entity-cluster"
 
 
 class DynamoPersistance:
+    """
+    the shared graph is persisted as a snapshot (the compacted graph in s3) plus an append-only log of deltas
+    each instance appends the nodes/edges it changed since its last persist as a delta item; no mutex is needed as every delta has its own sort key
+    one instance holds a lease, renews it on every persist and periodically compacts the deltas into the snapshot; other instances only write their deltas and take over the lease once it expired
+    delta sort keys are delta|{chain_id}|{micros}|{name}|{seq}, so the deltas written since a point in time can be read with a single query
+    """
     name = None
     chain_id = None
     graph_cache = None
+    cluster_index: ClusterIndex = None  # entities of graph_cache; kept in sync with it
+    expiry_index: ExpiryIndex = None  # last_seen of the nodes of graph_cache; kept in sync with it
     table = None
-    mutex:DynamoDbMutex = None
+    lease:DynamoDbLease = None  # held by the instance that compacts
     tag:string = None
+    delta_seq = 0
+    compacted_through = 0  # micros of the last delta compacted into the snapshot graph_cache was loaded from
+    delta_cursor = 0  # micros of the most recent delta applied to graph_cache
+    applied_deltas = None  # sort key -> micros of the deltas applied within the read overlap window
+    last_refresh = 0
+    last_compaction = 0
 
 
     def __init__(self, tag = TEST_TAG, chain_id = 1):
@@ -60,74 +78,244 @@ class DynamoPersistance:
         self.chain_id = chain_id
         self.table = dynamodb.Table(DYNAMO_TABLE)
         self.tag = tag
-        self.mutex = DynamoDbMutex(f"mutex|{self.chain_id}|{self.tag}", DYNAMO_TABLE, self.name, region_name=DYNAMO_REGION, ttl_minutes=15, timeoutms=MUTEX_TIMEOUT_MILLIS)
+        self.lease = DynamoDbLease(f"lease|{self.chain_id}|{self.tag}", DYNAMO_TABLE, self.name, region_name=DYNAMO_REGION, ttl_minutes=15, duration_seconds=LEASE_DURATION_SECONDS)
         print(f"chain id {self.chain_id}  - name {self.name} - dynamo table:  {DYNAMO_TABLE} - tag: {self.tag}")
-        self.graph_cache = self.load(GRAPH_KEY)
-        if not self.graph_cache:
-            self.graph_cache = nx.DiGraph()
-
-
-    def persist(self, delta_graph: object, key: str, prune_graph):
-        for n in range(5):
-            locked = self.mutex.lock()
-            if locked:
-                try:
-                    compose = []
-                    shared_graph = self.load(GRAPH_KEY)
-                    if shared_graph:
-                        compose.append(shared_graph)
-                    compose.append(delta_graph)
-                    obj = nx.compose_all(compose)
-                    prune_graph(obj)
-                    bytes = pickle.dumps(obj)
-                    size = self.bytes_to_kb(bytes)
-                    c = bz2.compress(bytes)
-                    c_size =  self.bytes_to_kb(c)
-                    print(f"Persisting with MUTEX {key}/{self.chain_id}/{self.tag} using API. Size:: {size} KB and compress {c_size} KB. {str(obj)}")
-                    s3_key = f"{BOT_ID}/sub_graph/{self.chain_id}/{self.table.table_name}_{self.tag}_SHARED_GRAPH"
-                    s3.put_object(Body=c, Bucket=S3_BUCKET, Key=s3_key)
-                    self.table.put_item(
-                        Item={
-                                DYNAMODB_PRIMARY_KEY: f"{PRIMARY_PREFIX}|{key}|{self.tag}",
-                                DYNAMODB_SORT_KEY: f"shared_graph|{self.chain_id}",
-                                'updated': datetime.now().isoformat(),
-                                'sizeKB': str(c_size), 
-                                's3_key': s3_key
-                            }
-                        )
-                    self.graph_cache = obj
-                except Exception as e:
-                    print(f"ERROR {e}")
-                finally:
-                    self.mutex.release()
-                    break
+        self.last_compaction = time.time()
+        self.reload(GRAPH_KEY)
+
+
+    def persist(self, delta_graph: object, key: str, prune_graph) -> bool:
+        """
+        appends the delta to the delta log and applies the deltas written since the last persist (by any instance) to graph_cache
+        :return: whether the delta was persisted; if not, the caller should retain it and persist it with the next delta
+        """
+        try:
+            if len(delta_graph.nodes) > 0:
+                self.write_delta(delta_graph, key)
+        except Exception as e:
+            print(f"ERROR {e}")
+            return False
+
+        try:
+            if time.time() - self.last_refresh > COMPACTION_INTERVAL_SECONDS:
+                # deltas older than the previous compaction may have been deleted already
+                self.reload(key)
             else:
-                print(f"{self.name} table mutex is locked, tryinging in 2 second, try #{n}")
-                time.sleep(2)
+                self.apply_deltas(key)
+
+            if self.lease.is_held():
+                # renewing the lease keeps this instance the one that compacts
+                self.lease.acquire()
+
+            if time.time() - self.last_compaction > COMPACTION_INTERVAL_SECONDS:
+                self.last_compaction = time.time()
+                self.compact(key, prune_graph)
+                self.cluster_index.remove_nodes(self.expiry_index.prune(self.graph_cache))
+        except Exception as e:
+            print(f"ERROR {e}")
+        return True
+
+    def delta_sort_key_prefix(self) -> str:
+        return f"delta|{self.chain_id}|"
+
+    def write_delta(self, delta_graph: object, key: str):
+        micros = int(time.time() * 1000000)
+        self.delta_seq += 1
+        sort_key = f"{self.delta_sort_key_prefix()}{micros:020d}|{self.name}|{self.delta_seq}"
+        bytes = pickle.dumps(delta_graph)
+        c = bz2.compress(bytes)
+        c_size = self.bytes_to_kb(c)
+        item = {
+            DYNAMODB_PRIMARY_KEY: f"{PRIMARY_PREFIX}|{key}|{self.tag}",
+            DYNAMODB_SORT_KEY: sort_key,
+            'updated': datetime.now().isoformat(),
+            'sizeKB': str(c_size)
+        }
+        if len(c) <= DELTA_INLINE_SIZE_LIMIT:
+            item['graph'] = c
+        else:
+            bucket = datetime.utcnow().strftime("%Y%m%d%H")
+            s3_key = f"{BOT_ID}/sub_graph/{self.chain_id}/{self.table.table_name}_{self.tag}_DELTA/{bucket}/{micros}_{self.name}_{self.delta_seq}"
+            s3.put_object(Body=c, Bucket=S3_BUCKET, Key=s3_key)
+            item['s3_key'] = s3_key
+        self.table.put_item(Item=item)
+        print(f"Persisted delta {sort_key} of {key}/{self.chain_id}/{self.tag}. Size:: {c_size} KB compressed. {str(delta_graph)}")
+
+    def query_deltas(self, key: str, after_micros: int, through_micros: int = None) -> list:
+        """
+        returns the delta items written after after_micros (and up to through_micros) in sort key order
+        """
+        prefix = self.delta_sort_key_prefix()
+        upper = f"{prefix}{through_micros:020d}|~" if through_micros is not None else f"{prefix}~"
+        key_condition = Key(DYNAMODB_PRIMARY_KEY).eq(f"{PRIMARY_PREFIX}|{key}|{self.tag}") & Key(DYNAMODB_SORT_KEY).between(f"{prefix}{after_micros + 1:020d}", upper)
+        items = []
+        last_evaluated_key = None
+        while True:
+            if last_evaluated_key is None:
+                response = self.table.query(KeyConditionExpression=key_condition)
+            else:
+                response = self.table.query(KeyConditionExpression=key_condition, ExclusiveStartKey=last_evaluated_key)
+            items.extend(response['Items'])
+            if 'LastEvaluatedKey' in response:
+                last_evaluated_key = response['LastEvaluatedKey']
+            else:
+                break
+        return items
+
+    @staticmethod
+    def delta_micros(item: dict) -> int:
+        return int(item[DYNAMODB_SORT_KEY].split('|')[2])
+
+    @staticmethod
+    def delta_graph(item: dict) -> object:
+        if 'graph' in item:
+            compressed = item['graph'].value
+        else:
+            compressed = s3.get_object(Bucket=S3_BUCKET, Key=item['s3_key'])['Body'].read()
+        return pickle.loads(bz2.decompress(compressed))
+
+    def apply_deltas(self, key: str):
+        """
+        applies the deltas written since the last one applied to graph_cache; deltas within the read overlap window are read again but only applied once
+        """
+        overlap_micros = DELTA_READ_OVERLAP_SECONDS * 1000000
+        items = self.query_deltas(key, max(self.compacted_through, self.delta_cursor - overlap_micros))
+        for item in items:
+            if item[DYNAMODB_SORT_KEY] in self.applied_deltas:
+                continue
+            micros = DynamoPersistance.delta_micros(item)
+            self.cache_graph(DynamoPersistance.delta_graph(item))
+            self.applied_deltas[item[DYNAMODB_SORT_KEY]] = micros
+            self.delta_cursor = max(self.delta_cursor, micros)
+        self.applied_deltas = dict((sort_key, micros) for sort_key, micros in self.applied_deltas.items() if micros > self.delta_cursor - overlap_micros)
+        self.last_refresh = time.time()
+        logging.info(f"Applied {len(items)} deltas of {key}/{self.chain_id}/{self.tag}. Shared graph {str(self.graph_cache)}")
+
+    def reload(self, key: str):
+        """
+        loads the shared graph snapshot and applies the deltas written since it was compacted
+        """
+        shared_graph, self.compacted_through = self.load_snapshot(key)
+        self.graph_cache = shared_graph if shared_graph else nx.DiGraph()
+        self.cluster_index = ClusterIndex.from_graph(self.graph_cache)
+        if self.expiry_index is None:
+            self.expiry_index = ExpiryIndex()
+        self.expiry_index.clear()
+        self.expiry_index.update(self.graph_cache)
+        self.delta_cursor = self.compacted_through
+        self.applied_deltas = dict()
+        self.apply_deltas(key)
+
+    def cache_graph(self, graph: object):
+        self.graph_cache.update(graph)
+        self.cluster_index.update(graph)
+        self.expiry_index.update(graph)
+
+    def cache_node(self, node: str, **attributes):
+        self.graph_cache.add_node(node, **attributes)
+        self.cluster_index.add_node(node)
+        if 'last_seen' in attributes:
+            self.expiry_index.touch(node, attributes['last_seen'])
+
+    def cache_edge(self, from_: str, to: str):
+        self.graph_cache.add_edge(from_, to)
+        self.cluster_index.add_edge(from_, to)
+
+    def compact(self, key: str, prune_graph) -> bool:
+        """
+        compacts the deltas written up to the read overlap window into the snapshot
+        deltas that were already compacted into the previous snapshot are deleted, so instances reading concurrently dont miss any
+        :return: whether this instance compacted; False if another instance holds the lease or compacted recently
+        """
+        if not self.lease.acquire():
+            print(f"{self.name} doesnt hold the compaction lease, skipping compaction")
+            return False
+
+        item = self.get_snapshot_item(key)
+        if item is not None and (datetime.now() - datetime.fromisoformat(item['updated'])).total_seconds() < COMPACTION_INTERVAL_SECONDS / 2:
+            logging.info(f"{key}/{self.chain_id}/{self.tag} was compacted recently by another instance")
+            return False
+
+        shared_graph, previous_compacted_through = self.load_snapshot(key)
+        compose = [shared_graph] if shared_graph else []
+        compacted_through = int(time.time() * 1000000) - DELTA_READ_OVERLAP_SECONDS * 1000000
+        deltas = self.query_deltas(key, previous_compacted_through, compacted_through)
+        compose.extend(DynamoPersistance.delta_graph(delta) for delta in deltas)
+        obj = nx.compose_all(compose) if len(compose) > 0 else nx.DiGraph()
+        prune_graph(obj)
+        self.write_snapshot(obj, key, compacted_through)
+
+        obsolete = self.query_deltas(key, 0, previous_compacted_through) if previous_compacted_through > 0 else []
+        for delta in obsolete:
+            self.table.delete_item(Key={DYNAMODB_PRIMARY_KEY: delta[DYNAMODB_PRIMARY_KEY], DYNAMODB_SORT_KEY: delta[DYNAMODB_SORT_KEY]})
+            if 's3_key' in delta:
+                s3.delete_object(Bucket=S3_BUCKET, Key=delta['s3_key'])
+        print(f"Compacted {len(deltas)} deltas of {key}/{self.chain_id}/{self.tag}, deleted {len(obsolete)} compacted deltas. {str(obj)}")
+        return True
+
+    def write_snapshot(self, obj: object, key: str, compacted_through: int):
+        bytes = pickle.dumps(obj)
+        size = self.bytes_to_kb(bytes)
+        c = bz2.compress(bytes)
+        c_size =  self.bytes_to_kb(c)
+        print(f"Persisting snapshot {key}/{self.chain_id}/{self.tag} using API. Size:: {size} KB and compress {c_size} KB. {str(obj)}")
+        s3_key = f"{BOT_ID}/sub_graph/{self.chain_id}/{self.table.table_name}_{self.tag}_SHARED_GRAPH"
+        s3.put_object(Body=c, Bucket=S3_BUCKET, Key=s3_key)
+        self.table.put_item(
+            Item={
+                    DYNAMODB_PRIMARY_KEY: f"{PRIMARY_PREFIX}|{key}|{self.tag}",
+                    DYNAMODB_SORT_KEY: f"shared_graph|{self.chain_id}",
+                    'updated': datetime.now().isoformat(),
+                    'sizeKB': str(c_size), 
+                    's3_key': s3_key,
+                    'compacted_through': compacted_through
+                }
+            )
 
     def bytes_to_kb(self, bytes):
         size_in_bytes = sys.getsizeof(bytes)
         size_in_kb = size_in_bytes / 1024
         return size_in_kb     
 
-    def load(self, key: str) -> object:
-        logging.info(f"Loading {key}/{self.chain_id}/{self.tag} using API")
+    def get_snapshot_item(self, key: str) -> dict:
         response = self.table.get_item(
             Key={
                 DYNAMODB_PRIMARY_KEY: f"{PRIMARY_PREFIX}|{key}|{self.tag}",
                 DYNAMODB_SORT_KEY: f"shared_graph|{self.chain_id}"
             }
         )
-        if "Item" in response:
-            obj = s3.get_object(Bucket=S3_BUCKET, Key=response['Item']['s3_key'])
+        return response.get("Item")
+
+    def load_snapshot(self, key: str) -> tuple:
+        """
+        :return: the shared graph snapshot (None if there is none) and the micros of the last delta compacted into it
+        """
+        logging.info(f"Loading {key}/{self.chain_id}/{self.tag} using API")
+        item = self.get_snapshot_item(key)
+        if item is not None:
+            obj = s3.get_object(Bucket=S3_BUCKET, Key=item['s3_key'])
             compressed = obj['Body'].read()
             dc = bz2.decompress(compressed)
-            return pickle.loads(dc)
+            return pickle.loads(dc), int(item.get('compacted_through', 0))
         else:
+            return None, 0
+
+    def load(self, key: str) -> object:
+        """
+        returns the shared graph, i.e. the snapshot with all deltas written since it was compacted applied
+        """
+        shared_graph, compacted_through = self.load_snapshot(key)
+        deltas = self.query_deltas(key, compacted_through)
+        if shared_graph is None and len(deltas) == 0:
             return None
+        shared_graph = shared_graph if shared_graph else nx.DiGraph()
+        for delta in deltas:
+            shared_graph.update(DynamoPersistance.delta_graph(delta))
+        return shared_graph
 
     
     def clean_db(self) -> list:
+        self.lease.clear()
 
         lastEvaluatedKey = None
         while True:
@@ -145,6 +333,8 @@ class DynamoPersistance:
             items = response['Items']
             for a_item in items:
                 self.table.delete_item(Key={DYNAMODB_PRIMARY_KEY: a_item[DYNAMODB_PRIMARY_KEY], DYNAMODB_SORT_KEY: a_item[DYNAMODB_SORT_KEY]})
+                if a_item[DYNAMODB_SORT_KEY].startswith("delta|") and 's3_key' in a_item:
+                    s3.delete_object(Bucket=S3_BUCKET, Key=a_item['s3_key'])
                 print("delete for " + a_item[DYNAMODB_SORT_KEY])
 
             # Set our lastEvlauatedKey to the value for next operation,
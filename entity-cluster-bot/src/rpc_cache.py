@@ -0,0 +1,136 @@
+import logging
+from collections import OrderedDict
+
+import requests
+from hexbytes import HexBytes
+from web3 import Web3
+
+try:
+    from src.constants import RPC_CACHE_SIZE, RPC_BATCH_SIZE, HTTP_RPC_TIMEOUT
+except ModuleNotFoundError:
+    from constants import RPC_CACHE_SIZE, RPC_BATCH_SIZE, HTTP_RPC_TIMEOUT
+
+
+class LRUCache:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key) -> bool:
+        return key in self.entries
+
+    def get(self, key, default=None):
+        if key not in self.entries:
+            return default
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+
+class ChainStateCache:
+    """
+    bounded LRU caches of the code and nonce of addresses at a block
+    prefetch resolves the code and nonce of all addresses of a transaction with a single JSON-RPC batch request
+    lookups that werent prefetched (or whose batch failed) fall back to individual w3 calls; lookups without a block arent cached, unless the address is a contract
+    contracts are cached by address only, as an address that has code keeps it
+    """
+
+    def __init__(self, max_size: int = RPC_CACHE_SIZE, batch_size: int = RPC_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.contracts = LRUCache(max_size)  # address -> True
+        self.eoas = LRUCache(max_size)  # (address, block) -> True for addresses without code at the block
+        self.nonces = LRUCache(max_size)  # (address, block) -> nonce
+        self.hits = 0
+        self.misses = 0
+        self.rpc_calls = 0
+        self.rpc_batches = 0
+
+    @staticmethod
+    def endpoint_uri(w3) -> str:
+        return getattr(getattr(w3, 'provider', None), 'endpoint_uri', None)
+
+    def _put_code(self, address: str, block_number: int, code):
+        if code != HexBytes('0x'):
+            self.contracts.put(address, True)
+        elif block_number is not None:
+            self.eoas.put((address, block_number), True)
+
+    def prefetch(self, w3, addresses, block_number: int):
+        """
+        looks up the code and nonce at the block of the addresses that arent cached with JSON-RPC batch requests
+        """
+        endpoint_uri = ChainStateCache.endpoint_uri(w3)
+        if endpoint_uri is None or block_number is None:
+            return
+
+        block = hex(block_number)
+        lookups = []
+        for address in dict.fromkeys(Web3.toChecksumAddress(address) for address in addresses if address is not None):
+            if address not in self.contracts and (address, block_number) not in self.eoas:
+                lookups.append(("code", address, "eth_getCode"))
+            if (address, block_number) not in self.nonces:
+                lookups.append(("nonce", address, "eth_getTransactionCount"))
+
+        for i in range(0, len(lookups), self.batch_size):
+            batch = lookups[i:i + self.batch_size]
+            payload = [{"jsonrpc": "2.0", "id": id, "method": method, "params": [address, block]} for id, (_, address, method) in enumerate(batch)]
+            try:
+                self.rpc_batches += 1
+                response = requests.post(endpoint_uri, json=payload, timeout=HTTP_RPC_TIMEOUT)
+                results = dict((result["id"], result["result"]) for result in response.json() if "result" in result)
+            except Exception as e:
+                logging.warning(f"JSON-RPC batch of {len(batch)} lookups failed, falling back to individual lookups: {e}")
+                continue
+            for id, (kind, address, _) in enumerate(batch):
+                if id not in results:
+                    continue
+                if kind == "code":
+                    self._put_code(address, block_number, HexBytes(results[id]))
+                else:
+                    self.nonces.put((address, block_number), int(results[id], 16))
+
+    def is_contract(self, w3, address: str, block_number: int = None) -> bool:
+        checksum_address = Web3.toChecksumAddress(address)
+        if checksum_address in self.contracts or (checksum_address, block_number) in self.eoas:
+            self.hits += 1
+            return self.contracts.get(checksum_address, False)
+
+        self.misses += 1
+        self.rpc_calls += 1
+        code = w3.eth.get_code(checksum_address) if block_number is None else w3.eth.get_code(checksum_address, block_number)
+        self._put_code(checksum_address, block_number, code)
+        return code != HexBytes('0x')
+
+    def get_transaction_count(self, w3, address: str, block_number: int = None) -> int:
+        checksum_address = Web3.toChecksumAddress(address)
+        nonce = self.nonces.get((checksum_address, block_number))
+        if nonce is not None:
+            self.hits += 1
+            return nonce
+
+        self.misses += 1
+        self.rpc_calls += 1
+        if block_number is None:
+            return w3.eth.get_transaction_count(checksum_address)
+        nonce = w3.eth.get_transaction_count(checksum_address, block_number)
+        self.nonces.put((checksum_address, block_number), nonce)
+        return nonce
+
+    def stats(self) -> dict:
+        return {
+            "contracts": len(self.contracts),
+            "eoas": len(self.eoas),
+            "nonces": len(self.nonces),
+            "hits": self.hits,
+            "misses": self.misses,
+            "rpc_calls": self.rpc_calls,
+            "rpc_batches": self.rpc_batches,
+        }
@@ -0,0 +1,134 @@
+from hexbytes import HexBytes
+
+import rpc_cache
+from rpc_cache import ChainStateCache, LRUCache
+from web3_mock import CONTRACT, EOA_ADDRESS_SMALL_TX, EOA_ADDRESS_LARGE_TX, Web3Mock
+
+
+class CountingWeb3Mock(Web3Mock):
+    def __init__(self, endpoint_uri: str = None):
+        super().__init__()
+        self.calls = []
+        eth = self.eth
+        get_code, get_transaction_count = eth.get_code, eth.get_transaction_count
+
+        def count(method, f):
+            def g(*args):
+                self.calls.append((method, args))
+                return f(*args)
+            return g
+        eth.get_code = count("eth_getCode", get_code)
+        eth.get_transaction_count = count("eth_getTransactionCount", get_transaction_count)
+        if endpoint_uri is not None:
+            self.provider = type("ProviderMock", (), {"endpoint_uri": endpoint_uri})()
+
+
+class ResponseMock:
+    def __init__(self, json):
+        self._json = json
+
+    def json(self):
+        return self._json
+
+
+class PostMock:
+    """
+    answers JSON-RPC batches with the answers of the web3 mock
+    """
+    def __init__(self, fail: bool = False):
+        self.eth = Web3Mock().eth
+        self.fail = fail
+        self.batches = []
+
+    def __call__(self, url, json=None, timeout=None):
+        self.batches.append(json)
+        if self.fail:
+            raise ConnectionError("rpc unavailable")
+        results = []
+        for request in json:
+            address, block = request["params"]
+            if request["method"] == "eth_getCode":
+                result = HexBytes(self.eth.get_code(address)).hex()
+            else:
+                result = hex(self.eth.get_transaction_count(address, int(block, 16)))
+            results.append({"jsonrpc": "2.0", "id": request["id"], "result": result})
+        return ResponseMock(results)
+
+
+class TestChainStateCache:
+
+    def test_lru_eviction(self):
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        assert list(cache.entries.keys()) == ["a", "c"]
+
+    def test_cached_by_block(self):
+        w3 = CountingWeb3Mock()
+        cache = ChainStateCache()
+        assert cache.get_transaction_count(w3, EOA_ADDRESS_SMALL_TX, 1) == 499
+        assert cache.get_transaction_count(w3, EOA_ADDRESS_SMALL_TX.lower(), 1) == 499
+        assert not cache.is_contract(w3, EOA_ADDRESS_SMALL_TX, 1)
+        assert not cache.is_contract(w3, EOA_ADDRESS_SMALL_TX, 1)
+        assert len(w3.calls) == 2
+
+        cache.get_transaction_count(w3, EOA_ADDRESS_SMALL_TX, 2)
+        cache.is_contract(w3, EOA_ADDRESS_SMALL_TX, 2)
+        assert len(w3.calls) == 4, "nonce and code should be looked up again at a new block"
+
+    def test_contract_cached_for_all_blocks(self):
+        w3 = CountingWeb3Mock()
+        cache = ChainStateCache()
+        assert cache.is_contract(w3, CONTRACT, 1)
+        assert cache.is_contract(w3, CONTRACT, 2)
+        assert cache.is_contract(w3, CONTRACT)
+        assert len(w3.calls) == 1
+
+    def test_latest_isnt_cached(self):
+        w3 = CountingWeb3Mock()
+        cache = ChainStateCache()
+        cache.get_transaction_count(w3, EOA_ADDRESS_SMALL_TX)
+        cache.get_transaction_count(w3, EOA_ADDRESS_SMALL_TX)
+        assert len(w3.calls) == 2
+
+    def test_prefetch_batch(self, monkeypatch):
+        post = PostMock()
+        monkeypatch.setattr(rpc_cache.requests, "post", post)
+        w3 = CountingWeb3Mock("http://localhost:8545")
+        cache = ChainStateCache(batch_size=3)
+
+        cache.prefetch(w3, [EOA_ADDRESS_SMALL_TX, CONTRACT, None, EOA_ADDRESS_SMALL_TX.lower()], 10)
+        assert [len(batch) for batch in post.batches] == [3, 1], "code and nonce of the 2 addresses should be looked up in batches of 3"
+        assert post.batches[0][0] == {"jsonrpc": "2.0", "id": 0, "method": "eth_getCode", "params": [EOA_ADDRESS_SMALL_TX, hex(10)]}
+
+        assert not cache.is_contract(w3, EOA_ADDRESS_SMALL_TX, 10)
+        assert cache.get_transaction_count(w3, EOA_ADDRESS_SMALL_TX, 10) == 499
+        assert cache.is_contract(w3, CONTRACT, 10)
+        assert w3.calls == [], "lookups should be served from the prefetched cache"
+
+        cache.prefetch(w3, [EOA_ADDRESS_SMALL_TX, CONTRACT], 10)
+        assert len(post.batches) == 2, "cached addresses shouldnt be looked up again"
+
+        cache.prefetch(w3, [EOA_ADDRESS_LARGE_TX, CONTRACT], 11)
+        assert [request["method"] for request in post.batches[2]] == ["eth_getCode", "eth_getTransactionCount", "eth_getTransactionCount"]
+        assert cache.get_transaction_count(w3, EOA_ADDRESS_LARGE_TX, 11) == 501
+        assert cache.stats()["rpc_batches"] == 3
+
+    def test_prefetch_failure_falls_back(self, monkeypatch):
+        post = PostMock(fail=True)
+        monkeypatch.setattr(rpc_cache.requests, "post", post)
+        w3 = CountingWeb3Mock("http://localhost:8545")
+        cache = ChainStateCache()
+
+        cache.prefetch(w3, [EOA_ADDRESS_LARGE_TX], 10)
+        assert cache.get_transaction_count(w3, EOA_ADDRESS_LARGE_TX, 10) == 501
+        assert len(w3.calls) == 1
+
+    def test_prefetch_without_endpoint(self, monkeypatch):
+        post = PostMock()
+        monkeypatch.setattr(rpc_cache.requests, "post", post)
+        cache = ChainStateCache()
+        cache.prefetch(CountingWeb3Mock(), [EOA_ADDRESS_LARGE_TX], 10)
+        assert post.batches == []
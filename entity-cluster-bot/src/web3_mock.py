@@ -41,7 +41,7 @@ class EthMock:
             return 6
         return 0
 
-    def get_code(self, address):
+    def get_code(self, address, block_identifier=None):
         if address == EOA_ADDRESS_SMALL_TX or address == EOA_ADDRESS_LARGE_TX or address == EOA_ADDRESS_OLD or address == EOA_ADDRESS_NEW:
             return HexBytes('0x')
         elif address == CONTRACT:
@@ -0,0 +1,96 @@
+import logging
+import time
+from collections import OrderedDict
+
+FACTS = ('is_eoa', 'first_tx_timestamp', 'classification')
+
+
+class AddressFacts:
+    """
+    LRU cache of the facts about the addresses (is EOA, timestamp of the first tx, classification) in front of the
+    address_facts table. The updated facts are written to the table in one transaction by flush(), so they survive
+    restarts, and the most recently fetched ones are loaded back by warm().
+    """
+
+    def __init__(self, max_size: int, max_age_seconds: int):
+        self.max_size = max_size
+        self.max_age_seconds = max_age_seconds
+        self.entries = OrderedDict()  # address -> {'is_eoa', 'first_tx_timestamp', 'classification', 'fetched_at'}
+        self.dirty = set()  # addresses updated since the last flush
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _fresh_entry(self, address: str, now: float):
+        entry = self.entries.get(address)
+        if entry is None or now - entry['fetched_at'] > self.max_age_seconds:
+            return None
+        return entry
+
+    def get(self, address: str, fact: str, now: float = None):
+        """
+        :param address: address
+        :param fact: one of FACTS
+        :param now: current time, for the max age
+        :return: the fact, None if it isn't known
+        """
+        entry = self._fresh_entry(address, time.time() if now is None else now)
+        if entry is None or entry[fact] is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(address)
+        self.hits += 1
+        return entry[fact]
+
+    def update(self, address: str, now: float = None, **facts) -> None:
+        """
+        Sets facts of the address, the other known facts of the address are kept unless they are too old
+        """
+        now = time.time() if now is None else now
+        entry = self._fresh_entry(address, now)
+        if entry is None:
+            entry = dict.fromkeys(FACTS)
+        entry.update(facts)
+        entry['fetched_at'] = now
+        self._put(address, entry)
+        self.dirty.add(address)
+
+    def _put(self, address: str, entry: dict) -> None:
+        self.entries[address] = entry
+        self.entries.move_to_end(address)
+        while len(self.entries) > self.max_size:
+            evicted, _ = self.entries.popitem(last=False)
+            self.dirty.discard(evicted)  # not written if it wasn't flushed yet, the facts are fetched again when needed
+            self.evictions += 1
+
+    async def warm(self, table) -> None:
+        """
+        Loads the most recently fetched facts of the table
+        """
+        rows = await table.get_latest_rows('fetched_at', self.max_size)
+        for row in reversed(rows):
+            self._put(row.address, {fact: getattr(row, fact) for fact in FACTS + ('fetched_at',)})
+        logging.info(f"Address facts: loaded {len(self.entries)} addresses")
+
+    async def flush(self, table) -> int:
+        """
+        Writes the facts updated since the last flush to the table
+        :return: number of addresses written
+        """
+        if len(self.dirty) == 0:
+            return 0
+        rows = [{'address': address, **self.entries[address]} for address in self.dirty]
+        await table.merge_rows(rows)
+        self.dirty = set()
+        return len(rows)
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def log_stats(self) -> None:
+        logging.info(f"Address facts: {len(self.entries)} addresses, hit rate {self.hit_rate():.2%} "
+                     f"({self.hits} hits, {self.misses} misses), {self.evictions} evictions")
@@ -0,0 +1,121 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from src.address_facts import AddressFacts
+from src.analyze_newly_created import is_newly_created_async
+from src.enrichment import enrich_addresses
+
+NOW = datetime(2023, 6, 1)
+
+
+class TableMock:
+    """
+    address_facts table of the db
+    """
+    def __init__(self):
+        self.rows = {}
+        self.merges = []
+
+    async def merge_rows(self, rows):
+        self.merges.append(len(rows))
+        for row in rows:
+            self.rows[row['address']] = dict(row)
+
+    async def get_latest_rows(self, column, limit):
+        rows = sorted(self.rows.values(), key=lambda row: row[column], reverse=True)[:limit]
+        return [SimpleNamespace(**row) for row in rows]
+
+
+class RpcClientMock:
+    def __init__(self, contracts):
+        self.contracts = contracts
+        self.calls = []
+
+    async def get_code(self, address, block="latest"):
+        self.calls.append(address)
+        return "0x6080" if address in self.contracts else "0x"
+
+
+class BlockExplorerMock:
+    def __init__(self, first_txs):
+        self.first_txs = first_txs
+        self.first_tx_cache = {}
+        self.calls = []
+
+    async def get_first_tx_async(self, client, address):
+        self.calls.append(address)
+        if address not in self.first_txs:
+            return NOW
+        self.first_tx_cache[address] = self.first_txs[address]
+        return self.first_txs[address]
+
+
+class TestAddressFacts:
+
+    def test_get_update(self):
+        facts = AddressFacts(max_size=10, max_age_seconds=100)
+        assert facts.get("0xa", 'is_eoa', now=0) is None
+        facts.update("0xa", now=0, is_eoa=True)
+        facts.update("0xa", now=10, first_tx_timestamp=1234)
+        assert facts.get("0xa", 'is_eoa', now=20) is True
+        assert facts.get("0xa", 'first_tx_timestamp', now=20) == 1234
+        assert facts.get("0xa", 'classification', now=20) is None, "unknown facts should be misses"
+        assert (facts.hits, facts.misses) == (2, 2)
+        assert facts.hit_rate() == 0.5
+
+    def test_max_age(self):
+        facts = AddressFacts(max_size=10, max_age_seconds=100)
+        facts.update("0xa", now=0, is_eoa=True, first_tx_timestamp=1234)
+        assert facts.get("0xa", 'is_eoa', now=101) is None, "facts older than the max age should be fetched again"
+        facts.update("0xa", now=101, is_eoa=False)
+        assert facts.get("0xa", 'is_eoa', now=101) is False
+        assert facts.get("0xa", 'first_tx_timestamp', now=101) is None, "facts too old shouldnt be kept on update"
+
+    def test_lru_eviction(self):
+        facts = AddressFacts(max_size=2, max_age_seconds=100)
+        facts.update("0xa", now=0, is_eoa=True)
+        facts.update("0xb", now=0, is_eoa=True)
+        facts.get("0xa", 'is_eoa', now=0)  # 0xa is now most recently used
+        facts.update("0xc", now=0, is_eoa=True)
+        assert list(facts.entries.keys()) == ["0xa", "0xc"]
+        assert facts.evictions == 1
+        assert facts.dirty == {"0xa", "0xc"}
+
+    def test_flush_and_warm(self):
+        table = TableMock()
+        facts = AddressFacts(max_size=10, max_age_seconds=100)
+        facts.update("0xa", now=0, is_eoa=True)
+        facts.update("0xb", now=1, is_eoa=False, classification='mixer')
+        assert asyncio.run(facts.flush(table)) == 2
+        assert asyncio.run(facts.flush(table)) == 0, "only the updated facts should be written"
+        facts.update("0xa", now=2, first_tx_timestamp=1234)
+        asyncio.run(facts.flush(table))
+        assert table.merges == [2, 1]
+
+        restarted = AddressFacts(max_size=1, max_age_seconds=100)
+        asyncio.run(restarted.warm(table))
+        assert list(restarted.entries.keys()) == ["0xa"], "the most recently fetched facts should be loaded"
+        assert restarted.get("0xa", 'is_eoa', now=2) is True
+        assert restarted.get("0xa", 'first_tx_timestamp', now=2) == 1234
+        assert restarted.dirty == set()
+
+    def test_enrichment_uses_facts(self):
+        facts = AddressFacts(max_size=10, max_age_seconds=10 ** 10)
+        rpc_client = RpcClientMock({"0xc"})
+        blockexplorer = BlockExplorerMock({"0xa": NOW - timedelta(days=1), "0xb": NOW - timedelta(days=30)})
+        timestamp = NOW.timestamp()
+
+        for _ in range(3):
+            enrichment = asyncio.run(
+                enrich_addresses(rpc_client, blockexplorer, None, ["0xa", "0xb", "0xc", "0xd"], timestamp, facts))
+            assert enrichment == {"0xa": (True, True), "0xb": (True, False), "0xc": (False, False), "0xd": (True, True)}
+
+        assert sorted(rpc_client.calls) == ["0xa", "0xb", "0xc", "0xd"], "code should be fetched once per address"
+        assert sorted(blockexplorer.calls) == ["0xa", "0xb", "0xd", "0xd", "0xd"], \
+            "first tx should be fetched once, except for the addresses without txs"
+        assert facts.entries["0xb"]['first_tx_timestamp'] == int((NOW - timedelta(days=30)).timestamp())
+
+    def test_is_newly_created_without_facts(self):
+        blockexplorer = BlockExplorerMock({"0xa": NOW - timedelta(days=1)})
+        assert asyncio.run(is_newly_created_async("0xa", blockexplorer, None, NOW.timestamp()))
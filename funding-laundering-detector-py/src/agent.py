@@ -2,21 +2,27 @@ from __future__ import annotations
 import asyncio
 import json
 import logging
+import os
 
 import forta_agent
 from forta_agent import get_json_rpc_url, EntityType
 from web3 import Web3
 
+from src.address_facts import AddressFacts
 from src.analyze_newly_created import is_newly_created
-from src.calculate_usd import calculate_usd_for_base_token, update_top_currencies_info, calculate_usd_and_get_symbol
+from src.async_clients import AsyncHttpClient, AsyncRpcClient
+from src.calculate_usd import calculate_usd_for_base_token, calculate_usd_and_get_symbol, price_service
 from src.db.db_utils import db_utils
 from src.db.controller import init_async_db
 from src.findings import FundingLaunderingFindings
-from src.mixer_bridge_exchange import check_is_mixer_bridge_exchange
+from src.enrichment import enrich_addresses, is_eoa_async
+from src.mixer_bridge_exchange import fetch_address_classification_async
+from src.possible_targets import PossibleTargets
 from src.utils import extract_argument
 from .constants import WITHDRAW_ETH_FUNCTION_ABI
 from src.config import DEFAULT_THRESHOLDS, L2_THRESHOLDS, TRANSFERS_TO_CONFIRM, TEST_MODE, DEX_DISABLE, \
-    INFO_ALERTS, BLOCKS_IN_MEMORY_VALUES, MIXER_ADDRESSES
+    INFO_ALERTS, BLOCKS_IN_MEMORY_VALUES, MIXER_ADDRESSES, RPC_MAX_CONCURRENCY, EXPLORER_MAX_CONCURRENCY, \
+    ADDRESS_FACTS_CACHE_SIZE, ADDRESS_FACTS_MAX_AGE_SECONDS, ADDRESS_FACTS_STATS_INTERVAL_BLOCKS
 from src.blockexplorer import BlockExplorer
 
 initialized = False
@@ -29,6 +35,13 @@ CHAIN_ID = web3.eth.chain_id
 blockexplorer = BlockExplorer(CHAIN_ID)
 NULL_ADDRESS = "0x0000000000000000000000000000000000000000"
 
+# the events are handled on a single, persistent event loop, so the async clients keep their connections
+EVENT_LOOP = asyncio.new_event_loop()
+rpc_client = AsyncRpcClient(get_json_rpc_url(), RPC_MAX_CONCURRENCY)
+explorer_client = AsyncHttpClient(EXPLORER_MAX_CONCURRENCY)
+# is EOA, first tx and classification of the seen addresses, persisted in the database across restarts
+address_facts = AddressFacts(ADDRESS_FACTS_CACHE_SIZE, ADDRESS_FACTS_MAX_AGE_SECONDS)
+
 DENOMINATOR_COUNT_FUNDING = 0
 DENOMINATOR_COUNT_LAUNDERING = 0
 
@@ -66,6 +79,10 @@ async def analyze_transaction(transaction_event: forta_agent.transaction_event.T
     if transaction_event.to is None:
         return findings
 
+    # the addresses the transfers need analyzed are collected first and analyzed concurrently
+    candidates, erc20_usd = collect_enrichment_candidates(transaction_event, confirmed_targets_keys)
+    enrichment = await enrich_addresses(rpc_client, blockexplorer, explorer_client, candidates, timestamp, address_facts)
+
     # means the amount of transferred native token (ETH for 1 chain id etc.)
     if transaction_event.transaction.value > 0:
         from_ = transaction_event.from_.lower()  # transaction's initiator
@@ -80,7 +97,7 @@ async def analyze_transaction(transaction_event: forta_agent.transaction_event.T
             if from_ in confirmed_targets_keys and to not in confirmed_targets_keys:  # if we know initiator...
                 DENOMINATOR_COUNT_FUNDING += 1
                 if confirmed_targets[from_]['type'] != 'dex' or not DEX_DISABLE:
-                    eoa, newly_created = analyze_address(address=to, timestamp=timestamp)  # check is target eoa? and is it newly created?
+                    eoa, newly_created = analyzed_address(enrichment, address=to, timestamp=timestamp)  # check is target eoa? and is it newly created?
                     if len(findings) < 10 and eoa:
                         # append our finding
                         labels = [
@@ -136,7 +153,7 @@ async def analyze_transaction(transaction_event: forta_agent.transaction_event.T
 
                 if to in confirmed_targets and not (label == 'dex' and DEX_DISABLE) and \
                 (usd >= thresholds["LAUNDERING_LOW"] or INFO_ALERTS):
-                    eoa, newly_created = analyze_address(address=from_, timestamp=timestamp)  # check is target eoa? and is it newly created?
+                    eoa, newly_created = analyzed_address(enrichment, address=from_, timestamp=timestamp)  # check is target eoa? and is it newly created?
                     if len(findings) < 10 and eoa:
                         # append our finding
                         findings.append(
@@ -147,7 +164,7 @@ async def analyze_transaction(transaction_event: forta_agent.transaction_event.T
             if CHAIN_ID == 42161:
                 if transaction_event.transaction.nonce == 0:
                     DENOMINATOR_COUNT_FUNDING += 1
-                    eoa, newly_created = analyze_address(address=to, timestamp=timestamp)
+                    eoa, newly_created = analyzed_address(enrichment, address=to, timestamp=timestamp)
                     if len(findings) < 10 and eoa:
                         # append our finding
                         labels = [
@@ -214,7 +231,7 @@ async def analyze_transaction(transaction_event: forta_agent.transaction_event.T
                     ]
 
                     if confirmed_targets[from_]['type'] != 'dex' or not DEX_DISABLE:
-                        eoa, newly_created = analyze_address(
+                        eoa, newly_created = analyzed_address(enrichment,
                             address=to, timestamp=timestamp)  # check is target eoa? and is it newly created?
                         if len(findings) < 10 and eoa:
                             # append our finding
@@ -256,7 +273,7 @@ async def analyze_transaction(transaction_event: forta_agent.transaction_event.T
 
                     if to in confirmed_targets and not (label == 'dex' and DEX_DISABLE) and \
                     (usd >= thresholds["LAUNDERING_LOW"] or INFO_ALERTS):
-                        eoa, newly_created = analyze_address(
+                        eoa, newly_created = analyzed_address(enrichment,
                             address=from_, timestamp=timestamp)  # check is target eoa? and is it newly created?
                         if len(findings) < 10 and eoa:
                             # append our finding
@@ -280,9 +297,10 @@ async def analyze_transaction(transaction_event: forta_agent.transaction_event.T
         # FUNDING
         if from_ in confirmed_targets_keys and to not in confirmed_targets_keys:
             DENOMINATOR_COUNT_FUNDING += 1
-            usd, token = calculate_usd_and_get_symbol(web3, event.address.lower(), ERC20_ABI, value)
+            usd, token = erc20_usd.get((event.address.lower(), from_, to, value)) or \
+                calculate_usd_and_get_symbol(web3, event.address.lower(), ERC20_ABI, value)
             if usd > thresholds["TRANSFER_THRESHOLD_IN_USD"] and (confirmed_targets[from_]['type'] != 'dex' or not DEX_DISABLE):
-                eoa, newly_created = analyze_address(address=to, timestamp=timestamp)
+                eoa, newly_created = analyzed_address(enrichment, address=to, timestamp=timestamp)
                 if len(findings) < 10 and eoa:
                     labels = [
                         {
@@ -318,11 +336,12 @@ async def analyze_transaction(transaction_event: forta_agent.transaction_event.T
                 label = "mixer"
             else:
                 label = confirmed_targets[to]['type']
-            usd, token = calculate_usd_and_get_symbol(web3, event.address.lower(), ERC20_ABI, value)
+            usd, token = erc20_usd.get((event.address.lower(), from_, to, value)) or \
+                calculate_usd_and_get_symbol(web3, event.address.lower(), ERC20_ABI, value)
             if usd > thresholds["TRANSFER_THRESHOLD_IN_USD"] and (
                     label != 'dex' or not DEX_DISABLE) and (
                     usd >= thresholds["LAUNDERING_LOW"] or INFO_ALERTS):
-                eoa, newly_created = analyze_address(address=from_, timestamp=timestamp)
+                eoa, newly_created = analyzed_address(enrichment, address=from_, timestamp=timestamp)
 
                 labels = [
                     {
@@ -363,7 +382,7 @@ async def analyze_transaction(transaction_event: forta_agent.transaction_event.T
             DENOMINATOR_COUNT_FUNDING += 1
             usd, token = calculate_usd_for_base_token(value, CHAIN_ID)
             if usd > thresholds["TRANSFER_THRESHOLD_IN_USD"] and (confirmed_targets[from_]['type'] != 'dex' or not DEX_DISABLE):
-                eoa, newly_created = analyze_address(address=to, timestamp=timestamp)
+                eoa, newly_created = analyzed_address(enrichment, address=to, timestamp=timestamp)
                 if len(findings) < 10 and eoa:
                     labels = [
                         {
@@ -403,7 +422,7 @@ async def analyze_transaction(transaction_event: forta_agent.transaction_event.T
             if usd > thresholds["TRANSFER_THRESHOLD_IN_USD"] and (
                     label != 'dex' or not DEX_DISABLE) and (
                     usd >= thresholds["LAUNDERING_LOW"] or INFO_ALERTS):
-                eoa, newly_created = analyze_address(address=from_, timestamp=timestamp)
+                eoa, newly_created = analyzed_address(enrichment, address=from_, timestamp=timestamp)
 
                 labels = [
                     {
@@ -430,17 +449,91 @@ async def analyze_transaction(transaction_event: forta_agent.transaction_event.T
     return findings
 
 
+def collect_enrichment_candidates(transaction_event, confirmed_targets_keys):
+    """
+    Collects the addresses that analyze_transaction will analyze, i.e. the counterparties of the confirmed targets in
+    the transfers above the thresholds, so they can be analyzed concurrently. Addresses that are missed here are
+    analyzed when needed.
+    @return: (list of addresses, dict (token, from, to, value) -> (usd, symbol) of the erc20 transfers priced)
+    """
+    candidates = []
+    erc20_usd = {}
+    mixers = mixer_addresses.get(CHAIN_ID, [])
+
+    def collect(from_, to, usd):
+        if usd <= thresholds["TRANSFER_THRESHOLD_IN_USD"] or from_ == NULL_ADDRESS or to == NULL_ADDRESS:
+            return
+        if from_ in confirmed_targets_keys and to not in confirmed_targets_keys:
+            candidates.append(to)
+        elif (to in confirmed_targets_keys and from_ not in confirmed_targets_keys or to in mixers) and \
+                (usd >= thresholds["LAUNDERING_LOW"] or INFO_ALERTS):
+            candidates.append(from_)
+
+    if transaction_event.transaction.value > 0:
+        from_ = transaction_event.from_.lower()
+        to = transaction_event.to.lower()
+        usd, _ = calculate_usd_for_base_token(transaction_event.transaction.value, CHAIN_ID)
+        collect(from_, to, usd)
+        if CHAIN_ID == 42161 and transaction_event.transaction.nonce == 0 and \
+                usd > thresholds["TRANSFER_THRESHOLD_IN_USD"] and from_ != NULL_ADDRESS and to != NULL_ADDRESS:
+            candidates.append(to)
+
+    if CHAIN_ID == 1 and transaction_event.traces:
+        for trace in transaction_event.traces:
+            value = trace.action.value
+            if value == 0 or not isinstance(value, int):
+                continue
+            usd, _ = calculate_usd_for_base_token(value, CHAIN_ID)
+            collect(trace.action.from_, trace.action.to, usd)
+
+    for event in [*transaction_event.filter_log(json.dumps(TRANSFER_EVENT_ABI))]:
+        from_ = extract_argument(event, 'from').lower()
+        to = extract_argument(event, 'to').lower()
+        value = extract_argument(event, 'value')
+        if from_ == NULL_ADDRESS or to == NULL_ADDRESS:
+            continue
+        if from_ in confirmed_targets_keys or to in confirmed_targets_keys or to in mixers:
+            key = (event.address.lower(), from_, to, value)
+            if key not in erc20_usd:
+                erc20_usd[key] = calculate_usd_and_get_symbol(web3, event.address.lower(), ERC20_ABI, value)
+            collect(from_, to, erc20_usd[key][0])
+
+    for invocation in transaction_event.filter_function(WITHDRAW_ETH_FUNCTION_ABI):
+        args = invocation[1]
+        usd, _ = calculate_usd_for_base_token(args['amount'], CHAIN_ID)
+        collect(args['address'].lower(), args['destination'].lower(), usd)
+
+    return candidates, erc20_usd
+
+
+def analyzed_address(enrichment, address, timestamp):
+    """
+    The result of analyze_address from the concurrently analyzed addresses, analyzes the address if it wasn't
+    :return: (bool, bool)
+    """
+    if address in enrichment:
+        return enrichment[address]
+    return analyze_address(address, timestamp)
+
+
 def is_eoa(address):
     """
     This small function checks is address EOA or not
     :param address: target address
     :return: bool
     """
+    eoa = address_facts.get(address, 'is_eoa')
+    if eoa is not None:
+        return eoa
+
     try:
-        return web3.eth.getCode(Web3.toChecksumAddress(address)) == b''
+        eoa = web3.eth.getCode(Web3.toChecksumAddress(address)) == b''
     except:
         return False
 
+    address_facts.update(address, is_eoa=eoa)
+    return eoa
+
 
 def analyze_address(address, timestamp):
     """
@@ -472,11 +565,7 @@ def update_possible_targets(address, block):
     if address in confirmed_targets.keys():
         return
 
-    if address not in possible_targets.keys():
-        possible_targets[address] = {'amount': 1, 'expire_block': block + blocks_in_memory}
-    else:
-        possible_targets[address] = {'amount': possible_targets[address]['amount'] + 1,
-                                     'expire_block': block + blocks_in_memory}
+    possible_targets.add(address, block)
 
 
 async def analyze_blocks(block_event: forta_agent.block_event.BlockEvent) -> None:
@@ -489,25 +578,40 @@ async def analyze_blocks(block_event: forta_agent.block_event.BlockEvent) -> Non
     """
     global possible_targets
     global confirmed_targets
-    if int(block_event.block_number) % 20 == 0:
-        update_top_currencies_info()
-
     block = int(block_event.block_number)
 
-    # Save address that have enough transfers
-    newly_confirmed_targets = [k for k, v in possible_targets.items() if v['amount'] >= TRANSFERS_TO_CONFIRM]
-    # Remove them from possibles
-    possible_targets = {k: v for k, v in possible_targets.items() if
-                        v['expire_block'] >= block and v['amount'] < TRANSFERS_TO_CONFIRM}
+    # Forget the addresses that expire at this block
+    possible_targets.expire(block)
+    # and take the addresses that have enough transfers
+    newly_confirmed_targets = possible_targets.pop_confirmed()
+
+    async def classify(address):
+        eoa = await is_eoa_async(rpc_client, address, address_facts)
+        target_type = address_facts.get(address, 'classification')
+        if target_type is None:
+            target_type = await fetch_address_classification_async(explorer_client, address, eoa, CHAIN_ID)
+            if target_type is None:
+                # not cached, the address is classified again the next time it is confirmed
+                target_type = 'unknown'
+            else:
+                address_facts.update(address, classification=target_type)
+        return address, eoa, target_type
 
-    # Write do the db
-    for confirmed_target in newly_confirmed_targets:
-        eoa = is_eoa(address=confirmed_target)
-        target_type = check_is_mixer_bridge_exchange(address=confirmed_target, is_eoa=eoa, chain_id=CHAIN_ID)
+    rows = []
+    for confirmed_target, eoa, target_type in await asyncio.gather(*[classify(t) for t in newly_confirmed_targets]):
         confirmed_targets[confirmed_target] = {'type': target_type,
                                                'is_eoa': eoa}
+        rows.append({'address': confirmed_target, 'address_type': target_type, 'is_eoa': eoa})
+
+    # Write to the db in one transaction
+    if len(rows) > 0:
         addresses = db_utils.get_addresses()
-        await addresses.paste_row({'address': confirmed_target, 'address_type': target_type, 'is_eoa': eoa})
+        await addresses.paste_rows(rows)
+
+    # Save the facts learned about the addresses since the last block
+    await address_facts.flush(db_utils.get_address_facts())
+    if block % ADDRESS_FACTS_STATS_INTERVAL_BLOCKS == 0:
+        address_facts.log_stats()
 
 
 async def my_initialize():
@@ -519,16 +623,21 @@ async def my_initialize():
     global possible_targets
     global confirmed_targets
 
-    possible_targets = {}
+    possible_targets = PossibleTargets(TRANSFERS_TO_CONFIRM, blocks_in_memory)
     confirmed_targets = {}
 
     with open("./src/gecko_initial.json", 'r') as gecko_initial_file:  # get abi from the file
         gecko_initial = json.load(gecko_initial_file)
-    update_top_currencies_info(initial_values=gecko_initial)
+    # the prices are refreshed in the background, starting right away; the initial ones are as old as the file
+    price_service.set_top_currencies(gecko_initial, updated=os.path.getmtime("./src/gecko_initial.json"))
+    price_service.start()
 
     # initialize database tables
-    addresses_table = await init_async_db(TEST_MODE)
-    db_utils.set_tables(addresses_table)
+    addresses_table, address_facts_table = await init_async_db(TEST_MODE)
+    db_utils.set_tables(addresses_table, address_facts_table)
+
+    # warm the address facts cache
+    await address_facts.warm(address_facts_table)
 
     # export known pools from the database to the variable
     addresses = await addresses_table.get_all_rows()
@@ -566,7 +675,7 @@ def provide_handle_transaction():
     """
 
     def wrapped_handle_transaction(transaction_event: forta_agent.transaction_event.TransactionEvent) -> list:
-        return [finding for findings in asyncio.run(main(transaction_event)) for finding in findings]
+        return [finding for findings in EVENT_LOOP.run_until_complete(main(transaction_event)) for finding in findings]
 
     return wrapped_handle_transaction
 
@@ -578,7 +687,7 @@ def provide_handle_block():
     """
 
     def wrapped_handle_block(block_event: forta_agent.block_event.BlockEvent) -> list:
-        return [finding for findings in asyncio.run(main(block_event)) for finding in findings]
+        return [finding for findings in EVENT_LOOP.run_until_complete(main(block_event)) for finding in findings]
 
     return wrapped_handle_block
 
@@ -14,3 +14,30 @@ def is_newly_created(address, blockexplorer, timestamp):
             return False
     except:
         return False
+
+
+async def get_first_tx_async(address, blockexplorer, client, address_facts=None):
+    """
+    The first tx of the address, from the address facts when they know it
+    """
+    if address_facts is not None:
+        first_tx_timestamp = address_facts.get(address, 'first_tx_timestamp')
+        if first_tx_timestamp is not None:
+            return datetime.fromtimestamp(first_tx_timestamp)
+
+    first_tx = await blockexplorer.get_first_tx_async(client, address)
+    # only the first tx of the addresses that have txs is cached by the explorer, the others may be funded later
+    if address_facts is not None and address in blockexplorer.first_tx_cache:
+        address_facts.update(address, first_tx_timestamp=int(first_tx.timestamp()))
+    return first_tx
+
+
+async def is_newly_created_async(address, blockexplorer, client, timestamp, address_facts=None):
+    try:
+        first_tx = await get_first_tx_async(address, blockexplorer, client, address_facts)
+
+        tx_datetime = datetime.fromtimestamp(timestamp)
+
+        return first_tx > tx_datetime - timedelta(days=MIN_AGE_IN_DAYS)
+    except:
+        return False
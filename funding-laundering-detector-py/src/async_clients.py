@@ -0,0 +1,65 @@
+import asyncio
+
+import aiohttp
+from web3 import Web3
+
+from src.config import HTTP_TIMEOUT_SECONDS
+
+
+class AsyncHttpClient:
+    """
+    aiohttp client that allows at most max_concurrency requests in flight, so concurrent lookups don't exceed the rate
+    limits of a provider. The session and semaphore are created on first use, so the client must be used from a
+    single event loop.
+    """
+
+    def __init__(self, max_concurrency: int):
+        self.max_concurrency = max_concurrency
+        self.semaphore = None
+        self.session = None
+
+    def _ensure_session(self):
+        if self.session is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+            self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT_SECONDS))
+
+    async def get(self, url: str, headers: dict = None) -> (int, str):
+        """
+        :return: (status code, text)
+        """
+        self._ensure_session()
+        async with self.semaphore:
+            async with self.session.get(url, headers=headers) as response:
+                return response.status, await response.text()
+
+    async def post_json(self, url: str, payload) -> object:
+        self._ensure_session()
+        async with self.semaphore:
+            async with self.session.post(url, json=payload) as response:
+                return await response.json(content_type=None)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+class AsyncRpcClient(AsyncHttpClient):
+    """
+    JSON-RPC client for the lookups of the agent
+    """
+
+    def __init__(self, url: str, max_concurrency: int):
+        super().__init__(max_concurrency)
+        self.url = url
+        self.request_id = 0
+
+    async def request(self, method: str, params: list):
+        self.request_id += 1
+        data = await self.post_json(self.url, {"jsonrpc": "2.0", "id": self.request_id, "method": method, "params": params})
+        if "error" in data:
+            raise ValueError(f"{method} failed: {data['error']}")
+        return data["result"]
+
+    async def get_code(self, address: str, block: str = "latest") -> str:
+        return await self.request("eth_getCode", [Web3.toChecksumAddress(address), block])
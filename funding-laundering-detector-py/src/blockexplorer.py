@@ -3,6 +3,7 @@ import logging
 import datetime
 import requests
 import pandas as pd
+from collections import OrderedDict
 from functools import lru_cache
 
 from src.storage import get_secrets
@@ -12,8 +13,10 @@ class BlockExplorer:
     api_key = ""
     host = ""
     SECRETS_JSON = None
+    FIRST_TX_CACHE_SIZE = 100_000
 
     def __init__(self, chain_id):
+        self.first_tx_cache = OrderedDict()  # address -> datetime of the first tx, for get_first_tx_async
         if BlockExplorer.SECRETS_JSON is None:
             BlockExplorer.SECRETS_JSON = get_secrets()
 
@@ -58,3 +61,30 @@ class BlockExplorer:
         else:
             logging.warn(
                 "Unable obtain tx for account. Etherscan returned status code " + str(response.status_code))
+
+    async def get_first_tx_async(self, client, address: str) -> datetime:
+        """
+        get_first_tx using an AsyncHttpClient, so the lookups of several addresses can run concurrently
+        """
+        if address in self.first_tx_cache:
+            self.first_tx_cache.move_to_end(address)
+            return self.first_tx_cache[address]
+
+        url = self.host + \
+            f"/api?module=account&action=txlist&address={address}&startblock=0&endblock=999999999&page=1&offset=10&sort=asc&apikey={self.api_key}"
+        status, text = await client.get(url)
+        if status != 200:
+            logging.warning(
+                "Unable obtain tx for account. Etherscan returned status code " + str(status))
+            return None
+
+        result = json.loads(text)["result"]
+        if len(result) == 0:
+            # not cached, the address may be funded later
+            return datetime.datetime.fromtimestamp(int(datetime.datetime.now().timestamp()))
+
+        first_tx = datetime.datetime.fromtimestamp(min(int(tx["timeStamp"]) for tx in result))
+        self.first_tx_cache[address] = first_tx
+        if len(self.first_tx_cache) > BlockExplorer.FIRST_TX_CACHE_SIZE:
+            self.first_tx_cache.popitem(last=False)
+        return first_tx
@@ -1,23 +1,33 @@
 import requests
 from web3 import Web3
+from web3.exceptions import BadFunctionCallOutput, ContractLogicError
 import json
-from time import sleep
+import logging
+import os
+import threading
+import time
+from queue import Queue, Empty
 
-global top_currencies_info
-global top_currencies_info_back
+from src.config import PRICE_REFRESH_INTERVAL_SECONDS, PRICE_MAX_STALENESS_SECONDS, TOKEN_METADATA_PATH
 
 with open("./src/gecko_tokens.json", 'r') as file:
     gecko_tokens = json.load(file)
 
+# gecko ids of the tokens by symbol, several tokens can share a symbol
+gecko_token_ids = {}
+for gecko_token in gecko_tokens:
+    gecko_token_ids.setdefault(gecko_token['symbol'], []).append(gecko_token['id'])
 
-def update_top_currencies_info(initial_values=None):
+# native token symbol by chain id, other chains use avax
+BASE_TOKEN_SYMBOLS = {1: 'eth', 137: 'matic', 10: 'eth', 56: 'bnb', 250: 'ftm', 42161: 'eth'}
+BASE_TOKEN_DECIMALS = 18
+
+
+def fetch_top_currencies_info():
     """
-    Request latest prices from Gecko API
-    :return:
+    Request latest prices of the top 250 currencies from Gecko API
+    :return: list of the currencies info or None if the request failed
     """
-    global top_currencies_info
-    global top_currencies_info_back
-
     try:
         headers = {
             'accept': 'application/json',
@@ -37,84 +47,242 @@ def update_top_currencies_info(initial_values=None):
             if tci['id'] == 'bitcoin':
                 with open("./src/gecko_initial.json", 'w') as gecko_initial_file:  # get abi from the file
                     json.dump(top_currencies_info, gecko_initial_file)
-                break
-
+                return top_currencies_info
     except Exception as e:
-        if initial_values:
-            top_currencies_info = initial_values
-        else:
-            top_currencies_info = top_currencies_info_back
-    top_currencies_info_back = top_currencies_info
-
+        logging.warning(f"Failed to fetch the top currencies from Gecko API: {e}")
+    return None
 
-def fetch_token_price(symbol, amount, gecko_tokens, retries=3, delay=0.5):
-    for token in gecko_tokens:
-        if token['symbol'] == symbol:
-            id_ = token['id']
 
-            headers = {
-                'accept': 'application/json',
-            }
+def fetch_token_price(symbol, retries=3, delay=0.5):
+    """
+    Request the price of a token that is not in the top currencies from Gecko API
+    :return: price in USD or None if the symbol is unknown or the API failed
+    """
+    for id_ in gecko_token_ids.get(symbol, []):
+        headers = {
+            'accept': 'application/json',
+        }
 
-            params = {
-                'ids': id_,
-                'vs_currencies': 'usd',
-            }
+        params = {
+            'ids': id_,
+            'vs_currencies': 'usd',
+        }
 
-            for attempt in range(retries):
+        for attempt in range(retries):
+            try:
                 response = requests.get('https://api.coingecko.com/api/v3/simple/price', params=params, headers=headers)
-
                 if response.status_code == 200:
                     data = response.json()
                     if id_ in data and 'usd' in data[id_]:
-                        token_price = data[id_].get('usd', 0)
-                        return token_price * amount
+                        return data[id_].get('usd', 0)
                 else:
-                    print(f"Warning: Received status code {response.status_code} from CoinGecko API.")
+                    logging.warning(f"Received status code {response.status_code} from CoinGecko API.")
+            except Exception as e:
+                logging.warning(f"Failed to fetch the price of {symbol} from CoinGecko API: {e}")
 
-                sleep(delay)  # Delay before next attempt
+            time.sleep(delay)  # Delay before next attempt
 
-    print("Error: Symbol not found or API failed to return valid data.")
-    return 0
+    logging.warning(f"Symbol {symbol} not found or API failed to return valid data.")
+    return None
 
-def calculate_usd_and_get_symbol(web3, token_address, erc20_abi, amount):
+
+def is_not_erc20_error(error):
     """
-    This function is responsible for calling erc20 functions like symbols and decimals to be able to calculate the price
-    using data from Gecko
-    :param web3:
-    :param token_address:
-    :param erc20_abi:
-    :param amount:
-    :return:
+    :return: whether the error of a symbol() or decimals() call means that the contract isn't an erc20 token (the call
+             reverted or returned data that doesn't decode), rather than a transient failure such as an RPC timeout
     """
-    try:
-        global top_currencies_info
+    if isinstance(error, (ContractLogicError, BadFunctionCallOutput)):
+        return True
+    # the error responses of the node are raised as ValueError
+    return isinstance(error, ValueError) and 'revert' in str(error).lower()
 
-        token_contract = web3.eth.contract(address=Web3.toChecksumAddress(token_address), abi=erc20_abi)
-        symbol = token_contract.functions.symbol().call().lower()
-        decimals = token_contract.functions.decimals().call()
-        amount = amount / 10 ** decimals
 
-        token_price = None
+class PriceService:
+    """
+    Prices tokens without blocking on the network once the tokens have been seen:
+    - the prices of the top currencies are kept in a symbol -> price index, refreshed in the background; the last known
+      prices are kept while the refresh fails (e.g. rate limited), with a warning once they are older than max_staleness
+    - the prices of the other tokens are fetched in the background the first time they are needed (they are priced at 0
+      until then) and used while they are younger than max_staleness
+    - the symbol and decimals of the tokens are cached by contract address and persisted to metadata_path
+    """
 
-        # Search the token in the top 250
+    def __init__(self, fetch_markets=fetch_top_currencies_info, fetch_price=fetch_token_price,
+                 metadata_path=TOKEN_METADATA_PATH, refresh_interval=PRICE_REFRESH_INTERVAL_SECONDS,
+                 max_staleness=PRICE_MAX_STALENESS_SECONDS):
+        self.fetch_markets = fetch_markets
+        self.fetch_price = fetch_price
+        self.metadata_path = metadata_path
+        self.refresh_interval = refresh_interval
+        self.max_staleness = max_staleness
+        self.lock = threading.Lock()
+        self.top_prices = {}  # symbol -> price of the top currencies
+        self.top_prices_updated = 0
+        self.top_prices_stale = False  # the top prices went stale, logged once until they are refreshed
+        self.token_prices = {}  # symbol -> (price, fetched at) of the other tokens
+        self.pending = set()  # symbols queued for a price fetch
+        self.queue = Queue()
+        self.metadata = {}  # token address -> (symbol, decimals)
+        self.metadata_dirty = False
+        self.failed_metadata = set()  # token addresses that aren't erc20 tokens, not persisted; transient failures aren't cached
+        self.thread = None
+        self.load_metadata()
+
+    def set_top_currencies(self, top_currencies_info, updated=None):
+        """
+        :param updated: time the prices were fetched at, now by default
+        """
+        top_prices = {}
         for tci in top_currencies_info:
-            if tci['symbol'] == symbol:
-                token_price = tci['current_price']
-                break
+            # the first (largest market cap) currency of a symbol wins
+            top_prices.setdefault(tci['symbol'], tci['current_price'])
+        with self.lock:
+            self.top_prices = top_prices
+            self.top_prices_updated = time.time() if updated is None else updated
+            self.top_prices_stale = False
 
-        total_in_usd = 0
+    def _last_top_prices(self):
+        """
+        :return: the last known top prices, a warning is logged once they are older than max_staleness; must be called holding the lock
+        """
+        age = time.time() - self.top_prices_updated
+        if age >= self.max_staleness and not self.top_prices_stale and self.top_prices:
+            self.top_prices_stale = True
+            logging.warning(f"The prices of the top currencies are stale (updated {age:.0f}s ago), the last known prices "
+                            f"are used until they are refreshed")
+        return self.top_prices
 
-        # If the token is hidden gem then we need advanced search...
-        if token_price:
-            total_in_usd = amount * token_price
-        else:
-            total_in_usd = fetch_token_price(symbol, amount, gecko_tokens)
+    def refresh_top_currencies(self):
+        top_currencies_info = self.fetch_markets()
+        if top_currencies_info:
+            self.set_top_currencies(top_currencies_info)
 
-        return total_in_usd, symbol
-    except Exception as e:
+    def refresh_token_price(self, symbol):
+        price = self.fetch_price(symbol)
+        with self.lock:
+            # unknown tokens are priced at 0 as well, so they are not requested again until the price is stale
+            self.token_prices[symbol] = (price if price else 0, time.time())
+            self.pending.discard(symbol)
+
+    def get_base_price(self, symbol):
+        with self.lock:
+            return self._last_top_prices().get(symbol, 0)
+
+    def get_price(self, symbol):
+        """
+        :return: price in USD of the token or 0 if it is not known yet; unknown or stale prices are queued for a refresh
+        """
+        with self.lock:
+            price = self._last_top_prices().get(symbol)
+            if price:
+                return price
+            entry = self.token_prices.get(symbol)
+            if entry is not None and time.time() - entry[1] < self.max_staleness:
+                return entry[0]
+            if symbol not in self.pending:
+                self.pending.add(symbol)
+                self.queue.put(symbol)
+        return 0
+
+    def get_token_metadata(self, web3, token_address, erc20_abi):
+        """
+        :return: (symbol, decimals) of the token or None if it isn't an erc20 token
+        """
+        with self.lock:
+            if token_address in self.metadata:
+                return self.metadata[token_address]
+            if token_address in self.failed_metadata:
+                return None
+
+        try:
+            token_contract = web3.eth.contract(address=Web3.toChecksumAddress(token_address), abi=erc20_abi)
+            metadata = (token_contract.functions.symbol().call().lower(), token_contract.functions.decimals().call())
+        except Exception as e:
+            if is_not_erc20_error(e):
+                with self.lock:
+                    self.failed_metadata.add(token_address)
+            else:
+                logging.warning(f"Failed to fetch the metadata of the token {token_address}, it is requested again next time: {e}")
+            return None
+
+        with self.lock:
+            self.metadata[token_address] = metadata
+            self.metadata_dirty = True
+        return metadata
+
+    def load_metadata(self):
+        if self.metadata_path is None or not os.path.exists(self.metadata_path):
+            return
+        try:
+            with open(self.metadata_path, 'r') as metadata_file:
+                self.metadata = {address: tuple(metadata) for address, metadata in json.load(metadata_file).items()}
+        except Exception as e:
+            logging.warning(f"Failed to load the token metadata from {self.metadata_path}: {e}")
+
+    def save_metadata(self):
+        if self.metadata_path is None:
+            return
+        with self.lock:
+            if not self.metadata_dirty:
+                return
+            metadata = dict(self.metadata)
+            self.metadata_dirty = False
+        try:
+            with open(f"{self.metadata_path}.tmp", 'w') as metadata_file:
+                json.dump(metadata, metadata_file)
+            os.replace(f"{self.metadata_path}.tmp", self.metadata_path)
+        except Exception as e:
+            logging.warning(f"Failed to save the token metadata to {self.metadata_path}: {e}")
+
+    def run(self):
+        """
+        Refreshes the top currencies every refresh_interval and fetches the queued token prices in between
+        """
+        next_refresh = time.time()
+        while True:
+            try:
+                symbol = self.queue.get(timeout=max(0, next_refresh - time.time()))
+                self.refresh_token_price(symbol)
+            except Empty:
+                pass
+            except Exception as e:
+                logging.warning(f"Failed to refresh the token price: {e}")
+
+            if time.time() >= next_refresh:
+                try:
+                    self.refresh_top_currencies()
+                    self.save_metadata()
+                except Exception as e:
+                    logging.warning(f"Failed to refresh the top currencies: {e}")
+                next_refresh = time.time() + self.refresh_interval
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+
+price_service = PriceService()
+
+
+def calculate_usd_and_get_symbol(web3, token_address, erc20_abi, amount):
+    """
+    This function is responsible for getting the symbol and decimals of the token to be able to calculate the price
+    using data from Gecko
+    :param web3:
+    :param token_address:
+    :param erc20_abi:
+    :param amount:
+    :return:
+    """
+    metadata = price_service.get_token_metadata(web3, token_address, erc20_abi)
+    if metadata is None:
         return 0, 'NOT_ERC20'
 
+    symbol, decimals = metadata
+    amount = amount / 10 ** decimals
+    return amount * price_service.get_price(symbol), symbol
+
 
 def calculate_usd_for_base_token(amount, chain_id):
     """
@@ -123,39 +291,6 @@ def calculate_usd_for_base_token(amount, chain_id):
     :param chain_id:
     :return:
     """
-    global top_currencies_info
-
-    if chain_id == 1:
-        symbol = 'eth'
-        decimals = 18
-    elif chain_id == 137:
-        symbol = 'matic'
-        decimals = 18
-    elif chain_id == 10:
-        symbol = 'eth'
-        decimals = 18
-    elif chain_id == 56:
-        symbol = 'bnb'
-        decimals = 18
-    elif chain_id == 250:
-        symbol = 'ftm'
-        decimals = 18
-    elif chain_id == 42161:
-        symbol = 'eth'
-        decimals = 18
-    else:
-        symbol = 'avax'
-        decimals = 18
-
-    token_price = 0
-    try:
-        for tci in top_currencies_info:
-            if tci['symbol'] == symbol:
-                token_price = tci['current_price']
-                break
-    except:
-        print("Something was wrong with gecko API")
-
-    amount = amount / 10 ** decimals
-    total_in_usd = amount * token_price
-    return total_in_usd, symbol
+    symbol = BASE_TOKEN_SYMBOLS.get(chain_id, 'avax')
+    amount = amount / 10 ** BASE_TOKEN_DECIMALS
+    return amount * price_service.get_base_price(symbol), symbol
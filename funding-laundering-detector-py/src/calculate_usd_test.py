@@ -0,0 +1,137 @@
+import os
+import time
+
+from src.calculate_usd import PriceService
+
+TOP_CURRENCIES = [{'id': 'ethereum', 'symbol': 'eth', 'current_price': 2000},
+                  {'id': 'tether', 'symbol': 'usdt', 'current_price': 1},
+                  {'id': 'bridged-ether', 'symbol': 'eth', 'current_price': 1990}]
+USDT_ADDRESS = "0xdac17f958d2ee523a2206206994597c13d831ec7"
+METADATA_PATH = "./calculate_usd_test_metadata.json"
+
+
+class FetchPriceMock:
+    def __init__(self, prices):
+        self.prices = prices
+        self.calls = []
+
+    def __call__(self, symbol):
+        self.calls.append(symbol)
+        return self.prices.get(symbol)
+
+
+class CallMock:
+    def __init__(self, value, calls):
+        self.value = value
+        self.calls = calls
+
+    def call(self):
+        self.calls.append(self.value)
+        if isinstance(self.value, Exception):
+            raise self.value
+        return self.value
+
+
+class Web3Mock:
+    def __init__(self, symbol="USDT", decimals=6):
+        self.eth = self
+        self.calls = []
+        self.symbol_value = symbol
+        self.decimals_value = decimals
+
+    def contract(self, address, abi):
+        self.functions = self
+        return self
+
+    def symbol(self):
+        return CallMock(self.symbol_value, self.calls)
+
+    def decimals(self):
+        return CallMock(self.decimals_value, self.calls)
+
+
+def price_service(prices=None, max_staleness=900):
+    service = PriceService(fetch_markets=lambda: TOP_CURRENCIES, fetch_price=FetchPriceMock(prices or {}),
+                           metadata_path=None, max_staleness=max_staleness)
+    service.refresh_top_currencies()
+    return service
+
+
+class TestPriceService:
+
+    def test_top_currencies_index(self):
+        service = price_service()
+        assert service.get_price('eth') == 2000, "the first currency of a symbol should be used"
+        assert service.get_base_price('usdt') == 1
+        assert service.get_base_price('btc') == 0
+
+    def test_unknown_token_doesnt_block(self):
+        service = price_service({'pepe': 0.5})
+        assert service.get_price('pepe') == 0, "unknown token should be priced at 0 until its price is fetched"
+        assert service.get_price('pepe') == 0
+        assert service.fetch_price.calls == []
+        assert service.queue.qsize() == 1, "the token should be queued once"
+
+        service.refresh_token_price(service.queue.get())
+        assert service.get_price('pepe') == 0.5
+
+    def test_stale_price_is_refetched(self):
+        service = price_service({'pepe': 0.5}, max_staleness=0.05)
+        service.get_price('pepe')
+        service.refresh_token_price(service.queue.get())
+        assert service.get_price('pepe') == 0.5
+        time.sleep(0.1)
+        assert service.get_price('pepe') == 0, "stale price shouldnt be used"
+        assert service.queue.qsize() == 1
+
+    def test_token_metadata_cache(self):
+        service = price_service()
+        web3 = Web3Mock()
+        assert service.get_token_metadata(web3, USDT_ADDRESS, []) == ('usdt', 6)
+        assert service.get_token_metadata(web3, USDT_ADDRESS, []) == ('usdt', 6)
+        assert web3.calls == ["USDT", 6], "symbol and decimals should be requested once"
+
+    def test_not_erc20(self):
+        service = price_service()
+        web3 = Web3Mock(symbol=ValueError("execution reverted"))
+        assert service.get_token_metadata(web3, USDT_ADDRESS, []) is None
+        assert service.get_token_metadata(web3, USDT_ADDRESS, []) is None
+        assert len(web3.calls) == 1
+
+    def test_metadata_transient_error_isnt_cached(self):
+        service = price_service()
+        web3 = Web3Mock(symbol=TimeoutError("read timed out"))
+        assert service.get_token_metadata(web3, USDT_ADDRESS, []) is None
+        assert USDT_ADDRESS not in service.failed_metadata
+
+        web3.symbol_value = "USDT"
+        assert service.get_token_metadata(web3, USDT_ADDRESS, []) == ('usdt', 6), "the token should be requested again"
+
+    def test_stale_top_prices(self):
+        service = price_service(max_staleness=900)
+        service.fetch_markets = lambda: None  # rate limited
+        service.set_top_currencies(TOP_CURRENCIES, updated=time.time() - 1000)
+        service.refresh_top_currencies()
+        assert service.get_base_price('eth') == 2000, "the last known top prices should be kept while the refresh fails"
+        assert service.get_price('eth') == 2000
+        assert service.top_prices_stale
+        assert service.queue.qsize() == 0
+
+        service.fetch_markets = lambda: [{'symbol': 'eth', 'current_price': 2100}]
+        service.refresh_top_currencies()
+        assert service.get_base_price('eth') == 2100
+        assert not service.top_prices_stale
+
+    def test_metadata_is_persisted(self):
+        try:
+            service = PriceService(fetch_markets=lambda: None, metadata_path=METADATA_PATH)
+            service.get_token_metadata(Web3Mock(), USDT_ADDRESS, [])
+            service.save_metadata()
+
+            restored = PriceService(fetch_markets=lambda: None, metadata_path=METADATA_PATH)
+            web3 = Web3Mock()
+            assert restored.get_token_metadata(web3, USDT_ADDRESS, []) == ('usdt', 6)
+            assert web3.calls == []
+        finally:
+            if os.path.exists(METADATA_PATH):
+                os.remove(METADATA_PATH)
@@ -40,3 +40,15 @@ BLOCKS_IN_MEMORY_VALUES = {
 }
 
 MIXER_ADDRESSES = {1: ["0x4025ee6512dbbda97049bcf5aa5d38c54af6be8a"], 42161: ["0x20c2a9430baa7251eb9143cbe80ac3968893d06c", "0x5ad95c537b002770a39dea342c4bb2b68b1497aa"]}
+
+PRICE_REFRESH_INTERVAL_SECONDS = 240  # Prices of the top currencies are refreshed in the background this often (~20 blocks on Ethereum)
+PRICE_MAX_STALENESS_SECONDS = 900  # Prices of the other tokens are not used once older than this, they are refetched in the background; the top currencies keep their last known prices, with a warning
+TOKEN_METADATA_PATH = "./token_metadata.json"  # Symbol and decimals of the seen tokens, so they are not requested again after a restart
+
+RPC_MAX_CONCURRENCY = 10  # Max concurrent JSON-RPC requests
+EXPLORER_MAX_CONCURRENCY = 5  # Max concurrent block explorer requests (API and pages)
+HTTP_TIMEOUT_SECONDS = 10  # Timeout of the async HTTP requests
+
+ADDRESS_FACTS_CACHE_SIZE = 100_000  # Max addresses whose facts (is EOA, first tx, classification) are kept in memory
+ADDRESS_FACTS_MAX_AGE_SECONDS = 7 * 24 * 60 * 60  # Facts older than this are fetched again (e.g. a contract can be deployed to an EOA address)
+ADDRESS_FACTS_STATS_INTERVAL_BLOCKS = 100  # The hit rate of the address facts is logged this often
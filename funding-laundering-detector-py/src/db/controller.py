@@ -22,5 +22,5 @@ async def init_async_db(test=False):
     async with engine.begin() as conn:
         await conn.run_sync(base.metadata.create_all)
 
-    addresses = await wrapped_methods(wrapped_models, session)
-    return addresses
+    addresses, address_facts = await wrapped_methods(wrapped_models, session)
+    return addresses, address_facts
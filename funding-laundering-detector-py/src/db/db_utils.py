@@ -1,13 +1,18 @@
 class DBUtils:
     def __init__(self):
         self.addresses = None
+        self.address_facts = None
         self.base = None
 
     def get_addresses(self):
         return self.addresses
 
-    def set_tables(self, addresses):
+    def get_address_facts(self):
+        return self.address_facts
+
+    def set_tables(self, addresses, address_facts):
         self.addresses = addresses
+        self.address_facts = address_facts
 
     def set_base(self, base):
         self.base = base
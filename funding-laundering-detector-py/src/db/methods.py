@@ -2,7 +2,7 @@ from sqlalchemy.future import select
 
 
 async def wrapped_methods(wrapped_models: list, async_session):
-    return Methods(wrapped_models[0], async_session)
+    return [Methods(model, async_session) for model in wrapped_models]
 
 
 def wrap_async(func):
@@ -31,6 +31,23 @@ class Methods:
         session.add(self.__model(**kwargs))
         await session.flush()
 
+    @wrap_async
+    async def paste_rows(self, rows: list, session):
+        session.add_all([self.__model(**kwargs) for kwargs in rows])
+        await session.flush()
+
+    @wrap_async
+    async def merge_rows(self, rows: list, session):
+        for kwargs in rows:
+            await session.merge(self.__model(**kwargs))
+        await session.flush()
+
+    @wrap_async
+    async def get_latest_rows(self, column: str, limit: int, session) -> list:
+        q = await session.execute(select(self.__model).order_by(getattr(self.__model, column).desc()).limit(limit))
+        data = q.scalars().all()
+        return data
+
     @wrap_async
     async def get_all_rows(self, session) -> tuple or None:
         q = await session.execute(select(self.__model))
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, Boolean
+from sqlalchemy import Column, String, Integer, Boolean, Float
 from sqlalchemy.ext.declarative import declarative_base
 
 
@@ -11,4 +11,13 @@ async def wrapped_models(Base: declarative_base):
         address_type = Column(String)
         is_eoa = Column(Boolean)
 
-    return [Addresses]
+    class AddressFacts(Base):
+        __tablename__ = 'address_facts'
+
+        address = Column(String, primary_key=True)
+        is_eoa = Column(Boolean)
+        first_tx_timestamp = Column(Integer)
+        classification = Column(String)
+        fetched_at = Column(Float, index=True)
+
+    return [Addresses, AddressFacts]
@@ -0,0 +1,55 @@
+import asyncio
+
+from hexbytes import HexBytes
+
+from src.analyze_newly_created import is_newly_created_async
+
+
+async def is_eoa_async(rpc_client, address, address_facts=None):
+    """
+    Checks is address EOA or not using an AsyncRpcClient
+    :param address: target address
+    :param address_facts: AddressFacts cache, optional
+    :return: bool
+    """
+    if address_facts is not None:
+        eoa = address_facts.get(address, 'is_eoa')
+        if eoa is not None:
+            return eoa
+
+    try:
+        eoa = HexBytes(await rpc_client.get_code(address)) == b''
+    except:
+        return False
+
+    if address_facts is not None:
+        address_facts.update(address, is_eoa=eoa)
+    return eoa
+
+
+async def analyze_address_async(rpc_client, blockexplorer, explorer_client, address, timestamp, address_facts=None):
+    """
+    Aggregates the results from EOA check and from newly_created check
+    :return: (bool, bool)
+    """
+    eoa = await is_eoa_async(rpc_client, address, address_facts)
+
+    # If the address is not an EOA, return False for newly_created without calling is_newly_created
+    if not eoa:
+        return False, False
+
+    newly_created = await is_newly_created_async(address, blockexplorer, explorer_client, timestamp, address_facts)
+
+    return eoa, newly_created
+
+
+async def enrich_addresses(rpc_client, blockexplorer, explorer_client, addresses, timestamp, address_facts=None):
+    """
+    Analyzes the addresses concurrently, the number of requests in flight is bounded by the clients
+    :return: dict address -> (eoa, newly_created)
+    """
+    addresses = list(dict.fromkeys(addresses))
+    results = await asyncio.gather(
+        *[analyze_address_async(rpc_client, blockexplorer, explorer_client, address, timestamp, address_facts)
+          for address in addresses])
+    return dict(zip(addresses, results))
@@ -0,0 +1,91 @@
+import asyncio
+import random
+from datetime import datetime, timedelta
+
+from src.enrichment import analyze_address_async, enrich_addresses
+
+RPC_LATENCY_SECONDS = 0.01
+EXPLORER_LATENCY_SECONDS = 0.02
+NOW = datetime(2023, 6, 1)
+
+
+class RpcClientMock:
+    """
+    getCode with a latency, bounded by a semaphore like AsyncRpcClient
+    """
+
+    def __init__(self, contracts, max_concurrency=4):
+        self.contracts = contracts
+        self.max_concurrency = max_concurrency
+        self.semaphore = None
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def get_code(self, address, block="latest"):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self.semaphore:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            await asyncio.sleep(RPC_LATENCY_SECONDS)
+            self.in_flight -= 1
+        return "0x6080" if address in self.contracts else "0x"
+
+
+class BlockExplorerMock:
+    def __init__(self, first_txs):
+        self.first_txs = first_txs
+        self.calls = []
+
+    async def get_first_tx_async(self, client, address):
+        self.calls.append(address)
+        await asyncio.sleep(EXPLORER_LATENCY_SECONDS)
+        return self.first_txs[address]
+
+
+def synthetic_blocks(n_blocks=10, transfers_per_block=10, seed=7):
+    """
+    blocks of random transfer counterparties with their code and first tx
+    """
+    rnd = random.Random(seed)
+    blocks, contracts, first_txs = [], set(), {}
+    for block in range(n_blocks):
+        addresses = [f"0x{rnd.getrandbits(160):040x}" for _ in range(transfers_per_block)]
+        for address in addresses:
+            if rnd.random() < 0.2:
+                contracts.add(address)
+            first_txs[address] = NOW - timedelta(days=rnd.choice([1, 30]))
+        blocks.append(addresses)
+    return blocks, contracts, first_txs
+
+
+class TestEnrichment:
+
+    def test_analyze_address(self):
+        rpc_client = RpcClientMock({"0xc"})
+        blockexplorer = BlockExplorerMock({"0xa": NOW - timedelta(days=1), "0xb": NOW - timedelta(days=30)})
+        enrichment = asyncio.run(enrich_addresses(rpc_client, blockexplorer, None, ["0xa", "0xb", "0xc", "0xa"], NOW.timestamp()))
+        assert enrichment == {"0xa": (True, True), "0xb": (True, False), "0xc": (False, False)}
+        assert sorted(blockexplorer.calls) == ["0xa", "0xb"], "contracts shouldnt be looked up in the explorer"
+
+    def test_replay(self):
+        blocks, contracts, first_txs = synthetic_blocks()
+
+        async def sequential():
+            rpc_client, blockexplorer = RpcClientMock(contracts), BlockExplorerMock(first_txs)
+            results = {}
+            for addresses in blocks:
+                for address in addresses:
+                    results[address] = await analyze_address_async(rpc_client, blockexplorer, None, address, NOW.timestamp())
+            return results
+
+        async def concurrent():
+            rpc_client, blockexplorer = RpcClientMock(contracts), BlockExplorerMock(first_txs)
+            results = {}
+            for addresses in blocks:
+                results.update(await enrich_addresses(rpc_client, blockexplorer, None, addresses, NOW.timestamp()))
+            return results, rpc_client
+
+        concurrent_results, rpc_client = asyncio.run(concurrent())
+        assert concurrent_results == asyncio.run(sequential())
+        assert rpc_client.max_in_flight == rpc_client.max_concurrency, "addresses of a block should be analyzed concurrently, up to the bound of the client"
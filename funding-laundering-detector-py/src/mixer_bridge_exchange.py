@@ -1,62 +1,91 @@
 import re
 import requests
 
+HEADERS_ETHERSCAN = {
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:107.0) Gecko/20100101 Firefox/107.0',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
+    'Accept-Language': 'en-GB,en;q=0.5',
+    'Referer': 'https://etherscan.io/txs',
+    'Alt-Used': 'etherscan.io',
+    'Connection': 'keep-alive',
+    'Upgrade-Insecure-Requests': '1',
+    'Sec-Fetch-Dest': 'document',
+    'Sec-Fetch-Mode': 'navigate',
+    'Sec-Fetch-Site': 'same-origin',
+    'Sec-Fetch-User': '?1',
+}
 
-def check_is_mixer_bridge_exchange(address, is_eoa, chain_id):
-    """
-    This function is used to parse the explorer and check if address is mixer, bridge, cex, dex
-    :param address:
-    :param is_eoa:
-    :param chain_id:
-    :return:
-    """
+RE_EXCHANGE = re.compile(r"\b(?:exchange|Exchange)\b")
+RE_BRIDGE = re.compile(r"\b(?:bridge|Bridge)\b")
+RE_DEX = re.compile(r"\b(?:Decentralized Exchange|decentralized exchange|dex|DEX)\b")
+
+
+def get_base_url(chain_id):
     if chain_id == 1:
-        base_url = "https://etherscan.io/address/"
+        return "https://etherscan.io/address/"
     elif chain_id == 137:
-        base_url = "https://polygonscan.com/address/"
+        return "https://polygonscan.com/address/"
     elif chain_id == 10:
-        base_url = "https://optimistic.etherscan.io/address/"
+        return "https://optimistic.etherscan.io/address/"
     elif chain_id == 56:
-        base_url = "https://bscscan.com/address/"
+        return "https://bscscan.com/address/"
     elif chain_id == 250:
-        base_url = "https://ftmscan.com/address/"
+        return "https://ftmscan.com/address/"
     elif chain_id == 42161:
-        base_url = "https://arbiscan.io/address/"
+        return "https://arbiscan.io/address/"
     else:
-        base_url = "https://etherscan.io/address/"
-
-    headers_etherscan = {
-        'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:107.0) Gecko/20100101 Firefox/107.0',
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
-        'Accept-Language': 'en-GB,en;q=0.5',
-        'Referer': 'https://etherscan.io/txs',
-        'Alt-Used': 'etherscan.io',
-        'Connection': 'keep-alive',
-        'Upgrade-Insecure-Requests': '1',
-        'Sec-Fetch-Dest': 'document',
-        'Sec-Fetch-Mode': 'navigate',
-        'Sec-Fetch-Site': 'same-origin',
-        'Sec-Fetch-User': '?1',
-    }
+        return "https://etherscan.io/address/"
 
-    try:
-        response = requests.get(f'{base_url}{address.lower()}', headers=headers_etherscan)
-        re_exchange = re.compile(r"\b(?:exchange|Exchange)\b")
-        number_of_word_exchange = len(re_exchange.findall(response.text))
-        re_bridge = re.compile(r"\b(?:bridge|Bridge)\b")
-        number_of_word_bridge = len(re_bridge.findall(response.text))
-        re_dex = re.compile(r"\b(?:Decentralized Exchange|decentralized exchange|dex|DEX)\b")
-        number_of_word_dex = len(re_dex.findall(response.text))
-
-        if number_of_word_bridge > number_of_word_exchange and not is_eoa:
-            return 'bridge'
-        elif is_eoa:
-            return 'exchange'
-        elif not is_eoa and number_of_word_dex > 2:
-            return 'dex'
-        else:
-            return 'mixer'
 
+def classify_address_page(text, is_eoa):
+    """
+    Classifies the address as mixer, bridge, cex, dex from its explorer page
+    :param text: explorer page of the address
+    :param is_eoa:
+    :return:
+    """
+    number_of_word_exchange = len(RE_EXCHANGE.findall(text))
+    number_of_word_bridge = len(RE_BRIDGE.findall(text))
+    number_of_word_dex = len(RE_DEX.findall(text))
+
+    if number_of_word_bridge > number_of_word_exchange and not is_eoa:
+        return 'bridge'
+    elif is_eoa:
+        return 'exchange'
+    elif not is_eoa and number_of_word_dex > 2:
+        return 'dex'
+    else:
+        return 'mixer'
+
+
+def check_is_mixer_bridge_exchange(address, is_eoa, chain_id):
+    """
+    This function is used to parse the explorer and check if address is mixer, bridge, cex, dex
+    :param address:
+    :param is_eoa:
+    :param chain_id:
+    :return:
+    """
+    try:
+        response = requests.get(f'{get_base_url(chain_id)}{address.lower()}', headers=HEADERS_ETHERSCAN)
+        return classify_address_page(response.text, is_eoa)
     except Exception as e:
         print(f"Unable to check the type of the address ({address}): {e}")
         return 'unknown'
+
+
+async def fetch_address_classification_async(client, address, is_eoa, chain_id):
+    """
+    Classifies the address from its explorer page fetched with an AsyncHttpClient, so several addresses can be checked concurrently
+    :return: the classification, None if the page couldn't be fetched with a 200 response (e.g. rate limited)
+    """
+    try:
+        status, text = await client.get(f'{get_base_url(chain_id)}{address.lower()}', headers=HEADERS_ETHERSCAN)
+        if status != 200:
+            print(f"Unable to check the type of the address ({address}): status {status}")
+            return None
+        return classify_address_page(text, is_eoa)
+    except Exception as e:
+        print(f"Unable to check the type of the address ({address}): {e}")
+        return None
+
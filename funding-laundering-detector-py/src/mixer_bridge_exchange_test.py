@@ -0,0 +1,28 @@
+import asyncio
+
+from src.mixer_bridge_exchange import fetch_address_classification_async
+
+BRIDGE_PAGE = "Token Bridge: the bridge of the exchange, a bridge"
+
+
+class HttpClientMock:
+    def __init__(self, status, text):
+        self.status = status
+        self.text = text
+
+    async def get(self, url, headers=None):
+        if self.status is None:
+            raise ConnectionError("connection reset")
+        return self.status, self.text
+
+
+class TestMixerBridgeExchange:
+
+    def test_classify(self):
+        assert asyncio.run(fetch_address_classification_async(HttpClientMock(200, BRIDGE_PAGE), "0xa", False, 1)) == 'bridge'
+
+    def test_error_status_is_not_classified(self):
+        # None rather than a classification, so the agent doesn't cache it
+        for status in [403, 429, 500, None]:
+            assert asyncio.run(fetch_address_classification_async(HttpClientMock(status, BRIDGE_PAGE), "0xa", False, 1)) is None
+            assert asyncio.run(fetch_address_classification_async(HttpClientMock(status, ""), "0xa", True, 1)) is None
@@ -0,0 +1,74 @@
+import heapq
+
+
+class PossibleTargets:
+    """
+    Addresses seen in transfers that are not confirmed targets yet.
+    The addresses are bucketed by the block they expire at, so expiring them only touches the buckets that are due,
+    and the addresses that reach the transfers to confirm are queued, so confirming them doesn't scan the tracked addresses.
+    """
+
+    def __init__(self, transfers_to_confirm: int, blocks_in_memory: int):
+        self.transfers_to_confirm = transfers_to_confirm
+        self.blocks_in_memory = blocks_in_memory
+        self.targets = {}  # address -> {'amount': transfers seen, 'expire_block': block the address expires after}
+        self.buckets = {}  # expire block -> set of addresses
+        self.bucket_heap = []  # expire blocks of the buckets
+        self.confirmed = {}  # addresses that reached the transfers to confirm, in confirmation order
+
+    def __len__(self) -> int:
+        return len(self.targets)
+
+    def __contains__(self, address) -> bool:
+        return address in self.targets or address in self.confirmed
+
+    def add(self, address: str, block: int) -> None:
+        """
+        Counts a transfer of the address and pushes its expiry back
+        :param address: address seen in a transfer
+        :param block: block of the transfer
+        """
+        if address in self.confirmed:
+            return
+
+        expire_block = block + self.blocks_in_memory
+        target = self.targets.get(address)
+        if target is None:
+            target = {'amount': 0, 'expire_block': expire_block}
+            self.targets[address] = target
+        else:
+            self.buckets[target['expire_block']].discard(address)
+            target['expire_block'] = expire_block
+
+        target['amount'] += 1
+        if target['amount'] >= self.transfers_to_confirm:
+            del self.targets[address]
+            self.confirmed[address] = None
+            return
+
+        bucket = self.buckets.get(expire_block)
+        if bucket is None:
+            bucket = self.buckets[expire_block] = set()
+            heapq.heappush(self.bucket_heap, expire_block)
+        bucket.add(address)
+
+    def expire(self, block: int) -> int:
+        """
+        Forgets the addresses that weren't seen in the last blocks in memory
+        :param block: current block
+        :return: number of expired addresses
+        """
+        expired = 0
+        while self.bucket_heap and self.bucket_heap[0] < block:
+            for address in self.buckets.pop(heapq.heappop(self.bucket_heap)):
+                del self.targets[address]
+                expired += 1
+        return expired
+
+    def pop_confirmed(self) -> list:
+        """
+        :return: addresses that reached the transfers to confirm since the last call
+        """
+        confirmed = list(self.confirmed)
+        self.confirmed = {}
+        return confirmed
@@ -0,0 +1,101 @@
+import os
+import random
+import time
+
+import pytest
+
+from src.possible_targets import PossibleTargets
+
+
+def rebuild_possible_targets(possible_targets: dict, block: int, transfers_to_confirm: int) -> tuple:
+    """
+    confirmation and expiry as done by the agent before the tracker, by rebuilding the dict every block
+    """
+    newly_confirmed_targets = [k for k, v in possible_targets.items() if v['amount'] >= transfers_to_confirm]
+    possible_targets = {k: v for k, v in possible_targets.items() if
+                        v['expire_block'] >= block and v['amount'] < transfers_to_confirm}
+    return newly_confirmed_targets, possible_targets
+
+
+class TestPossibleTargets:
+
+    def test_confirmation(self):
+        targets = PossibleTargets(transfers_to_confirm=3, blocks_in_memory=10)
+        for block in range(3):
+            targets.add("0xa", block)
+        targets.add("0xb", 2)
+        assert targets.pop_confirmed() == ["0xa"]
+        assert targets.pop_confirmed() == [], "confirmed addresses should be returned once"
+        assert "0xa" not in targets.targets
+        assert len(targets) == 1
+
+        targets.add("0xa", 3)
+        targets.add("0xb", 3)
+        assert targets.targets["0xb"]['amount'] == 2
+        assert targets.pop_confirmed() == []
+
+    def test_expiry(self):
+        targets = PossibleTargets(transfers_to_confirm=3, blocks_in_memory=10)
+        targets.add("0xa", 1)
+        targets.add("0xb", 1)
+        targets.add("0xb", 5)
+        assert targets.expire(11) == 0, "addresses should be kept for the blocks in memory"
+        assert targets.expire(12) == 1
+        assert "0xa" not in targets
+        assert targets.targets["0xb"] == {'amount': 2, 'expire_block': 15}
+        assert targets.expire(16) == 1
+        assert len(targets) == 0
+        assert targets.buckets == {}
+
+        targets.add("0xa", 20)
+        assert targets.targets["0xa"]['amount'] == 1, "expired addresses should be counted again from scratch"
+
+    def test_equivalent_to_rebuild(self):
+        rnd = random.Random(42)
+        addresses = [f"0x{i:040x}" for i in range(200)]
+        transfers_to_confirm, blocks_in_memory = 5, 20
+        targets = PossibleTargets(transfers_to_confirm, blocks_in_memory)
+        possible_targets = {}
+        for block in range(500):
+            # the agent handles the block event before the transactions of the block
+            expected_confirmed, possible_targets = rebuild_possible_targets(possible_targets, block, transfers_to_confirm)
+            targets.expire(block)
+            assert sorted(targets.pop_confirmed()) == sorted(expected_confirmed)
+            assert targets.targets == possible_targets
+
+            for _ in range(rnd.randint(0, 10)):
+                address = rnd.choice(addresses)
+                targets.add(address, block)
+                if address in possible_targets:
+                    possible_targets[address] = {'amount': possible_targets[address]['amount'] + 1,
+                                                 'expire_block': block + blocks_in_memory}
+                else:
+                    possible_targets[address] = {'amount': 1, 'expire_block': block + blocks_in_memory}
+
+    @pytest.mark.skipif(os.environ.get("RUN_BENCHMARKS") is None, reason="benchmark; set RUN_BENCHMARKS=1 to run it")
+    def test_benchmark(self):
+        # many short lived addresses tracked, few of them expiring and confirmed per block
+        addresses_per_block, blocks, blocks_in_memory = 200, 300, 100
+        rnd = random.Random(42)
+        transfers = [[f"0x{rnd.randrange(addresses_per_block * blocks):040x}" for _ in range(addresses_per_block)]
+                     for _ in range(blocks)]
+
+        start = time.time()
+        possible_targets = {}
+        for block, block_transfers in enumerate(transfers):
+            _, possible_targets = rebuild_possible_targets(possible_targets, block, 50)
+            for address in block_transfers:
+                amount = possible_targets[address]['amount'] + 1 if address in possible_targets else 1
+                possible_targets[address] = {'amount': amount, 'expire_block': block + blocks_in_memory}
+        rebuild_seconds = time.time() - start
+
+        start = time.time()
+        targets = PossibleTargets(50, blocks_in_memory)
+        for block, block_transfers in enumerate(transfers):
+            targets.expire(block)
+            targets.pop_confirmed()
+            for address in block_transfers:
+                targets.add(address, block)
+        index_seconds = time.time() - start
+
+        print(f"{len(targets)} addresses tracked: rebuild {rebuild_seconds:.2f}s, expiry index {index_seconds:.2f}s")
@@ -11,7 +11,9 @@ import re
 import pickle
 import json
 import math
+import itertools
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import pytz
 import traceback
 import joblib
@@ -22,7 +24,7 @@ import forta_agent
 from forta_agent import Finding, FindingType, FindingSeverity, get_alerts, get_labels
 from web3 import Web3
 
-from src.constants import (BASE_BOTS, ALERTED_ENTITIES_ML_KEY, ALERTED_ENTITIES_ML_QUEUE_SIZE, ALERTED_ENTITIES_PASSTHROUGH_KEY, ALERTED_ENTITIES_PASSTHROUGH_QUEUE_SIZE, ALERTED_ENTITIES_SCAMMER_ASSOCIATION_KEY, ALERTED_ENTITIES_SCAMMER_ASSOCIATION_QUEUE_SIZE, ALERTED_ENTITIES_SIMILAR_CONTRACT_KEY, ALERTED_ENTITIES_SIMILAR_CONTRACT_QUEUE_SIZE, ALERTED_ENTITIES_MANUAL_KEY, ALERTED_ENTITIES_MANUAL_QUEUE_SIZE, ALERTED_ENTITIES_MANUAL_METAMASK_KEY, ALERTED_ENTITIES_MANUAL_METAMASK_QUEUE_SIZE, ALERT_LOOKBACK_WINDOW_IN_DAYS, ENTITY_CLUSTER_BOTS,
+from src.constants import (BASE_BOTS, ALERTED_ENTITIES_ML_KEY, ALERTED_ENTITIES_ML_QUEUE_SIZE, ALERTED_ENTITIES_PASSTHROUGH_KEY, ALERTED_ENTITIES_PASSTHROUGH_QUEUE_SIZE, ALERTED_ENTITIES_SCAMMER_ASSOCIATION_KEY, ALERTED_ENTITIES_SCAMMER_ASSOCIATION_QUEUE_SIZE, ALERTED_ENTITIES_SIMILAR_CONTRACT_KEY, ALERTED_ENTITIES_SIMILAR_CONTRACT_QUEUE_SIZE, ALERTED_ENTITIES_MANUAL_KEY, ALERTED_ENTITIES_MANUAL_QUEUE_SIZE, ALERTED_ENTITIES_MANUAL_METAMASK_KEY, ALERTED_ENTITIES_MANUAL_METAMASK_QUEUE_SIZE, ALERT_LOOKBACK_WINDOW_IN_DAYS, ENTITY_CLUSTER_BOTS, DYNAMO_READ_CACHE_SIZE, DYNAMO_READ_CACHE_TTL_IN_SECONDS, LABEL_CACHE_BATCH_SIZE,
                        FINDINGS_CACHE_ALERT_KEY, FINDINGS_CACHE_BLOCK_KEY, ALERTED_FP_CLUSTERS_KEY, FINDINGS_CACHE_TRANSACTION_KEY,
                        ALERTED_FP_CLUSTERS_QUEUE_SIZE, SCAM_DETECTOR_BOT_ID, SCAM_DETECTOR_BETA_BOT_ID, SCAM_DETECTOR_BETA_ALT_BOT_ID, CONTRACT_SIMILARITY_BOTS, CONTRACT_SIMILARITY_BOT_THRESHOLDS, EOA_ASSOCIATION_BOTS,
                        EOA_ASSOCIATION_BOT_THRESHOLDS, PAIRCREATED_EVENT_ABI, SWAP_FACTORY_ADDRESSES, POOLCREATED_EVENT_ABI, ENCRYPTED_BOTS,
@@ -33,6 +35,12 @@ from src.blockchain_indexer_service import BlockChainIndexer
 from src.forta_explorer import FortaExplorer
 from src.base_bot_parser import BaseBotParser
 from src.l2_cache import L2Cache
+from src.feature_vector import FeatureVectorBuilder, ClusterFeatureState
+from src.dynamo_write_buffer import DynamoWriteBuffer
+from src.dynamo_read_cache import DynamoReadCache
+from src.dynamo_query import query_items
+from src.size_bounded_dict import SizeBoundedOrderedDict
+from src.persisted_state import PersistenceTracker, PersistedQueue, DELTA_KEY_SUFFIX
 from src.utils import Utils
 
 web3 = Utils.get_rpc_endpoint()
@@ -47,26 +55,31 @@ CHAIN_ID = -1
 BOT_VERSION = Utils.get_bot_version()
 LAST_PROCESSED_TIME = 0 # Used to update reactive likely fps
 
-ALERTED_ENTITIES_ML = OrderedDict()  # cluster -> alert_id
-ALERTED_ENTITIES_PASSTHROUGH = OrderedDict()  # cluster -> alert_id
-ALERTED_ENTITIES_SCAMMER_ASSOCIATION = OrderedDict()  # cluster -> alert_id
-ALERTED_ENTITIES_SIMILAR_CONTRACT = OrderedDict()  # cluster -> alert_id
-ALERTED_ENTITIES_MANUAL = OrderedDict()  # cluster -> alert_id
-ALERTED_ENTITIES_MANUAL_METAMASK = OrderedDict()  # cluster -> alert_id
+ALERTED_ENTITIES_ML = SizeBoundedOrderedDict(L2Cache.PERSISTENCE_SIZE_LIMIT)  # cluster -> alert_id
+ALERTED_ENTITIES_PASSTHROUGH = SizeBoundedOrderedDict(L2Cache.PERSISTENCE_SIZE_LIMIT)  # cluster -> alert_id
+ALERTED_ENTITIES_SCAMMER_ASSOCIATION = SizeBoundedOrderedDict(L2Cache.PERSISTENCE_SIZE_LIMIT)  # cluster -> alert_id
+ALERTED_ENTITIES_SIMILAR_CONTRACT = SizeBoundedOrderedDict(L2Cache.PERSISTENCE_SIZE_LIMIT)  # cluster -> alert_id
+ALERTED_ENTITIES_MANUAL = SizeBoundedOrderedDict(L2Cache.PERSISTENCE_SIZE_LIMIT)  # cluster -> alert_id
+ALERTED_ENTITIES_MANUAL_METAMASK = SizeBoundedOrderedDict(L2Cache.PERSISTENCE_SIZE_LIMIT)  # cluster -> alert_id
 ALERTED_ENTITIES_MANUAL_METAMASK_LIST = [] # Used to reduce size of persisted item
-ALERTED_FP_CLUSTERS = OrderedDict()  # clusters -> alert_id (dummy val) which are considered FPs that have been alerted on
-FINDINGS_CACHE_BLOCK = []
-FINDINGS_CACHE_ALERT = []
-FINDINGS_CACHE_TRANSACTION = []
+ALERTED_FP_CLUSTERS = SizeBoundedOrderedDict(L2Cache.PERSISTENCE_SIZE_LIMIT)  # clusters -> alert_id (dummy val) which are considered FPs that have been alerted on
+FINDINGS_CACHE_BLOCK = PersistedQueue()
+FINDINGS_CACHE_ALERT = PersistedQueue()
+FINDINGS_CACHE_TRANSACTION = PersistedQueue()
+PERSISTENCE_TRACKER = PersistenceTracker()  # skips persisting state that didnt change since it was last persisted
 REACTIVE_LIKELY_FPS = {}  # address -> list of label metadata (addresses that are yet to be checked)
 SCAMMER_ASSOCIATION_LABELS = None
 SIMILAR_CONTRACT_LABELS = None
 DF_CONTRACT_SIGNATURES = None
 
 MODEL = None
+FEATURE_VECTOR_BUILDER = FeatureVectorBuilder(MODEL_FEATURES)
 
 s3 = None
 dynamo = None
+dynamo_write_buffer = None
+dynamo_read_cache = DynamoReadCache(DYNAMO_READ_CACHE_SIZE, DYNAMO_READ_CACHE_TTL_IN_SECONDS)  # itemId -> sortKey -> read_entity_clusters value
+cluster_feature_states = DynamoReadCache(DYNAMO_READ_CACHE_SIZE, DYNAMO_READ_CACHE_TTL_IN_SECONDS)  # alert itemId -> ClusterFeatureState; rebuilt from dynamo on miss/expiry to pick up alerts of other shards
 secrets = None
 item_id_prefix = ""
 
@@ -96,59 +109,79 @@ def initialize(test = False):
     global INITIALIZED
 
     try:
-        reinitialize()
+        timings = {}
+        start = time.time()
+        timed(timings, "reinitialize", reinitialize)
 
-        Utils.update_fp_list(CHAIN_ID)
+        state_keys = [ALERTED_ENTITIES_ML_KEY, ALERTED_ENTITIES_PASSTHROUGH_KEY, ALERTED_ENTITIES_SCAMMER_ASSOCIATION_KEY, ALERTED_ENTITIES_SIMILAR_CONTRACT_KEY, ALERTED_ENTITIES_MANUAL_KEY, ALERTED_FP_CLUSTERS_KEY,
+                      FINDINGS_CACHE_BLOCK_KEY, FINDINGS_CACHE_BLOCK_KEY + DELTA_KEY_SUFFIX, FINDINGS_CACHE_ALERT_KEY, FINDINGS_CACHE_ALERT_KEY + DELTA_KEY_SUFFIX, FINDINGS_CACHE_TRANSACTION_KEY, FINDINGS_CACHE_TRANSACTION_KEY + DELTA_KEY_SUFFIX]
+        if CHAIN_ID == 1:
+            state_keys.append(ALERTED_ENTITIES_MANUAL_METAMASK_KEY)
+
+        # state, fp list, manual list and model are independent downloads/loads, so they are done concurrently
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            fp_list_future = executor.submit(timed, timings, "fp_list", Utils.update_fp_list, CHAIN_ID)
+            manual_list_future = executor.submit(timed, timings, "manual_list", Utils.get_manual_list)
+            model_future = executor.submit(timed, timings, "model", joblib.load, MODEL_NAME)
+            state = timed(timings, "state", load_all, CHAIN_ID, state_keys)
+            fp_list_future.result()
+            df_manual_list = manual_list_future.result()
+            model = model_future.result()
 
         global ALERTED_ENTITIES_ML
-        alerted_entities_ml = load(CHAIN_ID, ALERTED_ENTITIES_ML_KEY)
-        ALERTED_ENTITIES_ML = OrderedDict() if alerted_entities_ml is None else OrderedDict(alerted_entities_ml)
+        ALERTED_ENTITIES_ML = SizeBoundedOrderedDict(L2Cache.PERSISTENCE_SIZE_LIMIT, state[ALERTED_ENTITIES_ML_KEY])
 
         global ALERTED_ENTITIES_PASSTHROUGH
-        alerted_entities_passthrough = load(CHAIN_ID, ALERTED_ENTITIES_PASSTHROUGH_KEY)
-        ALERTED_ENTITIES_PASSTHROUGH = OrderedDict() if alerted_entities_passthrough is None else OrderedDict(alerted_entities_passthrough)
+        ALERTED_ENTITIES_PASSTHROUGH = SizeBoundedOrderedDict(L2Cache.PERSISTENCE_SIZE_LIMIT, state[ALERTED_ENTITIES_PASSTHROUGH_KEY])
 
         global ALERTED_ENTITIES_SCAMMER_ASSOCIATION
-        alerted_entities_scammer_association = load(CHAIN_ID, ALERTED_ENTITIES_SCAMMER_ASSOCIATION_KEY)
-        ALERTED_ENTITIES_SCAMMER_ASSOCIATION = OrderedDict() if alerted_entities_scammer_association is None else OrderedDict(alerted_entities_scammer_association)
+        ALERTED_ENTITIES_SCAMMER_ASSOCIATION = SizeBoundedOrderedDict(L2Cache.PERSISTENCE_SIZE_LIMIT, state[ALERTED_ENTITIES_SCAMMER_ASSOCIATION_KEY])
 
         global ALERTED_ENTITIES_SIMILAR_CONTRACT
-        alerted_entities_similar_contract = load(CHAIN_ID, ALERTED_ENTITIES_SIMILAR_CONTRACT_KEY)
-        ALERTED_ENTITIES_SIMILAR_CONTRACT = OrderedDict() if alerted_entities_similar_contract is None else OrderedDict(alerted_entities_similar_contract)
+        ALERTED_ENTITIES_SIMILAR_CONTRACT = SizeBoundedOrderedDict(L2Cache.PERSISTENCE_SIZE_LIMIT, state[ALERTED_ENTITIES_SIMILAR_CONTRACT_KEY])
 
         global ALERTED_ENTITIES_MANUAL
-        alerted_entities_manual = load(CHAIN_ID, ALERTED_ENTITIES_MANUAL_KEY)
-        ALERTED_ENTITIES_MANUAL = OrderedDict() if alerted_entities_manual is None else OrderedDict(alerted_entities_manual)
+        ALERTED_ENTITIES_MANUAL = SizeBoundedOrderedDict(L2Cache.PERSISTENCE_SIZE_LIMIT, state[ALERTED_ENTITIES_MANUAL_KEY])
 
         if CHAIN_ID == 1:
             global ALERTED_ENTITIES_MANUAL_METAMASK
             global ALERTED_ENTITIES_MANUAL_METAMASK_LIST
-            alerted_entities_manual_metamask = load(CHAIN_ID, ALERTED_ENTITIES_MANUAL_METAMASK_KEY)
+            alerted_entities_manual_metamask = state[ALERTED_ENTITIES_MANUAL_METAMASK_KEY]
             ALERTED_ENTITIES_MANUAL_METAMASK_LIST = [] if alerted_entities_manual_metamask is None else list(alerted_entities_manual_metamask)
-            ALERTED_ENTITIES_MANUAL_METAMASK = {item: 'manual_metamaskSCAM-DETECTOR-MANUAL-METAMASK-PHISHING' for item in ALERTED_ENTITIES_MANUAL_METAMASK_LIST}
+            ALERTED_ENTITIES_MANUAL_METAMASK = SizeBoundedOrderedDict(L2Cache.PERSISTENCE_SIZE_LIMIT, [(item, 'manual_metamaskSCAM-DETECTOR-MANUAL-METAMASK-PHISHING') for item in ALERTED_ENTITIES_MANUAL_METAMASK_LIST])
 
         global ALERTED_FP_CLUSTERS
-        alerted_fp_addresses = load(CHAIN_ID, ALERTED_FP_CLUSTERS_KEY)
-        ALERTED_FP_CLUSTERS = OrderedDict() if alerted_fp_addresses is None else OrderedDict(alerted_fp_addresses)
+        ALERTED_FP_CLUSTERS = SizeBoundedOrderedDict(L2Cache.PERSISTENCE_SIZE_LIMIT, state[ALERTED_FP_CLUSTERS_KEY])
 
         global FINDINGS_CACHE_BLOCK
-        findings_cache_block = load(CHAIN_ID, FINDINGS_CACHE_BLOCK_KEY)
-        FINDINGS_CACHE_BLOCK = [] if findings_cache_block is None else list(findings_cache_block)
+        FINDINGS_CACHE_BLOCK = PersistedQueue.restore(state[FINDINGS_CACHE_BLOCK_KEY], state[FINDINGS_CACHE_BLOCK_KEY + DELTA_KEY_SUFFIX])
 
         global FINDINGS_CACHE_ALERT
-        findings_cache_alert = load(CHAIN_ID, FINDINGS_CACHE_ALERT_KEY)
-        FINDINGS_CACHE_ALERT = [] if findings_cache_alert is None else list(findings_cache_alert)
+        FINDINGS_CACHE_ALERT = PersistedQueue.restore(state[FINDINGS_CACHE_ALERT_KEY], state[FINDINGS_CACHE_ALERT_KEY + DELTA_KEY_SUFFIX])
 
         global FINDINGS_CACHE_TRANSACTION
-        findings_cache_transaction = load(CHAIN_ID, FINDINGS_CACHE_TRANSACTION_KEY)
-        FINDINGS_CACHE_TRANSACTION = [] if findings_cache_transaction is None else list(findings_cache_transaction)
+        FINDINGS_CACHE_TRANSACTION = PersistedQueue.restore(state[FINDINGS_CACHE_TRANSACTION_KEY], state[FINDINGS_CACHE_TRANSACTION_KEY + DELTA_KEY_SUFFIX])
+
+        PERSISTENCE_TRACKER.clear()
+        PERSISTENCE_TRACKER.mark_persisted(ALERTED_ENTITIES_ML_KEY, ALERTED_ENTITIES_ML)
+        PERSISTENCE_TRACKER.mark_persisted(ALERTED_ENTITIES_PASSTHROUGH_KEY, ALERTED_ENTITIES_PASSTHROUGH)
+        PERSISTENCE_TRACKER.mark_persisted(ALERTED_ENTITIES_SCAMMER_ASSOCIATION_KEY, ALERTED_ENTITIES_SCAMMER_ASSOCIATION)
+        PERSISTENCE_TRACKER.mark_persisted(ALERTED_ENTITIES_SIMILAR_CONTRACT_KEY, ALERTED_ENTITIES_SIMILAR_CONTRACT)
+        PERSISTENCE_TRACKER.mark_persisted(ALERTED_ENTITIES_MANUAL_KEY, ALERTED_ENTITIES_MANUAL)
+        PERSISTENCE_TRACKER.mark_persisted(ALERTED_ENTITIES_MANUAL_METAMASK_KEY, ALERTED_ENTITIES_MANUAL_METAMASK)
+        PERSISTENCE_TRACKER.mark_persisted(ALERTED_FP_CLUSTERS_KEY, ALERTED_FP_CLUSTERS)
+        PERSISTENCE_TRACKER.mark_persisted(FINDINGS_CACHE_BLOCK_KEY, FINDINGS_CACHE_BLOCK)
+        PERSISTENCE_TRACKER.mark_persisted(FINDINGS_CACHE_ALERT_KEY, FINDINGS_CACHE_ALERT)
+        PERSISTENCE_TRACKER.mark_persisted(FINDINGS_CACHE_TRANSACTION_KEY, FINDINGS_CACHE_TRANSACTION)
         
         global DF_CONTRACT_SIGNATURES
-        df_manual_list = Utils.get_manual_list()
         DF_CONTRACT_SIGNATURES = df_manual_list[df_manual_list['EntityType']=='Code']
 
         global MODEL
-        MODEL = joblib.load(MODEL_NAME)
+        MODEL = model
+
+        timings["total"] = time.time() - start
+        logging.info(f"{BOT_VERSION}: Startup timing: " + ", ".join(f"{phase} {duration:.2f}s" for phase, duration in timings.items()))
 
         # subscribe to the base bots, FP mitigation and entity clustering bot
         global BASE_BOTS
@@ -172,6 +205,7 @@ def reinitialize():
     global BOT_VERSION
     global s3
     global dynamo
+    global dynamo_write_buffer
     global secrets 
 
     try:
@@ -180,6 +214,7 @@ def reinitialize():
             secrets = get_secrets()
             s3 = s3_client(secrets)
             dynamo = dynamo_table(secrets)
+            dynamo_write_buffer = DynamoWriteBuffer(dynamo)
             logging.info(f"{BOT_VERSION}: Initialized dynamo DB successfully.")
     except Exception as e:
         logging.error(f"{BOT_VERSION}: Error getting chain id: {e}")
@@ -233,28 +268,10 @@ def alert_target(alert_event: forta_agent.alert_event.AlertEvent, bots: tuple) -
     return ""
 
 
-def update_list(items: dict, max_size: int, item: str, alert_id: str, list_name: str, logic = ""):
-    if item not in items.keys():
-        items[item] = set()
-    items[item].add(logic+alert_id)
+def update_list(items: SizeBoundedOrderedDict, max_size: int, item: str, alert_id: str, list_name: str, logic = ""):
+    items.add(item, logic+alert_id)
 
-    while len(items) > max_size:
-        if isinstance(items, list):
-            items.pop(0)
-        else:
-            items.popitem(last=False)
-
-    count = 0
-    if len(items) % 1000 == 0:
-        while len(pickle.dumps(items)) > L2Cache.PERSISTENCE_SIZE_LIMIT:
-            for i in range(100): # remove 100 items at a time given pickle is expensive
-                if len(items) > 0:
-                    if isinstance(items, list):
-                        items.pop(0)
-                    else:
-                        items.popitem(last=False)
-                    count += 1
-    
+    count = items.evict(max_size)  # estimated pickle size is tracked per entry, so no need to pickle the list to check against the persistence limit
     if count > 0:
         logging.warning(f"Removed {count} items from {list_name} list to reduce size.")
 
@@ -275,21 +292,14 @@ def put_entity_cluster(alert_created_at_str: str, address: str, cluster: str):
     
     expiresAt = int(alert_created_at) + int(expiry_offset)
     logging.debug(f"expiresAt: {expiresAt}")
-    response = dynamo.put_item(Item={
+    dynamo_write_buffer.put({
         "itemId": itemId,
         "sortKey": sortId,
         "address": address,
         "cluster": cluster,
         "expiresAt": expiresAt
     })
-
-    if response["ResponseMetadata"]["HTTPStatusCode"] != 200:
-        logging.error(f"Error putting alert in dynamoDB: {response}")
-        Utils.ERROR_CACHE.add(Utils.alert_error(f'dynamo.put_item HTTPStatusCode {response["ResponseMetadata"]["HTTPStatusCode"]}', "agent.put_entity_cluster", ""))
-        return
-    else:
-        logging.info(f"Successfully put alert in dynamoDB: {response}")
-        return
+    dynamo_read_cache.update(itemId, sortId, cluster)
 
 # put in item alerts per cluster
 # note, given sort key is part of the key, alerts with different hashes will result in different entries
@@ -311,7 +321,7 @@ def put_alert(alert_event: forta_agent.alert_event.AlertEvent, cluster: str):
     
     expiresAt = int(alert_created_at) + int(expiry_offset)
     logging.debug(f"expiresAt: {expiresAt}")
-    response = dynamo.put_item(Item={
+    dynamo_write_buffer.put({
         "itemId": itemId,
         "sortKey": sortId,
         "botId": alert_event.alert.source.bot.id,
@@ -320,14 +330,9 @@ def put_alert(alert_event: forta_agent.alert_event.AlertEvent, cluster: str):
         "cluster": cluster,
         "expiresAt": expiresAt
     })
-
-    if response["ResponseMetadata"]["HTTPStatusCode"] != 200:
-        logging.error(f"Error putting alert in dynamoDB: {response}")
-        Utils.ERROR_CACHE.add(Utils.alert_error(f'dynamo.put_item HTTPStatusCode {response["ResponseMetadata"]["HTTPStatusCode"]}', "agent.put_alert", ""))
-        return
-    else:
-        logging.info(f"Successfully put alert in dynamoDB: {response}")
-        return
+    cluster_feature_state = cluster_feature_states.peek(itemId)
+    if cluster_feature_state is not None:
+        cluster_feature_state.add(alert_event.alert.source.bot.id, alert_event.alert.alert_id, alert_event.alert_hash, expiresAt)
 
 
 
@@ -337,107 +342,64 @@ def read_entity_clusters(address: str) -> OrderedDict:
     entity_clusters = OrderedDict()
     itemId = f"{item_id_prefix}|{CHAIN_ID}|entity_cluster|{address}"
     logging.debug(f"Reading entity clusters for address {address} from itemId {itemId}")
+    cached_items = dynamo_read_cache.get(itemId)
+    if cached_items is not None:
+        for cluster in cached_items.values():
+            entity_clusters[address] = cluster
+        logging.info(f"Read entity clusters for address {address} from cache. Retrieved {len(entity_clusters)} alert_clusters. Cache hits {dynamo_read_cache.hits}, misses {dynamo_read_cache.misses}.")
+        return entity_clusters
+
     logging.debug(f"Dynamo : {dynamo}")
-    response = dynamo.query(KeyConditionExpression='itemId = :id',
-                            ExpressionAttributeValues={
-                                ':id': itemId
-                            }
-                            )
-
-    # Print retrieved item
-    items = response.get('Items', [])
-    logging.debug(f"Items retrieved: {len(items)}")
-    for item in items:
+    flushed = dynamo_write_buffer.flush(itemId)  # read your own writes
+    cached_items = OrderedDict()
+    for item in query_items(dynamo, itemId, projection=["sortKey", "cluster"]):
         logging.debug(f"Item retrieved: {item}")
         entity_clusters[address] = item["cluster"]
+        cached_items[item["sortKey"]] = item["cluster"]
+    if flushed:
+        dynamo_read_cache.put(itemId, cached_items)
+    else:
+        # the writes of this instance are still pending, they are merged in but the read isn't cached
+        for item in dynamo_write_buffer.pending_items(itemId):
+            entity_clusters[address] = item["cluster"]
     logging.info(f"Read entity clusters for address {address}. Retrieved {len(entity_clusters)} alert_clusters.")
     return entity_clusters
 
 def read_alerts(cluster: str) -> list:
+    return get_cluster_feature_state(cluster).alert_list()
+
+def get_cluster_feature_state(cluster: str) -> ClusterFeatureState:
     global CHAIN_ID
     global BOT_VERSION
 
-    logging.debug(f"Reading alerts for cluster {cluster}")
-    alert_items = []
     itemId = f"{item_id_prefix}|{CHAIN_ID}|alert|{cluster}"
+    cluster_feature_state = cluster_feature_states.get(itemId)
+    if cluster_feature_state is not None:
+        logging.info(f"{BOT_VERSION}: Read alerts for cluster {cluster} from feature state. Retrieved {len(cluster_feature_state.alerts)} alerts. Cache hits {cluster_feature_states.hits}, misses {cluster_feature_states.misses}.")
+        return cluster_feature_state
+
     logging.debug(f"Reading alerts for cluster {cluster} from itemId {itemId}")
     logging.debug(f"Dynamo : {dynamo}")
-    response = dynamo.query(KeyConditionExpression='itemId = :id',
-                            ExpressionAttributeValues={
-                                ':id': itemId
-                            }
-                            )
-
-    # Print retrieved item
-    items = response.get('Items', [])
-    logging.debug(f"Items retrieved: {len(items)}")
-    for item in items:
+    flushed = dynamo_write_buffer.flush(itemId)  # read your own writes
+    cluster_feature_state = ClusterFeatureState(FEATURE_VECTOR_BUILDER, ALERT_LOOKBACK_WINDOW_IN_DAYS * 24 * 60 * 60)
+    for item in query_items(dynamo, itemId, projection=["botId", "alertId", "alertHash", "expiresAt"]):
         logging.debug(f"Item retrieved: {item}")
-        alert_items.append((item["botId"], item["alertId"], item["alertHash"]))
+        cluster_feature_state.add(item["botId"], item["alertId"], item["alertHash"], int(item["expiresAt"]))
+    if flushed:
+        cluster_feature_states.put(itemId, cluster_feature_state)
+    else:
+        # the writes of this instance are still pending, they are merged in but the state isn't cached
+        for item in dynamo_write_buffer.pending_items(itemId):
+            cluster_feature_state.add(item["botId"], item["alertId"], item["alertHash"], int(item["expiresAt"]))
 
-    logging.info(f"{BOT_VERSION}: Read alerts for cluster {cluster}. Retrieved {len(alert_items)} alerts.")
-    return alert_items
+    logging.info(f"{BOT_VERSION}: Read alerts for cluster {cluster}. Retrieved {len(cluster_feature_state.alerts)} alerts.")
+    return cluster_feature_state
 
 # alerts are tuples of (botId, alertId, alertHash)
 def build_feature_vector(alerts: list, cluster: str) -> pd.DataFrame: 
-    global BOT_VERSION
-
-    df_feature_vector = pd.DataFrame(columns=MODEL_FEATURES)
-    df_feature_vector.loc[0] = np.zeros(len(MODEL_FEATURES))
-
-    # create dataframe out of list of alert tuples
-    df_alerts_all = pd.DataFrame(alerts, columns=['bot_id', 'alert_id', 'alert_hash'])
-    df_alerts_all.drop_duplicates(inplace=True)
-    df_alerts_all['cluster'] = cluster
-    df_alerts_all['alert_hash'] = 1
-
-
-    grouped = df_alerts_all.groupby(['cluster', 'bot_id', 'alert_id'])['alert_hash'].sum().reset_index()
-    pivoted = pd.pivot_table(grouped, values='alert_id', index = 'cluster', columns=['bot_id', 'alert_id'], aggfunc='sum')
-    pivoted.columns = [f'{col[0]}_{col[1]}' for col in pivoted.columns]
-    pivoted.fillna(0, inplace=True)
-
-
-    bot_count_features = set()
-    for column in pivoted.columns:
-        if column in MODEL_FEATURES:
-            bot_count_features.add(column[0:66])
-
-    for bot_count_feature in bot_count_features:
-        pivoted[bot_count_feature + '_count'] = 0
-        pivoted[bot_count_feature + '_uniqalertid_count'] = 0
-
-    for index, row in pivoted.iterrows():
-        bot_id_unique_alert_ids = {}
-        for column in pivoted.columns:
-            if column[0:66] in bot_count_features and column[0:66] + '_count' not in column and column in MODEL_FEATURES:
-                count = row[column]
-                pivoted.loc[index, column[0:66] + '_count'] += count
-
-                #increment unique alert id count if count > 0
-                if column[0:66] not in bot_id_unique_alert_ids:
-                    bot_id_unique_alert_ids[column[0:66]] = 0
+    global FEATURE_VECTOR_BUILDER
 
-                if count > 0 and "_count" not in column:
-                    bot_id_unique_alert_ids[column[0:66]] += 1
-
-
-        for column in pivoted.columns:
-            if "_uniqalertid_count" in column:
-                pivoted.loc[index, column] = bot_id_unique_alert_ids[column[0:66]]
-
-
-    for column in pivoted.columns:
-        df_feature_vector.loc[0, column] = pivoted.loc[cluster, column]
-
-    df_feature_vector = df_feature_vector.sort_index(axis=1) #sort columns alphabetically
-
-    for column in df_feature_vector.columns:
-        if column not in MODEL_FEATURES:
-            logging.warning(f"Feature {column} not in model features. Dropping.")
-            df_feature_vector.drop(columns=[column], inplace=True)
-
-    return df_feature_vector
+    return FEATURE_VECTOR_BUILDER.to_frame(FEATURE_VECTOR_BUILDER.build(alerts))
 
 def get_model_score(df_feature_vector: pd.DataFrame) -> float:
     global MODEL
@@ -522,13 +484,13 @@ def emit_ml_finding(w3, alert_event: forta_agent.alert_event.AlertEvent) -> list
         put_alert(alert_event, cluster)
         logging.info(f"{BOT_VERSION}: alert {alert_event.alert_hash} {alert_event.bot_id} {alert_event.alert.alert_id} - put alert into dynamo for cluster {cluster}. Processing took {time.time() - start_time} seconds.")
 
-        # get all alerts from dynamo for the cluster
-        alert_list = read_alerts(cluster)  # list of tuple of (botId, alertId, alertHash)
-        logging.info(f"{BOT_VERSION}: alert {alert_event.alert_hash} {alert_event.bot_id} {alert_event.alert.alert_id} - got {len(alert_list)} alerts from dynamo for cluster {cluster}. Processing took {time.time() - start_time} seconds.")
+        # get the feature state of all alerts of the cluster; only read from dynamo if it isnt cached
+        cluster_feature_state = get_cluster_feature_state(cluster)
+        logging.info(f"{BOT_VERSION}: alert {alert_event.alert_hash} {alert_event.bot_id} {alert_event.alert.alert_id} - got {len(cluster_feature_state.alerts)} alerts for cluster {cluster}. Processing took {time.time() - start_time} seconds.")
 
 
         # assess based on ML model
-        feature_vector = build_feature_vector(alert_list, cluster)
+        feature_vector = cluster_feature_state.to_frame()
         score = get_model_score(feature_vector)
         logging.info(f"{BOT_VERSION}: alert {alert_event.alert_hash} {alert_event.bot_id} {alert_event.alert.alert_id} - got score {score} for cluster {cluster}. Processing took {time.time() - start_time} seconds.")
         model_threshold = MODEL_ALERT_THRESHOLD_LOOSE if (Utils.is_beta() or Utils.is_beta_alt()) else MODEL_ALERT_THRESHOLD_STRICT
@@ -540,6 +502,7 @@ def emit_ml_finding(w3, alert_event: forta_agent.alert_event.AlertEvent) -> list
                 continue
 
             logging.info(f"{BOT_VERSION}: alert {alert_event.alert_hash} {alert_event.bot_id} {alert_event.alert.alert_id} - cluster {cluster} not in FP mitigation clusters. Processing took {time.time() - start_time} seconds.")
+            alert_list = cluster_feature_state.alert_list()  # list of tuple of (botId, alertId, alertHash)
             for alert_id in get_scam_detector_alert_ids(alert_list):
 
                 unique_alertIds = set(alert[1] for alert in alert_list)
@@ -1056,6 +1019,8 @@ def update_reactive_likely_fps(w3, current_date) -> list:
                 SIMILAR_CONTRACT_LABELS = None
                 SCAMMER_ASSOCIATION_LABELS = None
 
+            # labels of the next addresses to process are looked up in a single call; they are served from the label cache in the following blocks
+            Utils.get_etherscan_label_cache().get_many(list(itertools.islice(REACTIVE_LIKELY_FPS, LABEL_CACHE_BATCH_SIZE)))
             address = next(iter(REACTIVE_LIKELY_FPS), None)
             logging.info(f"{BOT_VERSION}: Processing address: {address}")
             if Utils.is_fp(w3, address, CHAIN_ID):
@@ -1304,9 +1269,15 @@ def clear_state():
     L2Cache.remove(CHAIN_ID, FINDINGS_CACHE_BLOCK_KEY)
     L2Cache.remove(CHAIN_ID, FINDINGS_CACHE_ALERT_KEY)
     L2Cache.remove(CHAIN_ID, FINDINGS_CACHE_TRANSACTION_KEY)
+    L2Cache.remove(CHAIN_ID, FINDINGS_CACHE_BLOCK_KEY + DELTA_KEY_SUFFIX)
+    L2Cache.remove(CHAIN_ID, FINDINGS_CACHE_ALERT_KEY + DELTA_KEY_SUFFIX)
+    L2Cache.remove(CHAIN_ID, FINDINGS_CACHE_TRANSACTION_KEY + DELTA_KEY_SUFFIX)
+    PERSISTENCE_TRACKER.clear()
     
     Utils.FP_MITIGATION_ADDRESSES = set()
     Utils.CONTRACT_CACHE = OrderedDict()
+    dynamo_read_cache.clear()
+    cluster_feature_states.clear()
     Utils.IS_BETA_ALT = None
     Utils.IS_BETA = None
 
@@ -1345,26 +1316,80 @@ def persist_state():
     global CHAIN_ID
 
     start = time.time()
-    persist(ALERTED_ENTITIES_ML, CHAIN_ID, ALERTED_ENTITIES_ML_KEY)
-    persist(ALERTED_ENTITIES_PASSTHROUGH, CHAIN_ID, ALERTED_ENTITIES_PASSTHROUGH_KEY)
-    persist(ALERTED_ENTITIES_SCAMMER_ASSOCIATION, CHAIN_ID, ALERTED_ENTITIES_SCAMMER_ASSOCIATION_KEY)
-    persist(ALERTED_ENTITIES_SIMILAR_CONTRACT, CHAIN_ID, ALERTED_ENTITIES_SIMILAR_CONTRACT_KEY)
-    persist(ALERTED_ENTITIES_MANUAL, CHAIN_ID, ALERTED_ENTITIES_MANUAL_KEY)
-    persist(ALERTED_FP_CLUSTERS, CHAIN_ID, ALERTED_FP_CLUSTERS_KEY)
-    persist(FINDINGS_CACHE_BLOCK, CHAIN_ID, FINDINGS_CACHE_BLOCK_KEY)
-    persist(FINDINGS_CACHE_ALERT, CHAIN_ID, FINDINGS_CACHE_ALERT_KEY)
-    persist(FINDINGS_CACHE_TRANSACTION, CHAIN_ID, FINDINGS_CACHE_TRANSACTION_KEY)
-
-    if CHAIN_ID == 1 and len(ALERTED_ENTITIES_MANUAL_METAMASK.keys()) > 0:
+    # pending dynamo writes would be lost on shutdown otherwise
+    if dynamo_write_buffer is not None:
+        dynamo_write_buffer.flush()
+    persisted_count = 0
+    persisted_count += persist_if_dirty(ALERTED_ENTITIES_ML, CHAIN_ID, ALERTED_ENTITIES_ML_KEY)
+    persisted_count += persist_if_dirty(ALERTED_ENTITIES_PASSTHROUGH, CHAIN_ID, ALERTED_ENTITIES_PASSTHROUGH_KEY)
+    persisted_count += persist_if_dirty(ALERTED_ENTITIES_SCAMMER_ASSOCIATION, CHAIN_ID, ALERTED_ENTITIES_SCAMMER_ASSOCIATION_KEY)
+    persisted_count += persist_if_dirty(ALERTED_ENTITIES_SIMILAR_CONTRACT, CHAIN_ID, ALERTED_ENTITIES_SIMILAR_CONTRACT_KEY)
+    persisted_count += persist_if_dirty(ALERTED_ENTITIES_MANUAL, CHAIN_ID, ALERTED_ENTITIES_MANUAL_KEY)
+    persisted_count += persist_if_dirty(ALERTED_FP_CLUSTERS, CHAIN_ID, ALERTED_FP_CLUSTERS_KEY)
+    persisted_count += persist_queue(FINDINGS_CACHE_BLOCK, CHAIN_ID, FINDINGS_CACHE_BLOCK_KEY)
+    persisted_count += persist_queue(FINDINGS_CACHE_ALERT, CHAIN_ID, FINDINGS_CACHE_ALERT_KEY)
+    persisted_count += persist_queue(FINDINGS_CACHE_TRANSACTION, CHAIN_ID, FINDINGS_CACHE_TRANSACTION_KEY)
+    Utils.get_etherscan_label_cache().save_snapshot()
+
+    if CHAIN_ID == 1 and len(ALERTED_ENTITIES_MANUAL_METAMASK.keys()) > 0 and PERSISTENCE_TRACKER.is_dirty(ALERTED_ENTITIES_MANUAL_METAMASK_KEY, ALERTED_ENTITIES_MANUAL_METAMASK):
         ALERTED_ENTITIES_MANUAL_METAMASK_LIST = list(ALERTED_ENTITIES_MANUAL_METAMASK.keys())
-        persist(ALERTED_ENTITIES_MANUAL_METAMASK_LIST, CHAIN_ID, ALERTED_ENTITIES_MANUAL_METAMASK_KEY)
+        if persist(ALERTED_ENTITIES_MANUAL_METAMASK_LIST, CHAIN_ID, ALERTED_ENTITIES_MANUAL_METAMASK_KEY):
+            PERSISTENCE_TRACKER.mark_persisted(ALERTED_ENTITIES_MANUAL_METAMASK_KEY, ALERTED_ENTITIES_MANUAL_METAMASK)
+            persisted_count += 1
 
     end = time.time()
-    logging.info(f"Persisted bot state. took {end - start} seconds")
+    logging.info(f"Persisted bot state ({persisted_count} changed keys). took {end - start} seconds")
 
 
-def persist(obj: object, chain_id: int, key: str):
-    L2Cache.write(obj, chain_id, key)
+def persist(obj: object, chain_id: int, key: str) -> bool:
+    return L2Cache.write(obj, chain_id, key)
+
+
+def persist_if_dirty(obj: object, chain_id: int, key: str) -> int:
+    """
+    persists obj unless it is unchanged since it was last persisted or loaded
+    :return: 1 if obj was persisted, 0 otherwise
+    """
+    if not PERSISTENCE_TRACKER.is_dirty(key, obj):
+        return 0
+    if persist(obj, chain_id, key):
+        PERSISTENCE_TRACKER.mark_persisted(key, obj)
+        return 1
+    return 0
+
+
+def persist_queue(queue: PersistedQueue, chain_id: int, key: str) -> int:
+    """
+    persists the delta of a findings queue since its last snapshot or, once the delta grew large, a new snapshot
+    :return: 1 if the queue was persisted, 0 otherwise
+    """
+    if not PERSISTENCE_TRACKER.is_dirty(key, queue):
+        return 0
+    if queue.needs_compaction():
+        persisted = persist(queue.snapshot(), chain_id, key)
+        if persisted:
+            queue.mark_compacted()
+    else:
+        persisted = persist(queue.delta(), chain_id, key + DELTA_KEY_SUFFIX)
+    if persisted:
+        PERSISTENCE_TRACKER.mark_persisted(key, queue)
+        return 1
+    return 0
+
+
+def load_all(chain_id: int, keys: list) -> dict:
+    return L2Cache.load_all(chain_id, keys)
+
+
+def timed(timings: dict, phase: str, fn, *args):
+    """
+    calls fn and records its duration in seconds under phase in timings
+    """
+    start = time.time()
+    try:
+        return fn(*args)
+    finally:
+        timings[phase] = time.time() - start
 
 
 def load(chain_id: int, key: str) -> object:
@@ -1427,6 +1452,8 @@ def provide_handle_alert(w3):
         logging.info(f"{BOT_VERSION}: Handle alert called. Findings cache for alerts size: {len(FINDINGS_CACHE_ALERT)}")
         scam_findings = detect_scam(w3, alert_event)
         logging.info(f"{BOT_VERSION}: Added {len(scam_findings)} scam findings.") 
+        if dynamo_write_buffer is not None:
+            dynamo_write_buffer.flush_if_due()
         FINDINGS_CACHE_ALERT.extend(scam_findings)
         logging.info(f"{BOT_VERSION}: Handle alert called. Findings cache for alerts size now: {len(FINDINGS_CACHE_ALERT)}")
         
@@ -1434,10 +1461,9 @@ def provide_handle_alert(w3):
             persist_state()
             logging.info(f"{BOT_VERSION}: Persisted state")
        
-        for finding in FINDINGS_CACHE_ALERT[0:10]:  # 10 findings per handle alert due to size limitation
+        for finding in FINDINGS_CACHE_ALERT.pop_front(10):  # 10 findings per handle alert due to size limitation
             if finding is not None:
                 findings.append(finding)
-        FINDINGS_CACHE_ALERT = FINDINGS_CACHE_ALERT[10:]
 
         logging.info(f"{BOT_VERSION}: Return {len(findings)} finding(s) to handleAlert.") 
 
@@ -1518,13 +1544,15 @@ def provide_handle_block(w3):
             persist_state()
             logging.info(f"{BOT_VERSION}: Persisted state")
         
+        if dynamo_write_buffer is not None:
+            dynamo_write_buffer.flush_if_due()
+
         reactive_fp_findings = update_reactive_likely_fps(w3, dt) 
         FINDINGS_CACHE_BLOCK.extend(reactive_fp_findings)
 
-        for finding in FINDINGS_CACHE_BLOCK[0:25]:  # 25 findings per block due to size limitation
+        for finding in FINDINGS_CACHE_BLOCK.pop_front(25):  # 25 findings per block due to size limitation
             if finding is not None:
                 findings.append(finding)
-        FINDINGS_CACHE_BLOCK = FINDINGS_CACHE_BLOCK[25:]
 
         logging.info(f"{BOT_VERSION}: Return {len(findings)} to handleBlock. FINDINGS_CACHE_BLOCK size: {len(FINDINGS_CACHE_BLOCK)}")
 
@@ -1571,10 +1599,9 @@ def provide_handle_transaction(w3):
 
         logging.debug(f"{BOT_VERSION}: Handle transaction on the hour was called. Findings cache for transaction size now: {len(FINDINGS_CACHE_TRANSACTION)}")
             
-        for finding in FINDINGS_CACHE_TRANSACTION[0:10]:  # 10 findings per block due to size limitation
+        for finding in FINDINGS_CACHE_TRANSACTION.pop_front(10):  # 10 findings per block due to size limitation
             if finding is not None:
                 findings.append(finding)
-        FINDINGS_CACHE_TRANSACTION = FINDINGS_CACHE_TRANSACTION[10:]
 
         logging.debug(f"{BOT_VERSION}: Return {len(findings)} to handleTransaction.")
 
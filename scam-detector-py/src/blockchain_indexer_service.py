@@ -11,7 +11,6 @@ from web3 import Web3
 import pandas as pd
 import logging
 import random
-from functools import lru_cache
 from datetime import datetime, timedelta
 
 from src.storage import get_secrets
@@ -230,9 +229,8 @@ class BlockChainIndexer:
         return False
     
     @staticmethod
-    @lru_cache(maxsize=512)
     @RateLimiter(max_calls=1, period=1)
-    def get_etherscan_labels(addresses) -> dict: #address -> {'labels': ['XXXXX'], 'nametag': 'YYYYYY'}
+    def get_etherscan_labels(addresses) -> dict: #address -> {'labels': ['XXXXX'], 'nametag': 'YYYYYY'}; None if the lookup failed
         address_labels = dict()
         wait_time = 1 # seconds
         try:
@@ -268,7 +266,7 @@ class BlockChainIndexer:
                     count += 1
                     if count > 10:
                         Utils.ERROR_CACHE.add(Utils.alert_error(f'request etherscan {data.status_code}', "blockchain_indexer_service.get_etherscan_labels", ""))
-                        break
+                        return None
                     # Exponential backoff with jitter
                     time_to_sleep = wait_time + random.uniform(-0.3 * wait_time, 0.3 * wait_time)
                     time.sleep(time_to_sleep)
@@ -276,5 +274,6 @@ class BlockChainIndexer:
         except Exception as e:
             logging.warning(f"Error getting labels on etherscan: {e}")
             Utils.ERROR_CACHE.add(Utils.alert_error(str(e), "blockchain_indexer_service.get_etherscan_labels", traceback.format_exc()))
-            
+            return None
+
         return address_labels
\ No newline at end of file
@@ -3,6 +3,16 @@ ENABLE_METAMASK_CONSUMPTION = True
 
 ALERT_LOOKBACK_WINDOW_IN_DAYS = 7
 
+DYNAMO_READ_CACHE_SIZE = 10000  # number of itemIds (clusters/addresses) whose dynamo query results are kept in memory
+DYNAMO_READ_CACHE_TTL_IN_SECONDS = 300  # bounds how stale alerts written by other shards can be
+
+ATTACKER_LABEL_KEYWORDS = ['attack', 'phish', 'hack', 'heist', 'drainer', 'exploit', 'scam', 'fraud', '.eth']  # labels containing any of these (case insensitive) dont mitigate FPs
+LABEL_CACHE_SIZE = 50000  # number of addresses whose labels are kept in memory
+LABEL_CACHE_TTL_IN_SECONDS = 2 * 3600
+LABEL_CACHE_NEGATIVE_TTL_IN_SECONDS = 3600  # addresses without labels are looked up again sooner, as labels get added over time
+LABEL_CACHE_BATCH_SIZE = 100  # max number of addresses looked up in a single label API call
+ETHERSCAN_LABEL_CACHE_SNAPSHOT_PATH = "etherscan_label_cache.pkl"
+
 ENTITY_CLUSTER_BOTS = [("0xd3061db4662d5b3406b52b20f34234e462d2c275b99414d76dc644e2486be3e9", "ENTITY-CLUSTER")]
 
 CONTRACT_SIMILARITY_BOTS = [("0x3acf759d5e180c05ecabac2dbd11b79a1f07e746121fc3c86910aaace8910560", "NEW-SCAMMER-CONTRACT-CODE-HASH")]
@@ -0,0 +1,59 @@
+from unittest.mock import Mock
+
+from dynamo_query import query_items
+
+
+class TestDynamoQuery:
+
+    def test_query_items_single_page(self):
+        dynamo = Mock()
+        dynamo.query.return_value = {'Items': [{'botId': '0x1'}]}
+
+        items = list(query_items(dynamo, 'item'))
+
+        assert items == [{'botId': '0x1'}]
+        dynamo.query.assert_called_once_with(KeyConditionExpression='itemId = :id', ExpressionAttributeValues={':id': 'item'})
+
+    def test_query_items_follows_pages(self):
+        dynamo = Mock()
+        dynamo.query.side_effect = [{'Items': [{'botId': '0x1'}], 'LastEvaluatedKey': {'itemId': 'item', 'sortKey': '1'}},
+                                    {'Items': [{'botId': '0x2'}], 'LastEvaluatedKey': {'itemId': 'item', 'sortKey': '2'}},
+                                    {'Items': [{'botId': '0x3'}]}]
+
+        items = list(query_items(dynamo, 'item'))
+
+        assert items == [{'botId': '0x1'}, {'botId': '0x2'}, {'botId': '0x3'}], "should return items of all pages"
+        assert dynamo.query.call_count == 3
+        assert 'ExclusiveStartKey' not in dynamo.query.call_args_list[0].kwargs
+        assert dynamo.query.call_args_list[2].kwargs['ExclusiveStartKey'] == {'itemId': 'item', 'sortKey': '2'}
+
+    def test_query_items_stops_early(self):
+        dynamo = Mock()
+        dynamo.query.side_effect = [{'Items': [{'botId': '0x1'}, {'botId': '0x2'}], 'LastEvaluatedKey': {'itemId': 'item', 'sortKey': '2'}},
+                                    {'Items': [{'botId': '0x3'}]}]
+
+        for item in query_items(dynamo, 'item'):
+            break
+
+        assert dynamo.query.call_count == 1, "should not request further pages once the caller stops iterating"
+
+    def test_query_items_projection_and_sort_key(self):
+        dynamo = Mock()
+        dynamo.query.return_value = {'Items': []}
+
+        list(query_items(dynamo, 'item', 'sort', ['botId', 'alertId', 'alertHash'], page_size=100))
+
+        dynamo.query.assert_called_once_with(KeyConditionExpression='itemId = :id AND sortKey = :sid',
+                                             ExpressionAttributeValues={':id': 'item', ':sid': 'sort'},
+                                             ProjectionExpression='#p0, #p1, #p2',
+                                             ExpressionAttributeNames={'#p0': 'botId', '#p1': 'alertId', '#p2': 'alertHash'},
+                                             Limit=100)
+
+    def test_query_items_sort_key_prefix(self):
+        dynamo = Mock()
+        dynamo.query.return_value = {'Items': []}
+
+        list(query_items(dynamo, 'item', sort_key_prefix='sort|'))
+
+        dynamo.query.assert_called_once_with(KeyConditionExpression='itemId = :id AND begins_with(sortKey, :sid)',
+                                             ExpressionAttributeValues={':id': 'item', ':sid': 'sort|'})
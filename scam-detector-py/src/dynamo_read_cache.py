@@ -0,0 +1,61 @@
+import time
+from collections import OrderedDict
+
+
+class DynamoReadCache:
+    """
+    bounded LRU cache with TTL for dynamo query results keyed by itemId
+    values are usually dicts of sortKey -> value, so local writes can be applied to a cached itemId (write-through) using update
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()  # itemId -> (cached_at, dict of sortKey -> value)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, item_id: str) -> dict:
+        """
+        returns the cached dict of sortKey -> value for the itemId or None if it isnt cached or expired
+        """
+        entry = self.entries.get(item_id)
+        if entry is not None and time.time() - entry[0] < self.ttl_seconds:
+            self.entries.move_to_end(item_id)
+            self.hits += 1
+            return entry[1]
+
+        if entry is not None:
+            del self.entries[item_id]
+        self.misses += 1
+        return None
+
+    def put(self, item_id: str, items: dict):
+        self.entries[item_id] = (time.time(), items)
+        self.entries.move_to_end(item_id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def peek(self, item_id: str):
+        """
+        returns the cached value for the itemId without counting a hit/miss or refreshing its LRU position
+        """
+        entry = self.entries.get(item_id)
+        return entry[1] if entry is not None else None
+
+    def update(self, item_id: str, sort_key: str, value):
+        """
+        applies a local write to a cached itemId; itemIds that arent cached are left alone as the cache would only hold part of their items
+        """
+        items = self.peek(item_id)
+        if items is not None:
+            items[sort_key] = value
+
+    def clear(self):
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
@@ -0,0 +1,51 @@
+import time
+from collections import OrderedDict
+
+from dynamo_read_cache import DynamoReadCache
+
+
+class TestDynamoReadCache:
+
+    def test_get_miss_and_hit(self):
+        cache = DynamoReadCache(10, 60)
+        assert cache.get("a") is None
+        cache.put("a", OrderedDict({"1": ("bot", "alert", "0x1")}))
+        assert cache.get("a") == {"1": ("bot", "alert", "0x1")}
+        assert cache.hits == 1
+        assert cache.misses == 1
+        assert cache.hit_rate() == 0.5
+
+    def test_ttl(self):
+        cache = DynamoReadCache(10, 0.05)
+        cache.put("a", OrderedDict())
+        assert cache.get("a") is not None
+        time.sleep(0.1)
+        assert cache.get("a") is None, "entry should have expired"
+        assert "a" not in cache.entries
+
+    def test_lru_eviction(self):
+        cache = DynamoReadCache(2, 60)
+        cache.put("a", OrderedDict())
+        cache.put("b", OrderedDict())
+        cache.get("a")  # a is now most recently used
+        cache.put("c", OrderedDict())
+        assert cache.get("b") is None, "least recently used entry should have been evicted"
+        assert cache.get("a") is not None
+        assert cache.get("c") is not None
+
+    def test_update_write_through(self):
+        cache = DynamoReadCache(10, 60)
+        cache.put("a", OrderedDict({"1": ("bot", "alert", "0x1")}))
+        cache.update("a", "2", ("bot", "alert", "0x2"))
+        cache.update("a", "1", ("bot", "alert", "0x1"))
+        assert list(cache.get("a").values()) == [("bot", "alert", "0x1"), ("bot", "alert", "0x2")]
+
+        cache.update("b", "1", ("bot", "alert", "0x1"))
+        assert cache.get("b") is None, "updates should not create partial entries"
+
+    def test_peek(self):
+        cache = DynamoReadCache(10, 60)
+        assert cache.peek("a") is None
+        cache.put("a", OrderedDict())
+        assert cache.peek("a") is not None
+        assert cache.hits == 0 and cache.misses == 0, "peek should not count as hit or miss"
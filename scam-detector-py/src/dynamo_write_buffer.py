@@ -0,0 +1,98 @@
+import logging
+import time
+import traceback
+from collections import OrderedDict
+
+from src.utils import Utils
+
+
+class DynamoWriteBuffer:
+    """
+    write-behind buffer for dynamo items; items are written in batches using the table's batch_writer
+    the buffer is flushed once it holds max_items items or its oldest item is older than max_age_seconds
+    items of a failed flush are put back in front of the buffer (puts are idempotent) and written again by the next flush
+    callers reading an itemId should call flush(item_id) first to keep read-your-writes semantics; if it fails, the
+    items still pending for the itemId (pending_items) are not part of the read and the read shouldn't be cached
+    """
+    MAX_ITEMS = 25  # dynamo batch write limit
+    MAX_AGE_SECONDS = 5.0
+
+    def __init__(self, dynamo, max_items: int = MAX_ITEMS, max_age_seconds: float = MAX_AGE_SECONDS):
+        self.dynamo = dynamo
+        self.max_items = max_items
+        self.max_age_seconds = max_age_seconds
+        self.items = OrderedDict()  # (itemId, sortKey) -> item; later puts overwrite earlier ones just like put_item
+        self.oldest_item_time = None
+
+        self.flush_count = 0
+        self.failed_flush_count = 0
+        self.flushed_item_count = 0
+        self.last_flush_latency = 0.0
+        self.total_flush_latency = 0.0
+
+    def put(self, item: dict):
+        if self.oldest_item_time is None:
+            self.oldest_item_time = time.time()
+        self.items[(item["itemId"], item["sortKey"])] = item
+
+        if len(self.items) >= self.max_items:
+            self.flush()
+        else:
+            self.flush_if_due()
+
+    def has_pending(self, item_id: str) -> bool:
+        for pending_item_id, _ in self.items.keys():
+            if pending_item_id == item_id:
+                return True
+        return False
+
+    def pending_items(self, item_id: str) -> list:
+        return [item for (pending_item_id, _), item in self.items.items() if pending_item_id == item_id]
+
+    def flush_if_due(self):
+        if self.oldest_item_time is not None and time.time() - self.oldest_item_time >= self.max_age_seconds:
+            self.flush()
+
+    def flush(self, item_id: str = None) -> bool:
+        """
+        writes all pending items; if item_id is provided, the buffer is only flushed if it holds items for that itemId
+        :return: False if the write failed and the items are still pending, True otherwise
+        """
+        if len(self.items) == 0:
+            return True
+        if item_id is not None and not self.has_pending(item_id):
+            return True
+
+        items = list(self.items.values())
+        self.items = OrderedDict()
+        self.oldest_item_time = None
+
+        start = time.time()
+        try:
+            with self.dynamo.batch_writer() as batch:
+                for item in items:
+                    batch.put_item(Item=item)
+        except Exception as e:
+            logging.error(f"Error batch writing {len(items)} items to dynamoDB, they will be written by the next flush: {e}")
+            Utils.ERROR_CACHE.add(Utils.alert_error(str(e), "dynamo_write_buffer.flush", traceback.format_exc()))
+            self.failed_flush_count += 1
+            self.requeue(items)
+            return False
+
+        latency = time.time() - start
+        self.flush_count += 1
+        self.flushed_item_count += len(items)
+        self.last_flush_latency = latency
+        self.total_flush_latency += latency
+        logging.info(f"Flushed {len(items)} items to dynamoDB. Flush took {latency} seconds; {self.flush_count} flushes, avg latency {self.total_flush_latency / self.flush_count} seconds.")
+        return True
+
+    def requeue(self, items: list):
+        """
+        puts the items back in front of the buffer; items put since keep their newer value
+        """
+        pending = self.items
+        self.items = OrderedDict(((item["itemId"], item["sortKey"]), item) for item in items)
+        self.items.update(pending)
+        # retried once the max age passes again, or when the size threshold is reached
+        self.oldest_item_time = time.time()
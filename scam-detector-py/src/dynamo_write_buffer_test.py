@@ -0,0 +1,105 @@
+from unittest.mock import MagicMock
+import time
+
+from dynamo_write_buffer import DynamoWriteBuffer
+from utils import Utils
+
+
+class TestDynamoWriteBuffer:
+
+    @staticmethod
+    def item(item_id: str, sort_key: str, cluster: str = "cluster") -> dict:
+        return {"itemId": item_id, "sortKey": sort_key, "cluster": cluster, "expiresAt": 0}
+
+    @staticmethod
+    def written_items(dynamo) -> list:
+        batch = dynamo.batch_writer.return_value.__enter__.return_value
+        return [call.kwargs["Item"] for call in batch.put_item.call_args_list]
+
+    def test_flush_on_size(self):
+        dynamo = MagicMock()
+        buffer = DynamoWriteBuffer(dynamo, max_items=3, max_age_seconds=60)
+
+        buffer.put(TestDynamoWriteBuffer.item("a", "1"))
+        buffer.put(TestDynamoWriteBuffer.item("a", "2"))
+        assert dynamo.batch_writer.call_count == 0, "should buffer items below the size threshold"
+
+        buffer.put(TestDynamoWriteBuffer.item("b", "1"))
+        assert dynamo.batch_writer.call_count == 1, "should flush once the size threshold is reached"
+        assert len(TestDynamoWriteBuffer.written_items(dynamo)) == 3
+        assert buffer.flush_count == 1
+        assert buffer.flushed_item_count == 3
+        assert len(buffer.items) == 0
+
+    def test_flush_on_age(self):
+        dynamo = MagicMock()
+        buffer = DynamoWriteBuffer(dynamo, max_items=25, max_age_seconds=0.05)
+
+        buffer.put(TestDynamoWriteBuffer.item("a", "1"))
+        buffer.flush_if_due()
+        assert dynamo.batch_writer.call_count == 0, "should not flush before max age"
+
+        time.sleep(0.1)
+        buffer.flush_if_due()
+        assert dynamo.batch_writer.call_count == 1, "should flush after max age"
+
+    def test_flush_for_item_id(self):
+        dynamo = MagicMock()
+        buffer = DynamoWriteBuffer(dynamo, max_items=25, max_age_seconds=60)
+
+        buffer.put(TestDynamoWriteBuffer.item("a", "1"))
+        assert buffer.flush("b")
+        assert dynamo.batch_writer.call_count == 0, "should not flush for an item id without pending writes"
+
+        assert buffer.flush("a")
+        assert dynamo.batch_writer.call_count == 1, "should flush before reading an item id with pending writes"
+        assert buffer.last_flush_latency >= 0
+
+    def test_put_same_key_overwrites(self):
+        dynamo = MagicMock()
+        buffer = DynamoWriteBuffer(dynamo, max_items=25, max_age_seconds=60)
+
+        buffer.put(TestDynamoWriteBuffer.item("a", "1", "cluster1"))
+        buffer.put(TestDynamoWriteBuffer.item("a", "1", "cluster2"))
+        buffer.flush()
+
+        items = TestDynamoWriteBuffer.written_items(dynamo)
+        assert len(items) == 1, "batch writes must not contain duplicate keys"
+        assert items[0]["cluster"] == "cluster2", "last write should win"
+
+    def test_flush_error(self):
+        Utils.ERROR_CACHE.clear()
+        dynamo = MagicMock()
+        dynamo.batch_writer.side_effect = Exception("dynamo unavailable")
+        buffer = DynamoWriteBuffer(dynamo, max_items=25, max_age_seconds=60)
+
+        buffer.put(TestDynamoWriteBuffer.item("a", "1"))
+        assert not buffer.flush("a"), "the reader should know its writes are still pending"
+
+        assert Utils.ERROR_CACHE.len() == 1, "error should be surfaced as error finding"
+        assert buffer.flush_count == 0
+        assert buffer.failed_flush_count == 1
+        assert list(buffer.items.keys()) == [("a", "1")], "items of the failed flush should be kept"
+        assert buffer.pending_items("a") == [TestDynamoWriteBuffer.item("a", "1")]
+        assert buffer.pending_items("b") == []
+        Utils.ERROR_CACHE.clear()
+
+    def test_flush_error_requeues(self):
+        Utils.ERROR_CACHE.clear()
+        dynamo = MagicMock()
+        dynamo.batch_writer.side_effect = [Exception("throttled"), MagicMock()]
+        buffer = DynamoWriteBuffer(dynamo, max_items=25, max_age_seconds=60)
+
+        buffer.put(TestDynamoWriteBuffer.item("a", "1", "cluster1"))
+        buffer.put(TestDynamoWriteBuffer.item("b", "1"))
+        buffer.flush()
+        buffer.put(TestDynamoWriteBuffer.item("c", "1"))
+        buffer.put(TestDynamoWriteBuffer.item("a", "1", "cluster2"))
+        assert list(buffer.items.keys()) == [("a", "1"), ("b", "1"), ("c", "1")], "failed items should be put back in front"
+        assert buffer.items[("a", "1")]["cluster"] == "cluster2", "newer puts should win over requeued items"
+
+        buffer.flush()
+        assert buffer.flush_count == 1
+        assert buffer.flushed_item_count == 3
+        assert len(buffer.items) == 0
+        Utils.ERROR_CACHE.clear()
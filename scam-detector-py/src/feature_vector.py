@@ -0,0 +1,119 @@
+import heapq
+import logging
+import numpy as np
+import pandas as pd
+
+BOT_ID_LENGTH = 66  # 0x + 64 hex chars
+COUNT_SUFFIX = "_count"
+UNIQUE_ALERT_ID_COUNT_SUFFIX = "_uniqalertid_count"
+
+
+class FeatureVectorBuilder:
+    """
+    builds the scammer model feature vector from a list of alert tuples (botId, alertId, alertHash)
+    the column layout (alphabetically sorted model features) and the position of the per bot _count/_uniqalertid_count features
+    are computed once, so building a vector is a single pass over the alerts without any pandas operations
+    """
+
+    def __init__(self, model_features: list):
+        self.columns = sorted(set(model_features))
+        self.column_index = {feature: i for i, feature in enumerate(self.columns)}
+
+        # alert feature column -> column of the bot level _count / _uniqalertid_count feature (-1 if the model doesnt use it)
+        self.count_index = {}
+        self.unique_alert_id_count_index = {}
+        for feature, i in self.column_index.items():
+            bot_id = feature[0:BOT_ID_LENGTH]
+            if feature.endswith(COUNT_SUFFIX):
+                continue  # bot level _count/_uniqalertid_count feature itself
+            self.count_index[i] = self.column_index.get(bot_id + COUNT_SUFFIX, -1)
+            self.unique_alert_id_count_index[i] = self.column_index.get(bot_id + UNIQUE_ALERT_ID_COUNT_SUFFIX, -1)
+
+    def build(self, alerts: list) -> np.ndarray:
+        """
+        returns the feature vector as a float64 array ordered by self.columns
+        :param alerts: list of tuples (botId, alertId, alertHash); duplicates are counted once
+        """
+        vector = [0.0] * len(self.columns)
+        unknown_features = set()
+        for bot_id, alert_id, _ in set(alerts):
+            feature = f"{bot_id}_{alert_id}"
+            i = self.column_index.get(feature)
+            if i is None or i not in self.count_index:
+                unknown_features.add(feature)
+                continue
+
+            if vector[i] == 0:
+                unique_alert_id_count_index = self.unique_alert_id_count_index[i]
+                if unique_alert_id_count_index >= 0:
+                    vector[unique_alert_id_count_index] += 1
+            vector[i] += 1
+            count_index = self.count_index[i]
+            if count_index >= 0:
+                vector[count_index] += 1
+
+        for feature in unknown_features:
+            logging.warning(f"Feature {feature} not in model features. Dropping.")
+
+        return np.array(vector, dtype=np.float64)
+
+    def to_frame(self, vector: np.ndarray) -> pd.DataFrame:
+        """
+        wraps a vector returned by build into the single row dataframe the model and findings expect
+        """
+        return pd.DataFrame(vector.reshape(1, -1), columns=self.columns)
+
+
+class ClusterFeatureState:
+    """
+    feature vector of a single cluster that is maintained incrementally as alerts are added and expire
+    alerts expire lookback_seconds after the latest alert of the cluster, mirroring the expiresAt of the dynamo items
+    (i.e. time is derived from the alerts' expiresAt rather than the wall clock, so replays behave the same)
+    """
+
+    def __init__(self, builder: FeatureVectorBuilder, lookback_seconds: int):
+        self.builder = builder
+        self.lookback_seconds = lookback_seconds
+        self.vector = [0.0] * len(builder.columns)
+        self.alerts = {}  # (botId, alertId, alertHash) -> expiresAt
+        self.expiry_heap = []  # (expiresAt, alert); entries are stale if the alert has been re-added with a later expiresAt
+        self.latest_alert_time = 0
+
+    def add(self, bot_id: str, alert_id: str, alert_hash: str, expires_at: int):
+        alert = (bot_id, alert_id, alert_hash)
+        previous_expires_at = self.alerts.get(alert)
+        if previous_expires_at is None:
+            self._apply(alert, 1)
+        if previous_expires_at is None or expires_at > previous_expires_at:
+            self.alerts[alert] = expires_at
+            heapq.heappush(self.expiry_heap, (expires_at, alert))
+
+        self.latest_alert_time = max(self.latest_alert_time, expires_at - self.lookback_seconds)
+        self.expire(self.latest_alert_time)
+
+    def expire(self, now: int):
+        while len(self.expiry_heap) > 0 and self.expiry_heap[0][0] <= now:
+            expires_at, alert = heapq.heappop(self.expiry_heap)
+            if self.alerts.get(alert) == expires_at:
+                del self.alerts[alert]
+                self._apply(alert, -1)
+
+    def _apply(self, alert: tuple, delta: int):
+        i = self.builder.column_index.get(f"{alert[0]}_{alert[1]}")
+        if i is None or i not in self.builder.count_index:
+            return
+
+        self.vector[i] += delta
+        if (delta > 0 and self.vector[i] == 1) or (delta < 0 and self.vector[i] == 0):
+            unique_alert_id_count_index = self.builder.unique_alert_id_count_index[i]
+            if unique_alert_id_count_index >= 0:
+                self.vector[unique_alert_id_count_index] += delta
+        count_index = self.builder.count_index[i]
+        if count_index >= 0:
+            self.vector[count_index] += delta
+
+    def alert_list(self) -> list:
+        return list(self.alerts.keys())
+
+    def to_frame(self) -> pd.DataFrame:
+        return self.builder.to_frame(np.array(self.vector, dtype=np.float64))
@@ -0,0 +1,179 @@
+import os
+import random
+import timeit
+import logging
+import pandas as pd
+import numpy as np
+import pytest
+
+from constants import MODEL_FEATURES
+from feature_vector import FeatureVectorBuilder, ClusterFeatureState
+
+builder = FeatureVectorBuilder(MODEL_FEATURES)
+
+
+# pandas based implementation the scam detector used before the FeatureVectorBuilder; kept as reference for equivalence and perf tests
+def build_feature_vector_pandas(alerts: list, cluster: str) -> pd.DataFrame:
+    df_feature_vector = pd.DataFrame(columns=MODEL_FEATURES)
+    df_feature_vector.loc[0] = np.zeros(len(MODEL_FEATURES))
+
+    df_alerts_all = pd.DataFrame(alerts, columns=['bot_id', 'alert_id', 'alert_hash'])
+    df_alerts_all.drop_duplicates(inplace=True)
+    df_alerts_all['cluster'] = cluster
+    df_alerts_all['alert_hash'] = 1
+
+    grouped = df_alerts_all.groupby(['cluster', 'bot_id', 'alert_id'])['alert_hash'].sum().reset_index()
+    pivoted = pd.pivot_table(grouped, values='alert_id', index = 'cluster', columns=['bot_id', 'alert_id'], aggfunc='sum')
+    pivoted.columns = [f'{col[0]}_{col[1]}' for col in pivoted.columns]
+    pivoted.fillna(0, inplace=True)
+
+    bot_count_features = set()
+    for column in pivoted.columns:
+        if column in MODEL_FEATURES:
+            bot_count_features.add(column[0:66])
+
+    for bot_count_feature in bot_count_features:
+        pivoted[bot_count_feature + '_count'] = 0
+        pivoted[bot_count_feature + '_uniqalertid_count'] = 0
+
+    for index, row in pivoted.iterrows():
+        bot_id_unique_alert_ids = {}
+        for column in pivoted.columns:
+            if column[0:66] in bot_count_features and column[0:66] + '_count' not in column and column in MODEL_FEATURES:
+                count = row[column]
+                pivoted.loc[index, column[0:66] + '_count'] += count
+
+                if column[0:66] not in bot_id_unique_alert_ids:
+                    bot_id_unique_alert_ids[column[0:66]] = 0
+
+                if count > 0 and "_count" not in column:
+                    bot_id_unique_alert_ids[column[0:66]] += 1
+
+        for column in pivoted.columns:
+            if "_uniqalertid_count" in column:
+                pivoted.loc[index, column] = bot_id_unique_alert_ids[column[0:66]]
+
+    for column in pivoted.columns:
+        df_feature_vector.loc[0, column] = pivoted.loc[cluster, column]
+
+    df_feature_vector = df_feature_vector.sort_index(axis=1)
+
+    for column in df_feature_vector.columns:
+        if column not in MODEL_FEATURES:
+            df_feature_vector.drop(columns=[column], inplace=True)
+
+    return df_feature_vector
+
+
+def generate_alerts(size: int, seed: int) -> list:
+    rng = random.Random(seed)
+    alert_features = [feature for feature in MODEL_FEATURES if not feature.endswith("_count")]
+    alerts = []
+    for i in range(size):
+        if rng.random() < 0.05:
+            bot_id, alert_id = "0x" + "ab" * 32, "UNKNOWN-ALERT"  # not part of the model
+        else:
+            feature = rng.choice(alert_features)
+            bot_id, alert_id = feature[0:66], feature[67:]
+        alert_hash = hex(rng.randint(0, size // 2 + 1))  # forces duplicates
+        alerts.append((bot_id, alert_id, alert_hash))
+    return alerts
+
+
+class TestFeatureVectorBuilder:
+
+    def test_layout(self):
+        assert builder.columns == sorted(MODEL_FEATURES)
+        assert len(builder.count_index) + len([f for f in MODEL_FEATURES if f.endswith("_count")]) == len(MODEL_FEATURES)
+
+    def test_build(self):
+        alerts = [('0xbc06a40c341aa1acc139c900fd1b7e3999d71b80c13a9dd50a369d8f923757f5', 'FLASHBOTS-TRANSACTIONS', '0x1'),
+                  ('0x8badbf2ad65abc3df5b1d9cc388e419d9255ef999fb69aac6bf395646cf01c14', 'ICE-PHISHING-ERC20-PERMIT', '0x2'),
+                  ('0x8badbf2ad65abc3df5b1d9cc388e419d9255ef999fb69aac6bf395646cf01c14', 'ICE-PHISHING-ERC721-APPROVAL-FOR-ALL', '0x3'),
+                  ('0x8badbf2ad65abc3df5b1d9cc388e419d9255ef999fb69aac6bf395646cf01c14', 'ICE-PHISHING-ERC721-APPROVAL-FOR-ALL', '0x4'),
+                  ('0x8badbf2ad65abc3df5b1d9cc388e419d9255ef999fb69aac6bf395646cf01c14', 'ICE-PHISHING-ERC721-APPROVAL-FOR-ALL', '0x4')
+                  ]
+
+        vector = builder.build(alerts)
+        assert vector[builder.column_index["0xbc06a40c341aa1acc139c900fd1b7e3999d71b80c13a9dd50a369d8f923757f5_FLASHBOTS-TRANSACTIONS"]] == 1
+        assert vector[builder.column_index["0x8badbf2ad65abc3df5b1d9cc388e419d9255ef999fb69aac6bf395646cf01c14_ICE-PHISHING-ERC721-APPROVAL-FOR-ALL"]] == 2, "duplicate alert hashes should be counted once"
+        assert vector[builder.column_index["0x8badbf2ad65abc3df5b1d9cc388e419d9255ef999fb69aac6bf395646cf01c14_count"]] == 3
+        assert vector[builder.column_index["0x8badbf2ad65abc3df5b1d9cc388e419d9255ef999fb69aac6bf395646cf01c14_uniqalertid_count"]] == 2
+        assert vector.sum() == 1 + 1 + 1 + 1 + 2 + 3 + 2
+
+    def test_build_empty(self):
+        df_feature_vector = builder.to_frame(builder.build([]))
+        assert df_feature_vector.shape == (1, len(MODEL_FEATURES))
+        assert df_feature_vector.values.sum() == 0
+
+    def test_build_equivalent_to_pandas(self):
+        logging.disable(logging.WARNING)
+        try:
+            for seed, size in enumerate([1, 2, 10, 50, 100, 500]):
+                alerts = generate_alerts(size, seed)
+                df_expected = build_feature_vector_pandas(alerts, "0xcluster")
+                df_actual = builder.to_frame(builder.build(alerts))
+                assert df_actual.equals(df_expected), f"feature vectors differ for {size} alerts"
+        finally:
+            logging.disable(logging.NOTSET)
+
+    @pytest.mark.skipif(os.environ.get("RUN_BENCHMARKS") is None, reason="benchmark; set RUN_BENCHMARKS=1 to run it")
+    def test_perf_build(self):
+        logging.disable(logging.WARNING)
+        try:
+            for size in [10, 100, 1000, 10000]:
+                alerts = generate_alerts(size, size)
+                processing_runs = 3
+                processing_time_pandas_ms = timeit.timeit(lambda: build_feature_vector_pandas(alerts, "0xcluster"), number=processing_runs) * 1000 / processing_runs
+                processing_time_builder_ms = timeit.timeit(lambda: builder.to_frame(builder.build(alerts)), number=processing_runs) * 1000 / processing_runs
+                print(f"{size} alerts: pandas {processing_time_pandas_ms:.2f}ms, builder {processing_time_builder_ms:.2f}ms")
+        finally:
+            logging.disable(logging.NOTSET)
+
+
+class TestClusterFeatureState:
+    LOOKBACK_SECONDS = 7 * 24 * 60 * 60
+
+    def test_incremental_equivalent_to_build(self):
+        logging.disable(logging.WARNING)
+        try:
+            alerts = generate_alerts(500, 1)
+            state = ClusterFeatureState(builder, TestClusterFeatureState.LOOKBACK_SECONDS)
+            for i, (bot_id, alert_id, alert_hash) in enumerate(alerts):
+                state.add(bot_id, alert_id, alert_hash, 1700000000 + i + TestClusterFeatureState.LOOKBACK_SECONDS)
+                if i % 50 == 0:
+                    assert np.array_equal(np.array(state.vector), builder.build(alerts[0:i + 1])), f"incremental state differs after {i + 1} alerts"
+            assert state.to_frame().equals(builder.to_frame(builder.build(alerts)))
+            assert set(state.alert_list()) == set(alerts)
+        finally:
+            logging.disable(logging.NOTSET)
+
+    def test_expiry(self):
+        bot_id = "0x8badbf2ad65abc3df5b1d9cc388e419d9255ef999fb69aac6bf395646cf01c14"
+        state = ClusterFeatureState(builder, 100)
+        state.add(bot_id, "ICE-PHISHING-ERC20-PERMIT", "0x1", 1100)  # created at 1000
+        state.add(bot_id, "ICE-PHISHING-ERC20-PERMIT", "0x2", 1150)  # created at 1050
+        state.add(bot_id, "ICE-PHISHING-ERC721-APPROVAL-FOR-ALL", "0x3", 1150)
+        assert state.vector[builder.column_index[bot_id + "_count"]] == 3
+        assert state.vector[builder.column_index[bot_id + "_uniqalertid_count"]] == 2
+
+        state.add(bot_id, "ICE-PHISHING-ERC721-APPROVAL-FOR-ALL", "0x4", 1210)  # created at 1110; alert 0x1 expired at 1100
+        assert ("0x8badbf2ad65abc3df5b1d9cc388e419d9255ef999fb69aac6bf395646cf01c14", "ICE-PHISHING-ERC20-PERMIT", "0x1") not in state.alerts
+        assert state.vector[builder.column_index[bot_id + "_ICE-PHISHING-ERC20-PERMIT"]] == 1
+        assert state.vector[builder.column_index[bot_id + "_count"]] == 3
+
+        state.add(bot_id, "ICE-PHISHING-ERC721-APPROVAL-FOR-ALL", "0x5", 1300)  # created at 1200; all but 0x4 and 0x5 expired
+        assert state.vector[builder.column_index[bot_id + "_ICE-PHISHING-ERC20-PERMIT"]] == 0
+        assert state.vector[builder.column_index[bot_id + "_count"]] == 2
+        assert state.vector[builder.column_index[bot_id + "_uniqalertid_count"]] == 1
+        assert np.array_equal(np.array(state.vector), builder.build(state.alert_list()))
+
+    def test_readd_extends_expiry(self):
+        bot_id = "0x8badbf2ad65abc3df5b1d9cc388e419d9255ef999fb69aac6bf395646cf01c14"
+        state = ClusterFeatureState(builder, 100)
+        state.add(bot_id, "ICE-PHISHING-ERC20-PERMIT", "0x1", 1100)
+        state.add(bot_id, "ICE-PHISHING-ERC20-PERMIT", "0x1", 1180)  # same alert written again, overwriting expiresAt
+        assert state.vector[builder.column_index[bot_id + "_count"]] == 1, "same alert should be counted once"
+
+        state.add(bot_id, "ICE-PHISHING-ERC721-APPROVAL-FOR-ALL", "0x2", 1250)  # created at 1150
+        assert state.vector[builder.column_index[bot_id + "_ICE-PHISHING-ERC20-PERMIT"]] == 1, "alert should expire based on its latest expiresAt"
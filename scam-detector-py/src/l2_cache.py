@@ -2,89 +2,117 @@
 
 import logging
 import os
-import time
-import pickle
-import requests
 import traceback
-import forta_agent
+from concurrent.futures import ThreadPoolExecutor
 
-DATABASE = "https://research.forta.network/database/bot/"
-VERSION = "V11"
+VERSION = "V12"  # keys are prefixed with the version, so previous releases never decode the snapshot format they dont know
+LEGACY_VERSIONS = ["V11"]  # pickled keys of previous releases; loaded as long as this version hasnt written the key yet
 
 from src.utils import Utils
+from src.l2_cache_codec import L2CacheCodec
+from src.persistence_client import PersistenceClient, get_client
 
 class L2Cache:
-    MAX_RETRIES = 3
+    MAX_LOAD_WORKERS = 8
     PERSISTENCE_SIZE_LIMIT = 4 * 1024 * 1024 # 4.5 MB
+    CODEC = L2CacheCodec  # encodes/decodes persisted objects; decode falls back to legacy pickles
+    CLIENT = None  # PersistenceClient to use instead of the shared one, e.g. pointed at a local stand-in in tests
 
     @staticmethod
-    def write(obj: object, chain_id: int, key: str):
+    def client() -> PersistenceClient:
+        return L2Cache.CLIENT if L2Cache.CLIENT is not None else get_client()
+
+    @staticmethod
+    def write(obj: object, chain_id: int, key: str) -> bool:
+        """
+        :return: True if the object was persisted
+        """
         key = f"{VERSION}-{key}"
         byte_length = 0
+        persisted = False
         if 'NODE_ENV' in os.environ and 'production' in os.environ.get('NODE_ENV'):
-            attempt = 0  
-            while attempt < L2Cache.MAX_RETRIES:
-                try:
-                    logging.info(f"Persisting {key} using API")
-                    bytes = pickle.dumps(obj)
-                    byte_length = len(bytes)
-                    token = forta_agent.fetch_jwt({})
-
-                    headers = {"Authorization": f"Bearer {token}"}
-                    res = requests.post(f"{DATABASE}{key}_{chain_id}", data=bytes, headers=headers)
-                    if res.status_code != 200:
-                        Utils.ERROR_CACHE.add(Utils.alert_error(f'Error {res.status_code} while persisting key {key} to DB; length {len(obj)} size {byte_length}.', "l2_cache.write.internal", ""))
-                    logging.info(f"Persisting {key}_{chain_id} to database. Response: {res}")
-                    break
-                except Exception as e:
-                    logging.warn(f"Exception in persist {e}")
-                    attempt += 1 
-                    time.sleep(0.2)
-                    if attempt == L2Cache.MAX_RETRIES:
-                        Utils.ERROR_CACHE.add(Utils.alert_error(str(e), "l2_cache.write (max retries reached)", traceback.format_exc()))
+            try:
+                logging.info(f"Persisting {key} using API")
+                bytes = L2Cache.CODEC.encode(obj)
+                byte_length = len(bytes)
+                res = L2Cache.client().post(f"{key}_{chain_id}", bytes)
+                if res.status_code != 200:
+                    Utils.ERROR_CACHE.add(Utils.alert_error(f'Error {res.status_code} while persisting key {key} to DB; length {len(obj)} size {byte_length}.', "l2_cache.write.internal", ""))
+                else:
+                    persisted = True
+                logging.info(f"Persisting {key}_{chain_id} to database. Response: {res}")
+            except Exception as e:
+                logging.warn(f"Exception in persist {e}")
+                Utils.ERROR_CACHE.add(Utils.alert_error(str(e), "l2_cache.write (max retries reached)", traceback.format_exc()))
 
         else:
             logging.info(f"Persisting {key}_{chain_id} locally")
-            pickle.dump(obj, open(key, "wb"))
+            with open(key, "wb") as f:
+                f.write(L2Cache.CODEC.encode(obj))
+            persisted = True
+        return persisted
 
     @staticmethod
     def remove(chain_id: int, key: str):
-        key = f"{VERSION}-{key}"
         if not ('NODE_ENV' in os.environ and 'production' in os.environ.get('NODE_ENV')):
-            if os.path.exists(key):
-                os.remove(key)
+            for version in [VERSION] + LEGACY_VERSIONS:
+                versioned_key = f"{version}-{key}"
+                if os.path.exists(versioned_key):
+                    os.remove(versioned_key)
 
     @staticmethod
     def load(chain_id: int, key: str) -> object:
-        key = f"{VERSION}-{key}"
+        """
+        loads the key written by this version, falling back to the key written by previous versions if it doesnt exist yet
+        """
+        versions = [VERSION] + LEGACY_VERSIONS
+        for i, version in enumerate(versions):
+            missing, obj = L2Cache._load(chain_id, f"{version}-{key}", report_missing=i == len(versions) - 1)
+            if not missing:
+                return obj
+        return None
+
+    @staticmethod
+    def _load(chain_id: int, key: str, report_missing: bool) -> tuple:
+        """
+        :return: (True if the key doesnt exist, loaded object)
+        """
         if 'NODE_ENV' in os.environ and 'production' in os.environ.get('NODE_ENV'):
-            attempt = 0
-            while attempt < L2Cache.MAX_RETRIES:
-                try:
-                    logging.info(f"Loading {key}_{chain_id}  using API")
-                    token = forta_agent.fetch_jwt({})
-                    headers = {"Authorization": f"Bearer {token}"}
-                    res = requests.get(f"{DATABASE}{key}_{chain_id}", headers=headers)
-                    logging.info(f"Loaded {key}_{chain_id} . Response: {res}")
-                    if res.status_code == 200 and len(res.content) > 0:
-                        return pickle.loads(res.content)
-                    else:
-                        Utils.ERROR_CACHE.add(Utils.alert_error(f'request DB {res.status_code}. key {key} doesnt exist.', "l2_cache.load", ""))
-                        logging.info(f"{key} does not exist")
-                        break
-                except Exception as e:
-                    logging.warn(f"Exception in load {e}")
-                    attempt += 1
-                    time.sleep(0.2)
-                    if attempt == L2Cache.MAX_RETRIES:
-                        Utils.ERROR_CACHE.add(Utils.alert_error(str(e), "l2_cache.load (max retries reached)", traceback.format_exc()))
-                        break
+            try:
+                logging.info(f"Loading {key}_{chain_id}  using API")
+                res = L2Cache.client().get(f"{key}_{chain_id}")
+                logging.info(f"Loaded {key}_{chain_id} . Response: {res}")
+                if res.status_code == 200 and len(res.content) > 0:
+                    return False, L2Cache.CODEC.decode(res.content)
+                missing = res.status_code in (200, 404)
+                if report_missing or not missing:
+                    Utils.ERROR_CACHE.add(Utils.alert_error(f'request DB {res.status_code}. key {key} doesnt exist.', "l2_cache.load", ""))
+                logging.info(f"{key} does not exist")
+                return missing, None
+            except Exception as e:
+                logging.warn(f"Exception in load {e}")
+                Utils.ERROR_CACHE.add(Utils.alert_error(str(e), "l2_cache.load (max retries reached)", traceback.format_exc()))
+                return False, None
 
         else:
             # load locally
             logging.info(f"Loading {key}_{chain_id} locally")
             if os.path.exists(key):
-                return pickle.load(open(key, "rb"))
+                with open(key, "rb") as f:
+                    return False, L2Cache.CODEC.decode(f.read())
             else:
                 logging.info(f"File {key} does not exist")
-        return None
\ No newline at end of file
+        return True, None
+
+    @staticmethod
+    def load_all(chain_id: int, keys: list) -> dict:
+        """
+        loads the keys concurrently; the requests share the connection pool and jwt of the persistence client
+        :return: dict of key -> loaded object (None if the key doesnt exist)
+        """
+        if not ('NODE_ENV' in os.environ and 'production' in os.environ.get('NODE_ENV')):
+            return {key: L2Cache.load(chain_id, key) for key in keys}
+
+        with ThreadPoolExecutor(max_workers=L2Cache.MAX_LOAD_WORKERS) as executor:
+            futures = {key: executor.submit(L2Cache.load, chain_id, key) for key in keys}
+            return {key: future.result() for key, future in futures.items()}
@@ -0,0 +1,244 @@
+import pickle
+import re
+import zlib
+from collections import OrderedDict
+
+try:
+    import zstandard
+except ImportError:  # optional; zlib is used if zstandard isnt installed
+    zstandard = None
+
+# snapshot layout: MAGIC | format version | codec | compression | payload
+# legacy snapshots are plain pickles, which start with the PROTO opcode (0x80) and can therefore never start with MAGIC
+MAGIC = b"FL2C"
+FORMAT_VERSION = 1
+HEADER_SIZE = len(MAGIC) + 3
+
+CODEC_PICKLE = 0  # any object; used if none of the compact codecs apply
+CODEC_ALERTED_ENTITIES = 1  # dict of entity -> set of alert ids (or a single alert id)
+CODEC_STRING_LIST = 2  # list of entities
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_ZSTD = 2
+
+ENTITY_ADDRESS = 0  # 20 byte address
+ENTITY_ADDRESS_CLUSTER = 1  # comma separated addresses as count + 20 bytes per address
+ENTITY_STRING = 2  # anything else, e.g. urls or checksummed addresses, as utf-8
+
+VALUE_SET = 0
+VALUE_STRING = 1
+
+ADDRESS_PATTERN = re.compile(r"0x[0-9a-f]{40}")
+
+
+class L2CacheCodec:
+    """
+    compact, versioned binary snapshot format for the state persisted through L2Cache
+    addresses are packed as 20 bytes, alert ids are written once into a table and referenced by index, and the payload is compressed
+    """
+
+    @staticmethod
+    def _write_varint(buffer: bytearray, value: int):
+        while value >= 0x80:
+            buffer.append((value & 0x7F) | 0x80)
+            value >>= 7
+        buffer.append(value)
+
+    @staticmethod
+    def _read_varint(data: bytes, offset: int) -> tuple:
+        value = 0
+        shift = 0
+        while True:
+            b = data[offset]
+            offset += 1
+            value |= (b & 0x7F) << shift
+            if b < 0x80:
+                return value, offset
+            shift += 7
+
+    @staticmethod
+    def _write_string(buffer: bytearray, s: str):
+        encoded = s.encode("utf-8")
+        L2CacheCodec._write_varint(buffer, len(encoded))
+        buffer += encoded
+
+    @staticmethod
+    def _read_string(data: bytes, offset: int) -> tuple:
+        length, offset = L2CacheCodec._read_varint(data, offset)
+        return data[offset:offset + length].decode("utf-8"), offset + length
+
+    @staticmethod
+    def _write_entity(buffer: bytearray, entity: str):
+        if ADDRESS_PATTERN.fullmatch(entity):
+            buffer.append(ENTITY_ADDRESS)
+            buffer += bytes.fromhex(entity[2:])
+            return
+
+        addresses = entity.split(",")
+        if len(addresses) > 1 and all(ADDRESS_PATTERN.fullmatch(address) for address in addresses):
+            buffer.append(ENTITY_ADDRESS_CLUSTER)
+            L2CacheCodec._write_varint(buffer, len(addresses))
+            for address in addresses:
+                buffer += bytes.fromhex(address[2:])
+            return
+
+        buffer.append(ENTITY_STRING)
+        L2CacheCodec._write_string(buffer, entity)
+
+    @staticmethod
+    def _read_entity(data: bytes, offset: int) -> tuple:
+        entity_type = data[offset]
+        offset += 1
+        if entity_type == ENTITY_ADDRESS:
+            return "0x" + data[offset:offset + 20].hex(), offset + 20
+        if entity_type == ENTITY_ADDRESS_CLUSTER:
+            count, offset = L2CacheCodec._read_varint(data, offset)
+            addresses = []
+            for i in range(count):
+                addresses.append("0x" + data[offset:offset + 20].hex())
+                offset += 20
+            return ",".join(addresses), offset
+        if entity_type == ENTITY_STRING:
+            return L2CacheCodec._read_string(data, offset)
+        raise ValueError(f"Unknown entity type {entity_type}")
+
+    @staticmethod
+    def _codec_for(obj: object) -> int:
+        if isinstance(obj, dict) and all(isinstance(key, str) for key in obj.keys()) \
+                and all(isinstance(value, str) or (isinstance(value, (set, frozenset)) and all(isinstance(item, str) for item in value)) for value in obj.values()):
+            return CODEC_ALERTED_ENTITIES
+        if isinstance(obj, list) and all(isinstance(item, str) for item in obj):
+            return CODEC_STRING_LIST
+        return CODEC_PICKLE
+
+    @staticmethod
+    def _encode_alerted_entities(items: dict) -> bytes:
+        alert_ids = {}  # alert id -> index in the alert id table
+        for value in items.values():
+            for alert_id in ((value,) if isinstance(value, str) else value):
+                if alert_id not in alert_ids:
+                    alert_ids[alert_id] = len(alert_ids)
+
+        buffer = bytearray()
+        L2CacheCodec._write_varint(buffer, len(alert_ids))
+        for alert_id in alert_ids.keys():
+            L2CacheCodec._write_string(buffer, alert_id)
+
+        L2CacheCodec._write_varint(buffer, len(items))
+        for entity, value in items.items():
+            L2CacheCodec._write_entity(buffer, entity)
+            if isinstance(value, str):
+                buffer.append(VALUE_STRING)
+                L2CacheCodec._write_varint(buffer, alert_ids[value])
+            else:
+                buffer.append(VALUE_SET)
+                L2CacheCodec._write_varint(buffer, len(value))
+                for alert_id in value:
+                    L2CacheCodec._write_varint(buffer, alert_ids[alert_id])
+        return bytes(buffer)
+
+    @staticmethod
+    def _decode_alerted_entities(data: bytes) -> OrderedDict:
+        offset = 0
+        count, offset = L2CacheCodec._read_varint(data, offset)
+        alert_ids = []
+        for i in range(count):
+            alert_id, offset = L2CacheCodec._read_string(data, offset)
+            alert_ids.append(alert_id)
+
+        items = OrderedDict()
+        count, offset = L2CacheCodec._read_varint(data, offset)
+        for i in range(count):
+            if data[offset] == ENTITY_ADDRESS:  # most common case inlined, as decoding is done per entry in python
+                entity = "0x" + data[offset + 1:offset + 21].hex()
+                offset += 21
+            else:
+                entity, offset = L2CacheCodec._read_entity(data, offset)
+            value_type = data[offset]
+            size = data[offset + 1]
+            offset += 2
+            if size >= 0x80:
+                size, offset = L2CacheCodec._read_varint(data, offset - 1)
+            if value_type == VALUE_STRING:
+                items[entity] = alert_ids[size]
+                continue
+
+            values = set()
+            for j in range(size):
+                index = data[offset]
+                offset += 1
+                if index >= 0x80:
+                    index, offset = L2CacheCodec._read_varint(data, offset - 1)
+                values.add(alert_ids[index])
+            items[entity] = values
+        return items
+
+    @staticmethod
+    def _encode_string_list(items: list) -> bytes:
+        buffer = bytearray()
+        L2CacheCodec._write_varint(buffer, len(items))
+        for item in items:
+            L2CacheCodec._write_entity(buffer, item)
+        return bytes(buffer)
+
+    @staticmethod
+    def _decode_string_list(data: bytes) -> list:
+        offset = 0
+        count, offset = L2CacheCodec._read_varint(data, offset)
+        items = []
+        for i in range(count):
+            item, offset = L2CacheCodec._read_entity(data, offset)
+            items.append(item)
+        return items
+
+    @staticmethod
+    def default_compression() -> int:
+        return COMPRESSION_ZSTD if zstandard is not None else COMPRESSION_ZLIB
+
+    @staticmethod
+    def encode(obj: object, compression: int = None) -> bytes:
+        compression = L2CacheCodec.default_compression() if compression is None else compression
+        codec = L2CacheCodec._codec_for(obj)
+        if codec == CODEC_ALERTED_ENTITIES:
+            payload = L2CacheCodec._encode_alerted_entities(obj)
+        elif codec == CODEC_STRING_LIST:
+            payload = L2CacheCodec._encode_string_list(obj)
+        else:
+            payload = pickle.dumps(obj)
+
+        if compression == COMPRESSION_ZSTD:
+            payload = zstandard.ZstdCompressor(level=3).compress(payload)
+        elif compression == COMPRESSION_ZLIB:
+            payload = zlib.compress(payload, 6)
+        return MAGIC + bytes([FORMAT_VERSION, codec, compression]) + payload
+
+    @staticmethod
+    def decode(data: bytes) -> object:
+        """
+        decodes a snapshot written by encode; snapshots without the header are legacy pickles and are unpickled as before
+        """
+        if not data.startswith(MAGIC):
+            return pickle.loads(data)
+
+        version, codec, compression = data[len(MAGIC)], data[len(MAGIC) + 1], data[len(MAGIC) + 2]
+        if version > FORMAT_VERSION:
+            raise ValueError(f"Unsupported L2Cache snapshot format version {version}")
+
+        payload = data[HEADER_SIZE:]
+        if compression == COMPRESSION_ZSTD:
+            if zstandard is None:
+                raise ValueError("L2Cache snapshot is zstd compressed, but zstandard is not installed")
+            payload = zstandard.ZstdDecompressor().decompress(payload)
+        elif compression == COMPRESSION_ZLIB:
+            payload = zlib.decompress(payload)
+        elif compression != COMPRESSION_NONE:
+            raise ValueError(f"Unknown L2Cache snapshot compression {compression}")
+
+        if codec == CODEC_ALERTED_ENTITIES:
+            return L2CacheCodec._decode_alerted_entities(payload)
+        if codec == CODEC_STRING_LIST:
+            return L2CacheCodec._decode_string_list(payload)
+        if codec == CODEC_PICKLE:
+            return pickle.loads(payload)
+        raise ValueError(f"Unknown L2Cache snapshot codec {codec}")
@@ -0,0 +1,125 @@
+import pickle
+import random
+import timeit
+from collections import OrderedDict
+
+from forta_agent import Finding, FindingSeverity, FindingType
+
+from l2_cache_codec import L2CacheCodec, MAGIC, COMPRESSION_NONE, COMPRESSION_ZLIB, CODEC_ALERTED_ENTITIES, CODEC_STRING_LIST, CODEC_PICKLE
+from size_bounded_dict import SizeBoundedOrderedDict
+
+
+def random_address(rng: random.Random) -> str:
+    return "0x" + "".join(rng.choice("0123456789abcdef") for _ in range(40))
+
+
+def alerted_entities(rng: random.Random, size: int, logic: str, alert_ids: list) -> SizeBoundedOrderedDict:
+    items = SizeBoundedOrderedDict(4 * 1024 * 1024)
+    for i in range(size):
+        r = rng.random()
+        if r < 0.1:
+            entity = ",".join(random_address(rng) for j in range(rng.randint(2, 4)))  # entity cluster
+        elif r < 0.15:
+            entity = f"https://scam-{i}.example.com"
+        else:
+            entity = random_address(rng)
+        for alert_id in rng.sample(alert_ids, rng.randint(1, min(2, len(alert_ids)))):
+            items.add(entity, logic + alert_id)
+    return items
+
+
+def findings(rng: random.Random, size: int) -> list:
+    return [Finding({
+        'name': 'Scam detector identified an EOA with past alerts mapping to scam behavior',
+        'description': f'{random_address(rng)} likely involved in a scam (SCAM-DETECTOR-ICE-PHISHING, passthrough)',
+        'alert_id': 'SCAM-DETECTOR-ICE-PHISHING',
+        'type': FindingType.Scam,
+        'severity': FindingSeverity.Critical,
+        'metadata': {'scammer_addresses': random_address(rng), 'involved_alert_hashes_1': hex(rng.getrandbits(256))},
+        'labels': []
+    }) for i in range(size)]
+
+
+# the nine keys persist_state writes; FINDINGS_CACHE_* are usually short lived, the metamask list is written instead of its dict
+def persisted_state(seed: int) -> dict:
+    rng = random.Random(seed)
+    alert_ids = ["SCAM-DETECTOR-ICE-PHISHING", "SCAM-DETECTOR-ADDRESS-POISONER", "SCAM-DETECTOR-RAKE-TOKEN", "SCAM-DETECTOR-SOCIAL-ENG-NATIVE-ICE-PHISHING", "SCAM-DETECTOR-FRAUDULENT-NFT-ORDER", "SCAM-DETECTOR-WASH-TRADE"]
+    return {
+        "ALERTED_ENTITIES_ML": alerted_entities(rng, 20000, "ml", alert_ids),
+        "ALERTED_ENTITIES_PASSTHROUGH": alerted_entities(rng, 20000, "passthrough", alert_ids),
+        "ALERTED_ENTITIES_SCAMMER_ASSOCIATION": alerted_entities(rng, 5000, "scammer_association", ["SCAM-DETECTOR-SCAMMER-ASSOCIATION"]),
+        "ALERTED_ENTITIES_SIMILAR_CONTRACT": alerted_entities(rng, 5000, "similar_contract", ["SCAM-DETECTOR-SIMILAR-CONTRACT"]),
+        "ALERTED_ENTITIES_MANUAL": alerted_entities(rng, 2000, "manual", alert_ids),
+        "ALERTED_FP_CLUSTERS": alerted_entities(rng, 2000, "", ["SCAM-DETECTOR-FALSE-POSITIVE"]),
+        "ALERTED_ENTITIES_MANUAL_METAMASK_LIST": [f"scam-{i}.example.com" for i in range(20000)],
+        "FINDINGS_CACHE_BLOCK": findings(rng, 50),
+        "FINDINGS_CACHE_ALERT": findings(rng, 50),
+        "FINDINGS_CACHE_TRANSACTION": [],
+    }
+
+
+class TestL2CacheCodec:
+
+    def test_round_trip_alerted_entities(self):
+        items = OrderedDict()
+        items["0x" + "ab" * 20] = {"mlSCAM-DETECTOR-ICE-PHISHING", "mlSCAM-DETECTOR-RAKE-TOKEN"}
+        items["0x" + "cd" * 20 + ",0x" + "ef" * 20] = {"mlSCAM-DETECTOR-ICE-PHISHING"}
+        items["0xAbCd" + "ef" * 18] = {"manualSCAM-DETECTOR-MANUAL-ICE-PHISHING"}  # checksummed addresses are kept as is
+        items["https://scam.example.com"] = "manual_metamaskSCAM-DETECTOR-MANUAL-METAMASK-PHISHING"
+        items["0x1"] = set()
+
+        for compression in [COMPRESSION_NONE, COMPRESSION_ZLIB]:
+            data = L2CacheCodec.encode(items, compression)
+            assert data.startswith(MAGIC)
+            assert data[len(MAGIC) + 1] == CODEC_ALERTED_ENTITIES
+            decoded = L2CacheCodec.decode(data)
+            assert decoded == items
+            assert list(decoded.keys()) == list(items.keys()), "order should be preserved as eviction relies on it"
+
+    def test_round_trip_string_list(self):
+        items = ["scam.example.com", "0x" + "ab" * 20, ""]
+        data = L2CacheCodec.encode(items)
+        assert data[len(MAGIC) + 1] == CODEC_STRING_LIST
+        assert L2CacheCodec.decode(data) == items
+
+    def test_round_trip_pickle_fallback(self):
+        items = findings(random.Random(1), 3)
+        data = L2CacheCodec.encode(items)
+        assert data[len(MAGIC) + 1] == CODEC_PICKLE
+        decoded = L2CacheCodec.decode(data)
+        assert [finding.description for finding in decoded] == [finding.description for finding in items]
+
+        mixed = OrderedDict({"0x1": {1, 2}})
+        assert L2CacheCodec.decode(L2CacheCodec.encode(mixed)) == mixed
+
+    def test_decode_legacy_pickle(self):
+        items = OrderedDict({"0x" + "ab" * 20: {"mlSCAM-DETECTOR-ICE-PHISHING"}})
+        assert L2CacheCodec.decode(pickle.dumps(items)) == items
+        assert L2CacheCodec.decode(pickle.dumps([])) == []
+
+    def test_decode_newer_version(self):
+        data = bytearray(L2CacheCodec.encode([]))
+        data[len(MAGIC)] = 99
+        try:
+            L2CacheCodec.decode(bytes(data))
+            assert False, "newer format versions should not be decoded"
+        except ValueError:
+            pass
+
+    def test_perf_persisted_state(self):
+        state = persisted_state(1)
+        total_pickle_bytes = total_codec_bytes = 0
+        for key, obj in state.items():
+            pickled = pickle.dumps(obj)
+            encoded = L2CacheCodec.encode(obj)
+            processing_runs = 3
+            load_time_pickle_ms = timeit.timeit(lambda: pickle.loads(pickled), number=processing_runs) * 1000 / processing_runs
+            load_time_codec_ms = timeit.timeit(lambda: L2CacheCodec.decode(encoded), number=processing_runs) * 1000 / processing_runs
+            print(f"{key}: pickle {len(pickled)} bytes, load {load_time_pickle_ms:.2f}ms; codec {len(encoded)} bytes, load {load_time_codec_ms:.2f}ms")
+            total_pickle_bytes += len(pickled)
+            total_codec_bytes += len(encoded)
+            if key.startswith("ALERTED"):
+                assert L2CacheCodec.decode(encoded) == obj
+                assert len(encoded) < len(pickled) / 2, f"{key} should be less than half the size of its pickle"
+
+        print(f"total: pickle {total_pickle_bytes} bytes, codec {total_codec_bytes} bytes")
@@ -0,0 +1,90 @@
+import os
+import pickle
+from collections import OrderedDict
+from unittest.mock import Mock, patch
+
+import l2_cache
+from l2_cache import L2Cache
+from persisted_state import DELTA_KEY_SUFFIX, PersistedQueue
+from persistence_client import PersistenceClient
+from research_db_mock import ResearchDBMock
+
+
+class TestL2Cache:
+
+    def setup_method(self):
+        self.db = ResearchDBMock()
+        self.fetch_jwt = Mock(return_value="token")
+        L2Cache.CLIENT = PersistenceClient(self.db.url, backoff_base=0.01, fetch_jwt=self.fetch_jwt)
+
+    def teardown_method(self):
+        L2Cache.CLIENT = None
+        self.db.stop()
+
+    def test_write_and_load_production(self):
+        items = OrderedDict({"0x" + "ab" * 20: {"mlSCAM-DETECTOR-ICE-PHISHING"}})
+        with patch.dict(os.environ, {"NODE_ENV": "production"}):
+            assert L2Cache.write(items, 1, "key1")
+            assert L2Cache.load(1, "key1") == items
+            assert L2Cache.load(1, "key2") is None
+
+    def test_load_all_production(self):
+        items = OrderedDict({"0x" + "ab" * 20: {"mlSCAM-DETECTOR-ICE-PHISHING"}})
+        with patch.dict(os.environ, {"NODE_ENV": "production"}):
+            L2Cache.write(items, 1, "key1")
+            L2Cache.write([1, 2], 1, "key2")
+            state = L2Cache.load_all(1, ["key1", "key2", "key3"])
+
+        assert state == {"key1": items, "key2": [1, 2], "key3": None}
+        assert self.fetch_jwt.call_count == 1, "the jwt should be shared across writes and loads"
+        assert len(self.db.requests) == 6, "the missing key should be looked up under the legacy version too"
+
+    def test_write_failure_production(self):
+        self.db.fail_next(500, 500, 500)
+        with patch.dict(os.environ, {"NODE_ENV": "production"}):
+            assert not L2Cache.write([1, 2], 1, "key1")
+
+    def test_load_legacy_pickle_production(self):
+        self.db.items[f"/database/bot/{l2_cache.VERSION}-key1_1"] = pickle.dumps([1, 2])
+        with patch.dict(os.environ, {"NODE_ENV": "production"}):
+            assert L2Cache.load(1, "key1") == [1, 2]
+
+    def test_load_legacy_version_production(self):
+        self.db.items[f"/database/bot/V11-key1_1"] = pickle.dumps([1, 2])
+        with patch.dict(os.environ, {"NODE_ENV": "production"}):
+            assert L2Cache.load(1, "key1") == [1, 2], "keys of previous versions should be loaded until this version writes them"
+            assert L2Cache.write([3], 1, "key1")
+            assert L2Cache.load(1, "key1") == [3]
+        assert pickle.loads(self.db.items["/database/bot/V11-key1_1"]) == [1, 2], "keys read by previous versions should be left as they were"
+        assert l2_cache.VERSION != "V11"
+
+    def test_findings_queue_upgrade_production(self):
+        self.db.items[f"/database/bot/V11-findings_1"] = pickle.dumps([1, 2, 3])
+        with patch.dict(os.environ, {"NODE_ENV": "production"}):
+            queue = PersistedQueue.restore(L2Cache.load(1, "findings"), L2Cache.load(1, "findings" + DELTA_KEY_SUFFIX))
+            assert queue == [1, 2, 3]
+            queue.append(4)
+            assert queue.needs_compaction(), "the dict-shaped snapshot should be written on the first persist after the upgrade"
+            assert L2Cache.write(queue.snapshot(), 1, "findings")
+            queue.mark_compacted()
+            queue.append(5)
+            assert not queue.needs_compaction()
+            assert L2Cache.write(queue.delta(), 1, "findings" + DELTA_KEY_SUFFIX)
+
+            restored = PersistedQueue.restore(L2Cache.load(1, "findings"), L2Cache.load(1, "findings" + DELTA_KEY_SUFFIX))
+            assert restored == [1, 2, 3, 4, 5]
+        assert pickle.loads(self.db.items["/database/bot/V11-findings_1"]) == [1, 2, 3], "previous versions should keep reading a list"
+        assert "/database/bot/V11-findings_delta_1" not in self.db.items
+
+    def test_load_error_doesnt_fall_back_production(self):
+        self.db.items[f"/database/bot/V11-key1_1"] = pickle.dumps([1, 2])
+        self.db.fail_next(500, 500, 500, 500)
+        with patch.dict(os.environ, {"NODE_ENV": "production"}):
+            assert L2Cache.load(1, "key1") is None, "stale keys of previous versions shouldnt be loaded when the current key cant be read"
+
+    def test_load_all_local(self):
+        L2Cache.write([1, 2], 1, "l2_cache_test_key")
+        try:
+            assert L2Cache.load_all(1, ["l2_cache_test_key", "l2_cache_test_missing_key"]) == {"l2_cache_test_key": [1, 2], "l2_cache_test_missing_key": None}
+        finally:
+            L2Cache.remove(1, "l2_cache_test_key")
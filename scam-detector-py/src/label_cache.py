@@ -0,0 +1,153 @@
+import logging
+import os
+import pickle
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from src.constants import ATTACKER_LABEL_KEYWORDS, LABEL_CACHE_SIZE, LABEL_CACHE_TTL_IN_SECONDS, LABEL_CACHE_NEGATIVE_TTL_IN_SECONDS, LABEL_CACHE_BATCH_SIZE
+
+ATTACKER_LABEL_PATTERN = re.compile("|".join(re.escape(keyword) for keyword in ATTACKER_LABEL_KEYWORDS), re.IGNORECASE)
+
+
+class LabelCache:
+    """
+    bounded LRU cache with TTL of address -> labels (e.g. etherscan labels/nametag) shared by the FP checks of a bot
+    addresses without labels are cached as well (negative caching), with their own, usually shorter, TTL
+    addresses that arent cached are looked up in batches of batch_size with a single call of fetch_labels
+    fetch_labels(addresses) returns a dict of address -> labels for the addresses that have labels or None if the lookup failed; failed lookups arent cached
+    entries can be snapshotted to a local file, so a restarted bot doesnt look up all labels again
+    """
+
+    def __init__(self, fetch_labels, max_size: int = LABEL_CACHE_SIZE, ttl_seconds: float = LABEL_CACHE_TTL_IN_SECONDS,
+                 negative_ttl_seconds: float = LABEL_CACHE_NEGATIVE_TTL_IN_SECONDS, batch_size: int = LABEL_CACHE_BATCH_SIZE, snapshot_path: str = None):
+        self.fetch_labels = fetch_labels
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.batch_size = batch_size
+        self.snapshot_path = snapshot_path
+        self.entries = OrderedDict()  # address -> (expires_at, labels or None)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if snapshot_path is not None:
+            self.load_snapshot()
+
+    def _get_cached(self, address: str, now: float) -> tuple:
+        """
+        returns (True, labels) for a cached address or (False, None) if it isnt cached or expired; must be called holding the lock
+        """
+        entry = self.entries.get(address)
+        if entry is not None and now < entry[0]:
+            self.entries.move_to_end(address)
+            self.hits += 1
+            return True, entry[1]
+
+        if entry is not None:
+            del self.entries[address]
+        self.misses += 1
+        return False, None
+
+    def _put(self, address: str, labels, now: float):
+        ttl_seconds = self.ttl_seconds if labels else self.negative_ttl_seconds
+        self.entries[address] = (now + ttl_seconds, labels if labels else None)
+        self.entries.move_to_end(address)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def get_many(self, addresses) -> dict:
+        """
+        returns a dict of address -> labels for the addresses that have labels; addresses are lower cased
+        """
+        labels_by_address = dict()
+        missing = []
+        now = time.time()
+        with self.lock:
+            for address in dict.fromkeys(address.lower() for address in addresses):
+                cached, labels = self._get_cached(address, now)
+                if not cached:
+                    missing.append(address)
+                elif labels:
+                    labels_by_address[address] = labels
+
+        for i in range(0, len(missing), self.batch_size):
+            batch = missing[i:i + self.batch_size]
+            fetched = self.fetch_labels(batch)
+            if fetched is None:
+                logging.warning(f"Label lookup of {len(batch)} addresses failed. Not caching them.")
+                continue
+            fetched = dict((address.lower(), labels) for address, labels in fetched.items())
+            now = time.time()
+            with self.lock:
+                for address in batch:
+                    labels = fetched.get(address)
+                    self._put(address, labels, now)
+                    if labels:
+                        labels_by_address[address] = labels
+        return labels_by_address
+
+    def get(self, address: str):
+        """
+        returns the labels of the address or None if it has none
+        """
+        return self.get_many([address]).get(address.lower())
+
+    def clear(self):
+        with self.lock:
+            self.entries = OrderedDict()
+            self.hits = 0
+            self.misses = 0
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def save_snapshot(self):
+        """
+        writes the unexpired entries to snapshot_path; the file is replaced atomically, so a crash while writing leaves the previous snapshot intact
+        """
+        if self.snapshot_path is None:
+            return
+        now = time.time()
+        with self.lock:
+            entries = [(address, entry) for address, entry in self.entries.items() if now < entry[0]]
+        tmp_path = f"{self.snapshot_path}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump(entries, f)
+            os.replace(tmp_path, self.snapshot_path)
+            logging.info(f"Saved label cache snapshot of {len(entries)} addresses to {self.snapshot_path}")
+        except Exception as e:
+            logging.warning(f"Could not save label cache snapshot {self.snapshot_path}: {e}")
+
+    def load_snapshot(self):
+        if self.snapshot_path is None or not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                entries = pickle.load(f)
+        except Exception as e:
+            logging.warning(f"Could not load label cache snapshot {self.snapshot_path}: {e}")
+            return
+        now = time.time()
+        with self.lock:
+            for address, entry in entries:
+                if now < entry[0]:
+                    self.entries[address] = entry
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        logging.info(f"Loaded label cache snapshot of {len(self.entries)} addresses from {self.snapshot_path}")
+
+    @staticmethod
+    def is_attacker_label(label: str) -> bool:
+        return ATTACKER_LABEL_PATTERN.search(label) is not None
+
+    @staticmethod
+    def is_non_attacker(labels) -> bool:
+        """
+        whether the labels identify a known, non attacker entity: at least one label and none containing an attacker keyword
+        """
+        labels = [label for label in labels if label]
+        return len(labels) > 0 and not any(LabelCache.is_attacker_label(label) for label in labels)
@@ -0,0 +1,95 @@
+import os
+import time
+
+from label_cache import LabelCache
+
+LABELS = {"0xa": ["Uniswap", "Uniswap V3: FORT-USDC"], "0xb": ["Fake_Phishing123"]}
+
+
+class FetchMock:
+    def __init__(self, labels: dict = LABELS, fail: bool = False):
+        self.labels = labels
+        self.fail = fail
+        self.calls = []
+
+    def __call__(self, addresses: list) -> dict:
+        self.calls.append(list(addresses))
+        if self.fail:
+            return None
+        return dict((address.upper().replace("0X", "0x"), self.labels[address]) for address in addresses if address in self.labels)
+
+
+class TestLabelCache:
+
+    def test_batched_lookup(self):
+        fetch = FetchMock()
+        cache = LabelCache(fetch, batch_size=2)
+        assert cache.get_many(["0xA", "0xb", "0xc", "0xa"]) == LABELS
+        assert fetch.calls == [["0xa", "0xb"], ["0xc"]], "addresses should be lower cased, deduplicated and looked up in batches"
+
+    def test_hit(self):
+        fetch = FetchMock()
+        cache = LabelCache(fetch)
+        assert cache.get("0xa") == LABELS["0xa"]
+        assert cache.get("0xA") == LABELS["0xa"]
+        assert cache.get_many(["0xa", "0xb"]) == LABELS
+        assert fetch.calls == [["0xa"], ["0xb"]]
+        assert cache.hits == 2
+        assert cache.misses == 2
+
+    def test_negative_caching(self):
+        fetch = FetchMock()
+        cache = LabelCache(fetch, negative_ttl_seconds=0.05)
+        assert cache.get("0xc") is None
+        assert cache.get("0xc") is None
+        assert len(fetch.calls) == 1, "addresses without labels should be cached"
+        time.sleep(0.1)
+        assert cache.get("0xc") is None
+        assert len(fetch.calls) == 2, "addresses without labels should be looked up again after the negative ttl"
+
+    def test_ttl(self):
+        fetch = FetchMock()
+        cache = LabelCache(fetch, ttl_seconds=0.05)
+        cache.get("0xa")
+        time.sleep(0.1)
+        assert cache.get("0xa") == LABELS["0xa"]
+        assert len(fetch.calls) == 2, "entry should have expired"
+
+    def test_failed_lookup_isnt_cached(self):
+        fetch = FetchMock(fail=True)
+        cache = LabelCache(fetch)
+        assert cache.get("0xa") is None
+        fetch.fail = False
+        assert cache.get("0xa") == LABELS["0xa"]
+        assert len(fetch.calls) == 2
+
+    def test_lru_eviction(self):
+        fetch = FetchMock()
+        cache = LabelCache(fetch, max_size=2)
+        cache.get_many(["0xa", "0xb"])
+        cache.get("0xa")  # 0xa is now most recently used
+        cache.get("0xc")
+        assert list(cache.entries.keys()) == ["0xa", "0xc"]
+
+    def test_snapshot(self):
+        path = "label_cache_test_snapshot.pkl"
+        try:
+            cache = LabelCache(FetchMock(), snapshot_path=path)
+            cache.get_many(["0xa", "0xb", "0xc"])
+            cache.save_snapshot()
+
+            fetch = FetchMock()
+            restored = LabelCache(fetch, snapshot_path=path)
+            assert restored.get_many(["0xa", "0xb", "0xc"]) == LABELS
+            assert fetch.calls == [], "labels should be restored from the snapshot"
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_is_non_attacker(self):
+        assert LabelCache.is_non_attacker(["Uniswap", "Uniswap V3: FORT-USDC"])
+        assert not LabelCache.is_non_attacker(["Uniswap", "Fake_Phishing123"])
+        assert not LabelCache.is_non_attacker(["Exploiter 1"])
+        assert not LabelCache.is_non_attacker(["vitalik.eth"])
+        assert not LabelCache.is_non_attacker([])
+        assert not LabelCache.is_non_attacker([""])
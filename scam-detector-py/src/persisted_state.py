@@ -0,0 +1,105 @@
+DELTA_KEY_SUFFIX = "_delta"
+
+
+class PersistenceTracker:
+    """
+    remembers the state of each key when it was last persisted (or loaded), so unchanged objects arent written again
+    the state of an object is its identity and its version attribute; objects without a version are always considered dirty
+    """
+
+    def __init__(self):
+        self.tokens = {}  # key -> (id of object, version)
+
+    @staticmethod
+    def _token(obj: object) -> tuple:
+        version = getattr(obj, "version", None)
+        return None if version is None else (id(obj), version)
+
+    def is_dirty(self, key: str, obj: object) -> bool:
+        token = PersistenceTracker._token(obj)
+        return token is None or self.tokens.get(key) != token
+
+    def mark_persisted(self, key: str, obj: object):
+        token = PersistenceTracker._token(obj)
+        if token is not None:
+            self.tokens[key] = token
+
+    def clear(self):
+        self.tokens = {}
+
+
+class PersistedQueue(list):
+    """
+    list of findings that is appended to at the end and consumed from the front
+    it is persisted as a snapshot plus a delta of the items appended and the number of items consumed since that snapshot
+    the delta is written on each persist and the snapshot is rewritten (compacted) once the delta grows to half of the queue
+    snapshot and delta carry a generation, so a delta that predates the latest snapshot is ignored when loading
+    a queue restored from a plain list (the format of previous releases) is compacted on its first persist, so the dict-shaped
+    snapshot is written under the current L2Cache version and the list previous releases read is left as is
+    """
+
+    def __init__(self, items=None, generation: int = 0):
+        super().__init__(items if items is not None else [])
+        self.generation = generation
+        self.appended = []  # items appended since the snapshot
+        self.consumed = 0  # items consumed from the front since the snapshot
+        self.version = 0
+        self.legacy = False  # restored from a plain list, no snapshot of this format written yet
+
+    def append(self, item):
+        super().append(item)
+        self.appended.append(item)
+        self.version += 1
+
+    def extend(self, items):
+        items = list(items)
+        if len(items) > 0:
+            super().extend(items)
+            self.appended.extend(items)
+            self.version += 1
+
+    def pop_front(self, count: int) -> list:
+        front = self[0:count]
+        if len(front) > 0:
+            del self[0:count]
+            self.consumed += len(front)
+            self.version += 1
+        return front
+
+    def needs_compaction(self) -> bool:
+        return self.legacy or len(self.appended) * 2 >= len(self)
+
+    def snapshot(self) -> dict:
+        """
+        snapshot of the queue for the next generation; call mark_compacted once it was written
+        """
+        return {"generation": self.generation + 1, "items": list(self)}
+
+    def mark_compacted(self):
+        self.generation += 1
+        self.legacy = False
+        self.appended = []
+        self.consumed = 0
+
+    def delta(self) -> dict:
+        return {"generation": self.generation, "consumed": self.consumed, "appended": list(self.appended)}
+
+    @staticmethod
+    def restore(snapshot: object, delta: object) -> 'PersistedQueue':
+        """
+        restores the queue from its persisted snapshot and delta; a plain list is a snapshot written before deltas were introduced
+        """
+        if snapshot is None:
+            queue = PersistedQueue()
+        elif isinstance(snapshot, dict):
+            queue = PersistedQueue(list(snapshot["items"]), snapshot["generation"])
+        else:
+            queue = PersistedQueue(list(snapshot))
+            queue.legacy = True
+
+        if isinstance(delta, dict) and delta.get("generation") == queue.generation:
+            list.extend(queue, delta["appended"])
+            del queue[0:delta["consumed"]]
+            queue.appended = list(delta["appended"])
+            queue.consumed = delta["consumed"]
+        return queue
@@ -0,0 +1,98 @@
+from persisted_state import PersistenceTracker, PersistedQueue
+from size_bounded_dict import SizeBoundedOrderedDict
+
+
+class TestPersistenceTracker:
+
+    def test_is_dirty(self):
+        tracker = PersistenceTracker()
+        items = SizeBoundedOrderedDict(1000)
+        assert tracker.is_dirty("key", items), "keys that were never persisted are dirty"
+
+        tracker.mark_persisted("key", items)
+        assert not tracker.is_dirty("key", items)
+
+        items.add("0x1", "mlSCAM-DETECTOR-ICE-PHISHING")
+        assert tracker.is_dirty("key", items)
+        tracker.mark_persisted("key", items)
+
+        items.add("0x1", "mlSCAM-DETECTOR-ICE-PHISHING")
+        assert not tracker.is_dirty("key", items), "adding an existing alert id doesnt change the dict"
+
+        items.evict(0)
+        assert tracker.is_dirty("key", items)
+
+    def test_replaced_object_is_dirty(self):
+        tracker = PersistenceTracker()
+        items = SizeBoundedOrderedDict(1000)
+        tracker.mark_persisted("key", items)
+        replaced = SizeBoundedOrderedDict(1000)
+        assert tracker.is_dirty("key", replaced)
+
+    def test_unversioned_object_is_always_dirty(self):
+        tracker = PersistenceTracker()
+        items = []
+        tracker.mark_persisted("key", items)
+        assert tracker.is_dirty("key", items)
+
+
+class TestPersistedQueue:
+
+    def test_pop_front(self):
+        queue = PersistedQueue()
+        queue.extend([1, 2, 3])
+        queue.append(4)
+        assert queue.pop_front(3) == [1, 2, 3]
+        assert queue == [4]
+        assert queue.pop_front(3) == [4]
+        assert queue.pop_front(3) == []
+        assert queue.consumed == 4
+
+    def test_restore_snapshot_and_delta(self):
+        queue = PersistedQueue()
+        queue.extend(range(10))
+        snapshot = queue.snapshot()
+        queue.mark_compacted()
+
+        queue.pop_front(3)
+        queue.extend([10, 11])
+        delta = queue.delta()
+        assert delta["appended"] == [10, 11] and delta["consumed"] == 3
+
+        restored = PersistedQueue.restore(snapshot, delta)
+        assert restored == queue
+        assert restored.generation == queue.generation
+
+        restored.pop_front(9)  # consumes beyond the snapshot
+        restored.append(12)
+        assert PersistedQueue.restore(snapshot, restored.delta()) == [12], "deltas should be cumulative since the snapshot"
+
+    def test_restore_ignores_stale_delta(self):
+        queue = PersistedQueue()
+        queue.extend([1, 2])
+        stale_delta = queue.delta()  # delta of generation 0
+        snapshot = queue.snapshot()  # generation 1 already contains the appended items
+        queue.mark_compacted()
+
+        assert PersistedQueue.restore(snapshot, stale_delta) == [1, 2]
+
+    def test_restore_legacy_list(self):
+        assert PersistedQueue.restore([1, 2], None) == [1, 2]
+        assert PersistedQueue.restore(None, None) == []
+
+        queue = PersistedQueue.restore(list(range(100)), None)
+        assert queue.needs_compaction(), "a queue restored from a list should be compacted on its first persist"
+        queue.mark_compacted()
+        assert not queue.needs_compaction()
+
+    def test_needs_compaction(self):
+        queue = PersistedQueue()
+        queue.extend(range(100))
+        assert queue.needs_compaction()
+        queue.mark_compacted()
+        assert not queue.needs_compaction()
+
+        queue.extend(range(10))
+        assert not queue.needs_compaction(), "small deltas should be persisted as delta"
+        queue.pop_front(90)
+        assert queue.needs_compaction(), "delta is at least half the size of the queue"
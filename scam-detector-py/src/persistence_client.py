@@ -0,0 +1,109 @@
+import base64
+import json
+import logging
+import random
+import threading
+import time
+
+import forta_agent
+import requests
+
+DATABASE = "https://research.forta.network/database/bot/"
+CONNECT_TIMEOUT_IN_SECONDS = 3.05
+READ_TIMEOUT_IN_SECONDS = 30
+MAX_RETRIES = 3
+BACKOFF_BASE_IN_SECONDS = 0.2
+BACKOFF_MAX_IN_SECONDS = 5
+POOL_SIZE = 8
+JWT_DEFAULT_TTL_IN_SECONDS = 60  # used if the jwt has no (readable) exp claim
+JWT_REFRESH_MARGIN_IN_SECONDS = 30
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class PersistenceClient:
+    """
+    client for the research DB used to persist bot state
+    keeps a pool of keep-alive connections, caches the jwt until shortly before it expires, applies timeouts and retries with exponential backoff
+    it is safe to share across threads
+    """
+
+    def __init__(self, base_url: str = DATABASE, connect_timeout: float = CONNECT_TIMEOUT_IN_SECONDS, read_timeout: float = READ_TIMEOUT_IN_SECONDS,
+                 max_retries: int = MAX_RETRIES, backoff_base: float = BACKOFF_BASE_IN_SECONDS, backoff_max: float = BACKOFF_MAX_IN_SECONDS, pool_size: int = POOL_SIZE, fetch_jwt=None):
+        self.base_url = base_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.fetch_jwt = fetch_jwt if fetch_jwt is not None else lambda: forta_agent.fetch_jwt({})
+        self.session = requests.Session()
+        self.session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.token_lock = threading.Lock()
+        self.token = None
+        self.token_expires_at = 0
+
+    @staticmethod
+    def _expiry(token: str) -> float:
+        try:
+            payload = token.split(".")[1]
+            claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+            return float(claims["exp"])
+        except Exception:
+            return time.time() + JWT_DEFAULT_TTL_IN_SECONDS
+
+    def get_token(self) -> str:
+        with self.token_lock:
+            if self.token is None or time.time() >= self.token_expires_at - JWT_REFRESH_MARGIN_IN_SECONDS:
+                self.token = self.fetch_jwt()
+                self.token_expires_at = PersistenceClient._expiry(self.token)
+            return self.token
+
+    def invalidate_token(self):
+        with self.token_lock:
+            self.token = None
+
+    def backoff(self, attempt: int) -> float:
+        return min(self.backoff_max, self.backoff_base * (2 ** attempt)) * random.uniform(0.5, 1.0)
+
+    def request(self, method: str, path: str, data: bytes = None) -> requests.Response:
+        """
+        issues the request, retrying on connection errors, timeouts and 429/5xx responses; a 401/403 refreshes the jwt once
+        raises the last exception if all attempts failed with an exception
+        """
+        token_refreshed = False
+        attempt = 0
+        while True:
+            try:
+                headers = {"Authorization": f"Bearer {self.get_token()}"}
+                res = self.session.request(method, f"{self.base_url}{path}", data=data, headers=headers, timeout=self.timeout)
+                if res.status_code in (401, 403) and not token_refreshed:
+                    self.invalidate_token()
+                    token_refreshed = True
+                    continue
+                if res.status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries - 1:
+                    return res
+                logging.warning(f"{method} {path} returned {res.status_code}; retrying")
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt >= self.max_retries - 1:
+                    raise e
+                logging.warning(f"{method} {path} failed: {e}; retrying")
+            time.sleep(self.backoff(attempt))
+            attempt += 1
+
+    def get(self, path: str) -> requests.Response:
+        return self.request("GET", path)
+
+    def post(self, path: str, data: bytes) -> requests.Response:
+        return self.request("POST", path, data)
+
+
+CLIENT = None
+CLIENT_LOCK = threading.Lock()
+
+
+def get_client() -> PersistenceClient:
+    global CLIENT
+    with CLIENT_LOCK:
+        if CLIENT is None:
+            CLIENT = PersistenceClient()
+        return CLIENT
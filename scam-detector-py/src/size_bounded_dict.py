@@ -0,0 +1,151 @@
+import pickle
+from collections import OrderedDict
+
+# byte counts of the pickle protocol 4 opcodes emitted for an OrderedDict of str -> set of str (see pickletools.dis)
+PICKLE_HEADER_SIZE = 45  # PROTO, first FRAME, collections.OrderedDict global, EMPTY_TUPLE, REDUCE, MEMOIZE, STOP
+PICKLE_FRAME_SIZE = 64 * 1024  # pickle starts a new 9 byte FRAME roughly every 64KB
+PICKLE_FRAME_HEADER_SIZE = 9
+PICKLE_BATCH_SIZE = 1000  # dict items and set elements are written in batches of MARK ... SETITEMS/ADDITEMS
+PICKLE_MEMO_REF_SIZE = 5  # LONG_BINGET for a repeated reference to an already pickled value
+PICKLE_SHORT_MEMO_REF_SIZE = 2  # BINGET for references to the first 256 memoized objects
+PICKLE_HEADER_MEMO_COUNT = 4  # 'collections', 'OrderedDict', the global and the reduced dict
+
+
+class SizeBoundedOrderedDict(OrderedDict):
+    """
+    OrderedDict of entity -> set of alert ids that keeps a running estimate of its pickled size
+    oldest entries are evicted in O(1) once the estimate exceeds max_bytes (or the dict exceeds its max number of entries)
+    alert ids are interned, so repeated alert ids are pickled as memo references; this mirrors what unpickling a persisted dict yields
+    entries must be added through add for the estimate to be maintained; the dict pickles as a plain OrderedDict, so the persisted format is unchanged
+    """
+
+    def __init__(self, max_bytes: int, items=None):
+        super().__init__()
+        self.max_bytes = max_bytes
+        self.entry_sizes = {}  # entity -> estimated size of the key and the set, excluding the alert ids
+        self.entries_size = 0
+        self.value_counts = {}  # alert id -> (interned alert id, number of references)
+        self.values_size = 0
+        self.version = 0  # incremented on every change, used to skip persisting unchanged dicts
+        if items is not None:
+            for key, value in items.items() if isinstance(items, dict) else items:
+                self._load_entry(key, value)
+
+    def __reduce__(self):
+        return (OrderedDict, (), None, None, iter(self.items()))
+
+    @staticmethod
+    def _str_size(s: str) -> int:
+        n = len(s.encode("utf-8", "surrogatepass"))
+        return (2 + n if n < 256 else 5 + n) + 1  # SHORT_BINUNICODE/BINUNICODE + MEMOIZE
+
+    @staticmethod
+    def _set_size(n: int) -> int:
+        batches = (n + PICKLE_BATCH_SIZE - 1) // PICKLE_BATCH_SIZE
+        return 2 + 2 * batches  # EMPTY_SET, MEMOIZE, MARK/ADDITEMS per batch
+
+    def _intern(self, value: str) -> str:
+        entry = self.value_counts.get(value)
+        if entry is None:
+            self.value_counts[value] = (value, 1)
+            self.values_size += SizeBoundedOrderedDict._str_size(value)
+            return value
+        self.value_counts[value] = (entry[0], entry[1] + 1)
+        self.values_size += PICKLE_MEMO_REF_SIZE
+        return entry[0]
+
+    def _release(self, value: str):
+        interned, count = self.value_counts[value]
+        if count == 1:
+            del self.value_counts[value]
+            self.values_size -= SizeBoundedOrderedDict._str_size(value)
+        else:
+            self.value_counts[value] = (interned, count - 1)
+            self.values_size -= PICKLE_MEMO_REF_SIZE
+
+    def _load_entry(self, key, value):
+        size = SizeBoundedOrderedDict._str_size(key)
+        if isinstance(value, str):
+            value = self._intern(value)
+        elif isinstance(value, set):
+            value = set(self._intern(item) if isinstance(item, str) else item for item in value)
+            size += SizeBoundedOrderedDict._set_size(len(value)) + sum(len(pickle.dumps(item)) - 3 for item in value if not isinstance(item, str))
+        else:
+            size += len(pickle.dumps(value)) - 3  # without PROTO and STOP
+        super().__setitem__(key, value)
+        self.entry_sizes[key] = size
+        self.entries_size += size
+
+    def add(self, key: str, value: str):
+        """
+        adds value to the set of key; O(1) as only the added value is sized
+        """
+        if key not in self:
+            super().__setitem__(key, set())
+            self.entry_sizes[key] = SizeBoundedOrderedDict._str_size(key) + SizeBoundedOrderedDict._set_size(0)
+            self.entries_size += self.entry_sizes[key]
+        values = self[key]
+        if value in values:
+            return
+        values.add(self._intern(value))
+        self.version += 1
+        if len(values) % PICKLE_BATCH_SIZE == 1:
+            self.entry_sizes[key] += 2  # new MARK/ADDITEMS batch
+            self.entries_size += 2
+
+    def _short_memo_ref_savings(self) -> int:
+        """
+        references to alert ids first pickled within the first 256 memo entries are written as BINGET rather than LONG_BINGET
+        only the oldest entries are walked until the memo index exceeds 256, so this is bounded regardless of the size of the dict
+        """
+        memo_index = PICKLE_HEADER_MEMO_COUNT
+        memoized = set()
+        savings = 0
+        for key, value in self.items():
+            if memo_index >= 256:
+                break
+            memo_index += 1  # key
+            if isinstance(value, set):
+                memo_index += 1
+            else:
+                value = (value,)
+            for item in value:
+                if isinstance(item, str) and item not in memoized:
+                    memoized.add(item)
+                    if memo_index < 256:
+                        savings += (PICKLE_MEMO_REF_SIZE - PICKLE_SHORT_MEMO_REF_SIZE) * (self.value_counts[item][1] - 1)
+                    memo_index += 1
+        return savings
+
+    def estimated_size(self) -> int:
+        batches = (len(self) + PICKLE_BATCH_SIZE - 1) // PICKLE_BATCH_SIZE
+        size = PICKLE_HEADER_SIZE + 2 * batches + self.entries_size + self.values_size - self._short_memo_ref_savings()
+        if len(self) % PICKLE_BATCH_SIZE == 1:
+            size -= 1  # a last batch with a single entry is written as SETITEM without MARK
+        return size + PICKLE_FRAME_HEADER_SIZE * (size // PICKLE_FRAME_SIZE)
+
+    def pop_oldest(self):
+        key, value = super().popitem(last=False)
+        self.entries_size -= self.entry_sizes.pop(key)
+        self.version += 1
+        if isinstance(value, str):
+            self._release(value)
+        elif isinstance(value, set):
+            for item in value:
+                if isinstance(item, str):
+                    self._release(item)
+        return key, value
+
+    def evict(self, max_size: int) -> int:
+        """
+        removes the oldest entries until the dict has at most max_size entries and is estimated to pickle to at most max_bytes
+        :return: number of entries removed due to the byte budget
+        """
+        while len(self) > max_size:
+            self.pop_oldest()
+
+        count = 0
+        while len(self) > 0 and self.estimated_size() > self.max_bytes:
+            self.pop_oldest()
+            count += 1
+        return count
@@ -0,0 +1,71 @@
+import pickle
+import random
+from collections import OrderedDict
+
+from size_bounded_dict import SizeBoundedOrderedDict
+
+
+def random_address(rng: random.Random) -> str:
+    return "0x" + "".join(rng.choice("0123456789abcdef") for _ in range(40))
+
+
+def assert_estimate(items: SizeBoundedOrderedDict):
+    # frames are only approximated, so allow a few frame headers of slack
+    actual = len(pickle.dumps(items))
+    assert abs(items.estimated_size() - actual) <= 32, f"estimate {items.estimated_size()} too far from pickle size {actual}"
+
+
+class TestSizeBoundedOrderedDict:
+
+    def test_estimate_matches_pickle_size(self):
+        rng = random.Random(1)
+        items = SizeBoundedOrderedDict(10 * 1024 * 1024)
+        assert_estimate(items)
+
+        for i in range(20000):
+            items.add(random_address(rng), "ml" + rng.choice(["SCAM-DETECTOR-ICE-PHISHING", "SCAM-DETECTOR-ADDRESS-POISONER", "SCAM-DETECTOR-RAKE-TOKEN"]))
+            if i % 997 == 0:
+                assert_estimate(items)
+
+        loaded = SizeBoundedOrderedDict(10 * 1024 * 1024, pickle.loads(pickle.dumps(items)))
+        assert abs(loaded.estimated_size() - items.estimated_size()) <= 64, "estimate should not change when reloading the persisted dict"
+
+    def test_estimate_long_keys_and_large_sets(self):
+        items = SizeBoundedOrderedDict(10 * 1024 * 1024)
+        for i in range(2500):
+            items.add("https://" + "a" * 300 + ".com", f"manualSCAM-DETECTOR-MANUAL-{i}")  # BINUNICODE key, set spanning several ADDITEMS batches
+        items.add("0x1", "passthroughSCAM-DETECTOR-ICE-PHISHING")
+        assert_estimate(items)
+
+    def test_estimate_after_load(self):
+        loaded = OrderedDict()
+        loaded["0x1"] = {"mlSCAM-DETECTOR-ICE-PHISHING", "mlSCAM-DETECTOR-RAKE-TOKEN"}
+        loaded["0x2"] = "manual_metamaskSCAM-DETECTOR-MANUAL-METAMASK-PHISHING"
+        items = SizeBoundedOrderedDict(1000, loaded)
+        assert items == loaded
+        assert_estimate(items)
+
+    def test_pickles_as_ordered_dict(self):
+        items = SizeBoundedOrderedDict(1000)
+        items.add("0x2", "mlSCAM-DETECTOR-ICE-PHISHING")
+        items.add("0x1", "mlSCAM-DETECTOR-ICE-PHISHING")
+        loaded = pickle.loads(pickle.dumps(items))
+        assert type(loaded) is OrderedDict
+        assert list(loaded.keys()) == ["0x2", "0x1"]
+
+    def test_evict_max_size(self):
+        items = SizeBoundedOrderedDict(1024 * 1024)
+        for i in range(10):
+            items.add(f"0x{i}", "mlSCAM-DETECTOR-ICE-PHISHING")
+        assert items.evict(5) == 0, "max size evictions should not be counted as size based evictions"
+        assert list(items.keys()) == [f"0x{i}" for i in range(5, 10)]
+        assert_estimate(items)
+
+    def test_evict_max_bytes(self):
+        items = SizeBoundedOrderedDict(1000)
+        for i in range(100):
+            items.add(f"0x{i}", "mlSCAM-DETECTOR-ICE-PHISHING")
+        count = items.evict(1000)
+        assert count > 0
+        assert len(pickle.dumps(items)) <= 1000
+        assert "0x99" in items and "0x0" not in items, "oldest entries should be evicted first"
@@ -8,7 +8,6 @@ import io
 import rlp
 import base64
 import gnupg
-import time
 import pandas as pd
 import json
 import os
@@ -18,8 +17,9 @@ import traceback
 from web3 import Web3
 from forta_agent import get_json_rpc_url
 
-from src.constants import TX_COUNT_FILTER_THRESHOLD, CONFIDENCE_MAPPINGS
+from src.constants import TX_COUNT_FILTER_THRESHOLD, CONFIDENCE_MAPPINGS, ETHERSCAN_LABEL_CACHE_SNAPSHOT_PATH
 from src.error_cache import ErrorCache
+from src.label_cache import LabelCache
 from src.storage import get_secrets
 
 
@@ -29,7 +29,7 @@ class Utils:
     ETHERSCAN_LABEL_SOURCE_IDS = ['etherscan','0x6f022d4a65f397dffd059e269e1c2b5004d822f905674dbf518d968f744c2ede']
     FP_MITIGATION_ADDRESSES = set()
     CONTRACT_CACHE = dict()
-    ETHERSCAN_LOCAL_CACHE = dict()
+    ETHERSCAN_LABEL_CACHE = None  # LabelCache of address -> {'labels': [...], 'nametag': '...'}
     BOT_VERSION = None
     TOTAL_SHARDS = None
     IS_BETA = None
@@ -247,6 +247,18 @@ class Utils:
             'labels': labels
         })
 
+    @staticmethod
+    def get_etherscan_label_cache() -> LabelCache:
+        """
+        label cache of the etherscan labels checked by is_fp; snapshotted to disk in production, so restarts dont look up all labels again
+        """
+        if Utils.ETHERSCAN_LABEL_CACHE is None:
+            from src.blockchain_indexer_service import BlockChainIndexer
+            is_production = 'NODE_ENV' in os.environ and 'production' in os.environ.get('NODE_ENV')
+            Utils.ETHERSCAN_LABEL_CACHE = LabelCache(lambda addresses: BlockChainIndexer.get_etherscan_labels(tuple(addresses)),
+                                                     snapshot_path=ETHERSCAN_LABEL_CACHE_SNAPSHOT_PATH if is_production else None)
+        return Utils.ETHERSCAN_LABEL_CACHE
+
     @staticmethod
     def is_fp(w3, cluster: str, chain_id, findings_cache_alert: list = None, is_address: bool = True) -> bool:
         global ERROR_CACHE
@@ -259,37 +271,13 @@ class Utils:
                 findings_cache_alert.append(likely_fp_finding)
 
         if is_address: # if it's not a URL
-            etherscan_called = False
-            if cluster in Utils.ETHERSCAN_LOCAL_CACHE.keys():
-                current_time = time.time()
-                # we put a 2h cache on etherscan labels
-                if current_time - Utils.ETHERSCAN_LOCAL_CACHE[cluster]['time'] < 2 * 3600:
-                    etherscan_label = Utils.ETHERSCAN_LOCAL_CACHE[cluster]['labels']
-                    labels_dict = Utils.ETHERSCAN_LOCAL_CACHE[cluster].get('labels_dict', {}) 
-                    etherscan_called = True
-            if not etherscan_called:
-                from src.blockchain_indexer_service import BlockChainIndexer
-                block_chain_indexer = BlockChainIndexer()
-                labels_dict = block_chain_indexer.get_etherscan_labels(tuple(cluster.split(','))) # dict_values([{'labels': ['Proposer Fee Recipient'], 'nametag': 'Fee Recipient: 0xF4...A38'}])
-                labels = []
-                for item in labels_dict.values():
-                    if 'labels' in item.keys():
-                        labels.extend(item['labels'])
-                    if 'nametag' in item.keys():
-                        labels.append(item['nametag'])
-                etherscan_label = ','.join(labels).lower()
-                Utils.ETHERSCAN_LOCAL_CACHE[cluster] = {'labels': etherscan_label, 'labels_dict': labels_dict, 'time': time.time()}
-            if not ('attack' in etherscan_label
-                    or 'phish' in etherscan_label
-                    or 'hack' in etherscan_label
-                    or 'heist' in etherscan_label
-                    or 'exploit' in etherscan_label
-                    or 'drainer' in etherscan_label
-                    or 'scam' in etherscan_label
-                    or 'fraud' in etherscan_label
-                    or '.eth' in etherscan_label
-                    or etherscan_label == ''):
-                logging.info(f"Cluster {cluster} etherscan label: {etherscan_label}")
+            labels_dict = Utils.get_etherscan_label_cache().get_many(cluster.split(',')) # {'0x..': {'labels': ['Proposer Fee Recipient'], 'nametag': 'Fee Recipient: 0xF4...A38'}}
+            labels = []
+            for item in labels_dict.values():
+                labels.extend(item.get('labels', []))
+                labels.append(item.get('nametag', ''))
+            if LabelCache.is_non_attacker(labels):
+                logging.info(f"Cluster {cluster} etherscan label: {','.join(labels).lower()}")
                 if Utils.is_beta() or Utils.is_beta_alt():
                     for address, item in labels_dict.items():        
                             append_fp_finding(address, item['labels'], item['nametag'])